@@ -0,0 +1 @@
+"""Benchmarks locales del chatbot (LLM simulado + SQLite como sustituto de PostgreSQL)"""
@@ -0,0 +1,139 @@
+"""
+Plantillas de respuesta: preguntas frecuentes sin LLM y sin leer las tablas.
+
+Simula el tráfico habitual: unas pocas formas de pregunta (ventas por
+categoría, mejores clientes, pedidos por estado, pedidos de un cliente) con
+valores distintos, sobre --rows pedidos. Cada --write-every preguntas entra
+un pedido nuevo. Compara el chatbot sin y con plantillas (caché activada
+en los dos) y mide:
+  - tiempo total y p50/p95 por pregunta
+  - llamadas al LLM y consultas SQL ejecutadas sobre las tablas
+  - respuestas desactualizadas: distintas de ejecutar la SQL en ese momento
+
+Uso (desde app/):
+    python -m benchmarks.answer_templates --questions 300 --rows 20000
+"""
+from benchmarks.fixtures import add_orders, create_sqlite_db, prepare_environment, percentile
+import argparse
+import contextlib
+import io
+import logging
+import os
+import random
+import sqlite3
+import time
+
+SALES_BY_CATEGORY = ("SELECT p.categoria, SUM(d.cantidad * d.precio_unitario) AS ventas "
+                     "FROM detalles_pedido d INNER JOIN productos p ON d.producto_id = p.producto_id "
+                     "GROUP BY p.categoria ORDER BY ventas DESC")
+TOP_CLIENTS = ("SELECT c.nombre, SUM(d.cantidad * d.precio_unitario) AS gasto FROM clientes c "
+               "INNER JOIN pedidos pe ON c.cliente_id = pe.cliente_id "
+               "INNER JOIN detalles_pedido d ON pe.pedido_id = d.pedido_id "
+               "GROUP BY c.nombre ORDER BY gasto DESC LIMIT {n}")
+ORDERS_BY_STATE = "SELECT COUNT(*) AS total FROM pedidos WHERE estado = '{estado}'"
+ORDERS_BY_CLIENT = "SELECT COUNT(*) AS total FROM pedidos WHERE cliente_id = {cliente}"
+
+
+def build_workload(count: int, seed: int):
+    """Preguntas en orden y mapa pregunta -> SQL para el LLM simulado"""
+    rng = random.Random(seed)
+    shapes = [
+        lambda: ("Ventas por categoría", SALES_BY_CATEGORY),
+        lambda: (lambda n: (f"Top {n} clientes por gasto", TOP_CLIENTS.format(n=n)))(rng.choice([3, 5, 10])),
+        lambda: (lambda e: (f"¿Cuántos pedidos hay en estado {e}?", ORDERS_BY_STATE.format(estado=e)))(
+            rng.choice(["pendiente", "completado", "enviado"])),
+        lambda: (lambda c: (f"¿Cuántos pedidos ha hecho el cliente número {c}?",
+                            ORDERS_BY_CLIENT.format(cliente=c)))(rng.randint(1, 3))
+    ]
+    questions, answers = [], {}
+    for _ in range(count):
+        question, sql = rng.choice(shapes)()
+        questions.append(question)
+        answers[question] = sql
+    return questions, answers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=300)
+    parser.add_argument("--rows", type=int, default=20000, help="Pedidos sintéticos (dos líneas por pedido)")
+    parser.add_argument("--write-every", type=int, default=25, help="Preguntas entre pedidos nuevos (0 = sin escrituras)")
+    parser.add_argument("--latency", type=float, default=0.3, help="Latencia simulada por llamada al LLM (s)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    db_path = create_sqlite_db()
+    prepare_environment(db_path)
+    os.environ.setdefault("TEMPLATES_WATERMARK_INTERVAL", "0")
+    logging.disable(logging.WARNING)
+
+    from benchmarks.stubs import StubChatModel
+    from src.chatbot import ChatbotSQL
+    from src.config import TEMPLATE_CONFIG
+    from src.database import DatabaseManager
+    from src.results import row_values
+
+    questions, answers = build_workload(args.questions, args.seed)
+    counters = {"sql": 0, "watermark": 0}
+    fetch_page, table_watermarks = DatabaseManager.fetch_page, DatabaseManager.table_watermarks
+
+    def counting_fetch_page(self, *a, **kw):
+        counters["sql"] += 1
+        return fetch_page(self, *a, **kw)
+
+    def counting_watermarks(self, *a, **kw):
+        counters["watermark"] += 1
+        return table_watermarks(self, *a, **kw)
+
+    DatabaseManager.fetch_page = counting_fetch_page
+    DatabaseManager.table_watermarks = counting_watermarks
+
+    def run(label, templates: bool):
+        # Misma base de partida para las dos variantes
+        create_sqlite_db(db_path)
+        add_orders(db_path, args.rows, args.seed)
+        TEMPLATE_CONFIG["ENABLED"] = templates
+        llm = StubChatModel(latency=args.latency, answers=answers)
+        chatbot = ChatbotSQL(llm=llm, generation_mode="direct")
+        llm.stats.reset()
+        counters.update(sql=0, watermark=0)
+        truth = sqlite3.connect(db_path)
+        latencies, stale = [], 0
+        start = time.perf_counter()
+        try:
+            for i, question in enumerate(questions):
+                if args.write_every and i and i % args.write_every == 0:
+                    add_orders(db_path, 1, args.seed + i)
+                begin = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    response = chatbot.process_query(question, render=False)
+                latencies.append(time.perf_counter() - begin)
+                expected = [list(row) for row in truth.execute(answers[question]).fetchall()]
+                rows = row_values(response["columns"], response["results"]) if response["results"] is not None else []
+                if [list(row) for row in rows] != expected:
+                    stale += 1
+            elapsed = time.perf_counter() - start
+            stats = chatbot.templates.stats() if chatbot.templates else {}
+        finally:
+            truth.close()
+            chatbot.close()
+        print(f"{label:>15} {elapsed:>9.2f} {percentile(latencies, 50) * 1000:>8.1f} "
+              f"{percentile(latencies, 95) * 1000:>8.1f} {llm.stats.calls:>8} {counters['sql']:>8} "
+              f"{counters['watermark']:>11} {stale:>14}")
+        return stats
+
+    print(f"{len(questions)} preguntas de {len(set(questions))} formas y valores distintos, "
+          f"{args.rows} pedidos, un pedido nuevo cada {args.write_every} preguntas")
+    print(f"{'':>15} {'segundos':>9} {'p50 ms':>8} {'p95 ms':>8} {'LLM':>8} {'SQL':>8} "
+          f"{'marca agua':>11} {'desactualizadas':>14}")
+    try:
+        run("sin plantillas", False)
+        stats = run("con plantillas", True)
+        print(f"\nPlantillas: {stats}")
+    finally:
+        DatabaseManager.fetch_page, DatabaseManager.table_watermarks = fetch_page, table_watermarks
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
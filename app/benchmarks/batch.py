@@ -0,0 +1,106 @@
+"""
+Lote de preguntas: process_query una a una frente a process_batch.
+
+Simula el trabajo nocturno: --questions preguntas de negocio, la mitad
+repeticiones del corpus con variaciones de forma (mayúsculas y
+signos) y la otra mitad preguntas distintas cuyas SQL coinciden en parte.
+Cada variante parte de un chatbot nuevo (caché vacía) y un LLM simulado con
+--latency segundos por llamada. Mide tiempo total, llamadas al LLM y
+consultas SQL ejecutadas, y comprueba que ambas variantes dan las mismas
+respuestas.
+
+Uso (desde app/):
+    python -m benchmarks.batch --questions 200 --latency 0.3
+    python -m benchmarks.batch --rpm 600           # con el límite de Groq
+"""
+from benchmarks.fixtures import create_sqlite_db, prepare_environment
+from pathlib import Path
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import time
+
+CORPUS = Path(__file__).parent / "data" / "corpus.json"
+
+
+def build_workload(count: int):
+    """Preguntas del lote y mapa pregunta -> SQL para el LLM simulado"""
+    corpus = json.loads(CORPUS.read_text(encoding="utf-8"))
+    variants = [str.lower, str.upper, lambda q: q.strip("¿?") + " ", lambda q: q]
+    questions, answers = [], {}
+    for i in range(count // 2):
+        item = corpus[i % len(corpus)]
+        question = variants[(i // len(corpus)) % len(variants)](item["question"])
+        questions.append(question)
+        answers[question] = item["gold_sql"]
+    for i in range(count - len(questions)):
+        question = f"¿Cuántos pedidos ha hecho el cliente número {i}?"
+        questions.append(question)
+        answers[question] = f"SELECT COUNT(*) AS total FROM pedidos WHERE cliente_id = {i % 5 + 1}"
+    return questions, answers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.3, help="Latencia simulada por llamada al LLM (s)")
+    parser.add_argument("--mode", default="direct", choices=["direct", "agent"])
+    parser.add_argument("--concurrency", type=int, default=16, help="BATCH_CONCURRENCY")
+    parser.add_argument("--rpm", type=float, default=0, help="Peticiones por minuto al LLM (0 = sin límite)")
+    args = parser.parse_args()
+
+    db_path = create_sqlite_db()
+    prepare_environment(db_path)
+    if args.rpm:
+        os.environ["RATE_LIMIT_ENABLED"] = "True"
+        os.environ["RATE_LIMIT_REQUESTS_PER_MINUTE"] = str(args.rpm)
+    os.environ["BATCH_CONCURRENCY"] = str(args.concurrency)
+    logging.disable(logging.WARNING)
+
+    from benchmarks.stubs import StubChatModel
+    from src.chatbot import ChatbotSQL
+    from src.database import DatabaseManager
+
+    questions, answers = build_workload(args.questions)
+    sql_counter = {"count": 0}
+    fetch_page = DatabaseManager.fetch_page
+
+    def counting_fetch_page(self, *a, **kw):
+        sql_counter["count"] += 1
+        return fetch_page(self, *a, **kw)
+
+    DatabaseManager.fetch_page = counting_fetch_page
+
+    def run(label, fn):
+        llm = StubChatModel(latency=args.latency, answers=answers)
+        chatbot = ChatbotSQL(llm=llm, generation_mode=args.mode)
+        llm.stats.reset()
+        sql_counter["count"] = 0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            responses = fn(chatbot)
+        elapsed = time.perf_counter() - start
+        limiter = chatbot.rate_limiter.stats() if chatbot.rate_limiter else None
+        chatbot.close()
+        print(f"{label:>14} {elapsed:>9.2f} {llm.stats.calls:>13} {sql_counter['count']:>12}"
+              f"{'' if limiter is None else '  espera límite ' + str(limiter['wait_seconds']) + 's'}")
+        return responses, elapsed
+
+    print(f"{len(questions)} preguntas, modo {args.mode}, {args.latency}s por llamada al LLM")
+    print(f"{'':>14} {'segundos':>9} {'llamadas LLM':>13} {'consultas SQL':>12}")
+    try:
+        sequential, slow = run("una a una", lambda bot: [bot.process_query(q, render=False) for q in questions])
+        batched, fast = run("process_batch", lambda bot: bot.process_batch(questions))
+        same = all(a["success"] == b["success"] and a["query"] == b["query"] and list(a["results"] or []) == list(b["results"] or [])
+                   for a, b in zip(sequential, batched))
+        print(f"\nAceleración: x{slow / fast:.1f}; mismas respuestas: {'sí' if same else 'NO'}")
+    finally:
+        DatabaseManager.fetch_page = fetch_page
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Micro-benchmark: resultados con un dict por fila frente a ColumnarResult.
+
+Sobre un resultado de N filas (1M por defecto) generado en SQLite mide:
+- memoria retenida por el resultado y pico al construirlo (tracemalloc)
+- tiempo de leerlo con DatabaseManager.execute_query
+- tiempo de formatear HTML (_format_results), JSON (rows_as_lists + dumps),
+  CSV y de una agregación (suma de una columna)
+
+Uso (desde app/):
+    python -m benchmarks.columnar_results --rows 1000000
+"""
+from benchmarks.fixtures import create_sqlite_db, prepare_environment
+import argparse
+import csv
+import gc
+import io
+import logging
+import os
+import time
+import tracemalloc
+
+QUERY = (
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {rows}) "
+    "SELECT i AS detalle_id, i % 1000 AS pedido_id, i % 50 AS producto_id, "
+    "i % 7 + 1 AS cantidad, i * 0.37 AS precio_unitario FROM n"
+)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    value = fn()
+    return time.perf_counter() - start, value
+
+
+def memory(fn):
+    """Devuelve (MB retenidos por el valor devuelto, MB de pico, valor)"""
+    gc.collect()
+    tracemalloc.start()
+    value = fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / 1024 / 1024, peak / 1024 / 1024, value
+
+
+def csv_dicts(columns, data):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(data)
+    return out.tell()
+
+
+def csv_columnar(columns, data):
+    out = io.StringIO()
+    data.to_csv(out)
+    return out.tell()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Filas del resultado")
+    args = parser.parse_args()
+
+    db_path = create_sqlite_db()
+    prepare_environment(db_path)
+    os.environ["CACHE_ENABLED"] = "False"
+    logging.disable(logging.INFO)
+
+    from benchmarks.stubs import StubChatModel
+    from src.chatbot import ChatbotSQL
+    from src.serialization import dumps, rows_as_lists
+
+    chatbot = ChatbotSQL(llm=StubChatModel(latency=0))
+    db = chatbot.db_manager
+    sql = QUERY.format(rows=args.rows)
+
+    report = {}
+    try:
+        for name, columnar in (("dict/fila", False), ("columnar", True)):
+            retained, peak, _ = memory(lambda: db.execute_query(sql, columnar=columnar))
+            read_time, (columns, data) = timed(lambda: db.execute_query(sql, columnar=columnar))
+            if columnar:
+                total = lambda: sum(data.column("precio_unitario"))
+                to_csv = lambda: csv_columnar(columns, data)
+            else:
+                total = lambda: sum(row["precio_unitario"] for row in data)
+                to_csv = lambda: csv_dicts(columns, data)
+            report[name] = {
+                "MB retenidos": retained,
+                "MB pico": peak,
+                "lectura s": read_time,
+                "HTML s": timed(lambda: chatbot._format_results(columns, data))[0],
+                "JSON s": timed(lambda: dumps(rows_as_lists(columns, data)))[0],
+                "CSV s": timed(to_csv)[0],
+                "suma s": timed(total)[0],
+            }
+            del data
+            gc.collect()
+
+        print(f"{args.rows} filas")
+        print(f"{'':>14} {'dict/fila':>10} {'columnar':>10}")
+        for metric in report["dict/fila"]:
+            print(f"{metric:>14} {report['dict/fila'][metric]:>10.2f} {report['columnar'][metric]:>10.2f}")
+    finally:
+        chatbot.close()
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
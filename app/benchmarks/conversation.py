@@ -0,0 +1,145 @@
+"""
+Conversaciones: seguimientos resueltos sobre el resultado anterior.
+
+Varias conversaciones empiezan con una lista de pedidos con su importe y
+siguen con preguntas que solo filtran, ordenan, limitan o agregan esa
+lista ("y solo los completados", "los 10 primeros", "¿cuántos hay por
+estado?"). Con un LLM simulado que acierta siempre (--llm-latency por
+llamada) compara:
+  - sin sesión: cada seguimiento es una pregunta nueva (LLM + base de datos)
+  - con sesión: los seguimientos se resuelven en SQLite en memoria
+y mide llamadas al LLM, consultas a la base de datos, la latencia media de
+los seguimientos y si las respuestas coinciden con la SQL correcta. Con
+sesión comprueba además que la SQL equivalente devuelta da lo mismo en la
+base de datos. Cachés y plantillas desactivadas: cada pregunta se resuelve
+en frío.
+
+Uso (desde app/):
+    python -m benchmarks.conversation --rows 3000 --llm-latency 0.3
+"""
+from benchmarks.fixtures import add_orders, create_sqlite_db, prepare_environment
+import argparse
+import contextlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+LIST_SQL = ("SELECT p.pedido_id, p.fecha_pedido, p.estado, SUM(d.cantidad * d.precio_unitario) AS importe "
+            "FROM pedidos p INNER JOIN detalles_pedido d ON p.pedido_id = d.pedido_id "
+            "{where}GROUP BY p.pedido_id, p.fecha_pedido, p.estado {having}ORDER BY {order}")
+COMPLETED = "WHERE p.estado = 'completado' "
+EXPENSIVE = "HAVING SUM(d.cantidad * d.precio_unitario) > 1000 "
+
+# Conversaciones: (pregunta, SQL correcta sin contexto, que es lo que responde el LLM simulado)
+CONVERSATIONS = [
+    [
+        ("Lista los pedidos con su importe", LIST_SQL.format(where="", having="", order="p.pedido_id")),
+        ("y solo los completados", LIST_SQL.format(where=COMPLETED, having="", order="p.pedido_id")),
+        ("los que tienen un importe mayor de 1000",
+         LIST_SQL.format(where=COMPLETED, having=EXPENSIVE, order="p.pedido_id")),
+        ("ordénalos por fecha de mayor a menor",
+         LIST_SQL.format(where=COMPLETED, having=EXPENSIVE, order="p.fecha_pedido DESC, p.pedido_id")),
+        ("los 10 primeros",
+         LIST_SQL.format(where=COMPLETED, having=EXPENSIVE, order="p.fecha_pedido DESC, p.pedido_id") + " LIMIT 10")
+    ],
+    [
+        ("Lista los pedidos con su importe", LIST_SQL.format(where="", having="", order="p.pedido_id")),
+        ("¿cuántos hay por estado?",
+         "SELECT p.estado, COUNT(DISTINCT p.pedido_id) AS total FROM pedidos p "
+         "INNER JOIN detalles_pedido d ON p.pedido_id = d.pedido_id GROUP BY p.estado ORDER BY p.estado")
+    ],
+    [
+        ("Lista los pedidos con su importe", LIST_SQL.format(where="", having="", order="p.pedido_id")),
+        ("excepto los pendientes", LIST_SQL.format(where="WHERE p.estado <> 'pendiente' ", having="",
+                                                   order="p.pedido_id")),
+        ("la suma del importe por estado",
+         "SELECT p.estado, SUM(d.cantidad * d.precio_unitario) AS suma_importe FROM pedidos p "
+         "INNER JOIN detalles_pedido d ON p.pedido_id = d.pedido_id WHERE p.estado <> 'pendiente' "
+         "GROUP BY p.estado ORDER BY p.estado")
+    ]
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=3000, help="Pedidos sintéticos en SQLite")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Segundos por llamada al LLM simulado")
+    parser.add_argument("--repeat", type=int, default=3, help="Veces que se repite cada conversación")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="chatbot_conversation_")
+    db_path = create_sqlite_db(os.path.join(workdir, "tienda.db"))
+    add_orders(db_path, args.rows, seed=11)
+    prepare_environment(db_path)
+    os.environ["RESULT_MAX_ROWS"] = str(max(args.rows * 2, 1000))
+    os.environ["CONVERSATION_MAX_RESULT_ROWS"] = str(max(args.rows * 2, 1000))
+    os.environ["CACHE_ENABLED"] = "False"
+    os.environ["TEMPLATES_ENABLED"] = "False"
+    os.environ["DOCS_ENABLED"] = "False"
+    logging.disable(logging.WARNING)
+
+    from benchmarks.stubs import StubChatModel
+    from sqlalchemy import event, text
+    from src.chatbot import ChatbotSQL
+    from src.models import engine
+    from src.results import row_values
+
+    answers = {question: sql for conversation in CONVERSATIONS for question, sql in conversation}
+    llm = StubChatModel(latency=args.llm_latency, answers=answers)
+    chatbot = ChatbotSQL(llm=llm, generation_mode="direct")
+    queries = [0]
+    event.listen(engine, "before_cursor_execute", lambda *_: queries.__setitem__(0, queries[0] + 1))
+
+    def fetch(sql):
+        with engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(text(sql)).fetchall()]
+
+    def same(rows, expected, ordered):
+        return rows == expected if ordered else sorted(rows, key=repr) == sorted(expected, key=repr)
+
+    def run(label, sessions: bool):
+        calls, db_queries = llm.stats.calls, 0
+        latencies, wrong, equivalent, local = [], 0, 0, 0
+        for n in range(args.repeat):
+            for c, conversation in enumerate(CONVERSATIONS):
+                session_id = f"benchmark-{n}-{c}" if sessions else None
+                for step, (question, truth) in enumerate(conversation):
+                    start, db_start = time.perf_counter(), queries[0]
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        response = chatbot.process_query(question, render=False, session_id=session_id)
+                    elapsed = time.perf_counter() - start
+                    db_queries += queries[0] - db_start
+                    if not step:
+                        continue
+                    latencies.append(elapsed)
+                    rows = [tuple(row) for row in row_values(response["columns"], response["results"] or [])]
+                    expected = fetch(truth)
+                    wrong += not same(rows, expected, "ORDER BY" in truth)
+                    if sessions and response["response"].startswith("Calculado"):
+                        local += 1
+                        # La SQL equivalente sobre la base de datos da lo mismo
+                        equivalent += same(fetch(response["query"]), rows, True)
+        follow_ups = len(latencies)
+        mean = sum(latencies) / follow_ups * 1000 if follow_ups else 0.0
+        print(f"{label:>12} {llm.stats.calls - calls:>10} {db_queries:>10} {mean:>13.1f} "
+              f"{local:>7}/{follow_ups:<3} {wrong:>11}")
+        return local, equivalent
+
+    print(f"{len(CONVERSATIONS)} conversaciones x {args.repeat}, {args.rows} pedidos, "
+          f"LLM simulado de {args.llm_latency * 1000:.0f} ms por llamada")
+    print(f"{'':>12} {'llamadas':>10} {'consultas':>10} {'seguim. ms':>13} {'locales':>11} {'incorrectas':>11}")
+    try:
+        run("sin sesión", False)
+        local, equivalent = run("con sesión", True)
+        print(f"\nSQL equivalente correcta en {equivalent}/{local} seguimientos locales; "
+              f"sesiones: {chatbot.conversations.stats()}")
+    finally:
+        chatbot.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Índice local de documentación: construcción, carga y latencia de búsqueda.
+
+Construye el índice de app/documentacion en un directorio temporal, lo
+abre como al arrancar el chatbot y lanza --repeat veces cada pregunta de
+negocio con su sección esperada del glosario, más las preguntas del corpus
+de benchmarks/data (que no deberían necesitar contexto). Mide:
+  - segundos de construcción y de carga
+  - latencia de búsqueda p50/p95/máx en ms (sin red)
+  - aciertos: la sección esperada entre los k fragmentos añadidos
+  - tokens añadidos al prompt por pregunta
+
+Uso (desde app/):
+    python -m benchmarks.doc_retrieval --repeat 200
+"""
+from benchmarks.fixtures import create_sqlite_db, prepare_environment, percentile
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+# Pregunta -> sección del glosario que debería recuperarse
+BUSINESS_QUESTIONS = {
+    "¿Cuál es el ticket medio?": "Ticket medio",
+    "¿Cuántos pedidos en proceso hay?": "Estados de un pedido",
+    "¿Cuántos pedidos pendientes hay?": "Estados de un pedido",
+    "Pedidos abiertos de María García": "Estados de un pedido",
+    "Ventas del último mes": "Facturación, ventas e ingresos",
+    "¿Cuál es la facturación por categoría?": "Facturación, ventas e ingresos",
+    "¿Cuál es el importe del pedido 3?": "Importe de un pedido",
+    "Clientes recurrentes": "Gasto de un cliente",
+    "Clientes nuevos de este año": "Clientes nuevos y antigüedad",
+    "¿Cuál es el producto más vendido?": "Producto más vendido",
+}
+CORPUS = Path(__file__).parent / "data" / "corpus.json"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="Búsquedas por pregunta")
+    args = parser.parse_args()
+
+    db_path = create_sqlite_db()
+    index_dir = tempfile.mkdtemp(prefix="chatbot_docs_")
+    prepare_environment(db_path)
+    os.environ["DOCS_INDEX_DIR"] = index_dir
+    logging.disable(logging.WARNING)
+
+    from src.config import DOCS_CONFIG
+    from src.database import DatabaseManager
+    from src.doc_retrieval import DocsContextBuilder, build_index
+    from src.langchain_setup import estimate_tokens
+
+    db_manager = DatabaseManager()
+    try:
+        db_manager.connect()
+        summary = build_index(DOCS_CONFIG['DIR'], Path(index_dir), DOCS_CONFIG['CHUNK_WORDS'],
+                              DOCS_CONFIG['CHUNK_OVERLAP'], DOCS_CONFIG['DIMENSIONS'])
+        start = time.perf_counter()
+        docs = DocsContextBuilder(db_manager, {"AUTO_BUILD": False})
+        load_seconds = time.perf_counter() - start
+        corpus = [item["question"] for item in json.loads(CORPUS.read_text(encoding="utf-8"))]
+
+        latencies, hits, tokens = [], 0, {"negocio": [], "corpus": []}
+        for label, questions in (("negocio", list(BUSINESS_QUESTIONS)), ("corpus", corpus)):
+            for question in questions:
+                for _ in range(args.repeat):
+                    begin = time.perf_counter()
+                    found = docs.search(question)
+                    latencies.append(time.perf_counter() - begin)
+                tokens[label].append(estimate_tokens(docs.for_question(question)))
+                expected = BUSINESS_QUESTIONS.get(question) if label == "negocio" else None
+                headings = [chunk["heading"] for _, chunk in found]
+                if expected:
+                    hits += expected in headings
+                    mark = "ok" if expected in headings else "--"
+                    print(f"  {mark} {question:<42} {', '.join(headings) or '(nada)'}")
+
+        print(f"\nÍndice: {summary['documents']} documentos, {summary['chunks']} fragmentos, "
+              f"{summary['terms']} términos; construcción {summary['seconds']:.2f}s, carga {load_seconds * 1000:.1f} ms")
+        print(f"Búsqueda ({len(latencies)}): p50 {percentile(latencies, 50) * 1000:.3f} ms, "
+              f"p95 {percentile(latencies, 95) * 1000:.3f} ms, máx {max(latencies) * 1000:.3f} ms")
+        print(f"Aciertos: {hits}/{len(BUSINESS_QUESTIONS)} (top-{DOCS_CONFIG['TOP_K']})")
+        for label, values in tokens.items():
+            print(f"Tokens añadidos ({label}): media {sum(values) / len(values):.0f}, "
+                  f"sin contexto {sum(1 for v in values if not v)}/{len(values)}")
+    finally:
+        db_manager.close()
+        shutil.rmtree(index_dir, ignore_errors=True)
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
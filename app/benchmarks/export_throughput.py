@@ -0,0 +1,64 @@
+"""
+Rendimiento de la exportación de resultados completos (ResultExporter).
+
+Exporta una consulta 'sql:' de N filas a CSV, NDJSON y Parquet leyendo del
+cursor por lotes y mide el caudal (MB/s de salida) y el pico de memoria de
+Python (tracemalloc) para varios tamaños: el pico debe ser constante.
+
+Uso (desde app/):
+    python -m benchmarks.export_throughput --sizes 100000 500000
+"""
+from benchmarks.fixtures import create_sqlite_db, prepare_environment
+import argparse
+import logging
+import os
+import time
+import tracemalloc
+
+QUERY = (
+    "sql: WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {rows}) "
+    "SELECT i AS pedido_id, i % 1000 AS cliente_id, date('2024-01-01', '+' || (i % 365) || ' days') AS fecha, "
+    "i * 0.37 AS total, 'pendiente' AS estado FROM n"
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 500000], help="Filas exportadas")
+    args = parser.parse_args()
+
+    db_path = create_sqlite_db()
+    prepare_environment(db_path)
+    os.environ["CACHE_ENABLED"] = "False"
+    logging.disable(logging.INFO)
+
+    from benchmarks.stubs import StubChatModel
+    from src.chatbot import ChatbotSQL
+    from src.export import pa
+
+    chatbot = ChatbotSQL(llm=StubChatModel(latency=0))
+    formats = ["csv", "ndjson"] + (["parquet"] if pa is not None else [])
+
+    print(f"{'formato':>8} {'filas':>8} {'MB salida':>10} {'MB/s':>8} {'pico MB':>8}")
+    try:
+        for fmt in formats:
+            for rows in args.sizes:
+                query = QUERY.format(rows=rows)
+                start = time.perf_counter()
+                size = sum(len(chunk) for chunk in chatbot.export_query(query, fmt))
+                elapsed = time.perf_counter() - start
+                # Segunda pasada solo para la memoria (tracemalloc ralentiza mucho)
+                tracemalloc.start()
+                for _ in chatbot.export_query(query, fmt):
+                    pass
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                mb = size / 1024 / 1024
+                print(f"{fmt:>8} {rows:>8} {mb:>10.1f} {mb / elapsed:>8.1f} {peak / 1024 / 1024:>8.1f}")
+    finally:
+        chatbot.close()
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Servidor local que imita la API de chat de Groq (compatible con OpenAI).
+
+Atiende POST /openai/v1/chat/completions con la latencia y los fallos que
+se configuren, para probar el cliente real (ChatGroq + ResilientChatModel,
+con su pool HTTP) sin red ni cuota:
+  - latencia base y cola: una fracción de las peticiones tarda --tail-latency
+  - errores 429 (con Retry-After) y 500 en la proporción indicada
+  - comportamiento distinto por modelo (p. ej. un respaldo rápido y fiable)
+  - tool_call a sql_db_query si la petición trae herramientas (agente) y
+    respuesta en streaming (SSE) si se pide
+
+Uso (desde app/):
+    python -m benchmarks.fake_llm --port 8765 --latency 0.05 --error-rate 0.1
+    LLM_API_BASE=http://127.0.0.1:8765 python main.py
+
+Desde Python:
+    server = FakeLLMServer(latency=0.05).start()
+    ...  # LLM_API_BASE = server.url
+    server.stop()
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+
+DEFAULT_SQL = "SELECT COUNT(*) AS total FROM clientes"
+
+
+@dataclass
+class ModelBehavior:
+    """Latencia y fallos simulados para un modelo"""
+    latency: float = 0.05
+    tail_rate: float = 0.0
+    tail_latency: float = 1.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 0.05
+
+
+@dataclass
+class ServerStats:
+    requests: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    by_model: Dict[str, int] = field(default_factory=dict)
+    connections: int = 0
+
+
+class FakeLLMServer:
+    """
+    Servidor HTTP en un hilo aparte
+
+    Args:
+        latency, tail_rate, tail_latency, error_rate, rate_limit_rate,
+        retry_after: comportamiento por defecto (ver ModelBehavior)
+        models: comportamiento propio de algunos modelos, por nombre
+        answers: pregunta -> SQL; las preguntas desconocidas reciben DEFAULT_SQL
+        seed: semilla para que los fallos sean reproducibles
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 models: Optional[Dict[str, ModelBehavior]] = None,
+                 answers: Optional[Dict[str, str]] = None, seed: Optional[int] = None, **behavior: Any):
+        self.default = ModelBehavior(**behavior)
+        self.models = models or {}
+        self.answers = answers or {}
+        self.stats = ServerStats()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = ServerStats()
+
+    def _draw(self, behavior: ModelBehavior) -> Dict[str, Any]:
+        """Decide el destino de una petición (con el generador compartido)"""
+        with self._lock:
+            roll = self._random.random()
+            slow = self._random.random() < behavior.tail_rate
+        if roll < behavior.rate_limit_rate:
+            return {"status": 429}
+        if roll < behavior.rate_limit_rate + behavior.error_rate:
+            return {"status": 500}
+        return {"status": 200, "delay": behavior.tail_latency if slow else behavior.latency}
+
+    def _answer(self, payload: Dict[str, Any]) -> str:
+        question = ""
+        for message in payload.get("messages", []):
+            if message.get("role") == "user":
+                question = message.get("content") or ""
+        return self.answers.get(question.strip(), DEFAULT_SQL)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.stats.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                # El cliente cierra la conexión al cancelar una petición duplicada
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                model = payload.get("model", "")
+                behavior = server.models.get(model, server.default)
+                outcome = server._draw(behavior)
+                with server._lock:
+                    server.stats.requests += 1
+                    server.stats.by_model[model] = server.stats.by_model.get(model, 0) + 1
+                    server.stats.rate_limited += outcome["status"] == 429
+                    server.stats.errors += outcome["status"] == 500
+
+                if outcome["status"] == 429:
+                    self._send_json(429, {"error": {"message": "Rate limit reached", "type": "tokens"}},
+                                    {"Retry-After": str(behavior.retry_after)})
+                    return
+                if outcome["status"] == 500:
+                    self._send_json(500, {"error": {"message": "Internal server error"}})
+                    return
+
+                time.sleep(outcome["delay"])
+                sql = server._answer(payload)
+                if payload.get("stream"):
+                    self._stream(model, sql)
+                else:
+                    self._send_json(200, self._completion(model, sql, bool(payload.get("tools")), payload))
+
+            def _completion(self, model: str, sql: str, with_tools: bool, payload: Dict[str, Any]):
+                # Agente: primero consulta con la herramienta, después responde
+                called = any(m.get("role") == "tool" for m in payload.get("messages", []))
+                if with_tools and not called:
+                    message = {"role": "assistant", "content": None, "tool_calls": [{
+                        "id": f"call_{uuid.uuid4().hex[:8]}", "type": "function",
+                        "function": {"name": "sql_db_query", "arguments": json.dumps({"query": sql})}}]}
+                    finish = "tool_calls"
+                else:
+                    message = {"role": "assistant", "content": sql}
+                    finish = "stop"
+                return {
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion",
+                    "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": message, "finish_reason": finish}],
+                    "usage": {"prompt_tokens": 200, "completion_tokens": 20, "total_tokens": 220}
+                }
+
+            def _stream(self, model: str, sql: str):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion.chunk",
+                        "created": int(time.time()), "model": model}
+                pieces = [sql[i:i + 16] for i in range(0, len(sql), 16)]
+                events = [{**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece},
+                                                "finish_reason": None}]} for piece in pieces]
+                events.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                               "x_groq": {"usage": {"prompt_tokens": 200, "completion_tokens": 20,
+                                                    "total_tokens": 220}}})
+                for event in events:
+                    self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+                self._chunk(b"data: [DONE]\n\n")
+                self._chunk(b"")
+
+            def _chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-latency", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeLLMServer(host=args.host, port=args.port, latency=args.latency, tail_rate=args.tail_rate,
+                           tail_latency=args.tail_latency, error_rate=args.error_rate,
+                           rate_limit_rate=args.rate_limit_rate)
+    print(f"LLM simulado en {server.url} (Ctrl+C para salir)")
+    server.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+from pathlib import Path
+import atexit
+import datetime
+import math
+import os
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+
+# Script con el esquema y los datos de ejemplo del proyecto
+SQL_SCRIPT = Path(__file__).parent.parent / 'src' / 'sql_database.txt'
+
+
+def _to_sqlite(script: str) -> str:
+    """Adapta el script de PostgreSQL al dialecto de SQLite"""
+    script = re.sub(r"CREATE DATABASE[^;]*;", "", script)
+    script = re.sub(r"-{3,}", "", script)
+    return script.replace("SERIAL PRIMARY KEY", "INTEGER PRIMARY KEY")
+
+
+def create_sqlite_db(path: str = None) -> str:
+    """
+    Crea una base SQLite con el esquema y los datos de sql_database.txt
+
+    Returns:
+        Ruta del fichero creado
+    """
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="chatbot_bench_", suffix=".db")
+        os.close(fd)
+    if os.path.exists(path):
+        os.remove(path)
+    with sqlite3.connect(path) as conn:
+        conn.executescript(_to_sqlite(SQL_SCRIPT.read_text(encoding="utf-8")))
+    return path
+
+
+def load_postgres(url: str) -> None:
+    """
+    Carga el esquema y los datos de sql_database.txt en una base PostgreSQL
+
+    La base debe existir; las tablas del proyecto se borran y se vuelven a
+    crear para que cada ejecución parta de los mismos datos.
+    """
+    from sqlalchemy import create_engine
+    script = re.sub(r"CREATE DATABASE[^;]*;", "", SQL_SCRIPT.read_text(encoding="utf-8"))
+    engine = create_engine(url)
+    try:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DROP TABLE IF EXISTS detalles_pedido, pedidos, productos, clientes CASCADE")
+            conn.exec_driver_sql(script)
+    finally:
+        engine.dispose()
+
+
+def prepare_environment(db_path: str) -> None:
+    """
+    Configura las variables de entorno antes de importar src.*
+
+    Debe llamarse antes de cualquier import de src, porque src.config y
+    src.models leen la configuración al importarse.
+    """
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("GROQ_API_KEY", "benchmark-sin-red")
+    os.environ.setdefault("MODEL_NAME", "stub")
+    # El LLM es simulado: la cuota de Groq no aplica
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "False")
+    # Cada ejecución aprende sus propias plantillas de respuesta
+    os.environ.setdefault("TEMPLATES_PERSIST", "False")
+    # Sin grabar el workload del asesor de índices en .cache
+    os.environ.setdefault("INDEX_ADVISOR_RECORD", "False")
+    # Instantáneas de esquema (e índice de documentación) en un directorio
+    # temporal: cada ejecución usa una base nueva y la poda de instantáneas
+    # no debe borrar las de app/.cache
+    snapshot_dir = tempfile.mkdtemp(prefix="chatbot_bench_cache_")
+    atexit.register(shutil.rmtree, snapshot_dir, True)
+    os.environ["SCHEMA_SNAPSHOT_DIR"] = snapshot_dir
+
+
+def add_orders(db_path: str, rows: int, seed: int) -> None:
+    """
+    Pedidos y líneas de pedido sintéticos (dos por pedido) para que leer las tablas cueste algo
+
+    Las fechas de los pedidos se reparten entre 2023 y 2024.
+    """
+    rng = random.Random(seed)
+    states = ["pendiente", "completado", "enviado", "en proceso"]
+    start = datetime.date(2023, 1, 1)
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany("INSERT INTO pedidos (cliente_id, fecha_pedido, estado) VALUES (?, ?, ?)",
+                         [(rng.randint(1, 3), (start + datetime.timedelta(days=rng.randrange(730))).isoformat(),
+                           rng.choice(states)) for _ in range(rows)])
+        first = conn.execute("SELECT MAX(pedido_id) FROM pedidos").fetchone()[0] - rows + 1
+        products = [row[0] for row in conn.execute("SELECT producto_id FROM productos")]
+        conn.executemany(
+            "INSERT INTO detalles_pedido (pedido_id, producto_id, cantidad, precio_unitario) VALUES (?, ?, ?, ?)",
+            [(first + i, rng.choice(products), rng.randint(1, 5), rng.randint(5, 500))
+             for i in range(rows) for _ in range(2)])
+
+
+def percentile(values, pct: float) -> float:
+    """Percentil por el método del rango más cercano"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
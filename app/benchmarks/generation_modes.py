@@ -0,0 +1,54 @@
+"""
+Compara los modos de generación de SQL 'agent' y 'direct'.
+
+Cuenta llamadas al LLM y tokens (estimados) por pregunta con un LLM
+simulado que reproduce la secuencia de herramientas del agente real
+(listar tablas, pedir esquema, ejecutar consulta). Sin red y sin caché.
+
+Uso (desde app/):
+    python -m benchmarks.generation_modes
+"""
+from benchmarks.fixtures import create_sqlite_db, prepare_environment
+from benchmarks.load_test import ANSWERS
+import argparse
+import contextlib
+import io
+import os
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2, help="Latencia simulada por llamada al LLM (s)")
+    args = parser.parse_args()
+
+    db_path = create_sqlite_db()
+    prepare_environment(db_path)
+    os.environ["CACHE_ENABLED"] = "False"
+
+    from benchmarks.stubs import StubChatModel, AGENT_TOOL_SCRIPT
+    from src.chatbot import ChatbotSQL
+
+    print(f"{'modo':>8} {'llamadas/preg':>14} {'tokens entrada':>15} {'tokens salida':>14} {'s/preg':>8}")
+    try:
+        for mode in ("agent", "direct"):
+            llm = StubChatModel(latency=args.latency, answers=ANSWERS, tool_script=AGENT_TOOL_SCRIPT)
+            chatbot = ChatbotSQL(llm=llm, generation_mode=mode)
+            llm.stats.reset()
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for question in ANSWERS:
+                    assert chatbot.process_query(question)["success"]
+            elapsed = time.perf_counter() - start
+
+            n = len(ANSWERS)
+            print(f"{mode:>8} {llm.stats.calls / n:>14.1f} {llm.stats.prompt_tokens / n:>15.0f} "
+                  f"{llm.stats.completion_tokens / n:>14.0f} {elapsed / n:>8.2f}")
+            chatbot.close()
+    finally:
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
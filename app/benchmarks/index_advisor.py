@@ -0,0 +1,137 @@
+"""
+Asesor de índices sobre el workload grabado del chatbot.
+
+Crea --rows pedidos (dos líneas por pedido) en SQLite, sin más índices que
+las claves primarias, como en sql_database.txt. Hace --questions preguntas
+al chatbot en modo 'direct' (caché y plantillas desactivadas, para que
+cada pregunta llegue a la base) grabando la SQL con WorkloadRecorder.
+Después pasa el workload por IndexAdvisor con la estrategia 'trial'
+(crea cada candidato, mide y lo borra), crea los recomendados y repite
+las mismas preguntas. Muestra el informe del asesor y el tiempo SQL de
+las preguntas antes y después.
+
+Uso (desde app/):
+    python -m benchmarks.index_advisor --questions 200 --rows 50000
+"""
+from benchmarks.fixtures import add_orders, create_sqlite_db, prepare_environment, percentile
+import argparse
+import contextlib
+import io
+import logging
+import os
+import random
+import tempfile
+import time
+
+CLIENT_STATE = "SELECT COUNT(*) AS total FROM pedidos WHERE cliente_id = {cliente} AND estado = '{estado}'"
+ORDER_LINES = ("SELECT pr.nombre, d.cantidad, d.precio_unitario FROM detalles_pedido d "
+               "INNER JOIN productos pr ON d.producto_id = pr.producto_id WHERE d.pedido_id = {pedido}")
+ORDERS_BETWEEN = ("SELECT COUNT(*) AS total FROM pedidos "
+                  "WHERE fecha_pedido BETWEEN '{desde}' AND '{hasta}'")
+LAST_ORDERS = ("SELECT pedido_id, fecha_pedido, estado FROM pedidos WHERE cliente_id = {cliente} "
+               "ORDER BY fecha_pedido DESC LIMIT 5")
+ORDER_TOTAL = ("SELECT SUM(d.cantidad * d.precio_unitario) AS total FROM pedidos p "
+               "INNER JOIN detalles_pedido d ON p.pedido_id = d.pedido_id WHERE p.pedido_id = {pedido}")
+
+
+def build_workload(count: int, rows: int, seed: int):
+    """Preguntas en orden y mapa pregunta -> SQL para el LLM simulado"""
+    rng = random.Random(seed)
+
+    def day():
+        return f"20{rng.choice(['23', '24'])}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+    shapes = [
+        lambda c, e: (f"¿Cuántos pedidos {e} tiene el cliente {c}?", CLIENT_STATE.format(cliente=c, estado=e)),
+        lambda c, e: (f"Productos del pedido {c * 1000 + rng.randint(1, rows // 10)}", None),
+        lambda c, e: (f"Pedidos del {day()} al", None),
+        lambda c, e: (f"Últimos pedidos del cliente {c}", LAST_ORDERS.format(cliente=c)),
+        lambda c, e: (f"Importe del pedido {rng.randint(1, rows)}", None),
+    ]
+    questions, answers = [], {}
+    for _ in range(count):
+        client = rng.randint(1, 3)
+        state = rng.choice(["pendiente", "completado", "enviado"])
+        kind = rng.randrange(len(shapes))
+        question, sql = shapes[kind](client, state)
+        if kind == 1:
+            sql = ORDER_LINES.format(pedido=question.rsplit(" ", 1)[1])
+        elif kind == 2:
+            since = question.split(" ")[2]
+            until = f"{since[:4]}-12-31"
+            question = f"{question} {until}"
+            sql = ORDERS_BETWEEN.format(desde=since, hasta=until)
+        elif kind == 4:
+            sql = ORDER_TOTAL.format(pedido=question.rsplit(" ", 1)[1])
+        questions.append(question)
+        answers[question] = sql
+    return questions, answers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=50000, help="Pedidos sintéticos (dos líneas por pedido)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    db_path = create_sqlite_db()
+    add_orders(db_path, args.rows, args.seed)
+    fd, workload_file = tempfile.mkstemp(prefix="chatbot_workload_", suffix=".jsonl")
+    os.close(fd)
+    prepare_environment(db_path)
+    os.environ.update({"INDEX_ADVISOR_RECORD": "True", "INDEX_ADVISOR_WORKLOAD_FILE": workload_file,
+                       "CACHE_ENABLED": "False", "TEMPLATES_ENABLED": "False"})
+    logging.disable(logging.WARNING)
+
+    from benchmarks.stubs import StubChatModel
+    from src.chatbot import ChatbotSQL
+    from src.database import DatabaseManager
+    from src.index_advisor import IndexAdvisor, load_workload, format_report
+    from src.models import engine
+
+    questions, answers = build_workload(args.questions, args.rows, args.seed)
+    sql_seconds = []
+    execute_query = DatabaseManager.execute_query
+
+    def timed_execute_query(self, *a, **kw):
+        start = time.perf_counter()
+        try:
+            return execute_query(self, *a, **kw)
+        finally:
+            sql_seconds.append(time.perf_counter() - start)
+
+    DatabaseManager.execute_query = timed_execute_query
+    chatbot = ChatbotSQL(llm=StubChatModel(latency=0, answers=answers), generation_mode="direct")
+
+    def run():
+        sql_seconds.clear()
+        for question in questions:
+            with contextlib.redirect_stdout(io.StringIO()):
+                chatbot.process_query(question, render=False)
+        return sum(sql_seconds), percentile(sql_seconds, 50), percentile(sql_seconds, 95)
+
+    try:
+        before = run()
+        chatbot.db_manager.workload.close()
+        queries = load_workload(workload_file)
+        advisor = IndexAdvisor(engine, schema=chatbot.db_manager.get_database_schema())
+        start = time.perf_counter()
+        report = advisor.analyze(queries, apply=True, strategy="trial")
+        advisor_seconds = time.perf_counter() - start
+        after = run()
+
+        print(f"{len(questions)} preguntas, {args.rows} pedidos; asesor: {advisor_seconds:.1f}s\n")
+        print(format_report(report))
+        print(f"\n{'':>16} {'SQL total s':>12} {'p50 ms':>8} {'p95 ms':>8}")
+        for label, (total, p50, p95) in (("sin índices", before), ("con recomendados", after)):
+            print(f"{label:>16} {total:>12.2f} {p50 * 1000:>8.2f} {p95 * 1000:>8.2f}")
+    finally:
+        DatabaseManager.execute_query = execute_query
+        chatbot.close()
+        os.remove(db_path)
+        os.remove(workload_file)
+
+
+if __name__ == "__main__":
+    main()
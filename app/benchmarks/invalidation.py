@@ -0,0 +1,160 @@
+"""
+Invalidación de cachés por eventos (LISTEN/NOTIFY) frente a TTL largos.
+
+Necesita una base PostgreSQL local (las tablas del proyecto se recargan).
+Lanza --questions preguntas sobre pedidos, detalles_pedido, productos y
+clientes con un LLM simulado; cada --write-every preguntas entra un pedido
+nuevo con su línea. Compara el chatbot con caché de resultados de TTL largo
+sin invalidación y con invalidación por eventos, y mide:
+  - respuestas desactualizadas: distintas de ejecutar la SQL en ese momento
+  - aciertos de caché que se conservan (las preguntas de tablas sin cambios)
+  - retraso medio entre el commit y la invalidación
+  - tiempo hasta refrescar el esquema tras un ALTER TABLE (event trigger,
+    requiere superusuario)
+
+Uso (desde app/):
+    python -m benchmarks.invalidation --database-url postgresql+psycopg2://localhost/tienda_libros
+"""
+from benchmarks.fixtures import load_postgres
+import argparse
+import contextlib
+import io
+import logging
+import os
+import random
+import time
+
+# Pregunta -> SQL para el LLM simulado; solo las dos primeras tablas cambian
+ANSWERS = {
+    "¿Cuántos pedidos hay?": "SELECT COUNT(*) AS total FROM pedidos",
+    "¿Cuántas unidades se han vendido?": "SELECT SUM(cantidad) AS unidades FROM detalles_pedido",
+    "Pedidos por estado": "SELECT estado, COUNT(*) AS total FROM pedidos GROUP BY estado ORDER BY estado",
+    "¿Cuántos productos hay por categoría?": ("SELECT categoria, COUNT(*) AS total FROM productos "
+                                              "GROUP BY categoria ORDER BY categoria"),
+    "¿Cuál es el producto más caro?": "SELECT nombre, precio FROM productos ORDER BY precio DESC LIMIT 1",
+    "¿Cuántos clientes hay?": "SELECT COUNT(*) AS total FROM clientes",
+    "Clientes registrados por año": ("SELECT EXTRACT(YEAR FROM fecha_registro) AS anio, COUNT(*) AS total "
+                                     "FROM clientes GROUP BY anio ORDER BY anio")
+}
+
+
+def add_order(engine, rng: random.Random) -> None:
+    """Inserta un pedido con una línea, como haría la aplicación de la tienda"""
+    from sqlalchemy import text
+    with engine.begin() as conn:
+        pedido_id = conn.execute(
+            text("INSERT INTO pedidos (cliente_id, estado) VALUES (:cliente, :estado) RETURNING pedido_id"),
+            {"cliente": rng.randint(1, 3), "estado": rng.choice(["pendiente", "completado", "enviado"])}
+        ).scalar()
+        conn.execute(
+            text("INSERT INTO detalles_pedido (pedido_id, producto_id, cantidad, precio_unitario) "
+                 "VALUES (:pedido, :producto, :cantidad, 10)"),
+            {"pedido": pedido_id, "producto": rng.randint(1, 3), "cantidad": rng.randint(1, 5)}
+        )
+
+
+def wait_for(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return condition()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True, help="Base PostgreSQL local (se recargan las tablas)")
+    parser.add_argument("--questions", type=int, default=400)
+    parser.add_argument("--write-every", type=int, default=20, help="Preguntas entre pedidos nuevos")
+    parser.add_argument("--settle", type=float, default=0.05,
+                        help="Espera tras cada escritura para que llegue la notificación (s)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if not args.database_url.startswith("postgresql"):
+        parser.error("LISTEN/NOTIFY solo existe en PostgreSQL")
+
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("GROQ_API_KEY", "benchmark-sin-red")
+    os.environ.setdefault("MODEL_NAME", "stub")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "False")
+    os.environ.setdefault("TEMPLATES_PERSIST", "False")
+    os.environ.setdefault("INDEX_ADVISOR_RECORD", "False")
+    # TTL largo: sin invalidación las respuestas viejas se sirven hasta que caduca
+    os.environ["CACHE_RESULT_TTL"] = "3600"
+    os.environ["TEMPLATES_ENABLED"] = "False"
+    logging.disable(logging.WARNING)
+
+    from benchmarks.stubs import StubChatModel
+    from sqlalchemy import text
+    from src.config import INVALIDATION_CONFIG
+    from src.chatbot import ChatbotSQL
+    from src.database import engine
+    from src.invalidation import uninstall_triggers
+    from src.results import row_values
+
+    rng = random.Random(args.seed)
+    questions = [rng.choice(list(ANSWERS)) for _ in range(args.questions)]
+
+    def run(label, enabled: bool):
+        load_postgres(args.database_url)
+        engine.dispose()
+        INVALIDATION_CONFIG["ENABLED"] = enabled
+        chatbot = ChatbotSQL(llm=StubChatModel(latency=0, answers=ANSWERS), generation_mode="direct")
+        writes = random.Random(args.seed)
+        stale, hits = 0, 0
+        start = time.perf_counter()
+        try:
+            if enabled and not wait_for(lambda: chatbot.db_manager.change_listener.connected, 5):
+                raise SystemExit("El listener no llegó a conectarse")
+            for i, question in enumerate(questions):
+                if i and i % args.write_every == 0:
+                    add_order(engine, writes)
+                    time.sleep(args.settle)
+                hits_before = chatbot.cache.result_cache.hits
+                with contextlib.redirect_stdout(io.StringIO()):
+                    response = chatbot.process_query(question, render=False)
+                hits += chatbot.cache.result_cache.hits > hits_before
+                with engine.connect() as conn:
+                    expected = [list(row) for row in conn.execute(text(ANSWERS[question])).fetchall()]
+                rows = row_values(response["columns"], response["results"]) if response["results"] is not None else []
+                stale += [list(row) for row in rows] != expected
+            elapsed = time.perf_counter() - start
+            print(f"{label:>18} {elapsed:>9.2f} {hits:>8} {stale:>15}")
+            return chatbot.db_manager.invalidation_metrics(), ddl_refresh(chatbot) if enabled else None
+        finally:
+            chatbot.close()
+
+    def ddl_refresh(chatbot):
+        """Segundos desde el ALTER TABLE hasta ver la columna nueva en el esquema"""
+        if not chatbot.db_manager.watches_ddl:
+            return None
+        try:
+            start = time.perf_counter()
+            with engine.begin() as conn:
+                conn.exec_driver_sql("ALTER TABLE productos ADD COLUMN stock_benchmark INTEGER")
+            seen = wait_for(lambda: any(column["name"] == "stock_benchmark" for column in
+                                        chatbot.db_manager.get_database_schema()["productos"]["columns"]), 5)
+            return time.perf_counter() - start if seen else float("inf")
+        finally:
+            with engine.begin() as conn:
+                conn.exec_driver_sql("ALTER TABLE productos DROP COLUMN IF EXISTS stock_benchmark")
+
+    print(f"{len(questions)} preguntas de {len(ANSWERS)} formas, un pedido nuevo cada {args.write_every} preguntas")
+    print(f"{'':>18} {'segundos':>9} {'aciertos':>8} {'desactualizadas':>15}")
+    try:
+        run("TTL largo", False)
+        metrics, ddl_seconds = run("por eventos", True)
+        print(f"\nInvalidación: {metrics}")
+        if ddl_seconds is None:
+            print("Esquema tras DDL: sin event trigger (hace falta superusuario), se usa la comprobación periódica")
+        else:
+            print(f"Esquema tras DDL: refrescado en {ddl_seconds * 1000:.1f} ms")
+    finally:
+        uninstall_triggers(engine, ["clientes", "productos", "pedidos", "detalles_pedido"],
+                           INVALIDATION_CONFIG["CHANNEL"])
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
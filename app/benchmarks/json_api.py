@@ -0,0 +1,62 @@
+"""
+Compara /query (página HTML completa) con /api/query (JSON) y /query/stream.
+
+Ejecuta una consulta 'sql:' de N filas contra la base SQLite de ejemplo
+(sin LLM) y mide bytes por respuesta y tiempo de servidor por petición.
+Los resultados quedan en la caché tras la primera petición, de modo que
+se mide sobre todo el coste de renderizar/serializar.
+
+Uso (desde app/):
+    python -m benchmarks.json_api --rows 1000
+"""
+from benchmarks.fixtures import create_sqlite_db, prepare_environment, percentile
+import argparse
+import logging
+import os
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="Filas del resultado")
+    parser.add_argument("--requests", type=int, default=50, help="Peticiones por endpoint")
+    args = parser.parse_args()
+
+    db_path = create_sqlite_db()
+    prepare_environment(db_path)
+    logging.disable(logging.INFO)
+
+    from fastapi.testclient import TestClient
+    import main as app_main
+
+    query = (
+        "sql: WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {rows}) "
+        "SELECT i AS pedido_id, 'Cliente ' || i AS nombre, i * 1.25 AS total, "
+        "date('2024-01-01', '+' || (i % 365) || ' days') AS fecha FROM n"
+    ).format(rows=args.rows)
+    endpoints = {
+        "/query (HTML)": lambda c: c.post("/query", data={"user_input": query}),
+        "/query/stream": lambda c: c.post("/query/stream", data={"user_input": query}),
+        "/api/query": lambda c: c.post("/api/query", json={"user_input": query}),
+    }
+
+    print(f"{'endpoint':>15} {'bytes':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    try:
+        with TestClient(app_main.app) as client:
+            for name, call in endpoints.items():
+                response = call(client)
+                # Se mide una respuesta con filas, no una página de error
+                assert response.status_code == 200 and b"Cliente 1" in response.content, response.text[:500]
+                timings = []
+                for _ in range(args.requests):
+                    start = time.perf_counter()
+                    response = call(client)
+                    timings.append((time.perf_counter() - start) * 1000)
+                print(f"{name:>15} {len(response.content):>10} "
+                      f"{percentile(timings, 50):>8.1f} {percentile(timings, 95):>8.1f}")
+    finally:
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
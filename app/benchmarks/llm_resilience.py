@@ -0,0 +1,98 @@
+"""
+Cliente del LLM: ChatGroq tal cual frente a ResilientChatModel.
+
+Lanza --requests llamadas (con --concurrency hilos) contra el servidor
+simulado de benchmarks.fake_llm, con una cola de latencia (--tail-rate
+peticiones tardan --tail-latency s) y errores 500/429. El modelo de
+respaldo responde rápido y sin errores. Compara:
+  - 'ChatGroq': como antes de src.resilience (2 reintentos del SDK, cliente
+    HTTP propio)
+  - 'resiliente': create_llm() (pool compartido, reintentos con jitter,
+    hedging tras el p95 y respaldo)
+Mide tasa de error, p50/p95/p99, peticiones que llegan al servidor,
+conexiones TCP abiertas y reintentos/hedges/respaldos.
+
+Uso (desde app/):
+    python -m benchmarks.llm_resilience --requests 400 --tail-rate 0.04 --error-rate 0.05
+"""
+from benchmarks.fake_llm import FakeLLMServer, ModelBehavior
+from benchmarks.fixtures import percentile
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import logging
+import os
+import time
+
+
+def run(llm, server, requests: int, concurrency: int):
+    server.reset_stats()
+
+    def call(_):
+        start = time.perf_counter()
+        try:
+            llm.invoke("¿Cuántos clientes hay?")
+            return True, time.perf_counter() - start
+        except Exception:
+            return False, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies = [seconds for ok, seconds in results if ok]
+    return {
+        "errors": sum(1 for ok, _ in results if not ok) / requests,
+        "p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "p99": percentile(latencies, 99),
+        "elapsed": elapsed, "server_requests": server.stats.requests, "connections": server.stats.connections
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--tail-rate", type=float, default=0.04)
+    parser.add_argument("--tail-latency", type=float, default=1.5)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    server = FakeLLMServer(latency=args.latency, tail_rate=args.tail_rate, tail_latency=args.tail_latency,
+                           error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, seed=args.seed,
+                           models={"respaldo": ModelBehavior(latency=args.latency / 2)}).start()
+    os.environ.setdefault("GROQ_API_KEY", "fake")
+    os.environ["MODEL_NAME"] = "principal"
+
+    from langchain_groq import ChatGroq
+    from src.config import LLM_CONFIG
+    LLM_CONFIG.update({"API_BASE": server.url, "FALLBACK_MODEL": "respaldo",
+                       "BACKOFF_BASE": 0.05, "BACKOFF_MAX": 0.5,
+                       "HEDGE_MIN_DELAY": args.latency * 2, "HEDGE_MIN_SAMPLES": 20})
+    from src.langchain_setup import create_llm
+
+    variants = {
+        "ChatGroq": ChatGroq(temperature=0, model_name="principal", groq_api_key="fake", max_tokens=1024,
+                             base_url=server.url),
+        "resiliente": create_llm()
+    }
+
+    print(f"{args.requests} llamadas, {args.concurrency} en paralelo; cola {args.tail_rate:.0%} a "
+          f"{args.tail_latency}s, errores 500 {args.error_rate:.0%}, 429 {args.rate_limit_rate:.0%}")
+    print(f"{'':>11} {'error':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'segundos':>9} "
+          f"{'peticiones':>11} {'conexiones':>11}")
+    try:
+        for label, llm in variants.items():
+            stats = run(llm, server, args.requests, args.concurrency)
+            print(f"{label:>11} {stats['errors']:>7.1%} {stats['p50'] * 1000:>8.0f} {stats['p95'] * 1000:>8.0f} "
+                  f"{stats['p99'] * 1000:>8.0f} {stats['elapsed']:>9.2f} {stats['server_requests']:>11} "
+                  f"{stats['connections']:>11}")
+        print(f"\nResiliente: {variants['resiliente'].stats()}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
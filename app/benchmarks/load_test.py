@@ -0,0 +1,107 @@
+"""
+Prueba de carga del pool de consultas (QueryExecutor).
+
+Mide peticiones por segundo y latencia p50/p99 para distintos tamaños de
+pool usando un LLM simulado y SQLite, sin red. Las preguntas se repiten:
+por defecto la caché de consultas y las plantillas están desactivadas y
+cada petición llama al LLM y a la base de datos; con --cache se activan y
+la mayoría de las peticiones son aciertos de caché.
+
+Uso (desde app/):
+    python -m benchmarks.load_test --workers 1,2,4,8 --requests 200
+    python -m benchmarks.load_test --cache                             # con caché y plantillas
+    python -m benchmarks.load_test --mode async --workers 8,64,256   # requiere aiosqlite
+"""
+from benchmarks.fixtures import create_sqlite_db, prepare_environment, percentile
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import time
+
+QUESTIONS = [
+    "¿Cuántos clientes hay registrados?",
+    "Muéstrame el producto más caro",
+    "¿Cuántos pedidos pendientes hay?",
+]
+
+ANSWERS = {
+    QUESTIONS[0]: "SELECT COUNT(*) AS total FROM clientes",
+    QUESTIONS[1]: "SELECT nombre, precio FROM productos ORDER BY precio DESC LIMIT 1",
+    QUESTIONS[2]: "SELECT COUNT(*) AS total FROM pedidos WHERE estado = 'pendiente'",
+}
+
+
+async def _run_load(executor, total: int, concurrency: int):
+    """Lanza `total` peticiones con como máximo `concurrency` clientes simultáneos"""
+    from src.executor import QueueFullError
+
+    latencies, rejected = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal rejected
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await executor.submit(QUESTIONS[i % len(QUESTIONS)])
+                latencies.append(time.perf_counter() - start)
+            except QueueFullError:
+                rejected += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return latencies, rejected, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", default="thread", choices=["thread", "async"])
+    parser.add_argument("--workers", default="1,2,4,8", help="Tamaños de pool separados por comas")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.05, help="Latencia simulada por llamada al LLM (s)")
+    parser.add_argument("--cache", action="store_true", help="Activar la caché de consultas y las plantillas")
+    args = parser.parse_args()
+
+    db_path = create_sqlite_db()
+    prepare_environment(db_path)
+    os.environ["CACHE_ENABLED"] = str(args.cache)
+    os.environ["TEMPLATES_ENABLED"] = str(args.cache)
+
+    from benchmarks.stubs import StubChatModel
+    from src.chatbot import ChatbotSQL
+    from src.executor import QueryExecutor
+
+    llm = StubChatModel(latency=args.latency, answers=ANSWERS)
+    chatbot = ChatbotSQL(llm=llm)
+
+    print(f"Caché y plantillas {'activadas' if args.cache else 'desactivadas'}, "
+          f"LLM simulado de {args.latency * 1000:.0f} ms por llamada")
+    print(f"{'workers':>8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'rechazos':>9} {'llamadas LLM':>13}")
+    try:
+        for workers in [int(w) for w in args.workers.split(",")]:
+            executor = QueryExecutor(chatbot, mode=args.mode, workers=workers,
+                                     max_queue=args.max_queue, timeout=60)
+            calls = llm.stats.calls
+            # El agente escribe su traza en stdout (verbose=True)
+            with contextlib.redirect_stdout(io.StringIO()):
+                latencies, rejected, elapsed = asyncio.run(
+                    _run_load(executor, args.requests, args.concurrency)
+                )
+            executor.shutdown()
+            print(f"{workers:>8} {len(latencies) / elapsed:>9.1f} "
+                  f"{percentile(latencies, 50) * 1000:>9.1f} "
+                  f"{percentile(latencies, 99) * 1000:>9.1f} {rejected:>9} {llm.stats.calls - calls:>13}")
+    finally:
+        if args.mode == "async":
+            asyncio.run(chatbot.aclose())
+        else:
+            chatbot.close()
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Varios workers con la aplicación precargada, como gunicorn con preload_app.
+
+El proceso padre crea ChatbotSQL una vez (conexión, esquema, agente) y crea
+los workers con fork(); cada worker llama a after_fork() y atiende su parte
+de un flujo de preguntas repetidas del corpus. Para cada backend de caché
+('local': una caché por worker; 'shm': una caché común) y número de workers
+se mide:
+  - peticiones por segundo del conjunto y p50/p95 de latencia
+  - llamadas al LLM en total: con la caché común una pregunta solo se
+    genera una vez, la haga el worker que la haga
+
+Con más núcleos que workers el rendimiento debería crecer casi en
+proporción al número de workers. LLM simulado y SQLite, sin red.
+
+Uso (desde app/):
+    python -m benchmarks.multiworker --workers 1,2,4 --requests 360
+"""
+from benchmarks.fixtures import create_sqlite_db, prepare_environment, percentile
+from pathlib import Path
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+
+CORPUS = Path(__file__).parent / "data" / "corpus.json"
+
+
+def _serve(chatbot, llm_stats, questions, conn_w) -> None:
+    """Cuerpo de un worker: atiende sus preguntas y envía las medidas al padre"""
+    chatbot.after_fork()
+    llm_stats.reset()
+    latencies = []
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for question in questions:
+            begin = time.perf_counter()
+            chatbot.process_query(question, render=False)
+            latencies.append(time.perf_counter() - begin)
+    result = {"latencies": latencies, "elapsed": time.perf_counter() - start,
+              "llm_calls": llm_stats.calls}
+    os.write(conn_w, pickle.dumps(result))
+    os.close(conn_w)
+
+
+def run(chatbot, llm_stats, stream, workers: int):
+    """Reparte el flujo entre `workers` procesos hijos y agrega sus medidas"""
+    children = []
+    for index in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            code = 0
+            try:
+                _serve(chatbot, llm_stats, stream[index::workers], write_fd)
+            except Exception:
+                logging.exception("Error en el worker")
+                code = 1
+            os._exit(code)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+
+    start = time.perf_counter()
+    results = []
+    for pid, read_fd in children:
+        with os.fdopen(read_fd, "rb") as f:
+            payload = f.read()
+        os.waitpid(pid, 0)
+        if payload:
+            results.append(pickle.loads(payload))
+    wall = time.perf_counter() - start
+    latencies = [value for result in results for value in result["latencies"]]
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / wall if wall else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "llm_calls": sum(result["llm_calls"] for result in results),
+        "failed_workers": workers - len(results)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="Números de workers separados por comas")
+    parser.add_argument("--requests", type=int, default=360, help="Peticiones en total por ejecución")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latencia simulada por llamada al LLM (s)")
+    parser.add_argument("--backends", default="local,shm", help="Backends de caché a comparar")
+    args = parser.parse_args()
+
+    db_path = create_sqlite_db()
+    prepare_environment(db_path)
+    logging.disable(logging.WARNING)
+
+    from benchmarks.stubs import StubChatModel
+    from src.chatbot import ChatbotSQL
+    from src.config import CACHE_CONFIG
+
+    corpus = json.loads(CORPUS.read_text(encoding="utf-8"))
+    answers = {item["question"]: item["gold_sql"] for item in corpus}
+    questions = [item["question"] for item in corpus]
+    stream = [questions[i % len(questions)] for i in range(args.requests)]
+
+    print(f"{'backend':>8} {'workers':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'llamadas LLM':>13}")
+    try:
+        for backend in args.backends.split(","):
+            for workers in [int(w) for w in args.workers.split(",")]:
+                # Caché vacía en cada ejecución
+                fd, location = tempfile.mkstemp(prefix="chatbot_cache_", suffix=".db", dir="/dev/shm"
+                                                if os.path.isdir("/dev/shm") else None)
+                os.close(fd)
+                CACHE_CONFIG.update({"ENABLED": True, "BACKEND": backend, "LOCATION": location})
+
+                llm = StubChatModel(latency=args.latency, answers=answers)
+                chatbot = ChatbotSQL(llm=llm, generation_mode="direct")
+                try:
+                    stats = run(chatbot, llm.stats, stream, workers)
+                finally:
+                    chatbot.close()
+                    for suffix in ("", "-wal", "-shm"):
+                        with contextlib.suppress(FileNotFoundError):
+                            os.remove(location + suffix)
+
+                failed = f"  ({stats['failed_workers']} workers fallidos)" if stats["failed_workers"] else ""
+                print(f"{backend:>8} {workers:>8} {stats['rps']:>9.1f} {stats['p50'] * 1000:>9.1f} "
+                      f"{stats['p95'] * 1000:>9.1f} {stats['llm_calls']:>13}{failed}")
+        print(f"\n{len(questions)} preguntas distintas; núcleos disponibles: {os.cpu_count()}")
+    finally:
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Coste de QueryGuard frente a ejecutar la consulta sin comprobaciones.
+
+Mide el tiempo por consulta de la validación local (tablas y columnas
+contra el esquema cacheado) y de una página de resultados con y sin guard,
+y cuenta cuántas consultas patológicas de un lote (escrituras, columnas
+inventadas, productos cartesianos sin LIMIT) no llegan a ejecutarse.
+Comprueba además que no se rechazan lecturas válidas (CTE con lista de
+columnas, WITH RECURSIVE, alias como "comment" o "lock").
+
+En SQLite no hay EXPLAIN con costes: solo se mide la parte local. En
+PostgreSQL (DATABASE_URL apuntando a él) se incluye también el EXPLAIN.
+
+Uso (desde app/):
+    python -m benchmarks.query_guard --repeat 2000
+"""
+from benchmarks.fixtures import create_sqlite_db, prepare_environment, percentile
+import argparse
+import logging
+import os
+import time
+
+QUERIES = [
+    "SELECT c.nombre, SUM(d.cantidad * d.precio_unitario) AS total FROM clientes c "
+    "JOIN pedidos p ON p.cliente_id = c.cliente_id JOIN detalles_pedido d ON d.pedido_id = p.pedido_id "
+    "GROUP BY c.nombre ORDER BY total DESC",
+    "SELECT pr.categoria, COUNT(*) FROM productos pr GROUP BY pr.categoria",
+    "WITH t AS (SELECT cliente_id, COUNT(*) AS n FROM pedidos GROUP BY cliente_id) "
+    "SELECT c.nombre, t.n FROM clientes c JOIN t ON t.cliente_id = c.cliente_id",
+]
+
+# Lecturas que el guard debe aceptar
+VALID = [
+    "WITH t(a) AS (SELECT cliente_id FROM clientes) SELECT a FROM t",
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 10) SELECT i FROM n",
+    "SELECT nombre AS comment, cliente_id AS lock FROM clientes",
+]
+
+PATHOLOGICAL = [
+    "DELETE FROM pedidos",
+    "SELECT c.telefono FROM clientes c",
+    "SELECT * FROM pedidos; DROP TABLE clientes",
+    "SELECT p.pedido_id FROM pedidos p, pedidos q, pedidos r, pedidos s",
+    "WITH t AS (SELECT 1) DELETE FROM pedidos",
+    "SELECT * FROM pedidos FOR UPDATE",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000, help="Repeticiones por consulta")
+    args = parser.parse_args()
+
+    db_path = None
+    if not os.getenv("DATABASE_URL"):
+        db_path = create_sqlite_db()
+        prepare_environment(db_path)
+    logging.disable(logging.WARNING)
+
+    from src.database import DatabaseManager
+    from src.guard import QueryRejected
+
+    db = DatabaseManager()
+    db.get_database_schema()
+    try:
+        local, plain, guarded = [], [], []
+        for _ in range(args.repeat):
+            for sql in QUERIES:
+                start = time.perf_counter()
+                db.guard._validate(sql)
+                local.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                db.fetch_page(sql, limit=100)
+                plain.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                db.fetch_page(db.guard.check(sql), limit=100)
+                guarded.append(time.perf_counter() - start)
+
+        print(f"{'':>22} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, values in (("validación local", local), ("página sin guard", plain), ("página con guard", guarded)):
+            print(f"{name:>22} {percentile(values, 50) * 1000:>8.3f} {percentile(values, 95) * 1000:>8.3f}")
+
+        rejected = []
+        for sql in VALID:
+            try:
+                db.fetch_page(db.guard.check(sql), limit=100)
+            except QueryRejected as e:
+                rejected.append(sql)
+                print(f"lectura válida rechazada: {sql[:50]!r} -> {e}")
+        print(f"{len(VALID) - len(rejected)}/{len(VALID)} lecturas válidas aceptadas")
+
+        blocked = 0
+        for sql in PATHOLOGICAL:
+            try:
+                db.guard.check(sql)
+            except QueryRejected as e:
+                blocked += 1
+                print(f"rechazada: {sql[:50]!r} -> {e}")
+        print(f"{blocked}/{len(PATHOLOGICAL)} consultas patológicas rechazadas; estadísticas: {db.guard.stats()}")
+        if rejected:
+            raise SystemExit(1)
+    finally:
+        db.close()
+        if db_path:
+            os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Modelo de chat que reproduce respuestas grabadas (cassette) de ChatGroq.
+
+En modo replay no usa la red: para cada llamada busca la respuesta grabada
+por (pregunta, paso del agente, con o sin herramientas) y la devuelve con
+su uso de tokens. Los tokens de entrada se recalculan sobre el prompt real,
+así un cambio de prompt en setup_sql_agent se nota en el informe aunque la
+respuesta grabada sea la misma; si el prompt difiere del grabado se cuenta
+como deriva (y la suite falla).
+
+En modo record envuelve un modelo real (ChatGroq) y guarda cada respuesta:
+
+    python -m benchmarks.suite --record     # necesita GROQ_API_KEY y red
+
+Sin red, --refresh-prompts acepta un cambio de prompt intencionado: guarda
+la huella del prompt actual en las respuestas grabadas, que no cambian.
+"""
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+from benchmarks.stubs import StubStats, _estimate_tokens
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import threading
+import time
+
+CASSETTE_VERSION = 1
+
+
+class MissingRecording(KeyError):
+    """No hay respuesta grabada para la llamada (hay que volver a grabar)"""
+
+
+class Cassette:
+    """
+    Respuestas grabadas del LLM en un fichero JSON
+
+    {"version": 1, "model": "...", "interactions": {clave: {content,
+    tool_calls, input_tokens, output_tokens, latency, prompt_hash}}}
+    """
+
+    def __init__(self, path: Path, model: str = "", interactions: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.path = Path(path)
+        self.model = model
+        self.interactions = interactions or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path) -> "Cassette":
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        if data.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"Versión de cassette no soportada: {data.get('version')}")
+        return cls(path, data.get("model", ""), data.get("interactions", {}))
+
+    def save(self) -> None:
+        data = {"version": CASSETTE_VERSION, "model": self.model,
+                "interactions": dict(sorted(self.interactions.items()))}
+        self.path.write_text(json.dumps(data, ensure_ascii=False, indent=1) + "\n", encoding="utf-8")
+
+    def get(self, key: str) -> Dict[str, Any]:
+        try:
+            return self.interactions[key]
+        except KeyError:
+            raise MissingRecording(key) from None
+
+    def put(self, key: str, interaction: Dict[str, Any]) -> None:
+        with self._lock:
+            self.interactions[key] = interaction
+
+
+def interaction_key(question: str, step: int, tools: bool) -> str:
+    return f"{'agent' if tools else 'direct'}|{step}|{question}"
+
+
+def prompt_hash(messages: List[Any]) -> str:
+    """Huella del prompt sin la pregunta ni los pasos del agente (solo el texto fijo)"""
+    system = "".join(str(m.content) for m in messages if m.type == "system")
+    return hashlib.sha256(system.encode("utf-8")).hexdigest()[:12]
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Sustituto determinista de ChatGroq basado en un Cassette
+
+    latency_scale multiplica la latencia grabada (0 = sin esperas). Cuenta
+    llamadas y tokens en `stats` y las derivas de prompt en `drift`; con
+    refresh_prompts, en lugar de contarlas actualiza la huella grabada.
+    """
+
+    cassette: Any = None
+    latency_scale: float = 1.0
+    tools_bound: bool = False
+    recorder: Any = None
+    refresh_prompts: bool = False
+    _stats: StubStats = PrivateAttr(default_factory=StubStats)
+    _drift: List[str] = PrivateAttr(default_factory=list)
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay-chat"
+
+    @property
+    def stats(self) -> StubStats:
+        return self._stats
+
+    @property
+    def drift(self) -> List[str]:
+        return self._drift
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "ReplayChatModel":
+        recorder = self.recorder.bind_tools(tools, **kwargs) if self.recorder is not None else None
+        bound = self.model_copy(update={"tools_bound": True, "recorder": recorder})
+        bound._stats = self._stats
+        bound._drift = self._drift
+        return bound
+
+    def _key(self, messages: List[Any]) -> str:
+        humans = [m for m in messages if isinstance(m, HumanMessage)]
+        question = humans[-1].content if humans else ""
+        step = sum(1 for m in messages if isinstance(m, ToolMessage))
+        return interaction_key(question, step, self.tools_bound)
+
+    def _generate(self, messages: List[Any], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.recorder is not None:
+            return self._record(messages)
+        interaction = self._lookup(messages)
+        time.sleep(interaction.get("latency", 0) * self.latency_scale)
+        return self._result(messages, interaction)
+
+    async def _agenerate(self, messages: List[Any], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.recorder is not None:
+            return self._record(messages)
+        interaction = self._lookup(messages)
+        await asyncio.sleep(interaction.get("latency", 0) * self.latency_scale)
+        return self._result(messages, interaction)
+
+    def _lookup(self, messages: List[Any]) -> Dict[str, Any]:
+        key = self._key(messages)
+        interaction = self.cassette.get(key)
+        current = prompt_hash(messages)
+        if interaction.get("prompt_hash") and interaction["prompt_hash"] != current:
+            if self.refresh_prompts:
+                interaction = {**interaction, "prompt_hash": current}
+                self.cassette.put(key, interaction)
+            else:
+                self._drift.append(key)
+        return interaction
+
+    def _result(self, messages: List[Any], interaction: Dict[str, Any]) -> ChatResult:
+        prompt_tokens = _estimate_tokens("".join(str(m.content) for m in messages))
+        completion_tokens = interaction.get("output_tokens", 0)
+        self._stats.record(prompt_tokens, completion_tokens)
+        message = AIMessage(
+            content=interaction.get("content", ""),
+            tool_calls=interaction.get("tool_calls", []),
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _record(self, messages: List[Any]) -> ChatResult:
+        """Llama al modelo real y guarda la respuesta en el cassette"""
+        start = time.perf_counter()
+        message = self.recorder.invoke(messages)
+        latency = time.perf_counter() - start
+        usage = getattr(message, "usage_metadata", None) or {}
+        self.cassette.put(self._key(messages), {
+            "content": message.content,
+            "tool_calls": [
+                {"name": call["name"], "args": call["args"], "id": call.get("id") or f"call_{i}"}
+                for i, call in enumerate(getattr(message, "tool_calls", []) or [])
+            ],
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "latency": round(latency, 3),
+            "prompt_hash": prompt_hash(messages)
+        })
+        self._stats.record(usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+        return ChatResult(generations=[ChatGeneration(message=message)])
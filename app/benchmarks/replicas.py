@@ -0,0 +1,147 @@
+"""
+Réplicas de lectura: aislamiento de las consultas analíticas del chatbot.
+
+Varios analistas lanzan sin parar una agregación pesada ('sql:' directo,
+sin caché) mientras unos clientes transaccionales hacen lecturas por clave
+sobre la primaria, como la aplicación de la tienda. El pool de la primaria
+es pequeño (--pool-size) para que la competencia se vea en la espera por
+conexión. Compara:
+  - sin réplicas: todo va a la primaria
+  - con réplicas: la SQL del chatbot va a la réplica menos cargada
+  - con una réplica caída: lecturas repetidas en la primaria, sin errores
+y mide las agregaciones completadas, la latencia p50/p95/máx de las
+lecturas transaccionales y las consultas por destino.
+
+Por defecto usa SQLite (la primaria y dos copias como réplicas); con
+--database-url y --replica-urls, una primaria PostgreSQL y sus réplicas
+reales (los datos deben estar ya cargados).
+
+Uso (desde app/):
+    python -m benchmarks.replicas --rows 100000 --seconds 5
+"""
+from benchmarks.fixtures import add_orders, create_sqlite_db, prepare_environment, percentile
+import argparse
+import contextlib
+import io
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+HEAVY_SQL = ("sql: SELECT p.categoria, pe.estado, COUNT(DISTINCT pe.pedido_id) AS pedidos, "
+             "SUM(d.cantidad * d.precio_unitario) AS ventas FROM detalles_pedido d "
+             "INNER JOIN pedidos pe ON d.pedido_id = pe.pedido_id "
+             "INNER JOIN productos p ON d.producto_id = p.producto_id "
+             "GROUP BY p.categoria, pe.estado ORDER BY ventas DESC")
+POINT_SQL = "SELECT estado FROM pedidos WHERE pedido_id = :pedido"
+# Réplica inalcanzable para la fase de caída
+DOWN_URL = "postgresql+psycopg2://benchmark@127.0.0.1:1/caida"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="Pedidos sintéticos en SQLite")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duración de cada fase")
+    parser.add_argument("--analysts", type=int, default=4, help="Hilos con la agregación pesada")
+    parser.add_argument("--clients", type=int, default=4, help="Hilos con lecturas por clave")
+    parser.add_argument("--pool-size", type=int, default=4, help="Conexiones del pool de la primaria")
+    parser.add_argument("--database-url", help="Primaria PostgreSQL (con --replica-urls)")
+    parser.add_argument("--replica-urls", help="Réplicas separadas por comas")
+    args = parser.parse_args()
+    if bool(args.database_url) != bool(args.replica_urls):
+        parser.error("--database-url y --replica-urls van juntos")
+
+    workdir = tempfile.mkdtemp(prefix="chatbot_replicas_")
+    if args.database_url:
+        prepare_environment("")
+        os.environ["DATABASE_URL"] = args.database_url
+        replica_urls = [url.strip() for url in args.replica_urls.split(",") if url.strip()]
+    else:
+        db_path = create_sqlite_db(os.path.join(workdir, "primaria.db"))
+        add_orders(db_path, args.rows, seed=7)
+        prepare_environment(db_path)
+        replica_urls = []
+        for i in (1, 2):
+            replica = os.path.join(workdir, f"replica{i}.db")
+            shutil.copy(db_path, replica)
+            replica_urls.append(f"sqlite:///{replica}")
+    os.environ["DB_POOL_SIZE"] = str(args.pool_size)
+    os.environ["DB_POOL_MAX_OVERFLOW"] = "0"
+    os.environ["CACHE_ENABLED"] = "False"
+    os.environ["TEMPLATES_ENABLED"] = "False"
+    os.environ["DOCS_ENABLED"] = "False"
+    logging.disable(logging.WARNING)
+
+    from benchmarks.stubs import StubChatModel
+    from sqlalchemy import text
+    from src.chatbot import ChatbotSQL
+    from src.config import REPLICA_CONFIG
+    from src.models import engine
+
+    with engine.connect() as conn:
+        max_order = conn.execute(text("SELECT MAX(pedido_id) FROM pedidos")).scalar()
+
+    def run(label, urls):
+        REPLICA_CONFIG["URLS"] = urls
+        chatbot = ChatbotSQL(llm=StubChatModel(latency=0), generation_mode="direct")
+        stop = threading.Event()
+        latencies, analytic, errors = [], [0], [0]
+        lock = threading.Lock()
+
+        def analyst():
+            while not stop.is_set():
+                response = chatbot.process_query(HEAVY_SQL, render=False)
+                with lock:
+                    analytic[0] += 1
+                    errors[0] += response.get("results") is None
+
+        def client(seed: int):
+            rng = random.Random(seed)
+            while not stop.is_set():
+                begin = time.perf_counter()
+                with engine.connect() as conn:
+                    conn.execute(text(POINT_SQL), {"pedido": rng.randint(1, max_order)}).all()
+                with lock:
+                    latencies.append(time.perf_counter() - begin)
+                time.sleep(0.002)
+
+        threads = [threading.Thread(target=analyst) for _ in range(args.analysts)]
+        threads += [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+        try:
+            # Un solo redirect para todos los hilos: sys.stdout es global
+            with contextlib.redirect_stdout(io.StringIO()):
+                for thread in threads:
+                    thread.start()
+                time.sleep(args.seconds)
+                stop.set()
+                for thread in threads:
+                    thread.join()
+            metrics = chatbot.db_manager.replica_metrics()
+        finally:
+            chatbot.close()
+        print(f"{label:>18} {analytic[0]:>10} {errors[0]:>7} {percentile(latencies, 50) * 1000:>8.2f} "
+              f"{percentile(latencies, 95) * 1000:>8.2f} {max(latencies, default=0) * 1000:>8.2f}")
+        return metrics
+
+    print(f"{args.analysts} analistas y {args.clients} clientes durante {args.seconds:.0f}s por fase, "
+          f"pool de la primaria: {args.pool_size} conexiones")
+    print(f"{'':>18} {'agregac.':>10} {'errores':>7} {'p50 ms':>8} {'p95 ms':>8} {'máx ms':>8}")
+    try:
+        run("sin réplicas", [])
+        phases = {"con réplicas": run("con réplicas", replica_urls),
+                  "réplica caída": run("réplica caída", replica_urls[:1] + [DOWN_URL])}
+        for label, metrics in phases.items():
+            targets = ", ".join(f"{name} {target['queries']} ({target['avg_latency_ms']:.1f} ms, {target['state']})"
+                                for name, target in metrics["targets"].items())
+            print(f"\n{label}: {targets}; lecturas en la primaria {metrics['primary_reads']}, "
+                  f"repetidas tras fallo {metrics['failovers']}")
+    finally:
+        engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Memoria máxima al devolver resultados grandes de una consulta 'sql:'.
+
+Compara, para varios tamaños de resultado:
+- fetchall: DatabaseManager.execute_query (una dict por fila) y la tabla
+  HTML completa de _format_results, como se hacía antes
+- stream: ChatbotSQL.stream_query, que lee del cursor por lotes y serializa
+  cada lote como se envía al cliente (tope de filas desactivado para
+  comparar el mismo volumen de datos)
+
+La memoria se mide con tracemalloc (pico de memoria de Python). Con
+streaming el pico debe mantenerse plano aunque crezca el resultado.
+
+Uso (desde app/):
+    python -m benchmarks.result_memory --sizes 10000 50000 200000
+"""
+from benchmarks.fixtures import create_sqlite_db, prepare_environment
+import argparse
+import logging
+import os
+import time
+import tracemalloc
+
+QUERY = (
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {rows}) "
+    "SELECT i AS detalle_id, i % 1000 AS pedido_id, i % 50 AS producto_id, "
+    "i % 7 + 1 AS cantidad, i * 0.37 AS precio_unitario, "
+    "'Producto de ejemplo ' || i AS descripcion FROM n"
+)
+
+
+def measure(fn):
+    """Devuelve (pico de memoria en MB, segundos)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 / 1024, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 200000],
+                        help="Filas del resultado")
+    args = parser.parse_args()
+
+    db_path = create_sqlite_db()
+    prepare_environment(db_path)
+    os.environ["CACHE_ENABLED"] = "False"
+    logging.disable(logging.INFO)
+
+    from benchmarks.stubs import StubChatModel
+    from src.chatbot import ChatbotSQL
+    from src.serialization import dumps
+
+    chatbot = ChatbotSQL(llm=StubChatModel(latency=0))
+
+    def fetchall(sql):
+        columns, data = chatbot.db_manager.execute_query(sql)
+        html = chatbot._format_results(columns, data)
+        assert len(html) > 0
+
+    def stream(sql):
+        sent = 0
+        for event in chatbot.stream_query(f"sql: {sql}"):
+            sent += len(dumps(event["data"]))
+            assert event["event"] != "error", event
+        assert sent > 0
+
+    print(f"{'filas':>8} {'fetchall MB':>12} {'stream MB':>10} {'fetchall s':>11} {'stream s':>9}")
+    try:
+        for rows in args.sizes:
+            sql = QUERY.format(rows=rows)
+            chatbot.max_rows = rows
+            old_peak, old_time = measure(lambda: fetchall(sql))
+            new_peak, new_time = measure(lambda: stream(sql))
+            print(f"{rows:>8} {old_peak:>12.1f} {new_peak:>10.1f} {old_time:>11.2f} {new_time:>9.2f}")
+    finally:
+        chatbot.close()
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Tokens de esquema en el prompt frente al número de tablas.
+
+Combina las cuatro tablas de sql_database.txt con tablas sintéticas de
+otros dominios y compara el esquema completo con el recortado por
+SchemaIndex para un presupuesto dado. Comprueba además que las tablas
+necesarias para cada pregunta siguen en el contexto. No usa red ni base
+de datos.
+
+Uso (desde app/):
+    python -m benchmarks.schema_pruning --budget 2000
+"""
+import argparse
+import os
+import random
+import time
+
+# Esquema real del proyecto (mismo formato que get_database_schema())
+BASE_SCHEMA = {
+    "clientes": {"columns": [
+        {"name": "cliente_id", "type": "INTEGER", "nullable": False, "primary_key": True},
+        {"name": "nombre", "type": "VARCHAR(100)", "nullable": False, "primary_key": False},
+        {"name": "email", "type": "VARCHAR(100)", "nullable": False, "primary_key": False},
+        {"name": "fecha_registro", "type": "DATE", "nullable": True, "primary_key": False}],
+        "foreign_keys": []},
+    "productos": {"columns": [
+        {"name": "producto_id", "type": "INTEGER", "nullable": False, "primary_key": True},
+        {"name": "nombre", "type": "VARCHAR(100)", "nullable": False, "primary_key": False},
+        {"name": "precio", "type": "NUMERIC(10, 2)", "nullable": False, "primary_key": False},
+        {"name": "categoria", "type": "VARCHAR(50)", "nullable": True, "primary_key": False}],
+        "foreign_keys": []},
+    "pedidos": {"columns": [
+        {"name": "pedido_id", "type": "INTEGER", "nullable": False, "primary_key": True},
+        {"name": "cliente_id", "type": "INTEGER", "nullable": True, "primary_key": False},
+        {"name": "fecha_pedido", "type": "DATE", "nullable": True, "primary_key": False},
+        {"name": "estado", "type": "VARCHAR(20)", "nullable": True, "primary_key": False}],
+        "foreign_keys": [{"constrained_columns": ["cliente_id"], "referred_table": "clientes",
+                          "referred_columns": ["cliente_id"]}]},
+    "detalles_pedido": {"columns": [
+        {"name": "detalle_id", "type": "INTEGER", "nullable": False, "primary_key": True},
+        {"name": "pedido_id", "type": "INTEGER", "nullable": True, "primary_key": False},
+        {"name": "producto_id", "type": "INTEGER", "nullable": True, "primary_key": False},
+        {"name": "cantidad", "type": "INTEGER", "nullable": False, "primary_key": False},
+        {"name": "precio_unitario", "type": "NUMERIC(10, 2)", "nullable": False, "primary_key": False}],
+        "foreign_keys": [{"constrained_columns": ["pedido_id"], "referred_table": "pedidos",
+                          "referred_columns": ["pedido_id"]},
+                         {"constrained_columns": ["producto_id"], "referred_table": "productos",
+                          "referred_columns": ["producto_id"]}]},
+}
+
+# Pregunta -> tablas que necesita la SQL correcta
+QUESTIONS = {
+    "¿Cuántos clientes hay registrados?": {"clientes"},
+    "¿Cuántos pedidos pendientes hay?": {"pedidos"},
+    "¿Qué productos ha comprado Juan Pérez?": {"clientes", "pedidos", "detalles_pedido", "productos"},
+    "Ventas totales por categoría de producto": {"detalles_pedido", "productos"},
+}
+
+_DOMAINS = ["inventario", "almacen", "factura", "proveedor", "empleado", "nomina", "envio",
+            "devolucion", "campana", "ticket", "contrato", "sucursal", "auditoria", "licencia"]
+_ATTRIBUTES = ["codigo", "descripcion", "importe", "fecha_alta", "fecha_baja", "observaciones",
+               "responsable", "region", "prioridad", "version", "origen", "destino", "total"]
+
+
+def synthetic_schema(extra_tables: int, seed: int = 7):
+    rng = random.Random(seed)
+    schema = dict(BASE_SCHEMA)
+    names = []
+    for i in range(extra_tables):
+        name = f"{rng.choice(_DOMAINS)}_{rng.choice(_DOMAINS)}_{i}"
+        columns = [{"name": f"{name}_id", "type": "INTEGER", "nullable": False, "primary_key": True}]
+        columns += [{"name": attr, "type": "VARCHAR(80)", "nullable": True, "primary_key": False}
+                    for attr in rng.sample(_ATTRIBUTES, 8)]
+        fks = []
+        if names:
+            parent = rng.choice(names)
+            columns.append({"name": f"{parent}_id", "type": "INTEGER", "nullable": True, "primary_key": False})
+            fks.append({"constrained_columns": [f"{parent}_id"], "referred_table": parent,
+                        "referred_columns": [f"{parent}_id"]})
+        schema[name] = {"columns": columns, "foreign_keys": fks}
+        names.append(name)
+    return schema
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=int, default=2000)
+    parser.add_argument("--sizes", default="0,50,200,500")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GROQ_API_KEY", "benchmark-sin-red")
+    from src.langchain_setup import build_schema_text, estimate_tokens
+    from src.schema_retrieval import SchemaIndex
+
+    print(f"{'tablas':>7} {'tokens completo':>16} {'tokens recortado':>17} {'cobertura':>10} {'ms/pregunta':>12}")
+    for extra in [int(n) for n in args.sizes.split(",")]:
+        schema = synthetic_schema(extra)
+        full_tokens = estimate_tokens(build_schema_text(schema))
+        index = SchemaIndex(schema)
+
+        pruned, covered, elapsed = [], 0, 0.0
+        for question, needed in QUESTIONS.items():
+            start = time.perf_counter()
+            tables = index.select_tables(question, args.budget)
+            elapsed += time.perf_counter() - start
+            pruned.append(estimate_tokens(build_schema_text({t: schema[t] for t in tables})))
+            covered += needed.issubset(tables)
+
+        print(f"{len(schema):>7} {full_tokens:>16} {sum(pruned) / len(pruned):>17.0f} "
+              f"{f'{covered}/{len(QUESTIONS)}':>10} {elapsed / len(QUESTIONS) * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
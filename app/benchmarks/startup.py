@@ -0,0 +1,74 @@
+"""
+Tiempo de arranque de ChatbotSQL con un esquema grande.
+
+Genera una base SQLite con --tables tablas (con claves foráneas en árbol)
+y mide:
+  - antes: introspección tabla a tabla + reflexión completa de SQLDatabase
+  - arranque en frío: sin instantánea en disco
+  - arranque en caliente: reutilizando la instantánea del esquema
+
+Uso (desde app/):
+    python -m benchmarks.startup --tables 300
+"""
+from benchmarks.fixtures import create_sqlite_db, prepare_environment
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+
+def _add_tables(db_path: str, count: int, columns: int) -> None:
+    with sqlite3.connect(db_path) as conn:
+        for i in range(count):
+            cols = ", ".join(f"atributo_{j} VARCHAR(50)" for j in range(columns))
+            parent = (i - 1) // 10
+            fk = f", tabla_{parent}_id INTEGER REFERENCES tabla_{parent}(id)" if i else ""
+            conn.execute(f"CREATE TABLE tabla_{i} (id INTEGER PRIMARY KEY, {cols}{fk})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tables", type=int, default=300)
+    parser.add_argument("--columns", type=int, default=10)
+    args = parser.parse_args()
+
+    db_path = create_sqlite_db()
+    _add_tables(db_path, args.tables, args.columns)
+    snapshot_dir = tempfile.mkdtemp(prefix="chatbot_schema_")
+    prepare_environment(db_path)
+    os.environ["SCHEMA_SNAPSHOT_DIR"] = snapshot_dir
+
+    from benchmarks.stubs import StubChatModel
+    from langchain_community.utilities.sql_database import SQLDatabase
+    from src.chatbot import ChatbotSQL
+    from src.models import engine
+    from src.schema import _introspect_with_inspector
+
+    def timed(fn):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+        return time.perf_counter() - start, result
+
+    try:
+        before, _ = timed(lambda: (_introspect_with_inspector(engine), SQLDatabase(engine)))
+        cold, chatbot = timed(lambda: ChatbotSQL(llm=StubChatModel()))
+        chatbot.close()
+        warm, chatbot = timed(lambda: ChatbotSQL(llm=StubChatModel()))
+        chatbot.close()
+
+        print(f"Tablas: {args.tables + 4}")
+        print(f"  antes (inspector + reflexión completa): {before:.3f}s")
+        print(f"  arranque en frío (sin instantánea):     {cold:.3f}s")
+        print(f"  arranque en caliente (instantánea):     {warm:.3f}s")
+    finally:
+        os.remove(db_path)
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
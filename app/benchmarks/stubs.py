@@ -0,0 +1,116 @@
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+from typing import Any, Dict, List, Optional
+import asyncio
+import itertools
+import threading
+import time
+
+# Consulta por defecto cuando la pregunta no está en el mapa de respuestas
+DEFAULT_SQL = "SELECT COUNT(*) AS total FROM clientes"
+
+# Secuencia típica del agente SQL real: listar tablas, pedir el esquema y
+# ejecutar la consulta antes de responder
+AGENT_TOOL_SCRIPT = ["sql_db_list_tables", "sql_db_schema", "sql_db_query"]
+
+_call_ids = itertools.count()
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4) if text else 0
+
+
+class StubStats:
+    """Contadores de llamadas y tokens compartidos por las copias del modelo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, prompt_tokens: int, completion_tokens: int) -> None:
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = self.prompt_tokens = self.completion_tokens = 0
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Modelo de chat local y determinista que imita a ChatGroq.
+
+    Simula la latencia de red con un sleep. Cuando se usa como agente (tras
+    bind_tools) recorre tool_script pidiendo una herramienta por llamada y
+    después devuelve la SQL como respuesta final; sin herramientas devuelve
+    la SQL directamente. Cuenta llamadas y tokens (estimados) en `stats`.
+    """
+
+    latency: float = 0.05
+    answers: Dict[str, str] = {}
+    use_tools: bool = True
+    tool_script: List[str] = ["sql_db_query"]
+    tools_bound: bool = False
+    _stats: StubStats = PrivateAttr(default_factory=StubStats)
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat"
+
+    @property
+    def stats(self) -> StubStats:
+        return self._stats
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "StubChatModel":
+        bound = self.model_copy(update={"tools_bound": True})
+        bound._stats = self._stats
+        return bound
+
+    def _question(self, messages: List[Any]) -> str:
+        humans = [m for m in messages if isinstance(m, HumanMessage)]
+        return humans[-1].content if humans else ""
+
+    def _generate(self, messages: List[Any], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def _agenerate(self, messages: List[Any], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._respond(messages)
+
+    def _tool_call(self, name: str, sql: str) -> Dict[str, Any]:
+        args = {
+            "sql_db_list_tables": {"tool_input": ""},
+            "sql_db_schema": {"table_names": "clientes, pedidos"},
+            "sql_db_query": {"query": sql}
+        }.get(name, {})
+        return {"name": name, "args": args, "id": f"call_{next(_call_ids)}"}
+
+    def _respond(self, messages: List[Any]) -> ChatResult:
+        sql = self.answers.get(self._question(messages), DEFAULT_SQL)
+        step = sum(1 for m in messages if isinstance(m, ToolMessage))
+
+        if self.use_tools and self.tools_bound and step < len(self.tool_script):
+            tool_calls = [self._tool_call(self.tool_script[step], sql)]
+            content, completion = "", str(tool_calls)
+        else:
+            tool_calls, content, completion = [], sql, sql
+
+        prompt_tokens = _estimate_tokens("".join(str(m.content) for m in messages))
+        completion_tokens = _estimate_tokens(completion)
+        self._stats.record(prompt_tokens, completion_tokens)
+        # Uso de tokens como lo informa ChatGroq (usage_metadata)
+        message = AIMessage(content=content, tool_calls=tool_calls, usage_metadata={
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -0,0 +1,327 @@
+"""
+Suite de benchmarks sin red: corpus de preguntas con SQL de referencia.
+
+Carga sql_database.txt en SQLite (o en PostgreSQL con --postgres-url),
+reproduce las respuestas grabadas del LLM (benchmarks/data/cassette.json,
+ver benchmarks.replay) y pasa cada pregunta del corpus por
+ChatbotSQL.process_query en los modos 'agent' y 'direct'. Informa de:
+
+- latencia de extremo a extremo (p50/p90/p95/p99)
+- llamadas al LLM y tokens de entrada/salida por pregunta
+- tiempo de ejecución SQL (spans 'sql*' de src.tracing)
+- exactitud: el resultado de la SQL generada frente al de la SQL de
+  referencia (mismas filas, se admiten columnas de más; el orden solo
+  cuenta si la referencia tiene ORDER BY)
+
+Con --baseline compara con una ejecución anterior y sale con código 1 si
+empeora (para usarlo como control de regresiones); --save-baseline guarda
+la ejecución actual como referencia. Si el prompt ya no es el grabado en
+el cassette (deriva) también sale con código 1: las respuestas grabadas
+no corresponden al prompt actual y hay que volver a grabarlas (--record)
+o, si el cambio no afecta a las respuestas, aceptarlo con
+--refresh-prompts.
+
+Uso (desde app/):
+    python -m benchmarks.suite
+    python -m benchmarks.suite --baseline benchmarks/data/baseline.json
+    python -m benchmarks.suite --save-baseline benchmarks/data/baseline.json
+    python -m benchmarks.suite --record          # regraba con ChatGroq (red)
+    python -m benchmarks.suite --refresh-prompts --save-baseline benchmarks/data/baseline.json
+"""
+from benchmarks.fixtures import create_sqlite_db, prepare_environment, load_postgres, percentile
+from collections import Counter
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+DATA_DIR = Path(__file__).parent / "data"
+
+# Métricas comparadas con la línea base: nombre -> (mayor es mejor, tolerancia)
+GATED_METRICS = {
+    "accuracy": (True, "absolute"),
+    "llm_calls_per_question": (False, "relative"),
+    "prompt_tokens_per_question": (False, "relative"),
+    "completion_tokens_per_question": (False, "relative"),
+    "latency_p95": (False, "latency"),
+}
+
+
+def normalize_value(value: Any) -> Any:
+    """Valores comparables entre motores (Decimal/float redondeados, texto sin espacios)"""
+    if isinstance(value, (Decimal, float)):
+        return round(float(value), 2)
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def normalize_rows(data: Sequence[Any]) -> List[Counter]:
+    """
+    Filas como multiconjuntos de valores normalizados
+
+    El orden y los nombres de las columnas no cuentan (SELECT a, b equivale
+    a SELECT b AS x, a).
+    """
+    rows = []
+    for row in data:
+        values = row.values() if hasattr(row, "values") else row
+        rows.append(Counter(normalize_value(v) for v in values))
+    return rows
+
+
+def has_order_by(sql: str) -> bool:
+    return re.search(r"\border\s+by\b", sql, re.IGNORECASE) is not None
+
+
+def _covers(predicted: Counter, gold: Counter) -> bool:
+    """La fila generada contiene todos los valores de la de referencia (admite columnas de más)"""
+    return all(predicted[value] >= count for value, count in gold.items())
+
+
+def results_match(gold: List[Counter], predicted: List[Counter], ordered: bool) -> bool:
+    """
+    Mismo número de filas y cada fila de referencia contenida en una generada
+
+    Las columnas adicionales (p. ej. el precio junto al nombre) no cuentan
+    como error; sí las filas de más o de menos y los valores distintos.
+    """
+    if len(gold) != len(predicted):
+        return False
+    if ordered:
+        return all(_covers(p, g) for g, p in zip(gold, predicted))
+    remaining = list(predicted)
+    for row in gold:
+        match = next((i for i, candidate in enumerate(remaining) if _covers(candidate, row)), None)
+        if match is None:
+            return False
+        remaining.pop(match)
+    return True
+
+
+def run_mode(mode: str, corpus: List[Dict[str, Any]], gold: Dict[str, List[Counter]], cassette: Any,
+             args: argparse.Namespace, recorder: Any = None) -> Dict[str, Any]:
+    """Pasa el corpus por un ChatbotSQL en el modo de generación indicado"""
+    from benchmarks.replay import ReplayChatModel
+    from src.chatbot import ChatbotSQL
+    from src.tracing import tracer
+
+    llm = ReplayChatModel(cassette=cassette, latency_scale=args.latency_scale, recorder=recorder,
+                          refresh_prompts=args.refresh_prompts)
+    chatbot = ChatbotSQL(llm=llm, generation_mode=mode)
+    traces = []
+    tracer.subscribe(traces.append)
+    results = []
+    try:
+        for _ in range(args.repeat):
+            for item in corpus:
+                calls, prompt_tokens, completion_tokens = llm.stats.calls, llm.stats.prompt_tokens, llm.stats.completion_tokens
+                traces.clear()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    response = chatbot.process_query(item["question"], render=False)
+                latency = time.perf_counter() - start
+
+                spans = traces[-1].spans if traces else []
+                predicted = response.get("query")
+                correct = False
+                if predicted:
+                    _, data = chatbot.db_manager.execute_query(predicted)
+                    correct = data is not None and results_match(
+                        gold[item["id"]], normalize_rows(data), has_order_by(item["gold_sql"])
+                    )
+                results.append({
+                    "id": item["id"],
+                    "mode": mode,
+                    "success": response["success"],
+                    "correct": correct,
+                    "sql": predicted,
+                    "latency": latency,
+                    "llm_calls": llm.stats.calls - calls,
+                    "prompt_tokens": llm.stats.prompt_tokens - prompt_tokens,
+                    "completion_tokens": llm.stats.completion_tokens - completion_tokens,
+                    "llm_seconds": sum(s.duration for s in spans if s.name == "llm"),
+                    "sql_seconds": sum(s.duration for s in spans if s.name.startswith("sql")),
+                })
+    finally:
+        tracer.unsubscribe(traces.append)
+        chatbot.close()
+    return {"summary": summarize(results, llm.drift), "questions": results}
+
+
+def summarize(results: List[Dict[str, Any]], drift: List[str]) -> Dict[str, Any]:
+    n = len(results) or 1
+    latencies = [r["latency"] for r in results]
+    sql_times = [r["sql_seconds"] for r in results]
+    return {
+        "questions": len(results),
+        "accuracy": sum(r["correct"] for r in results) / n,
+        "success_rate": sum(r["success"] for r in results) / n,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "llm_calls_per_question": sum(r["llm_calls"] for r in results) / n,
+        "prompt_tokens_per_question": sum(r["prompt_tokens"] for r in results) / n,
+        "completion_tokens_per_question": sum(r["completion_tokens"] for r in results) / n,
+        "llm_seconds_per_question": sum(r["llm_seconds"] for r in results) / n,
+        "sql_ms_p50": percentile(sql_times, 50) * 1000,
+        "sql_ms_p95": percentile(sql_times, 95) * 1000,
+        "prompt_drift": len(set(drift)),
+    }
+
+
+def compare_with_baseline(summaries: Dict[str, Dict[str, Any]], baseline: Dict[str, Any],
+                          tolerance: float, latency_tolerance: float) -> List[str]:
+    """Lista de regresiones respecto a la línea base (vacía si no hay)"""
+    regressions = []
+    for mode, summary in summaries.items():
+        reference = baseline.get("modes", {}).get(mode)
+        if reference is None:
+            continue
+        for metric, (higher_is_better, kind) in GATED_METRICS.items():
+            current, previous = summary[metric], reference.get(metric)
+            if previous is None:
+                continue
+            if kind == "absolute":
+                worse = current < previous - 1e-9 if higher_is_better else current > previous + 1e-9
+            else:
+                allowed = tolerance if kind == "relative" else latency_tolerance
+                worse = current > previous * (1 + allowed) + 1e-9
+            if worse:
+                regressions.append(f"{mode}: {metric} {previous:.4g} -> {current:.4g}")
+    return regressions
+
+
+def print_report(summaries: Dict[str, Dict[str, Any]], results: List[Dict[str, Any]]) -> None:
+    rows = [
+        ("preguntas", "questions", "{:.0f}"),
+        ("exactitud", "accuracy", "{:.0%}"),
+        ("éxito", "success_rate", "{:.0%}"),
+        ("latencia p50 s", "latency_p50", "{:.3f}"),
+        ("latencia p90 s", "latency_p90", "{:.3f}"),
+        ("latencia p95 s", "latency_p95", "{:.3f}"),
+        ("latencia p99 s", "latency_p99", "{:.3f}"),
+        ("llamadas LLM", "llm_calls_per_question", "{:.2f}"),
+        ("tokens entrada", "prompt_tokens_per_question", "{:.0f}"),
+        ("tokens salida", "completion_tokens_per_question", "{:.0f}"),
+        ("LLM s/preg", "llm_seconds_per_question", "{:.3f}"),
+        ("SQL ms p50", "sql_ms_p50", "{:.2f}"),
+        ("SQL ms p95", "sql_ms_p95", "{:.2f}"),
+        ("deriva prompt", "prompt_drift", "{:.0f}"),
+    ]
+    modes = list(summaries)
+    print(f"{'':>16} " + " ".join(f"{mode:>10}" for mode in modes))
+    for label, key, fmt in rows:
+        print(f"{label:>16} " + " ".join(f"{fmt.format(summaries[m][key]):>10}" for m in modes))
+    failed = [r for r in results if not r["correct"]]
+    if failed:
+        print("\nRespuestas incorrectas:")
+        for r in failed:
+            print(f"  [{r['mode']}] {r['id']}: {r['sql']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, default=DATA_DIR / "corpus.json")
+    parser.add_argument("--cassette", type=Path, default=DATA_DIR / "cassette.json")
+    parser.add_argument("--modes", default="agent,direct", help="Modos de generación separados por comas")
+    parser.add_argument("--repeat", type=int, default=1, help="Pasadas por el corpus")
+    parser.add_argument("--latency-scale", type=float, default=0.1,
+                        help="Factor sobre la latencia grabada del LLM (0 = sin esperas)")
+    parser.add_argument("--postgres-url", help="Base PostgreSQL local en lugar de SQLite (se recargan las tablas)")
+    parser.add_argument("--baseline", type=Path, help="Línea base con la que comparar")
+    parser.add_argument("--save-baseline", type=Path, help="Guarda esta ejecución como línea base")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Empeoramiento relativo admitido en llamadas y tokens")
+    parser.add_argument("--latency-tolerance", type=float, default=0.50, help="Empeoramiento relativo admitido en latencia p95")
+    parser.add_argument("--output", type=Path, help="Resultados por pregunta en JSON")
+    parser.add_argument("--record", action="store_true", help="Graba las respuestas de ChatGroq en el cassette (usa la red)")
+    parser.add_argument("--refresh-prompts", action="store_true",
+                        help="Guarda en el cassette la huella del prompt actual sin cambiar las respuestas")
+    args = parser.parse_args()
+
+    db_path = None
+    if args.postgres_url:
+        load_postgres(args.postgres_url)
+        os.environ["DATABASE_URL"] = args.postgres_url
+        os.environ.setdefault("GROQ_API_KEY", "benchmark-sin-red")
+        os.environ.setdefault("MODEL_NAME", "stub")
+    else:
+        db_path = create_sqlite_db()
+        prepare_environment(db_path)
+    os.environ["CACHE_ENABLED"] = "False"
+    os.environ["SCHEMA_SNAPSHOT_ENABLED"] = "False"
+    os.environ["TRACING_SLOW_SECONDS"] = "inf"
+    logging.disable(logging.WARNING)
+
+    from benchmarks.replay import Cassette
+    from src.database import DatabaseManager
+
+    corpus = json.loads(args.corpus.read_text(encoding="utf-8"))
+    recorder = None
+    if args.record:
+        from src.langchain_setup import create_llm
+        recorder = create_llm()
+        cassette = Cassette(args.cassette, model=os.getenv("MODEL_NAME", ""))
+    else:
+        cassette = Cassette.load(args.cassette)
+
+    try:
+        db = DatabaseManager()
+        gold = {}
+        for item in corpus:
+            _, data = db.execute_query(item["gold_sql"])
+            if data is None:
+                raise SystemExit(f"La SQL de referencia de '{item['id']}' no se puede ejecutar")
+            gold[item["id"]] = normalize_rows(data)
+
+        summaries, results = {}, []
+        for mode in args.modes.split(","):
+            run = run_mode(mode.strip(), corpus, gold, cassette, args, recorder)
+            summaries[mode.strip()] = run["summary"]
+            results.extend(run["questions"])
+        if args.record or args.refresh_prompts:
+            cassette.save()
+            print(f"Cassette grabado en {args.cassette} ({len(cassette.interactions)} respuestas)")
+
+        print(f"Cassette: {args.cassette.name} (modelo {cassette.model or '?'}), {len(corpus)} preguntas")
+        print_report(summaries, results)
+
+        if args.output:
+            args.output.write_text(json.dumps({"modes": summaries, "questions": results},
+                                              ensure_ascii=False, indent=1), encoding="utf-8")
+        if args.save_baseline:
+            args.save_baseline.write_text(json.dumps({"modes": summaries}, ensure_ascii=False, indent=1) + "\n",
+                                          encoding="utf-8")
+            print(f"\nLínea base guardada en {args.save_baseline}")
+        drift = {mode: summary["prompt_drift"] for mode, summary in summaries.items() if summary["prompt_drift"]}
+        if args.baseline:
+            regressions = compare_with_baseline(summaries, json.loads(args.baseline.read_text(encoding="utf-8")),
+                                                args.tolerance, args.latency_tolerance)
+            if regressions:
+                print("\nRegresiones respecto a la línea base:")
+                for line in regressions:
+                    print(f"  {line}")
+                sys.exit(1)
+            if not drift:
+                print("\nSin regresiones respecto a la línea base")
+        if drift:
+            print("\nEl prompt no es el grabado en el cassette ("
+                  + ", ".join(f"{mode}: {count} respuestas" for mode, count in drift.items())
+                  + "): vuelva a grabarlo con --record o acepte el cambio con --refresh-prompts")
+            sys.exit(1)
+    finally:
+        if db_path:
+            os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
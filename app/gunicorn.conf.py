@@ -0,0 +1,42 @@
+"""
+Configuración de gunicorn para producción (desde app/):
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Cada worker es un proceso uvicorn. Con preload_app la aplicación (conexión,
+esquema y agente de ChatbotSQL) se carga una sola vez en el proceso maestro
+y los workers la heredan con fork(); post_fork rehace en cada worker las
+conexiones y los pools de hilos, que no pueden compartirse.
+
+Para que la caché de consultas sea común a todos los workers hay que usar
+CACHE_BACKEND=shm (memoria compartida de la máquina) o CACHE_BACKEND=redis.
+La instantánea del esquema ya es compartida (SCHEMA_SNAPSHOT_DIR).
+"""
+from src.config import SERVER_CONFIG, CACHE_CONFIG, POOL_CONFIG
+
+bind = f"{SERVER_CONFIG['HOST']}:{SERVER_CONFIG['PORT']}"
+workers = SERVER_CONFIG['WORKERS']
+worker_class = SERVER_CONFIG['WORKER_CLASS']
+timeout = SERVER_CONFIG['TIMEOUT']
+preload_app = SERVER_CONFIG['PRELOAD']
+# Equivalente a proxy_headers=True del modo de desarrollo
+forwarded_allow_ips = "*"
+
+
+def when_ready(server):
+    server.log.info(
+        f"{workers} workers; hasta {workers * (POOL_CONFIG['SIZE'] + POOL_CONFIG['MAX_OVERFLOW'])} "
+        f"conexiones a la base de datos en total"
+    )
+    if workers > 1 and CACHE_CONFIG['BACKEND'] == 'local':
+        server.log.warning(
+            "CACHE_BACKEND=local con varios workers: cada worker tendrá su propia caché "
+            "(usa 'shm' o 'redis' para compartirla)"
+        )
+
+
+def post_fork(server, worker):
+    # Sin preload cada worker importa main por su cuenta y no hay nada heredado
+    if preload_app:
+        import main
+        main.after_fork()
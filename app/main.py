@@ -1,12 +1,22 @@
-from fastapi import FastAPI, Request, Form, HTTPException
+from fastapi import FastAPI, Request, Form, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from src.chatbot import ChatbotSQL
-from typing import Optional
+from src.executor import QueryExecutor, QueueFullError, QueryTimeoutError
+from src.serialization import FastJSONResponse, dumps, rows_as_lists
+from src.export import EXPORT_FORMATS, export_filename, export_media_type
+from src.tracing import tracer, flatten_gauges
+from src.resilience import ResilientChatModel
+from src.config import BATCH_CONFIG
+from pydantic import BaseModel
+from typing import Any, Dict, Iterator, List, Optional
 import logging
 import os
+import re
+import uuid
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -46,14 +56,26 @@ except Exception as e:
     logger.error(f"Error al inicializar el chatbot: {e}")
     raise RuntimeError("No se pudo inicializar el chatbot")
 
+# Pool acotado que ejecuta las consultas fuera del event loop
+executor = QueryExecutor(chatbot)
+
+# Cookie con la sesión de conversación de la interfaz de chat
+SESSION_COOKIE = "chatbot_session"
+
+def valid_session(session_id: str) -> bool:
+    """Los identificadores de sesión los genera el servidor (uuid4 en hexadecimal)"""
+    return re.fullmatch(r"[0-9a-f]{32}", session_id) is not None
+
+def chat_session(request: Request) -> str:
+    """Sesión de la cookie, o una nueva si no hay o no es válida"""
+    session_id = request.cookies.get(SESSION_COOKIE, "")
+    return session_id if valid_session(session_id) else uuid.uuid4().hex
+
 @app.get("/", include_in_schema=False)
 async def read_root(request: Request):
     """Endpoint raíz que muestra la página principal"""
     try:
-        return templates.TemplateResponse(
-            "index.html",
-            {"request": request}
-        )
+        return templates.TemplateResponse(request, "index.html")
     except Exception as e:
         logger.error(f"Error al cargar la página principal: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
@@ -63,9 +85,9 @@ async def chat_interface(request: Request):
     """Endpoint que muestra la interfaz de chat"""
     try:
         return templates.TemplateResponse(
+            request,
             "chat.html",
             {
-                "request": request,
                 "user_input": None,
                 "bot_response": None
             }
@@ -76,46 +98,280 @@ async def chat_interface(request: Request):
 
 @app.post("/query", include_in_schema=False)
 async def process_query(request: Request, user_input: str = Form(...)):
-    """Endpoint que procesa las consultas del usuario"""
+    """
+    Endpoint que procesa las consultas del usuario
+
+    Las preguntas de un mismo navegador forman una conversación (cookie
+    chatbot_session): "y solo los completados" se entiende respecto a la
+    pregunta anterior.
+    """
     try:
         if not user_input.strip():
             return RedirectResponse("/chat", status_code=303)
             
-        response = chatbot.process_query(user_input)
+        session_id = chat_session(request)
+        response = await executor.submit(user_input, session_id=session_id)
         
         if not response.get("success", False):
             logger.warning(f"Consulta no procesada correctamente: {user_input}")
-            return templates.TemplateResponse(
+            page = templates.TemplateResponse(
+                request,
                 "chat.html",
                 {
-                    "request": request,
                     "user_input": user_input,
                     "bot_response": "Lo siento, no pude procesar tu consulta."
                 }
             )
-        
-        return templates.TemplateResponse(
-            "chat.html",
-            {
-                "request": request,
-                "user_input": user_input,
-                "bot_response": response["response"]
-            }
-        )
+        else:
+            # TemplateResponse renderiza la plantilla al construirse
+            with tracer.span("render"):
+                page = templates.TemplateResponse(
+                    request,
+                    "chat.html",
+                    {
+                        "user_input": user_input,
+                        "bot_response": response["response"]
+                    }
+                )
+        page.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+        return page
+    except QueueFullError as e:
+        logger.warning(f"Consulta rechazada por saturación: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except QueryTimeoutError as e:
+        logger.warning(f"Consulta cancelada por tiempo: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error al procesar consulta: {e}")
         return RedirectResponse("/chat", status_code=303)
 
+def format_sse(event: Dict[str, Any]) -> str:
+    """Serializa un evento de ChatbotSQL.stream_query en formato Server-Sent Events"""
+    data = dumps(event["data"]).decode("utf-8")
+    return f"event: {event['event']}\ndata: {data}\n\n"
+
+@app.post("/query/stream", include_in_schema=False)
+async def stream_query(request: Request, user_input: str = Form(...), page_token: Optional[str] = Form(None)):
+    """
+    Procesa la consulta emitiendo eventos SSE: progreso del agente, SQL
+    generada y filas del resultado a medida que están disponibles
+
+    Usa la misma sesión de conversación que /query (cookie chatbot_session).
+    """
+    if not user_input.strip():
+        raise HTTPException(status_code=400, detail="La consulta está vacía")
+
+    session_id = chat_session(request)
+    try:
+        events = executor.stream(user_input, page_token, session_id)
+    except QueueFullError as e:
+        logger.warning(f"Consulta rechazada por saturación: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    def body() -> Iterator[str]:
+        # Starlette consume los iteradores síncronos en su pool de hilos
+        try:
+            for event in events:
+                yield format_sse(event)
+        finally:
+            events.close()
+
+    response = StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+    return response
+
+class QueryRequest(BaseModel):
+    user_input: str
+    page_token: Optional[str] = None
+    session_id: Optional[str] = None
+    new_session: bool = False
+
+@app.post("/api/query", response_class=FastJSONResponse)
+async def api_query(payload: QueryRequest):
+    """
+    Procesa la consulta y devuelve JSON: success, response (texto, sin HTML),
+    query, columns, results (filas como listas en el orden de columns),
+    next_page (token para pedir la página siguiente en page_token) y
+    session_id
+
+    Con new_session el servidor abre una conversación y devuelve su
+    session_id; las preguntas siguientes que lo envíen forman parte de ella.
+    Sin session_id cada consulta es independiente. Los session_id no los
+    elige el cliente: son aleatorios para que no se puedan adivinar ni
+    reutilizar los de otro usuario.
+    """
+    if not payload.user_input.strip():
+        raise HTTPException(status_code=400, detail="La consulta está vacía")
+    session_id = payload.session_id
+    if session_id is not None and not valid_session(session_id):
+        raise HTTPException(status_code=400, detail="session_id no válido: pide uno nuevo con new_session")
+    if session_id is None and payload.new_session:
+        session_id = uuid.uuid4().hex
+    try:
+        response = await executor.submit(payload.user_input, render=False, page_token=payload.page_token,
+                                         session_id=session_id)
+    except QueueFullError as e:
+        logger.warning(f"Consulta rechazada por saturación: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except QueryTimeoutError as e:
+        logger.warning(f"Consulta cancelada por tiempo: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
+
+    return FastJSONResponse({**api_response(response), "session_id": session_id})
+
+def api_response(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Respuesta de process_query en el formato JSON de /api/query"""
+    return {
+        "success": response.get("success", False),
+        "response": response.get("response"),
+        "query": response.get("query"),
+        "columns": response.get("columns"),
+        "results": rows_as_lists(response.get("columns"), response.get("results")),
+        "next_page": response.get("next_page")
+    }
+
+class BatchRequest(BaseModel):
+    questions: List[str]
+
+@app.post("/api/batch", response_class=FastJSONResponse)
+async def api_batch(payload: BatchRequest):
+    """
+    Procesa un lote de preguntas (hasta BATCH_MAX_QUESTIONS) y devuelve
+    {"results": [...]} con una respuesta por pregunta, en el mismo orden y
+    con el formato de /api/query
+    """
+    if not payload.questions:
+        raise HTTPException(status_code=400, detail="El lote está vacío")
+    if len(payload.questions) > BATCH_CONFIG['MAX_QUESTIONS']:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El lote supera el máximo de {BATCH_CONFIG['MAX_QUESTIONS']} preguntas"
+        )
+    try:
+        responses = await executor.batch(payload.questions)
+    except QueueFullError as e:
+        logger.warning(f"Lote rechazado por saturación: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    return FastJSONResponse({"results": [api_response(response) for response in responses]})
+
+@app.get("/api/export")
+async def export_results(user_input: str, fmt: str = Query("csv", alias="format")):
+    """
+    Exporta el resultado completo de la consulta (CSV, NDJSON o Parquet)
+
+    Vuelve a ejecutar la SQL generada para la pregunta (o la de 'sql:') y
+    envía el fichero por fragmentos desde el cursor de la base de datos.
+    """
+    fmt = fmt.lower()
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {fmt}")
+    if not user_input.strip():
+        raise HTTPException(status_code=400, detail="La consulta está vacía")
+
+    try:
+        chunks = executor.export(user_input, fmt)
+    except QueueFullError as e:
+        logger.warning(f"Exportación rechazada por saturación: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    # El primer fragmento resuelve la SQL y abre el cursor: los errores se
+    # devuelven como respuesta HTTP antes de empezar a enviar el fichero
+    try:
+        first = await run_in_threadpool(next, chunks, b"")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error al exportar: {e}")
+        raise HTTPException(status_code=500, detail="No se pudo exportar el resultado")
+
+    def body() -> Iterator[bytes]:
+        try:
+            yield first
+            yield from chunks
+        finally:
+            chunks.close()
+
+    return StreamingResponse(
+        body(),
+        media_type=export_media_type(fmt),
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(fmt)}"'}
+    )
+
+def runtime_stats() -> Dict[str, Any]:
+    return {
+        "executor": executor.stats(),
+        "db_pool": chatbot.db_manager.pool_metrics(),
+        "replicas": chatbot.db_manager.replica_metrics(),
+        "guard": chatbot.db_manager.guard_metrics(),
+        "workload": chatbot.db_manager.workload_metrics(),
+        "invalidation": chatbot.db_manager.invalidation_metrics(),
+        "rate_limit": chatbot.rate_limiter.stats() if chatbot.rate_limiter else None,
+        "llm": chatbot.llm.stats() if isinstance(chatbot.llm, ResilientChatModel) else None,
+        "cache": chatbot.cache.stats() if chatbot.cache else None,
+        "templates": chatbot.templates.stats() if chatbot.templates else None,
+        "docs": chatbot.docs_context.stats() if chatbot.docs_context else None,
+        "conversations": chatbot.conversations.stats() if chatbot.conversations else None
+    }
+
+@app.get("/api/metrics")
+async def metrics():
+    """Métricas de ejecución: pool de consultas, pool de conexiones, réplicas de lectura, guard, SQL grabada, invalidación por eventos, límite y cliente del LLM, caché, plantillas, documentación y conversaciones"""
+    return runtime_stats()
+
+@app.get("/api/templates", response_class=FastJSONResponse)
+async def answer_templates():
+    """
+    Plantillas de respuesta aprendidas del historial
+
+    Por plantilla: forma de la pregunta, SQL con huecos, apariciones,
+    preguntas resueltas sin LLM (route_hits), resultados servidos sin leer
+    las tablas (result_hits) y refrescos del resultado materializado con su
+    coste total en segundos.
+    """
+    report = chatbot.templates.report() if chatbot.templates else []
+    return FastJSONResponse({"templates": report})
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """
+    Métricas en formato Prometheus
+
+    Duración por etapa (LLM, herramientas, SQL, formateo, renderizado),
+    tokens, filas y peticiones de src.tracing, más el estado actual de
+    /api/metrics como gauges. En modo 'process' solo incluye lo medido en
+    el proceso principal.
+    """
+    body = tracer.metrics.render(flatten_gauges("chatbot", runtime_stats()))
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def after_fork() -> None:
+    """
+    Prepara el chatbot y el pool de consultas en un worker de gunicorn
+
+    Con preload_app (gunicorn.conf.py) la aplicación se importa una vez en
+    el proceso maestro y los workers la heredan con fork(); aquí se
+    sustituyen las conexiones, pools de hilos y locks heredados.
+    """
+    chatbot.after_fork()
+    executor.after_fork()
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Maneja el cierre de la aplicación"""
     try:
-        chatbot.close()
+        executor.shutdown()
+        await chatbot.aclose()
         logger.info("Recursos del chatbot liberados correctamente")
     except Exception as e:
         logger.error(f"Error al cerrar recursos: {e}")
 
-# Punto de entrada para desarrollo
+# Punto de entrada para desarrollo (en producción, con varios workers:
+# gunicorn -c gunicorn.conf.py main:app)
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
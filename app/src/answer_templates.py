@@ -0,0 +1,504 @@
+from src.cache import LRUCache, normalize_sql
+from src.sql_validator import extract_tables
+from src.tracing import tracer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Literales de la SQL: identificadores entre comillas (se saltan), cadenas y números
+_SQL_LITERAL = re.compile(r"\"[^\"]*\"|'((?:[^']|'')*)'|(?<![\w.$])(\d+(?:\.\d+)?)(?![\w.])")
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_WHITESPACE = re.compile(r"\s+")
+# Signos que se ignoran al principio y al final de la pregunta
+_EDGE_PUNCTUATION = "¿?¡!.,;: \t\r\n"
+# Palabras como máximo de un hueco de texto
+_MAX_SLOT_WORDS = 4
+
+# Expresión de cada tipo de hueco (sobre la pregunta sin tildes)
+_NAME = r"[A-Z][\w'-]*"
+_SLOT_PATTERNS = {
+    "int": r"\d+",
+    "decimal": r"\d+(?:[.,]\d+)?",
+    "date": r"\d{4}-\d{2}-\d{2}",
+    "name": rf"(?-i:{_NAME})",
+    "word": r"[^\W\d_]+",
+    "code": r"[\w-]+"
+}
+
+tracer.metrics.describe("chatbot_template_hits_total", "counter",
+                        "Preguntas resueltas por plantilla (route: sin LLM; result: sin leer las tablas)")
+tracer.metrics.describe("chatbot_template_refresh_seconds", "histogram",
+                        "Duración de cada cálculo o refresco de un resultado materializado")
+
+
+def _fold(text: str) -> str:
+    """Quita las tildes carácter a carácter, sin cambiar la longitud: 'Pérez' -> 'Perez'"""
+    return "".join(unicodedata.normalize("NFKD", c)[0] if c.isalpha() else c for c in text)
+
+
+def _clean_question(question: str) -> str:
+    return _WHITESPACE.sub(" ", question).strip(_EDGE_PUNCTUATION)
+
+
+def _slot_kind(value: str) -> Optional[Tuple[str, int]]:
+    """Tipo y número de palabras de un literal que puede ser un hueco, o None"""
+    if re.fullmatch(r"\d+", value):
+        return "int", 1
+    if re.fullmatch(r"\d+\.\d+", value):
+        return "decimal", 1
+    if _DATE.fullmatch(value):
+        return "date", 1
+    words = _fold(value).split()
+    if not words or len(words) > _MAX_SLOT_WORDS:
+        return None
+    if all(re.fullmatch(_NAME, w) for w in words):
+        return "name", len(words)
+    if all(re.fullmatch(_SLOT_PATTERNS["word"], w) for w in words):
+        return "word", len(words)
+    if all(re.fullmatch(_SLOT_PATTERNS["code"], w) for w in words):
+        return "code", len(words)
+    return None
+
+
+def _letter_case(value: str, written: str) -> Optional[str]:
+    """Cómo pasar el texto de la pregunta al literal de la SQL, o None si no es previsible"""
+    if value == written:
+        return "as_is"
+    if value.islower():
+        return "lower"
+    if value.isupper():
+        return "upper"
+    if value.istitle():
+        return "title"
+    return None
+
+
+class AnswerTemplate:
+    """
+    Forma de pregunta con huecos y la SQL que le corresponde
+
+    Los huecos son los literales de la SQL que aparecen tal cual en la
+    pregunta: "¿Cuántos pedidos ha hecho el cliente número 3?" con
+    "... WHERE cliente_id = 3" da el patrón "cuántos pedidos ha hecho el
+    cliente número {0}" y la SQL "... WHERE cliente_id = {0}". Los literales
+    que no están en la pregunta forman parte fija de la plantilla.
+    """
+
+    def __init__(self, question: str, sql: str, pattern: str, display: str, sql_shape: str,
+                 slots: List[Dict[str, Any]]):
+        self.key = hashlib.sha1(f"{pattern}\x00{sql_shape}".encode("utf-8")).hexdigest()[:10]
+        self.example_question = question
+        self.example_sql = sql
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+        self.display = display
+        self.sql_shape = sql_shape
+        self.slots = slots
+        self.occurrences = 0
+        self.route_hits = 0
+        self.result_hits = 0
+        self.refreshes = 0
+        self.refresh_seconds = 0.0
+        self.last_seen = time.time()
+
+    @classmethod
+    def learn(cls, question: str, sql: str) -> Optional["AnswerTemplate"]:
+        """Plantilla de un par pregunta/SQL del historial, o None si la pregunta está vacía"""
+        text = _clean_question(question)
+        folded = _fold(text)
+        if not text or len(folded) != len(text):
+            return None
+        sql = normalize_sql(sql)
+
+        literals = []
+        for match in _SQL_LITERAL.finditer(sql):
+            if match.group(1) is not None:
+                literals.append((match, match.group(1).replace("''", "'"), True))
+            elif match.group(2) is not None:
+                literals.append((match, match.group(2), False))
+
+        # Hueco por cada valor distinto que aparece una sola vez en la pregunta
+        slots: List[Dict[str, Any]] = []
+        index_of: Dict[Tuple[str, bool], int] = {}
+        for _, value, quoted in literals:
+            if (value, quoted) in index_of or _slot_kind(value) is None:
+                continue
+            found = list(re.finditer(rf"(?<![\w.,-]){re.escape(_fold(value))}(?![\w-]|[.,]\d)",
+                                     folded, re.IGNORECASE))
+            if len(found) != 1:
+                continue
+            span = found[0].span()
+            if any(span[0] < slot["span"][1] and slot["span"][0] < span[1] for slot in slots):
+                continue
+            # El tipo sale de cómo está escrito en la pregunta y la conversión,
+            # de cómo está escrito en la SQL
+            kind = _slot_kind(folded[span[0]:span[1]])
+            case = _letter_case(value, text[span[0]:span[1]])
+            if kind is None or case is None:
+                continue
+            index_of[(value, quoted)] = len(slots)
+            slots.append({"kind": kind[0], "words": kind[1], "quoted": quoted, "span": span, "case": case})
+
+        # SQL con los huecos como {n}
+        parts, position = [], 0
+        for match, value, quoted in literals:
+            index = index_of.get((value, quoted))
+            if index is None:
+                continue
+            parts.append(sql[position:match.start()].replace("{", "{{").replace("}", "}}"))
+            parts.append(f"'{{{index}}}'" if quoted else f"{{{index}}}")
+            position = match.end()
+        parts.append(sql[position:].replace("{", "{{").replace("}", "}}"))
+
+        # Expresión de la pregunta: texto fijo (espacios flexibles) y grupos
+        pattern, display, position = [], [], 0
+        for index, slot in sorted(enumerate(slots), key=lambda item: item[1]["span"][0]):
+            start, end = slot["span"]
+            pattern.append(_fixed_pattern(folded[position:start].lower()))
+            body = _SLOT_PATTERNS[slot["kind"]]
+            pattern.append(f"(?P<s{index}>{body}" + rf"(?:\s+{body})" * (slot["words"] - 1) + ")")
+            display.append(text[position:start] + f"{{{index}}}")
+            position = end
+        pattern.append(_fixed_pattern(folded[position:].lower()))
+        display.append(text[position:])
+        for slot in slots:
+            del slot["span"]
+        return cls(question, sql, "".join(pattern), "".join(display), "".join(parts), slots)
+
+    def match(self, question: str) -> Optional[str]:
+        """SQL de la plantilla con los valores de la pregunta, o None si no encaja"""
+        text = _clean_question(question)
+        folded = _fold(text)
+        if len(folded) != len(text):
+            return None
+        match = self.pattern.fullmatch(folded)
+        if match is None:
+            return None
+        values = []
+        for index, slot in enumerate(self.slots):
+            value = text[match.start(f"s{index}"):match.end(f"s{index}")]
+            if slot["kind"] == "decimal":
+                value = value.replace(",", ".")
+            if slot["case"] == "lower":
+                value = value.lower()
+            elif slot["case"] == "upper":
+                value = value.upper()
+            elif slot["case"] == "title":
+                value = value.title()
+            values.append(value.replace("'", "''") if slot["quoted"] else value)
+        return self.sql_shape.format(*values)
+
+    @property
+    def weight(self) -> int:
+        return self.occurrences + self.route_hits
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.key,
+            "question": self.display,
+            "sql": self.sql_shape,
+            "slots": [slot["kind"] for slot in self.slots],
+            "occurrences": self.occurrences,
+            "route_hits": self.route_hits,
+            "result_hits": self.result_hits,
+            "refreshes": self.refreshes,
+            "refresh_seconds": round(self.refresh_seconds, 4)
+        }
+
+
+def _fixed_pattern(text: str) -> str:
+    return r"\s+".join(re.escape(word) for word in text.split(" ")) if text else ""
+
+
+class AnswerTemplates:
+    """
+    Plantillas de respuesta aprendidas del historial de SQL generada
+
+    - observe(): cada pregunta respondida con SQL suma una aparición a su
+      plantilla; a las MIN_OCCURRENCES apariciones la plantilla se activa.
+    - route(): una pregunta con la forma de una plantilla activa obtiene su
+      SQL sin llamar al LLM, aunque cambien los valores de los huecos.
+    - get_result()/put_result(): el resultado de la SQL de una plantilla
+      activa se materializa en memoria junto con la marca de agua de sus
+      tablas (DatabaseManager.table_watermarks). Mientras no cambie, se
+      sirve sin leer las tablas; si cambia, solo se recalculan los
+      resultados de las plantillas que usan esas tablas, la siguiente vez
+      que se piden.
+
+    La marca de agua se lee antes de ejecutar la SQL, así una escritura
+    simultánea deja el resultado como desactualizado y no como vigente.
+    """
+
+    def __init__(self, watermarks: Callable[[List[str]], Dict[str, str]], min_occurrences: int = 3,
+                 max_templates: int = 200, max_materialized: int = 256, watermark_interval: float = 5.0,
+                 path: Optional[Path] = None):
+        self.min_occurrences = max(1, min_occurrences)
+        self.max_templates = max_templates
+        self.watermark_interval = watermark_interval
+        self.path = Path(path) if path else None
+        self._fetch_watermarks = watermarks
+        self._templates: Dict[str, AnswerTemplate] = {}
+        self._active: Dict[str, AnswerTemplate] = {}
+        # SQL normalizada -> (plantilla, tablas) de las SQL de plantillas activas
+        self._tracked = LRUCache(max_materialized * 4)
+        # SQL normalizada -> (marca de agua, columnas, filas)
+        self._results = LRUCache(max_materialized)
+        self._watermarks: Dict[str, Tuple[str, float]] = {}
+        self._pending: Dict[str, Tuple[str, ...]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.invalidations = 0
+        if self.path is not None:
+            self.load()
+
+    # Aprendizaje y enrutado
+
+    def observe(self, question: str, sql: Optional[str]) -> None:
+        """Registra una pregunta respondida con `sql` (generada o de la caché)"""
+        if not sql:
+            return
+        learned = AnswerTemplate.learn(question, sql)
+        if learned is None:
+            return
+        with self._lock:
+            template = self._templates.get(learned.key)
+            if template is None:
+                if len(self._templates) >= self.max_templates:
+                    self._evict()
+                template = self._templates[learned.key] = learned
+            template.occurrences += 1
+            template.last_seen = time.time()
+            if template.occurrences == self.min_occurrences:
+                self._active[template.key] = template
+                self._dirty = True
+                logger.info(f"Nueva plantilla de respuesta {template.key}: '{template.display}' -> {template.sql_shape}")
+            active = template.key in self._active
+        if active:
+            self._track(sql, template)
+        if self._dirty and self.path is not None:
+            self.save()
+
+    def _evict(self) -> None:
+        """Descarta la plantilla menos usada (con el lock adquirido)"""
+        victim = min(self._templates.values(), key=lambda t: (t.weight, t.last_seen))
+        del self._templates[victim.key]
+        self._active.pop(victim.key, None)
+
+    def route(self, question: str) -> Optional[Tuple[str, str]]:
+        """
+        SQL para la pregunta según las plantillas activas
+
+        Returns:
+            Tuple con (SQL, id de la plantilla), o None si ninguna encaja
+        """
+        with self._lock:
+            candidates = list(self._active.values())
+        best: Optional[Tuple[AnswerTemplate, str]] = None
+        for template in candidates:
+            sql = template.match(question)
+            if sql is not None and (best is None or template.weight > best[0].weight):
+                best = (template, sql)
+        if best is None:
+            return None
+        template, sql = best
+        with self._lock:
+            template.route_hits += 1
+            template.last_seen = time.time()
+        tracer.metrics.inc("chatbot_template_hits_total", kind="route", template=template.key)
+        self._track(sql, template)
+        return sql, template.key
+
+    def _track(self, sql: str, template: AnswerTemplate) -> None:
+        key = normalize_sql(sql)
+        if key not in self._tracked:
+            tables, ctes = extract_tables(sql)
+            self._tracked.set(key, (template.key, sorted({t.split(".")[-1] for t in tables - ctes})))
+
+    # Resultados materializados
+
+    def get_result(self, sql: str) -> Optional[Tuple[List[str], Any]]:
+        """Resultado materializado y vigente de la SQL de una plantilla activa, o None"""
+        key = normalize_sql(sql)
+        tracked = self._tracked.get(key)
+        if tracked is None:
+            return None
+        template = self._active.get(tracked[0])
+        watermark = self._watermark(tracked[1]) if template is not None else None
+        if watermark is None:
+            return None
+        entry = self._results.get(key)
+        if entry is not None and entry[0] == watermark:
+            with self._lock:
+                template.result_hits += 1
+            tracer.metrics.inc("chatbot_template_hits_total", kind="result", template=template.key)
+            return entry[1], entry[2]
+        with self._lock:
+            if len(self._pending) > 1024:
+                self._pending.clear()
+            self._pending[key] = watermark
+        return None
+
+    def expects_result(self, sql: str) -> bool:
+        """True si get_result() ha fallado para esta SQL y put_result() la materializará"""
+        with self._lock:
+            return normalize_sql(sql) in self._pending
+
+    def put_result(self, sql: str, columns: List[str], data: Any, cost: float = 0.0) -> None:
+        """Materializa el resultado si get_result() acaba de fallar para esta SQL"""
+        key = normalize_sql(sql)
+        with self._lock:
+            watermark = self._pending.pop(key, None)
+        tracked = self._tracked.get(key) if watermark is not None else None
+        template = self._active.get(tracked[0]) if tracked is not None else None
+        if template is None:
+            return
+        self._results.set(key, (watermark, columns, data), cost=cost)
+        with self._lock:
+            template.refreshes += 1
+            template.refresh_seconds += cost
+        tracer.metrics.observe("chatbot_template_refresh_seconds", cost, template=template.key)
+
+    def _watermark(self, tables: List[str]) -> Optional[Tuple[str, ...]]:
+        """
+        Marca de agua conjunta de las tablas, o None si alguna no la tiene
+
+        Cada tabla se consulta como mucho una vez cada watermark_interval
+        segundos (un resultado puede servirse con ese retraso).
+        """
+        now = time.monotonic()
+        with self._lock:
+            stale = [t for t in tables if t not in self._watermarks
+                     or now - self._watermarks[t][1] >= self.watermark_interval]
+        if stale:
+            try:
+                fresh = self._fetch_watermarks(stale)
+            except Exception as e:
+                logger.warning(f"No se pudo leer la marca de agua de {stale}: {e}")
+                return None
+            with self._lock:
+                for table in stale:
+                    if table in fresh:
+                        self._watermarks[table] = (fresh[table], now)
+                    else:
+                        self._watermarks.pop(table, None)
+        with self._lock:
+            if any(t not in self._watermarks for t in tables):
+                return None
+            return tuple(self._watermarks[t][0] for t in tables)
+
+    # Mantenimiento
+
+    def invalidate(self) -> None:
+        """Olvida plantillas y resultados (p. ej. porque ha cambiado el esquema)"""
+        with self._lock:
+            self._templates.clear()
+            self._active.clear()
+            self._watermarks.clear()
+            self._pending.clear()
+            self.invalidations += 1
+            self._dirty = True
+        self._tracked.clear()
+        self._results.clear()
+
+    def tables_changed(self, tables: Optional[List[str]] = None) -> None:
+        """
+        Descarta los resultados materializados que leen las tablas (None =
+        todos) y su marca de agua memorizada
+
+        Lo llama src.invalidation al recibir una notificación de escritura.
+        Los contadores de pg_stat_user_tables pueden tardar en reflejar la
+        escritura, por eso no basta con volver a leer la marca de agua: el
+        resultado se recalcula en la siguiente get_result().
+        """
+        if tables is None:
+            with self._lock:
+                self._watermarks.clear()
+            self._results.clear()
+            return
+        changed = set(tables)
+        with self._lock:
+            for table in changed:
+                self._watermarks.pop(table, None)
+        stale = []
+        for key in self._results.keys():
+            tracked = self._tracked.get(key)
+            if tracked is None or changed.intersection(tracked[1]):
+                stale.append(key)
+        self._results.delete(stale)
+
+    def after_fork(self) -> None:
+        """Reinicia locks en un worker creado con fork()"""
+        self._lock = threading.Lock()
+        self._tracked.after_fork()
+        self._results.after_fork()
+        self._pending = {}
+
+    def save(self) -> None:
+        """Guarda las plantillas aprendidas de forma atómica (varios workers pueden escribir)"""
+        if self.path is None:
+            return
+        with self._lock:
+            self._dirty = False
+            payload = [{"question": t.example_question, "sql": t.example_sql, "occurrences": t.occurrences,
+                        "route_hits": t.route_hits} for t in self._templates.values()]
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"saved_at": time.time(), "templates": payload}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"No se pudieron guardar las plantillas de respuesta: {e}")
+
+    def load(self) -> None:
+        """Recupera las plantillas guardadas por save()"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)["templates"]
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Plantillas de respuesta ilegibles ({self.path}): {e}")
+            return
+        with self._lock:
+            for item in saved[:self.max_templates]:
+                template = AnswerTemplate.learn(item["question"], item["sql"])
+                if template is None:
+                    continue
+                template.occurrences = item.get("occurrences", 0)
+                template.route_hits = item.get("route_hits", 0)
+                self._templates[template.key] = template
+                if template.occurrences >= self.min_occurrences:
+                    self._active[template.key] = template
+        logger.info(f"Plantillas de respuesta cargadas: {len(self._templates)} ({len(self._active)} activas)")
+
+    # Métricas
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Plantillas con sus aciertos y coste de refresco, las más usadas primero"""
+        with self._lock:
+            templates = sorted(self._templates.values(), key=lambda t: t.weight + t.result_hits, reverse=True)
+            return [{**t.to_dict(), "active": t.key in self._active} for t in templates]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            active = list(self._active.values())
+            return {
+                "templates": len(self._templates),
+                "active": len(active),
+                "route_hits": sum(t.route_hits for t in active),
+                "result_hits": sum(t.result_hits for t in active),
+                "refreshes": sum(t.refreshes for t in active),
+                "refresh_seconds": round(sum(t.refresh_seconds for t in active), 3),
+                "materialized": self._results.stats()["size"],
+                "invalidations": self.invalidations
+            }
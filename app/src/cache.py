@@ -0,0 +1,857 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from decimal import Decimal
+from functools import lru_cache
+from pathlib import Path
+from src.results import ColumnarResult, ResultPage
+from src.sql_validator import extract_tables
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Tuple, List
+import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+
+try:
+    import redis
+except ImportError:  # redis es opcional: solo lo necesita CACHE_BACKEND=redis
+    redis = None
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: se usa json de la librería estándar
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Backends de QueryCache: 'local' (memoria del proceso), 'shm' (SQLite en
+# memoria compartida, /dev/shm) y 'redis' (Redis o compatible)
+CACHE_BACKENDS = ("local", "shm", "redis")
+
+# Signos que no cambian el significado de la pregunta
+_PUNCTUATION = re.compile(r"[¿?¡!.,;:\"'()\[\]{}]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """
+    Normaliza una pregunta para usarla como clave de caché
+
+    Ignora mayúsculas, tildes, signos de puntuación y espacios repetidos:
+    "¿Cuántos pedidos  pendientes hay?" -> "cuantos pedidos pendientes hay"
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def normalize_sql(sql: str) -> str:
+    """Normaliza espacios y el ';' final de una consulta SQL (sin tocar literales)"""
+    return _WHITESPACE.sub(" ", sql).strip().rstrip(";").strip()
+
+
+@lru_cache(maxsize=4096)
+def sql_tables(sql: str) -> FrozenSet[str]:
+    """Tablas que lee una consulta, sin esquema ni comillas y en minúsculas"""
+    tables, ctes = extract_tables(sql)
+    return frozenset(t.split(".")[-1].strip('"').lower() for t in tables - ctes)
+
+
+def schema_fingerprint(schema: Dict[str, Any]) -> str:
+    """Huella estable del esquema devuelto por get_database_schema()"""
+    payload = json.dumps(schema, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """
+    Caché LRU acotada en número de entradas y con TTL opcional.
+
+    Cada entrada guarda además el coste (segundos) que costó calcularla, de
+    modo que los aciertos contabilizan la latencia ahorrada.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[Any, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._meta: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires, cost = entry
+            if expires and expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += cost
+            return value
+
+    def set(self, key: str, value: Any, cost: float = 0.0) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl else 0.0
+        with self._lock:
+            self._data[key] = (value, expires, cost)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._data.keys())
+
+    def delete(self, keys: List[str]) -> int:
+        """Borra las claves indicadas y devuelve cuántas había"""
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def swap_meta(self, name: str, value: str) -> Optional[str]:
+        """Guarda un valor auxiliar (p. ej. la huella del esquema) y devuelve el anterior"""
+        with self._lock:
+            previous, self._meta[name] = self._meta.get(name), value
+            return previous
+
+    def after_fork(self) -> None:
+        """En un proceso hijo de fork(): el lock pudo copiarse adquirido"""
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "local",
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "saved_seconds": round(self.saved_seconds, 3)
+            }
+
+
+# Clave de los objetos JSON que representan un valor que JSON no tiene
+_TYPE_KEY = "__t"
+
+
+def _encode(value: Any) -> Any:
+    """
+    Valor de la caché como estructura JSON
+
+    Los tipos que JSON no tiene (Decimal, fechas, tuplas, páginas de
+    resultados...) se guardan como {"__t": tipo, ...} para que _decode
+    devuelva el mismo valor.
+    """
+    if value is None or isinstance(value, (str, int)):
+        return value
+    if isinstance(value, float):
+        return value if math.isfinite(value) else {_TYPE_KEY: "float", "v": repr(value)}
+    if isinstance(value, dict):
+        if _TYPE_KEY in value:
+            return {_TYPE_KEY: "dict", "v": [[k, _encode(v)] for k, v in value.items()]}
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, ResultPage):
+        return {_TYPE_KEY: "page", "v": [_encode(row) for row in value],
+                "offset": value.offset, "next_offset": value.next_offset}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, tuple):
+        return {_TYPE_KEY: "tuple", "v": [_encode(v) for v in value]}
+    if isinstance(value, ColumnarResult):
+        return {_TYPE_KEY: "columnar", "columns": value.columns,
+                "v": [[_encode(v) for v in array] for array in value.arrays],
+                "offset": value.offset, "next_offset": value.next_offset}
+    if isinstance(value, Decimal):
+        return {_TYPE_KEY: "decimal", "v": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {_TYPE_KEY: "datetime", "v": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {_TYPE_KEY: "date", "v": value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {_TYPE_KEY: "time", "v": value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {_TYPE_KEY: "timedelta", "v": value.total_seconds()}
+    if isinstance(value, uuid.UUID):
+        return {_TYPE_KEY: "uuid", "v": str(value)}
+    if isinstance(value, (bytes, memoryview)):
+        return {_TYPE_KEY: "bytes", "v": bytes(value).hex()}
+    raise TypeError(f"Tipo no admitido en la caché compartida: {type(value).__name__}")
+
+
+_DECODERS = {
+    "dict": lambda e: {k: _decode(v) for k, v in e["v"]},
+    "page": lambda e: ResultPage([_decode(row) for row in e["v"]], e["offset"], e["next_offset"]),
+    "tuple": lambda e: tuple(_decode(v) for v in e["v"]),
+    "columnar": lambda e: ColumnarResult(e["columns"], [[_decode(v) for v in array] for array in e["v"]],
+                                         e["offset"], e["next_offset"]),
+    "float": lambda e: float(e["v"]),
+    "decimal": lambda e: Decimal(e["v"]),
+    "datetime": lambda e: datetime.datetime.fromisoformat(e["v"]),
+    "date": lambda e: datetime.date.fromisoformat(e["v"]),
+    "time": lambda e: datetime.time.fromisoformat(e["v"]),
+    "timedelta": lambda e: datetime.timedelta(seconds=e["v"]),
+    "uuid": lambda e: uuid.UUID(e["v"]),
+    "bytes": lambda e: bytes.fromhex(e["v"])
+}
+
+
+def _decode(value: Any) -> Any:
+    """Inversa de _encode"""
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    kind = value.get(_TYPE_KEY)
+    if kind is None:
+        return {k: _decode(v) for k, v in value.items()}
+    try:
+        return _DECODERS[kind](value)
+    except KeyError:
+        raise ValueError(f"Entrada de caché no válida: {kind}") from None
+
+
+def dumps_value(value: Any) -> bytes:
+    """Serializa un valor de la caché compartida a JSON (orjson si está instalado)"""
+    if orjson is not None:
+        return orjson.dumps(_encode(value))
+    return json.dumps(_encode(value), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads_value(payload: bytes) -> Any:
+    """
+    Lee un valor guardado con dumps_value
+
+    Solo se decodifica JSON: una entrada escrita por otro usuario del
+    fichero o del servidor Redis no puede ejecutar código (como con pickle).
+
+    Raises:
+        ValueError: si la entrada no es JSON válido o tiene un tipo desconocido
+    """
+    return _decode(orjson.loads(payload) if orjson is not None else json.loads(payload))
+
+
+class _SharedCacheBase(ABC):
+    """
+    Parte común de las cachés compartidas entre procesos
+
+    Los valores se guardan como JSON (dumps_value) junto con su coste. Los
+    contadores de aciertos y fallos son del proceso que los consulta; el
+    tamaño y las entradas son comunes a todos los workers. Un fallo del
+    backend se registra y se trata como un fallo de caché: la consulta
+    sigue adelante sin caché.
+
+    Cada backend implementa los métodos abstractos; si le falta alguno
+    falla al construirse, no al usarse.
+    """
+
+    backend = ""
+
+    def __init__(self, namespace: str, maxsize: int, ttl: Optional[float] = None):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self.saved_seconds = 0.0
+
+    def _count(self, hit: bool, cost: float = 0.0) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.saved_seconds += cost
+            else:
+                self.misses += 1
+
+    def _failed(self, operation: str, error: Exception) -> None:
+        with self._lock:
+            self.errors += 1
+        logger.warning(f"Caché compartida ({self.backend}) no disponible en {operation}: {error}")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys()
+
+    def after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Valor de la clave, o None si no está o caducó"""
+
+    @abstractmethod
+    def set(self, key: str, value: Any, cost: float = 0.0) -> None:
+        """Guarda el valor expulsando las entradas menos usadas por encima de maxsize"""
+
+    @abstractmethod
+    def keys(self) -> List[str]:
+        """Claves del espacio de nombres, de la menos a la más usada"""
+
+    @abstractmethod
+    def delete(self, keys: List[str]) -> int:
+        """Borra las claves y devuelve cuántas existían"""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Vacía el espacio de nombres"""
+
+    @abstractmethod
+    def swap_meta(self, name: str, value: str) -> Optional[str]:
+        """Guarda un metadato compartido y devuelve su valor anterior"""
+
+    @abstractmethod
+    def _size(self) -> Optional[int]:
+        """Número de entradas, o None si el backend no responde"""
+
+    def stats(self) -> Dict[str, Any]:
+        size = self._size()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": self.backend,
+                "size": size,
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "errors": self.errors,
+                "saved_seconds": round(self.saved_seconds, 3)
+            }
+
+
+def default_shm_path() -> Path:
+    """
+    Fichero de la caché 'shm' en un directorio privado del usuario (0700)
+
+    En /dev/shm (tmpfs) si existe, si no en el directorio temporal. Otro
+    usuario de la máquina no puede crear el fichero antes ni leerlo.
+    """
+    base = Path("/dev/shm") if os.path.isdir("/dev/shm") else Path(tempfile.gettempdir())
+    directory = base / f"sql_chatbot-{os.getuid()}"
+    try:
+        directory.mkdir(mode=0o700)
+    except FileExistsError:
+        pass
+    _check_private(directory, directory=True)
+    return directory / "cache.db"
+
+
+def _check_private(path: Path, directory: bool = False) -> None:
+    """
+    Comprueba que 'path' es del usuario del proceso y no es un enlace; un
+    directorio, además, sin permisos para el grupo ni para otros
+
+    Raises:
+        PermissionError: si no es así
+    """
+    info = os.lstat(path)
+    if stat.S_ISLNK(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{path} no pertenece al usuario del proceso")
+    if directory and (not stat.S_ISDIR(info.st_mode) or info.st_mode & 0o077):
+        raise PermissionError(f"{path} debe ser un directorio con permisos 0700")
+
+
+class SharedMemoryLRUCache(_SharedCacheBase):
+    """
+    Caché LRU compartida por los procesos de la máquina (backend 'shm')
+
+    Es un fichero SQLite en /dev/shm (memoria, sin disco) abierto con mmap
+    y WAL: varios procesos leen a la vez y las escrituras se serializan con
+    el bloqueo del propio SQLite. Cada proceso (y cada hilo) abre su propia
+    conexión, también después de fork(). Un fichero existente solo se abre
+    si es del usuario del proceso (ver default_shm_path).
+    """
+
+    backend = "shm"
+
+    # La marca de último uso solo se reescribe si tiene más de esto (s): un
+    # acierto es una lectura y no compite por el bloqueo de escritura
+    TOUCH_INTERVAL = 1.0
+
+    def __init__(self, path: Path, namespace: str, maxsize: int, ttl: Optional[float] = None,
+                 mmap_size: int = 64 * 1024 * 1024):
+        super().__init__(namespace, maxsize, ttl)
+        self.path = Path(path)
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        if self.path.exists():
+            _check_private(self.path)
+        self._connection()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (ns TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+            "cost REAL NOT NULL, expires REAL NOT NULL, used REAL NOT NULL, PRIMARY KEY (ns, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (ns, used)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, cost, expires, used FROM entries WHERE ns = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+            if row is None:
+                self._count(False)
+                return None
+            value, cost, expires, used = row
+            now = time.time()
+            if expires and expires < now:
+                conn.execute("DELETE FROM entries WHERE ns = ? AND key = ?", (self.namespace, key))
+                self._count(False)
+                return None
+            if now - used > self.TOUCH_INTERVAL:
+                conn.execute("UPDATE entries SET used = ? WHERE ns = ? AND key = ?", (now, self.namespace, key))
+            result = loads_value(value)
+        except (sqlite3.Error, ValueError) as e:
+            self._failed("get", e)
+            self._count(False)
+            return None
+        self._count(True, cost)
+        return result
+
+    def set(self, key: str, value: Any, cost: float = 0.0) -> None:
+        now = time.time()
+        expires = now + self.ttl if self.ttl else 0.0
+        try:
+            payload = dumps_value(value)
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (ns, key, value, cost, expires, used) VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.namespace, key, payload, cost, expires, now)
+                )
+                excess = conn.execute(
+                    "SELECT COUNT(*) FROM entries WHERE ns = ?", (self.namespace,)
+                ).fetchone()[0] - self.maxsize
+                if excess > 0:
+                    conn.execute(
+                        "DELETE FROM entries WHERE ns = ? AND key IN "
+                        "(SELECT key FROM entries WHERE ns = ? ORDER BY used LIMIT ?)",
+                        (self.namespace, self.namespace, excess)
+                    )
+        except (sqlite3.Error, TypeError) as e:
+            self._failed("set", e)
+            return
+        if excess > 0:
+            with self._lock:
+                self.evictions += excess
+
+    def keys(self) -> List[str]:
+        try:
+            rows = self._connection().execute(
+                "SELECT key FROM entries WHERE ns = ? ORDER BY used", (self.namespace,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            self._failed("keys", e)
+            return []
+        return [row[0] for row in rows]
+
+    def delete(self, keys: List[str]) -> int:
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                return sum(conn.execute("DELETE FROM entries WHERE ns = ? AND key = ?",
+                                        (self.namespace, key)).rowcount for key in keys)
+        except sqlite3.Error as e:
+            self._failed("delete", e)
+            return 0
+
+    def clear(self) -> None:
+        try:
+            self._connection().execute("DELETE FROM entries WHERE ns = ?", (self.namespace,))
+        except sqlite3.Error as e:
+            self._failed("clear", e)
+
+    def swap_meta(self, name: str, value: str) -> Optional[str]:
+        name = f"{self.namespace}:{name}"
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+                conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+        except sqlite3.Error as e:
+            self._failed("swap_meta", e)
+            return None
+        return row[0] if row else None
+
+    def _size(self) -> Optional[int]:
+        try:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM entries WHERE ns = ?", (self.namespace,)
+            ).fetchone()[0]
+        except sqlite3.Error as e:
+            self._failed("stats", e)
+            return None
+
+    def after_fork(self) -> None:
+        # Las conexiones del padre no se usan en el hijo (se comprueba el pid)
+        super().after_fork()
+        self._local = threading.local()
+
+
+class RedisLRUCache(_SharedCacheBase):
+    """
+    Caché LRU compartida en Redis (o un servidor compatible: Valkey, KeyDB...)
+
+    Cada entrada es una clave '<namespace>:v:<clave>' con el TTL de Redis, y
+    el orden de uso se lleva en un sorted set '<namespace>:lru' para
+    expulsar las entradas más antiguas por encima de maxsize. El cliente de
+    redis-py detecta el fork y abre conexiones nuevas en cada worker.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, namespace: str, maxsize: int, ttl: Optional[float] = None):
+        if redis is None:
+            raise ImportError("CACHE_BACKEND=redis necesita el paquete redis")
+        super().__init__(namespace, maxsize, ttl)
+        self.client = redis.Redis.from_url(url)
+        self._lru_key = f"{namespace}:lru"
+
+    def _value_key(self, key: str) -> str:
+        return f"{self.namespace}:v:{key}"
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            payload = self.client.get(self._value_key(key))
+            if payload is None:
+                self.client.zrem(self._lru_key, key)
+                self._count(False)
+                return None
+            self.client.zadd(self._lru_key, {key: time.time()})
+            value, cost = loads_value(payload)
+        except (redis.RedisError, ValueError) as e:
+            self._failed("get", e)
+            self._count(False)
+            return None
+        self._count(True, cost)
+        return value
+
+    def set(self, key: str, value: Any, cost: float = 0.0) -> None:
+        try:
+            payload = dumps_value([value, cost])
+            pipe = self.client.pipeline()
+            pipe.set(self._value_key(key), payload, px=int(self.ttl * 1000) if self.ttl else None)
+            pipe.zadd(self._lru_key, {key: time.time()})
+            pipe.zcard(self._lru_key)
+            size = pipe.execute()[-1]
+            excess = size - self.maxsize
+            if excess > 0:
+                evicted = [k.decode("utf-8") for k, _ in self.client.zpopmin(self._lru_key, excess)]
+                if evicted:
+                    self.client.delete(*(self._value_key(k) for k in evicted))
+                with self._lock:
+                    self.evictions += len(evicted)
+        except (redis.RedisError, TypeError) as e:
+            self._failed("set", e)
+
+    def keys(self) -> List[str]:
+        try:
+            return [k.decode("utf-8") for k in self.client.zrange(self._lru_key, 0, -1)]
+        except redis.RedisError as e:
+            self._failed("keys", e)
+            return []
+
+    def delete(self, keys: List[str]) -> int:
+        if not keys:
+            return 0
+        try:
+            pipe = self.client.pipeline()
+            pipe.delete(*(self._value_key(k) for k in keys))
+            pipe.zrem(self._lru_key, *keys)
+            return pipe.execute()[0]
+        except redis.RedisError as e:
+            self._failed("delete", e)
+            return 0
+
+    def clear(self) -> None:
+        try:
+            keys = self.keys()
+            pipe = self.client.pipeline()
+            for start in range(0, len(keys), 500):
+                pipe.delete(*(self._value_key(k) for k in keys[start:start + 500]))
+            pipe.delete(self._lru_key)
+            pipe.execute()
+        except redis.RedisError as e:
+            self._failed("clear", e)
+
+    def swap_meta(self, name: str, value: str) -> Optional[str]:
+        try:
+            previous = self.client.set(f"{self.namespace}:meta:{name}", value, get=True)
+        except redis.RedisError as e:
+            self._failed("swap_meta", e)
+            return None
+        return previous.decode("utf-8") if previous is not None else None
+
+    def _size(self) -> Optional[int]:
+        try:
+            return self.client.zcard(self._lru_key)
+        except redis.RedisError as e:
+            self._failed("stats", e)
+            return None
+
+
+def create_cache_store(backend: str, namespace: str, maxsize: int, ttl: Optional[float] = None,
+                       location: Optional[str] = None):
+    """
+    Crea un nivel de QueryCache con el backend indicado
+
+    Args:
+        backend: 'local', 'shm' o 'redis' (ver CACHE_BACKENDS)
+        namespace: Prefijo de las claves en los backends compartidos
+        location: Fichero de la caché 'shm' o URL de Redis
+    """
+    if backend == "local":
+        return LRUCache(maxsize, ttl=ttl)
+    if backend == "shm":
+        return SharedMemoryLRUCache(location or default_shm_path(), namespace, maxsize, ttl=ttl)
+    if backend == "redis":
+        return RedisLRUCache(location or "redis://localhost:6379/0", namespace, maxsize, ttl=ttl)
+    raise ValueError(f"Backend de caché no soportado: {backend}")
+
+
+class QueryCache:
+    """
+    Caché de dos niveles para ChatbotSQL
+
+    - Nivel 1: pregunta normalizada -> SQL generada (y respuesta del agente),
+      con búsqueda opcional por similitud de embeddings.
+    - Nivel 2: SQL normalizada -> (columnas, filas), con TTL.
+
+    Ambos niveles se vacían cuando cambia la huella del esquema. Con un
+    backend compartido ('shm' o 'redis') los niveles y la huella son
+    comunes a todos los workers; los embeddings de la búsqueda por
+    similitud siguen siendo de cada proceso.
+
+    invalidate_tables() expulsa del nivel 2 solo los resultados que leen
+    las tablas modificadas (ver src.invalidation). Para que una consulta
+    que empezó antes de la escritura no vuelva a guardar filas antiguas,
+    put_result() acepta el change_token() tomado antes de ejecutarla.
+    """
+
+    def __init__(self, sql_maxsize: int = 512, result_maxsize: int = 256,
+                 result_ttl: Optional[float] = 300, embeddings: Any = None,
+                 similarity_threshold: float = 0.92, backend: str = "local",
+                 location: Optional[str] = None, namespace: str = "chatbot"):
+        self.backend = backend
+        self.sql_cache = create_cache_store(backend, f"{namespace}:sql", sql_maxsize, location=location)
+        self.result_cache = create_cache_store(backend, f"{namespace}:result", result_maxsize,
+                                               ttl=result_ttl, location=location)
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.similarity_hits = 0
+        self.invalidations = 0
+        self.table_evictions = 0
+        self._vectors: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        # Contador de invalidaciones y última invalidación de cada tabla (y total)
+        self._changes = 0
+        self._table_changes: Dict[str, int] = {}
+        self._cleared_at = 0
+
+    # Nivel 1: pregunta -> SQL
+
+    def get_sql(self, question: str) -> Optional[Dict[str, Any]]:
+        """Busca la SQL generada para una pregunta equivalente"""
+        key = normalize_question(question)
+        entry = self.sql_cache.get(key)
+        if entry is not None or self.embeddings is None:
+            return entry
+        similar = self._most_similar(key)
+        if similar is None:
+            return None
+        with self._lock:
+            self.similarity_hits += 1
+        return self.sql_cache.get(similar)
+
+    def put_sql(self, question: str, sql: Optional[str], output: str, cost: float = 0.0) -> None:
+        """Guarda la SQL (y la respuesta del agente) generada para una pregunta"""
+        key = normalize_question(question)
+        self.sql_cache.set(key, {"sql": sql, "output": output}, cost=cost)
+        if self.embeddings is not None:
+            try:
+                vector = self.embeddings.embed_query(key)
+            except Exception as e:
+                logger.warning(f"No se pudo calcular el embedding de la pregunta: {e}")
+                return
+            with self._lock:
+                self._vectors[key] = vector
+
+    def _most_similar(self, key: str) -> Optional[str]:
+        """Pregunta cacheada más parecida por coseno, si supera el umbral"""
+        try:
+            query_vector = self.embeddings.embed_query(key)
+        except Exception as e:
+            logger.warning(f"No se pudo calcular el embedding de la pregunta: {e}")
+            return None
+
+        live_keys = set(self.sql_cache.keys())
+        best_key, best_score = None, self.similarity_threshold
+        with self._lock:
+            # Descartar vectores de entradas ya expulsadas por el LRU
+            for stale in [k for k in self._vectors if k not in live_keys]:
+                del self._vectors[stale]
+            for candidate, vector in self._vectors.items():
+                score = _cosine(query_vector, vector)
+                if score >= best_score:
+                    best_key, best_score = candidate, score
+        return best_key
+
+    # Nivel 2: SQL -> resultados
+
+    def get_result(self, sql: str) -> Optional[Tuple[List[str], List[Dict]]]:
+        return self.result_cache.get(normalize_sql(sql))
+
+    def put_result(self, sql: str, columns: List[str], data: List[Dict], cost: float = 0.0,
+                   since: Optional[int] = None) -> None:
+        """
+        Guarda el resultado de una SQL
+
+        Args:
+            since: change_token() de antes de ejecutar la consulta; si desde
+                entonces se ha invalidado alguna de sus tablas, no se guarda
+        """
+        key = normalize_sql(sql)
+        if since is not None and self._changed_since(key, since):
+            return
+        self.result_cache.set(key, (columns, data), cost=cost)
+        # Una invalidación simultánea pudo llegar entre la comprobación y set()
+        if since is not None and self._changed_since(key, since):
+            self.result_cache.delete([key])
+
+    def change_token(self) -> int:
+        """Marca para put_result(since=...): número de invalidaciones hasta ahora"""
+        with self._lock:
+            return self._changes
+
+    def _changed_since(self, key: str, since: int) -> bool:
+        with self._lock:
+            if self._changes == since:
+                return False
+            if self._cleared_at > since:
+                return True
+            changed = {table for table, change in self._table_changes.items() if change > since}
+        return bool(changed & sql_tables(key))
+
+    # Invalidación
+
+    def check_schema(self, schema: Dict[str, Any]) -> bool:
+        """
+        Actualiza la huella del esquema y vacía la caché si ha cambiado
+
+        Returns:
+            True si la caché se ha invalidado
+        """
+        fingerprint = schema_fingerprint(schema)
+        # La huella vive junto a las entradas: con un backend compartido el
+        # primer worker que ve el cambio vacía la caché de todos
+        previous = self.sql_cache.swap_meta("schema_fingerprint", fingerprint)
+        if previous is not None and previous != fingerprint:
+            logger.info("El esquema ha cambiado: se invalida la caché de consultas")
+            self.invalidate()
+            return True
+        return False
+
+    def invalidate(self) -> None:
+        """Vacía los dos niveles de la caché"""
+        with self._lock:
+            self._changes += 1
+            self._cleared_at = self._changes
+        self.sql_cache.clear()
+        self.result_cache.clear()
+        with self._lock:
+            self._vectors.clear()
+            self.invalidations += 1
+
+    def invalidate_results(self) -> None:
+        """Vacía solo el nivel 2 (los datos pueden haber cambiado; el esquema no)"""
+        with self._lock:
+            self._changes += 1
+            self._cleared_at = self._changes
+        self.result_cache.clear()
+
+    def invalidate_tables(self, tables: Iterable[str]) -> int:
+        """
+        Expulsa los resultados de las SQL que leen alguna de las tablas
+
+        Returns:
+            Número de entradas expulsadas
+        """
+        tables = {table.lower() for table in tables}
+        if not tables:
+            return 0
+        with self._lock:
+            self._changes += 1
+            for table in tables:
+                self._table_changes[table] = self._changes
+        stale = [key for key in self.result_cache.keys() if sql_tables(key) & tables]
+        evicted = self.result_cache.delete(stale) if stale else 0
+        with self._lock:
+            self.table_evictions += evicted
+        return evicted
+
+    def after_fork(self) -> None:
+        """Reinicia locks y conexiones en un worker creado con fork()"""
+        self._lock = threading.Lock()
+        self.sql_cache.after_fork()
+        self.result_cache.after_fork()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "nl_to_sql": {**self.sql_cache.stats(), "similarity_hits": self.similarity_hits},
+            "sql_to_result": self.result_cache.stats(),
+            "invalidations": self.invalidations,
+            "table_evictions": self.table_evictions
+        }
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
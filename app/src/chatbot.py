@@ -1,86 +1,246 @@
-from typing import Optional, Dict, Any, List, Tuple
-from src.langchain_setup import setup_sql_agent
+from typing import Optional, Dict, Any, Generator, Iterable, Iterator, List, Set, Tuple
+from src.langchain_setup import setup_sql_agent, setup_sql_generator, create_llm
 from src.database import DatabaseManager
-from langchain_community.utilities.sql_database import SQLDatabase
-from src.config import get_db_uri
+from src.cache import QueryCache, normalize_question, normalize_sql
+from src.answer_templates import AnswerTemplates
+from src.sql_validator import clean_sql, validate_sql
+from src.schema_retrieval import SchemaContextBuilder
+from src.doc_retrieval import DocsContextBuilder
+from src.conversation import Conversation, ConversationStore
+from src.pagination import decode_page_token, encode_page_token, paginate_sql, LIMIT_PARAM, OFFSET_PARAM
+from src.config import (CACHE_CONFIG, SCHEMA_CONFIG, RESULT_CONFIG, BATCH_CONFIG, TEMPLATE_CONFIG, DOCS_CONFIG,
+                        INVALIDATION_CONFIG, CONVERSATION_CONFIG,
+                        GENERATION_MODE, get_db_uri)
+from src.results import ColumnarResult, row_values
+from src.export import ResultExporter
+from src.guard import QueryRejected, request_deadline
+from src.ratelimit import create_rate_limiter, RateLimitCallbackHandler
+from src.tracing import tracer
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
+import asyncio
+import contextvars
+import hashlib
 import re
+import time
 import logging
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _event(name: str, **data: Any) -> Dict[str, Any]:
+    """Evento de stream_query"""
+    return {"event": name, "data": data}
+
+
+def _remaining_ms(deadline: Optional[float]) -> Optional[int]:
+    """statement_timeout (ms) que deja el plazo de la petición, o None si no tiene plazo"""
+    if deadline is None:
+        return None
+    return max(1, int((deadline - time.time()) * 1000))
+
+
+def _check_deadline(deadline: Optional[float]) -> None:
+    """Abandona una petición cuyo plazo ya venció (el cliente ya recibió el 504)"""
+    if deadline is not None and time.time() > deadline:
+        raise TimeoutError("La consulta superó su plazo y se abandona")
+
+
 class ChatbotSQL:
-    def __init__(self):
+    def __init__(self, llm: Optional[Any] = None, embeddings: Optional[Any] = None,
+                 generation_mode: Optional[str] = None):
         self.db_manager = DatabaseManager()
         self.agent = None
+        self.sql_generator = None
+        self.generation_mode = generation_mode or GENERATION_MODE
         self.sql_db = None
+        self.schema_context = None
+        self.docs_context = None
+        self.cache = None
+        self.templates = None
+        self.exporter = None
+        self.rate_limiter = None
+        self.conversations = None
+        self.llm = None
+        self.max_rows = RESULT_CONFIG['MAX_ROWS']
+        self.columnar = RESULT_CONFIG['COLUMNAR']
+        self._schema_checked_at = 0.0
         
+        start = time.perf_counter()
         try:
             # Conectar a la base de datos
             if not self.db_manager.connect():
                 raise RuntimeError("No se pudo conectar a PostgreSQL")
             
-            # Configurar SQLDatabase para LangChain
-            self.sql_db = SQLDatabase.from_uri(get_db_uri())
+            # SQLDatabase para LangChain sobre el pool compartido
+            self.sql_db = self.db_manager.get_sql_database()
             
-            # Inicializar agente SQL
-            self.agent = setup_sql_agent(self.db_manager)
+            # Inicializar agente SQL (y el generador directo, si se usa)
+            if llm is None:
+                llm = create_llm()
+            self.llm = llm
+            # Cuota de Groq: cada llamada al LLM (agente incluido) espera turno
+            callbacks = []
+            self.rate_limiter = create_rate_limiter()
+            if self.rate_limiter is not None:
+                llm.rate_limiter = self.rate_limiter
+                callbacks.append(RateLimitCallbackHandler(self.rate_limiter))
+            self.agent = setup_sql_agent(self.db_manager, llm=llm, callbacks=callbacks)
             if not self.agent:
                 raise RuntimeError("No se pudo inicializar el agente SQL")
+            if self.generation_mode == "direct":
+                self.sql_generator = setup_sql_generator(self.db_manager, llm=llm, callbacks=callbacks)
+            
+            self.exporter = ResultExporter(self.db_manager)
+            
+            # Contexto de esquema por pregunta (recortado si es demasiado grande)
+            self.schema_context = SchemaContextBuilder(
+                self.db_manager,
+                token_budget=SCHEMA_CONFIG['PROMPT_TOKEN_BUDGET'],
+                enabled=SCHEMA_CONFIG['PRUNING_ENABLED']
+            )
+            # Definiciones de negocio de app/documentacion (índice local)
+            if DOCS_CONFIG['ENABLED']:
+                self.docs_context = DocsContextBuilder(self.db_manager)
+            
+            db_key = hashlib.sha256(get_db_uri().encode('utf-8')).hexdigest()[:12]
+
+            # Caché de dos niveles (pregunta -> SQL, SQL -> resultados)
+            if CACHE_CONFIG['ENABLED']:
+                self.cache = QueryCache(
+                    sql_maxsize=CACHE_CONFIG['SQL_MAXSIZE'],
+                    result_maxsize=CACHE_CONFIG['RESULT_MAXSIZE'],
+                    result_ttl=CACHE_CONFIG['RESULT_TTL'],
+                    embeddings=embeddings,
+                    similarity_threshold=CACHE_CONFIG['SIMILARITY_THRESHOLD'],
+                    backend=CACHE_CONFIG['BACKEND'],
+                    location=CACHE_CONFIG['LOCATION'],
+                    # Una misma caché compartida puede servir a varias bases
+                    namespace=f"chatbot:{db_key}"
+                )
+                self.cache.check_schema(self.db_manager.get_database_schema())
+                self._schema_checked_at = time.monotonic()
+
+            # Plantillas aprendidas del historial: preguntas frecuentes sin LLM
+            # y con el resultado materializado
+            if TEMPLATE_CONFIG['ENABLED']:
+                persist = TEMPLATE_CONFIG['PERSIST'] and SCHEMA_CONFIG['SNAPSHOT_DIR']
+                self.templates = AnswerTemplates(
+                    self.db_manager.table_watermarks,
+                    min_occurrences=TEMPLATE_CONFIG['MIN_OCCURRENCES'],
+                    max_templates=TEMPLATE_CONFIG['MAX_TEMPLATES'],
+                    max_materialized=TEMPLATE_CONFIG['MAX_MATERIALIZED'],
+                    watermark_interval=TEMPLATE_CONFIG['WATERMARK_INTERVAL'],
+                    path=SCHEMA_CONFIG['SNAPSHOT_DIR'] / f"templates_{db_key}.json" if persist else None
+                )
+
+            # Invalidación por eventos (LISTEN/NOTIFY): expulsa solo los
+            # resultados de las tablas escritas y refresca el esquema con DDL
+            if INVALIDATION_CONFIG['ENABLED']:
+                self.db_manager.watch_changes(self._on_database_change)
+
+            # Historial por sesión y seguimientos sobre el resultado anterior
+            if CONVERSATION_CONFIG['ENABLED']:
+                self.conversations = ConversationStore()
             
-            logger.info("Chatbot SQL inicializado correctamente")
+            logger.info(f"Chatbot SQL inicializado correctamente en {time.perf_counter() - start:.2f}s")
             
         except Exception as e:
             logger.error(f"Error durante la inicialización: {e}")
             self._cleanup_resources()
             raise RuntimeError("No se pudo inicializar el chatbot") from e
 
-    def process_query(self, user_input: str) -> Dict[str, Any]:
+    def process_query(self, user_input: str, render: bool = True, page_token: Optional[str] = None,
+                      session_id: Optional[str] = None, deadline: Optional[float] = None) -> Dict[str, Any]:
         """
         Procesa una consulta del usuario y devuelve una respuesta estructurada
         
         Args:
             user_input: Consulta en lenguaje natural o SQL directo (prefijado con 'sql:')
+            render: Incluir la tabla HTML de resultados en 'response'. Con
+                False 'response' es solo texto (para la API JSON)
+            page_token: Token 'next_page' de una respuesta anterior para
+                pedir la página siguiente de la misma consulta
+            session_id: Sesión de la conversación: el prompt incluye sus
+                preguntas anteriores y los seguimientos sobre el último
+                resultado ("y solo los completados") se resuelven sin LLM
+                ni base de datos (ver src.conversation)
+            deadline: Plazo (time.time()) de la petición: se abandona entre
+                pasos si ya venció y las consultas llevan como
+                statement_timeout el tiempo que queda
             
         Returns:
             Dict con:
             - success: Bool indicando si la operación fue exitosa
             - response: Respuesta formateada
             - query: Consulta SQL generada (opcional)
-            - results: Resultados en bruto (opcional)
+            - columns: Nombres de columnas de los resultados (opcional)
+            - results: Resultados en bruto (opcional), como mucho RESULT_MAX_ROWS filas
+            - next_page: Token de la página siguiente, o None si no hay más
         """
-        response = {
-            "success": False,
-            "response": "Lo siento, ocurrió un error al procesar tu consulta.",
-            "query": None,
-            "results": None
-        }
+        with tracer.trace("process_query") as span, request_deadline(deadline):
+            response = self._process_query(user_input, render, page_token, session_id, deadline)
+            span.set(success=response["success"], query=response["query"])
+            return response
+
+    def _process_query(self, user_input: str, render: bool = True, page_token: Optional[str] = None,
+                       session_id: Optional[str] = None, deadline: Optional[float] = None) -> Dict[str, Any]:
+        response = self._empty_response()
+        conversation = self._conversation(session_id)
         
         try:
             # Modo SQL directo (para desarrollo/depuración)
-            if user_input.strip().lower().startswith("sql:"):
-                query = user_input[4:].strip()
-                columns, data = self._execute_direct_query(query)
-                
-                if columns and data:
-                    response.update({
-                        "success": True,
-                        "response": self._format_results(columns, data),
-                        "query": query,
-                        "results": data
-                    })
-                return response
-            
-            # Consulta en lenguaje natural
-            agent_response = self.agent.invoke({"input": user_input})
-            sql_query = self._extract_sql_query(agent_response)
+            query = self._direct_sql(user_input)
+            if query is not None:
+                columns, data = self._execute_cached(query, page_token, deadline)
+                response = self._build_direct_response(response, query, columns, data, render)
+            elif not self._answer_follow_up(response, conversation, user_input, page_token, render):
+                # Consulta en lenguaje natural
+                self._maybe_check_schema()
+                output, sql_query, columns, data = self._answer_question(user_input, page_token, conversation, deadline)
+                response = self._build_agent_response(response, output, sql_query, columns, data, render)
+            self._remember_turn(conversation, user_input, response, page_token)
+            return response
             
-            response.update({
-                "success": True,
-                "response": agent_response.get("output", "No pude generar una respuesta."),
-                "query": sql_query
-            })
+        except Exception as e:
+            logger.error(f"Error al procesar consulta: {e}")
+            response["response"] = f"Error: {str(e)}"
+            return response
+
+    async def aprocess_query(self, user_input: str, render: bool = True, page_token: Optional[str] = None,
+                             session_id: Optional[str] = None, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Versión asíncrona de process_query
+        
+        Usa agent.ainvoke y el motor asyncpg, de modo que un único worker
+        puede mantener muchas llamadas al LLM y a la base de datos en curso.
+        Devuelve el mismo diccionario que process_query.
+        """
+        with tracer.trace("process_query", mode="async") as span, request_deadline(deadline):
+            response = await self._aprocess_query(user_input, render, page_token, session_id, deadline)
+            span.set(success=response["success"], query=response["query"])
+            return response
+
+    async def _aprocess_query(self, user_input: str, render: bool = True, page_token: Optional[str] = None,
+                              session_id: Optional[str] = None, deadline: Optional[float] = None) -> Dict[str, Any]:
+        response = self._empty_response()
+        conversation = self._conversation(session_id)
+        
+        try:
+            query = self._direct_sql(user_input)
+            if query is not None:
+                columns, data = await self._aexecute_cached(query, page_token, deadline)
+                response = self._build_direct_response(response, query, columns, data, render)
+            # El seguimiento local se calcula en SQLite (en memoria)
+            elif not await asyncio.to_thread(self._answer_follow_up, response, conversation, user_input,
+                                             page_token, render):
+                # Comprobar el esquema consulta el catálogo con el motor síncrono
+                await asyncio.to_thread(self._maybe_check_schema)
+                output, sql_query, columns, data = await self._aanswer_question(user_input, page_token, conversation,
+                                                                                deadline)
+                response = self._build_agent_response(response, output, sql_query, columns, data, render)
+            self._remember_turn(conversation, user_input, response, page_token)
             return response
             
         except Exception as e:
@@ -88,10 +248,805 @@ class ChatbotSQL:
             response["response"] = f"Error: {str(e)}"
             return response
 
-    def _execute_direct_query(self, query: str) -> Tuple[Optional[List[str]], Optional[List[Dict]]]:
-        """Ejecuta una consulta SQL directa y devuelve columnas y resultados"""
+    def process_batch(self, questions: List[str], render: bool = False) -> List[Dict[str, Any]]:
+        """
+        Procesa un lote de preguntas y devuelve las respuestas en el mismo orden
+
+        1. Las preguntas equivalentes (misma forma normalizada, o la misma
+           SQL con 'sql:') se resuelven una sola vez.
+        2. Las que están en la caché pregunta -> SQL no llaman al LLM.
+        3. Las demás se generan en paralelo (BATCH_CONCURRENCY a la vez)
+           dentro del límite de peticiones y tokens de Groq.
+        4. Cada SQL distinta se ejecuta una sola vez (BATCH_DB_CONCURRENCY a
+           la vez) y su resultado se reparte entre las preguntas que la usan.
+
+        Si la SQL del generador directo falla al ejecutarse la pregunta pasa
+        al agente, como en process_query.
+
+        Args:
+            questions: Preguntas en lenguaje natural o SQL directo (prefijado con 'sql:')
+            render: Incluir la tabla HTML de resultados en cada 'response'
+
+        Returns:
+            Un dict por pregunta, como los de process_query (primera página)
+        """
+        with tracer.trace("process_batch", questions=len(questions)) as span:
+            responses = self._process_batch(questions, render)
+            span.set(succeeded=sum(1 for response in responses if response["success"]))
+            return responses
+
+    def _process_batch(self, questions: List[str], render: bool = False) -> List[Dict[str, Any]]:
+        start = time.perf_counter()
+        self._maybe_check_schema()
+
+        # Pregunta representante de cada clave, en orden de aparición
+        keys = [self._batch_key(question) for question in questions]
+        unique: Dict[Tuple[str, str], str] = {}
+        for key, question in zip(keys, questions):
+            if key is not None:
+                unique.setdefault(key, question)
+
+        plans: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        pending = []
+        for key, question in unique.items():
+            if key[0] == "sql":
+                plans[key] = {"sql": self._direct_sql(question), "output": None, "source": "sql"}
+                continue
+            cached = self._cached_sql(question)
+            if cached is not None:
+                plans[key] = {"sql": cached["sql"], "output": cached["output"], "source": "cache"}
+            else:
+                pending.append(key)
+
+        generated = self._fan_out(self._plan_question, [unique[key] for key in pending],
+                                  BATCH_CONFIG['CONCURRENCY'])
+        plans.update(zip(pending, generated))
+        outcomes = self._execute_plans(plans.values())
+
+        # SQL del generador directo que no llegó a ejecutarse: al agente
+        retry = [key for key in pending if plans[key].get("source") == "direct"
+                 and outcomes[normalize_sql(plans[key]["sql"])].get("columns") is None]
+        agent_plans = self._fan_out(lambda question: self._plan_question(question, use_agent=True),
+                                    [unique[key] for key in retry], BATCH_CONFIG['CONCURRENCY'])
+        plans.update(zip(retry, agent_plans))
+        outcomes.update(self._execute_plans(agent_plans, skip=outcomes))
+
+        for key in pending:
+            plan = plans[key]
+            if plan.get("source") == "direct":
+                self._store_sql(unique[key], plan["sql"], plan["output"], plan["elapsed"])
+
+        built: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        responses = []
+        for key in keys:
+            if key is None:
+                response = self._empty_response()
+                response["response"] = "La consulta está vacía"
+            else:
+                if key not in built:
+                    built[key] = self._batch_response(key, plans[key], outcomes, render)
+                response = dict(built[key])
+            responses.append(response)
+
+        logger.info(
+            f"Lote de {len(questions)} preguntas: {len(unique)} distintas, "
+            f"{len(unique) - len(pending)} sin LLM, {len(pending) + len(retry)} generadas, "
+            f"{len(outcomes)} consultas SQL ejecutadas en {time.perf_counter() - start:.2f}s"
+        )
+        return responses
+
+    def _batch_key(self, question: str) -> Optional[Tuple[str, str]]:
+        """Clave de deduplicación: la SQL normalizada con 'sql:' o la pregunta normalizada"""
+        query = self._direct_sql(question)
+        if query is not None:
+            return ("sql", normalize_sql(query)) if query else None
+        normalized = normalize_question(question)
+        return ("question", normalized) if normalized else None
+
+    def _fan_out(self, fn: Any, items: List[Any], workers: int) -> List[Any]:
+        """
+        Aplica fn a cada elemento en un pool de hilos y devuelve los resultados en orden
+
+        Cada tarea se ejecuta en una copia del contexto, así sus spans
+        cuelgan de la traza del lote.
+        """
+        if len(items) <= 1 or workers <= 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(workers, len(items)),
+                                thread_name_prefix="chatbot-batch") as pool:
+            futures = [pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+            return [future.result() for future in futures]
+
+    def _plan_question(self, question: str, use_agent: bool = False) -> Dict[str, Any]:
+        """SQL para una pregunta sin ejecutarla (generador directo o agente)"""
+        start = time.perf_counter()
+        try:
+            if self.sql_generator is not None and not use_agent:
+                sql_query = self._check_generated_sql(self.sql_generator.invoke(self._prompt_inputs(question)))
+                if sql_query:
+                    return {"sql": sql_query, "output": sql_query, "source": "direct",
+                            "elapsed": time.perf_counter() - start}
+            agent_response = self.agent.invoke(self._prompt_inputs(question))
+            output, sql_query = self._remember_sql(question, agent_response, time.perf_counter() - start)
+            return {"sql": sql_query, "output": output, "source": "agent"}
+        except Exception as e:
+            logger.error(f"Error al generar la SQL de '{question}': {e}")
+            return {"error": str(e)}
+
+    def _execute_plans(self, plans: Iterable[Dict[str, Any]],
+                       skip: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Ejecuta una vez cada SQL distinta de los planes
+
+        Returns:
+            Dict SQL normalizada -> {"columns", "data"} o {"error"}
+        """
+        groups: Dict[str, str] = {}
+        for plan in plans:
+            if plan.get("sql"):
+                normalized = normalize_sql(plan["sql"])
+                if not skip or normalized not in skip:
+                    groups.setdefault(normalized, plan["sql"])
+        outcomes = self._fan_out(self._execute_batch_query, list(groups.values()),
+                                 BATCH_CONFIG['DB_CONCURRENCY'])
+        return dict(zip(groups, outcomes))
+
+    def _execute_batch_query(self, query: str) -> Dict[str, Any]:
+        try:
+            columns, data = self._execute_cached(query)
+        except Exception as e:
+            logger.warning(f"Consulta del lote no ejecutada ({e}): {query}")
+            return {"columns": None, "data": None, "error": str(e)}
+        return {"columns": columns, "data": data}
+
+    def _batch_response(self, key: Tuple[str, str], plan: Dict[str, Any],
+                        outcomes: Dict[str, Dict[str, Any]], render: bool) -> Dict[str, Any]:
+        response = self._empty_response()
+        if "error" in plan:
+            response["response"] = f"Error: {plan['error']}"
+            return response
+        outcome = outcomes[normalize_sql(plan["sql"])] if plan["sql"] else {"columns": None, "data": None}
+        if "error" in outcome:
+            response["response"] = f"Error: {outcome['error']}"
+            return response
+        if key[0] == "sql":
+            return self._build_direct_response(response, plan["sql"], outcome["columns"], outcome["data"], render)
+        return self._build_agent_response(response, plan["output"], plan["sql"],
+                                          outcome["columns"], outcome["data"], render)
+
+    def stream_query(self, user_input: str, page_token: Optional[str] = None,
+                     deadline: Optional[float] = None, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Procesa una consulta emitiendo eventos a medida que avanza
+
+        El primer evento se emite de inmediato, antes de llamar al LLM. La
+        traza de la petición dura hasta que se agota o se cierra el iterador.
+
+        Args:
+            user_input: Consulta en lenguaje natural o SQL directo (prefijado con 'sql:')
+            page_token: Token 'next_page' del evento 'done' de una respuesta anterior
+            deadline: Plazo (time.time()) de la petición: las consultas de
+                la respuesta se lanzan con el statement_timeout que quede
+            session_id: Sesión de la conversación, como en process_query.
+                Con sesión el resultado se lee completo (una página) en
+                lugar de del cursor, para poder guardarlo en ella
+
+        Yields:
+            Dict con 'event' y 'data'. Eventos:
+            - progress: {"message"} paso en curso (herramientas del agente, ejecución...)
+            - token: {"text"} fragmento de la SQL generada (modo directo)
+            - sql: {"query"} SQL definitiva
+            - answer: {"text"} respuesta del agente cuando no es solo la SQL
+            - columns: {"columns"} nombres de columnas del resultado
+            - rows: {"rows"} lote de filas (listas en el orden de 'columns');
+              como mucho RESULT_MAX_ROWS filas en total por página
+            - done: {"success", "query", "row_count", "next_page"}
+            - error: {"message"}
+        """
+        return tracer.traced(self._stream_events(user_input, page_token, deadline, session_id), "stream_query")
+
+    def _stream_events(self, user_input: str, page_token: Optional[str] = None,
+                       deadline: Optional[float] = None, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        yield _event("progress", message="Consulta recibida")
+        conversation = self._conversation(session_id)
+
+        try:
+            query = self._direct_sql(user_input)
+            direct = query is not None
+            if direct:
+                yield _event("sql", query=query)
+                yield _event("progress", message="Ejecutando la consulta")
+                cached = None
+                if self.cache is not None and not page_token and self._is_read_only(query):
+                    cached = self._cached_result(query)
+                if cached is None and conversation is None and self._is_read_only(query):
+                    # Sin caché ni sesión: filas directamente del cursor de servidor
+                    yield from self._stream_rows(query, page_token, deadline)
+                    return
+                columns, data = cached or self._execute_cached(query, page_token, deadline)
+            else:
+                follow_up = self._empty_response()
+                if self._answer_follow_up(follow_up, conversation, user_input, page_token, render=False):
+                    output, query = follow_up["response"], follow_up["query"]
+                    columns, data = follow_up["columns"], follow_up["results"]
+                    yield _event("sql", query=query)
+                else:
+                    self._maybe_check_schema()
+                    output, query, columns, data = yield from self._stream_answer(user_input, page_token,
+                                                                                  deadline, conversation)
+                if output and output != query:
+                    yield _event("answer", text=output)
+
+            if columns is None:
+                # Como process_query: la respuesta del agente cuenta como éxito
+                self._remember_turn(conversation, user_input, {
+                    "success": not direct, "query": query, "columns": None, "results": None, "next_page": None
+                }, page_token)
+                yield _event("done", success=not direct, query=query, row_count=0, next_page=None)
+                return
+
+            yield _event("columns", columns=columns)
+            batch_size = RESULT_CONFIG['FETCH_BATCH']
+            for start in range(0, len(data), batch_size):
+                yield _event("rows", rows=row_values(columns, data, start, start + batch_size))
+            next_page = self._next_page(query, data)
+            self._remember_turn(conversation, user_input, {
+                "success": True, "query": query, "columns": columns, "results": data, "next_page": next_page
+            }, page_token)
+            yield _event("done", success=True, query=query, row_count=len(data), next_page=next_page)
+
+        except Exception as e:
+            logger.error(f"Error al procesar consulta: {e}")
+            tracer.current().set(success=False, error=str(e))
+            yield _event("error", message=f"Error: {str(e)}")
+
+    def _stream_rows(self, query: str, page_token: Optional[str] = None,
+                     deadline: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Emite una página de resultados leyendo del cursor de servidor por lotes
+
+        La memoria usada no depende del tamaño del resultado: cada lote se
+        envía y se descarta antes de leer el siguiente.
+        """
+        offset = decode_page_token(page_token, query) if page_token else 0
+        guarded = self._guarded(query)
+        if guarded != query:
+            yield _event("progress", message="Resultado muy grande: se limita el número de filas")
+        params = {LIMIT_PARAM: self.max_rows + 1, OFFSET_PARAM: offset}
+        count, has_more = 0, False
+        with self.db_manager.stream_query(paginate_sql(guarded), params,
+                                          statement_timeout=_remaining_ms(deadline)) as (columns, batches):
+            yield _event("columns", columns=columns)
+            for batch in batches:
+                remaining = self.max_rows - count
+                if len(batch) > remaining:
+                    has_more, batch = True, batch[:remaining]
+                if batch:
+                    count += len(batch)
+                    yield _event("rows", rows=[list(row) for row in batch])
+        next_page = encode_page_token(query, offset + count) if has_more else None
+        yield _event("done", success=True, query=query, row_count=count, next_page=next_page)
+
+    def export_query(self, user_input: str, fmt: str = "csv") -> Iterator[bytes]:
+        """
+        Exporta el resultado completo de una consulta (modo exportación)
+
+        Obtiene la SQL como process_query (caché, generación directa o
+        agente) pero no la ejecuta por páginas ni formatea HTML: vuelve a
+        ejecutarla completa y la vuelca del cursor al formato pedido por
+        lotes. Devuelve un generador: la SQL se resuelve al pedir el primer
+        fragmento, así los errores llegan antes de enviar nada al cliente.
+
+        Args:
+            user_input: Consulta en lenguaje natural o SQL directo (prefijado con 'sql:')
+            fmt: 'csv', 'ndjson' o 'parquet'
+
+        Raises:
+            ValueError: si no se obtiene una consulta de lectura o el formato no es válido
+        """
+        return tracer.traced(self._export_chunks(user_input, fmt), "export_query", format=fmt)
+
+    def _export_chunks(self, user_input: str, fmt: str) -> Iterator[bytes]:
+        query = self._resolve_sql(user_input)
+        logger.info(f"Exportación {fmt}: {query}")
+        yield from self.exporter.export(query, fmt)
+
+    def _resolve_sql(self, user_input: str) -> str:
+        """SQL de lectura para la entrada del usuario, sin ejecutarla"""
+        query = self._direct_sql(user_input)
+        if query is None:
+            self._maybe_check_schema()
+            cached = self._cached_sql(user_input)
+            if cached is not None:
+                query = cached["sql"]
+            else:
+                if self.sql_generator is not None:
+                    start = time.perf_counter()
+                    query = self._check_generated_sql(self.sql_generator.invoke(self._prompt_inputs(user_input)))
+                    if query:
+                        self._store_sql(user_input, query, query, time.perf_counter() - start)
+                if not query:
+                    start = time.perf_counter()
+                    agent_response = self.agent.invoke(self._prompt_inputs(user_input))
+                    _, query = self._remember_sql(user_input, agent_response, time.perf_counter() - start)
+        if not query:
+            raise ValueError("No se pudo obtener una consulta SQL para exportar")
+        if self.db_manager.guard is not None:
+            # Sin LIMIT automático: la exportación pide el resultado completo
+            return self._guarded(query, limit_rows=False)
+        valid, error = validate_sql(query)
+        if not valid:
+            raise ValueError(error)
+        return clean_sql(query)
+
+    def _stream_answer(self, user_input: str, page_token: Optional[str] = None,
+                       deadline: Optional[float] = None, conversation: Optional[Conversation] = None) -> Generator[
+            Dict[str, Any], None, Tuple[str, Optional[str], Optional[List[str]], Optional[List[Dict]]]]:
+        """
+        Versión de _answer_question que emite eventos de progreso
+
+        Es un generador: sus eventos se reenvían con 'yield from' y el valor
+        de retorno es el mismo Tuple que devuelve _answer_question.
+        """
+        inputs = self._prompt_inputs(user_input, conversation)
+        shared = not inputs["history"]
+        cached = self._cached_sql(user_input) if shared else None
+        if cached is not None:
+            yield _event("progress", message="Consulta encontrada en caché")
+            if cached["sql"]:
+                yield _event("sql", query=cached["sql"])
+            columns, data = self._execute_cached(cached["sql"], page_token, deadline) if cached["sql"] else (None, None)
+            return cached["output"], cached["sql"], columns, data
+
+        if self.sql_generator is not None:
+            yield _event("progress", message="Generando la consulta SQL")
+            start = time.perf_counter()
+            parts = []
+            for chunk in self.sql_generator.stream(inputs):
+                text = getattr(chunk, "content", "")
+                if text:
+                    parts.append(text)
+                    yield _event("token", text=text)
+            sql_query = self._check_generated_sql("".join(parts))
+            if sql_query:
+                elapsed = time.perf_counter() - start
+                yield _event("sql", query=sql_query)
+                yield _event("progress", message="Ejecutando la consulta")
+                columns, data = self._execute_generated(sql_query, page_token, deadline)
+                if columns is not None:
+                    if shared:
+                        self._store_sql(user_input, sql_query, sql_query, elapsed)
+                    return sql_query, sql_query, columns, data
+                logger.warning("La SQL generada falló al ejecutarse; se recurre al agente")
+
+        yield _event("progress", message="El agente está analizando la pregunta")
+        start = time.perf_counter()
+        agent_response: Dict[str, Any] = {}
+        for step in self.agent.stream(inputs):
+            for action in step.get("actions", []):
+                yield _event("progress", message=f"Usando la herramienta {action.tool}")
+            if "output" in step:
+                agent_response = step
+        output, sql_query = self._remember_sql(user_input, agent_response, time.perf_counter() - start, shared)
+        if not sql_query:
+            return output, None, None, None
+        yield _event("sql", query=sql_query)
+        yield _event("progress", message="Ejecutando la consulta")
+        columns, data = self._execute_cached(sql_query, page_token, deadline)
+        return output, sql_query, columns, data
+
+    def _empty_response(self) -> Dict[str, Any]:
+        """Respuesta por defecto cuando algo falla"""
+        return {
+            "success": False,
+            "response": "Lo siento, ocurrió un error al procesar tu consulta.",
+            "query": None,
+            "columns": None,
+            "results": None,
+            "next_page": None
+        }
+
+    def _direct_sql(self, user_input: str) -> Optional[str]:
+        """Devuelve la SQL si la entrada usa el prefijo 'sql:', o None"""
+        text = user_input.strip()
+        if text.lower().startswith("sql:"):
+            return text[4:].strip()
+        return None
+
+    def _build_direct_response(self, response: Dict[str, Any], query: str,
+                               columns: Optional[List[str]], data: Optional[List[Dict]],
+                               render: bool = True) -> Dict[str, Any]:
+        """Completa la respuesta de una consulta SQL directa"""
+        if columns and data:
+            response.update({
+                "success": True,
+                "response": self._format_results(columns, data) if render else f"{len(data)} filas",
+                "query": query,
+                "columns": columns,
+                "results": data,
+                "next_page": self._next_page(query, data)
+            })
+        return response
+
+    def _build_agent_response(self, response: Dict[str, Any], output: str, sql_query: Optional[str],
+                              columns: Optional[List[str]], data: Optional[List[Dict]],
+                              render: bool = True) -> Dict[str, Any]:
+        """Completa la respuesta a partir de la salida del agente y sus resultados"""
+        if render and columns and data:
+            output = f"{output}{self._format_results(columns, data)}"
+        response.update({
+            "success": True,
+            "response": output,
+            "query": sql_query,
+            "columns": columns,
+            "results": data,
+            "next_page": self._next_page(sql_query, data)
+        })
+        return response
+
+    def _next_page(self, query: Optional[str], data: Optional[List[Dict]]) -> Optional[str]:
+        """Token para pedir la página siguiente, si la hay"""
+        next_offset = getattr(data, "next_offset", None)
+        if not query or next_offset is None:
+            return None
+        return encode_page_token(query, next_offset)
+
+    def _conversation(self, session_id: Optional[str]) -> Optional[Conversation]:
+        if self.conversations is None or not session_id:
+            return None
+        return self.conversations.get(session_id)
+
+    def _answer_follow_up(self, response: Dict[str, Any], conversation: Optional[Conversation],
+                          user_input: str, page_token: Optional[str], render: bool) -> bool:
+        """
+        Responde en local un seguimiento sobre el último resultado de la sesión
+
+        Returns:
+            True si 'response' quedó completa; False si hay que ir al LLM
+        """
+        if conversation is None or page_token is not None:
+            return False
+        answer = self.conversations.follow_up(conversation, user_input)
+        if answer is None:
+            return False
+        sql_query, result = answer
+        logger.info("Seguimiento resuelto sobre el resultado anterior, sin LLM ni base de datos")
+        data = result if self.columnar else result.to_dicts()
+        self._build_agent_response(response, "Calculado sobre el resultado anterior.", sql_query,
+                                   result.columns, data, render)
+        return True
+
+    def _remember_turn(self, conversation: Optional[Conversation], user_input: str,
+                       response: Dict[str, Any], page_token: Optional[str]) -> None:
+        """Guarda la pregunta y su resultado en la sesión (las páginas siguientes no)"""
+        if conversation is None or page_token is not None or not response["success"]:
+            return
+        self.conversations.record(conversation, user_input, response["query"], response["columns"],
+                                  response["results"], complete=response["next_page"] is None)
+
+    def _answer_question(self, user_input: str, page_token: Optional[str] = None,
+                         conversation: Optional[Conversation] = None,
+                         deadline: Optional[float] = None) -> Tuple[str, Optional[str], Optional[List[str]], Optional[List[Dict]]]:
+        """
+        Genera la SQL para una pregunta y la ejecuta
+
+        Orden: caché pregunta -> SQL o plantilla de respuesta aprendida;
+        generación directa (una llamada al LLM, si GENERATION_MODE='direct');
+        y el agente con herramientas como respaldo cuando la SQL directa no
+        valida o falla al ejecutarse.
+
+        Con historial de conversación la pregunta depende de los turnos
+        anteriores ("y solo los completados"): no se busca ni se guarda en la
+        caché pregunta -> SQL ni en las plantillas.
+
+        Returns:
+            Tuple con (respuesta, SQL o None, columnas, resultados)
+        """
+        inputs = self._prompt_inputs(user_input, conversation)
+        shared = not inputs["history"]
+        cached = self._cached_sql(user_input) if shared else None
+        if cached is not None:
+            columns, data = self._execute_cached(cached["sql"], page_token, deadline) if cached["sql"] else (None, None)
+            return cached["output"], cached["sql"], columns, data
+
+        if self.sql_generator is not None:
+            _check_deadline(deadline)
+            start = time.perf_counter()
+            sql_query = self._check_generated_sql(self.sql_generator.invoke(inputs))
+            if sql_query:
+                elapsed = time.perf_counter() - start
+                columns, data = self._execute_generated(sql_query, page_token, deadline)
+                if columns is not None:
+                    if shared:
+                        self._store_sql(user_input, sql_query, sql_query, elapsed)
+                    return sql_query, sql_query, columns, data
+                logger.warning("La SQL generada falló al ejecutarse; se recurre al agente")
+
+        _check_deadline(deadline)
+        start = time.perf_counter()
+        agent_response = self.agent.invoke(inputs)
+        output, sql_query = self._remember_sql(user_input, agent_response, time.perf_counter() - start, shared)
+        columns, data = self._execute_cached(sql_query, page_token, deadline) if sql_query else (None, None)
+        return output, sql_query, columns, data
+
+    async def _aanswer_question(self, user_input: str, page_token: Optional[str] = None,
+                                conversation: Optional[Conversation] = None,
+                                deadline: Optional[float] = None) -> Tuple[str, Optional[str], Optional[List[str]], Optional[List[Dict]]]:
+        """
+        Versión asíncrona de _answer_question
+
+        Lo que usa el motor síncrono, una caché compartida o los embeddings
+        (esquema, caché pregunta -> SQL) se ejecuta con asyncio.to_thread
+        para no bloquear el event loop.
+        """
+        inputs = await asyncio.to_thread(self._prompt_inputs, user_input, conversation)
+        shared = not inputs["history"]
+        cached = await asyncio.to_thread(self._cached_sql, user_input) if shared else None
+        if cached is not None:
+            columns, data = await self._aexecute_cached(cached["sql"], page_token, deadline) if cached["sql"] else (None, None)
+            return cached["output"], cached["sql"], columns, data
+
+        if self.sql_generator is not None:
+            _check_deadline(deadline)
+            start = time.perf_counter()
+            sql_query = self._check_generated_sql(await self.sql_generator.ainvoke(inputs))
+            if sql_query:
+                elapsed = time.perf_counter() - start
+                try:
+                    columns, data = await self._aexecute_cached(sql_query, page_token, deadline)
+                except QueryRejected as e:
+                    logger.warning(f"SQL generada rechazada ({e}); se recurre al agente")
+                    columns, data = None, None
+                if columns is not None:
+                    if shared:
+                        await asyncio.to_thread(self._store_sql, user_input, sql_query, sql_query, elapsed)
+                    return sql_query, sql_query, columns, data
+                logger.warning("La SQL generada falló al ejecutarse; se recurre al agente")
+
+        _check_deadline(deadline)
+        start = time.perf_counter()
+        agent_response = await self.agent.ainvoke(inputs)
+        output, sql_query = await asyncio.to_thread(self._remember_sql, user_input, agent_response,
+                                                    time.perf_counter() - start, shared)
+        columns, data = await self._aexecute_cached(sql_query, page_token, deadline) if sql_query else (None, None)
+        return output, sql_query, columns, data
+
+    def _prompt_inputs(self, user_input: str, conversation: Optional[Conversation] = None) -> Dict[str, Any]:
+        """
+        Variables del prompt: la pregunta, el esquema y la documentación
+        relevantes para ella y el historial de la conversación
+
+        En un seguimiento las tablas salen de la pregunta anterior: el
+        esquema y la documentación se buscan con las dos.
+        """
+        history = conversation.history(CONVERSATION_CONFIG['HISTORY_TOKEN_BUDGET']) if conversation else ""
+        context = f"{conversation.last_question}\n{user_input}" if history else user_input
+        return {
+            "input": user_input,
+            "schema": self.schema_context.for_question(context),
+            "docs": self.docs_context.for_question(context) if self.docs_context else "",
+            "history": history
+        }
+
+    def _check_generated_sql(self, message: Any) -> Optional[str]:
+        """Limpia y valida localmente la SQL devuelta por el generador directo"""
+        sql_query = clean_sql(getattr(message, "content", str(message)))
+        valid, error = validate_sql(sql_query, self.db_manager.get_database_schema())
+        if not valid:
+            logger.warning(f"SQL generada no válida ({error}); se recurre al agente")
+            return None
+        return sql_query
+
+    def _execute_generated(self, sql_query: str, page_token: Optional[str] = None,
+                           deadline: Optional[float] = None) -> Tuple[Optional[List[str]], Optional[List[Dict]]]:
+        """Ejecuta la SQL del generador directo; si QueryGuard la rechaza se recurre al agente"""
+        try:
+            return self._execute_cached(sql_query, page_token, deadline)
+        except QueryRejected as e:
+            logger.warning(f"SQL generada rechazada ({e}); se recurre al agente")
+            return None, None
+
+    def _cached_sql(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """SQL ya conocida para la pregunta: caché pregunta -> SQL o plantilla de respuesta"""
+        cached = self.cache.get_sql(user_input) if self.cache is not None else None
+        if cached is not None:
+            logger.info(
+                f"Caché pregunta->SQL: acierto (tasa {self.cache.sql_cache.stats()['hit_rate']:.0%}, "
+                f"{self.cache.sql_cache.saved_seconds:.1f}s ahorrados en total)"
+            )
+            if self.templates is not None:
+                self.templates.observe(user_input, cached["sql"])
+            return cached
+        return self._routed_sql(user_input)
+
+    def _routed_sql(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """SQL de la plantilla activa con la forma de la pregunta, sin llamar al LLM"""
+        if self.templates is None:
+            return None
+        routed = self.templates.route(user_input)
+        if routed is None:
+            return None
+        sql_query, template_id = routed
+        valid, error = validate_sql(sql_query, self.db_manager.get_database_schema())
+        if not valid:
+            logger.warning(f"SQL de la plantilla {template_id} no válida ({error}); se genera con el LLM")
+            return None
+        logger.info(f"Plantilla de respuesta {template_id}: pregunta resuelta sin LLM")
+        return {"sql": sql_query, "output": sql_query, "template": template_id}
+
+    def _remember_sql(self, user_input: str, agent_response: Dict[str, Any],
+                      elapsed: float, store: bool = True) -> Tuple[str, Optional[str]]:
+        output = agent_response.get("output", "No pude generar una respuesta.")
+        sql_query = self._extract_sql_query(agent_response)
+        if sql_query and store:
+            self._store_sql(user_input, sql_query, output, elapsed)
+        return output, sql_query
+
+    def _store_sql(self, user_input: str, sql_query: str, output: str, elapsed: float) -> None:
+        if self.cache is not None:
+            self.cache.put_sql(user_input, sql_query, output, cost=elapsed)
+        if self.templates is not None:
+            self.templates.observe(user_input, sql_query)
+
+    def _execute_cached(self, query: str, page_token: Optional[str] = None,
+                        deadline: Optional[float] = None) -> Tuple[Optional[List[str]], Optional[List[Dict]]]:
+        """
+        Ejecuta una consulta reutilizando la caché SQL -> resultados
+
+        Las consultas de lectura se leen por páginas de RESULT_MAX_ROWS filas;
+        solo la primera página se guarda en caché. Con 'deadline' la consulta
+        lleva como statement_timeout el tiempo que queda y no se lanza si ya
+        venció.
+        """
+        _check_deadline(deadline)
+        offset = decode_page_token(page_token, query) if page_token else 0
+        cacheable = offset == 0 and self._is_read_only(query)
+        if cacheable:
+            cached = self._cached_result(query)
+            if cached is not None:
+                return cached
+
+        start = time.perf_counter()
+        since = self.cache.change_token() if self.cache is not None else None
+        columns, data = self._execute_direct_query(query, offset, deadline)
+        if cacheable and columns is not None and data is not None:
+            self._put_result(query, columns, data, time.perf_counter() - start, since)
+        return columns, data
+
+    async def _aexecute_cached(self, query: str, page_token: Optional[str] = None,
+                               deadline: Optional[float] = None) -> Tuple[Optional[List[str]], Optional[List[Dict]]]:
+        """Versión asíncrona de _execute_cached"""
+        _check_deadline(deadline)
+        offset = decode_page_token(page_token, query) if page_token else 0
+        cacheable = offset == 0 and self._is_read_only(query)
+        if cacheable:
+            # La marca de agua de las plantillas se lee con el motor síncrono
+            cached = await asyncio.to_thread(self._cached_result, query)
+            if cached is not None:
+                return cached
+
+        start = time.perf_counter()
+        since = self.cache.change_token() if self.cache is not None else None
+        columns, data = await self._aexecute_direct_query(query, offset, deadline)
+        if cacheable and columns is not None and data is not None:
+            await asyncio.to_thread(self._put_result, query, columns, data, time.perf_counter() - start, since)
+        return columns, data
+
+    def _cached_result(self, query: str) -> Optional[Tuple[List[str], List[Dict]]]:
+        """Resultado materializado de una plantilla (vigente) o de la caché SQL -> resultados"""
+        if self.templates is not None:
+            materialized = self.templates.get_result(query)
+            if materialized is not None:
+                return materialized
+            # La caché con TTL no sabe si las tablas han cambiado: se recalcula
+            if self.templates.expects_result(query):
+                return None
+        if self.cache is None:
+            return None
+        cached = self.cache.get_result(query)
+        if cached is not None:
+            logger.info(
+                f"Caché SQL->resultados: acierto (tasa {self.cache.result_cache.stats()['hit_rate']:.0%}, "
+                f"{self.cache.result_cache.saved_seconds:.2f}s ahorrados en total)"
+            )
+        return cached
+
+    def _put_result(self, query: str, columns: List[str], data: Any, cost: float,
+                    since: Optional[int] = None) -> None:
+        if self.templates is not None:
+            self.templates.put_result(query, columns, data, cost=cost)
+        if self.cache is not None:
+            self.cache.put_result(query, columns, data, cost=cost, since=since)
+
+    def _is_read_only(self, query: str) -> bool:
+        """Solo las consultas SELECT/WITH son cacheables"""
+        return re.match(r"^\s*(select|with)\b", query, re.IGNORECASE) is not None
+
+    def _maybe_check_schema(self) -> None:
+        """Revisa periódicamente el esquema e invalida la caché si ha cambiado"""
+        if self.cache is None:
+            return
+        # Con el event trigger de DDL escuchándose, el esquema se revisa al recibir el aviso
+        listener = self.db_manager.change_listener
+        if self.db_manager.watches_ddl and listener is not None and listener.connected:
+            return
+        now = time.monotonic()
+        if now - self._schema_checked_at < CACHE_CONFIG['SCHEMA_CHECK_INTERVAL']:
+            return
+        self._schema_checked_at = now
+        self._check_schema()
+
+    def _check_schema(self) -> None:
+        schema = self.db_manager.get_database_schema(refresh=True)
+        if self.cache is not None and self.cache.check_schema(schema) and self.templates is not None:
+            self.templates.invalidate()
+
+    def _on_database_change(self, tables: Optional[Set[str]], ddl: bool) -> None:
+        """
+        Aviso de src.invalidation (en el hilo de escucha)
+
+        Args:
+            tables: Tablas escritas; None si pudieron perderse avisos (todas)
+            ddl: Hubo (o pudo haber) DDL: se refresca el esquema
+        """
+        if ddl:
+            self._check_schema()
+            self._schema_checked_at = time.monotonic()
+            self.db_manager.watch_tables(self.db_manager.get_database_schema())
+        if tables is None:
+            if self.cache is not None:
+                self.cache.invalidate_results()
+            if self.templates is not None:
+                self.templates.tables_changed(None)
+            if self.conversations is not None:
+                self.conversations.invalidate_tables(None)
+        elif tables:
+            evicted = self.cache.invalidate_tables(tables) if self.cache is not None else 0
+            if self.templates is not None:
+                self.templates.tables_changed(sorted(tables))
+            if self.conversations is not None:
+                self.conversations.invalidate_tables(tables)
+            logger.debug(f"Cambios en {sorted(tables)}: {evicted} resultados expulsados de la caché")
+
+    def _guarded(self, query: str, limit_rows: bool = True) -> str:
+        """
+        SQL que debe ejecutarse tras pasar por QueryGuard
+
+        Raises:
+            QueryRejected: si la consulta es de escritura, no encaja con el
+                esquema o supera los umbrales de coste
+        """
+        guard = self.db_manager.guard
+        if guard is None:
+            return query
+        with tracer.span("guard"):
+            return guard.check(query, limit_rows)
+
+    def _execute_direct_query(self, query: str, offset: int = 0,
+                              deadline: Optional[float] = None) -> Tuple[Optional[List[str]], Optional[List[Dict]]]:
+        """Ejecuta una consulta SQL directa y devuelve columnas y resultados (una página si es de lectura)"""
+        query = self._guarded(query)
         try:
-            return self.db_manager.execute_query(query)
+            if self._is_read_only(query):
+                return self.db_manager.fetch_page(query, offset=offset, limit=self.max_rows,
+                                                  columnar=self.columnar, statement_timeout=_remaining_ms(deadline))
+            return self.db_manager.execute_query(query, statement_timeout=_remaining_ms(deadline))
+        except Exception as e:
+            logger.error(f"Error al ejecutar consulta directa: {e}")
+            return None, None
+
+    async def _aexecute_direct_query(self, query: str, offset: int = 0,
+                                     deadline: Optional[float] = None) -> Tuple[Optional[List[str]], Optional[List[Dict]]]:
+        """Ejecuta una consulta SQL directa con el driver asíncrono"""
+        if self.db_manager.guard is not None:
+            with tracer.span("guard"):
+                query = await self.db_manager.guard.acheck(query)
+        try:
+            if self._is_read_only(query):
+                return await self.db_manager.afetch_page(query, offset=offset, limit=self.max_rows,
+                                                         columnar=self.columnar,
+                                                         statement_timeout=_remaining_ms(deadline))
+            return await self.db_manager.aexecute_query(query, statement_timeout=_remaining_ms(deadline))
         except Exception as e:
             logger.error(f"Error al ejecutar consulta directa: {e}")
             return None, None
@@ -109,18 +1064,31 @@ class ChatbotSQL:
         """
         if not columns or not data:
             return "No se encontraron resultados."
-        
-        html = ["<div class='table-responsive'><table class='table table-striped'><thead><tr>"]
-        html.extend(f"<th>{col}</th>" for col in columns)
-        html.append("</tr></thead><tbody>")
-        
-        for row in data:
-            html.append("<tr>")
-            html.extend(f"<td>{row.get(col, '')}</td>" for col in columns)
-            html.append("</tr>")
-        
-        html.append("</tbody></table></div>")
-        return "".join(html)
+        with tracer.span("format", rows=len(data)):
+            html = "".join(self._iter_format_results(columns, data))
+        if getattr(data, "next_offset", None) is not None:
+            html += f"<p>Se muestran {len(data)} filas; hay más resultados.</p>"
+        return html
+
+    def _iter_format_results(self, columns: List[str], rows: Iterable[Dict]) -> Iterator[str]:
+        """
+        Genera la tabla HTML por fragmentos (cabecera, una fila por fragmento, cierre)
+
+        Permite enviar la tabla al cliente a medida que se leen las filas
+        sin construir el HTML completo en memoria.
+        """
+        header = "".join(f"<th>{escape(str(col))}</th>" for col in columns)
+        yield f"<div class='table-responsive'><table class='table table-striped'><thead><tr>{header}</tr></thead><tbody>"
+        if isinstance(rows, ColumnarResult):
+            # Recorre las columnas en paralelo, sin vistas ni búsquedas por nombre
+            for values in rows.iter_tuples():
+                cells = "".join(f"<td>{escape(str(value))}</td>" for value in values)
+                yield f"<tr>{cells}</tr>"
+        else:
+            for row in rows:
+                cells = "".join(f"<td>{escape(str(row.get(col, '')))}</td>" for col in columns)
+                yield f"<tr>{cells}</tr>"
+        yield "</tbody></table></div>"
 
     def _extract_sql_query(self, agent_response: Dict[str, Any]) -> Optional[str]:
         """
@@ -134,14 +1102,35 @@ class ChatbotSQL:
         """
         output = agent_response.get("output", "")
         matches = re.findall(r"```sql\n(.*?)\n```", output, re.DOTALL)
-        return matches[0].strip() if matches else None
+        if matches:
+            return matches[0].strip()
+        # El prompt pide devolver solo la SQL, sin bloque markdown
+        if self._is_read_only(output):
+            return output.strip()
+        return None
+
+    def after_fork(self):
+        """
+        Reinicia en un worker recién creado con fork() lo que no puede
+        compartirse con el proceso padre: conexiones a la base de datos,
+        locks y conexiones de la caché y de las plantillas. El agente, el esquema y el contexto
+        de esquema cargados antes del fork se reutilizan tal cual.
+        """
+        self.db_manager.after_fork()
+        if self.cache is not None:
+            self.cache.after_fork()
+        if self.templates is not None:
+            self.templates.after_fork()
+        if self.conversations is not None:
+            self.conversations.after_fork()
 
     def _cleanup_resources(self):
         """Libera todos los recursos del chatbot"""
+        if getattr(self, 'templates', None) is not None:
+            self.templates.save()
         try:
             if hasattr(self, 'db_manager') and self.db_manager:
                 self.db_manager.close()
-                logger.info("Conexión a PostgreSQL cerrada")
         except Exception as e:
             logger.error(f"Error al cerrar conexión: {e}")
 
@@ -150,6 +1139,14 @@ class ChatbotSQL:
         self._cleanup_resources()
         logger.info("Chatbot SQL cerrado correctamente")
 
+    async def aclose(self):
+        """Cierra los recursos, incluido el pool asíncrono"""
+        try:
+            await self.db_manager.aclose()
+        except Exception as e:
+            logger.error(f"Error al cerrar el pool asíncrono: {e}")
+        self.close()
+
     def __enter__(self):
         """Permite usar el chatbot en un contexto with"""
         return self
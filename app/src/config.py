@@ -15,10 +15,243 @@ DB_CONFIG = {
 }
 
 
+# Pool de conexiones compartido por el ORM, las consultas directas y LangChain
+POOL_CONFIG = {
+    'SIZE': int(os.getenv('DB_POOL_SIZE', '10')),
+    'MAX_OVERFLOW': int(os.getenv('DB_POOL_MAX_OVERFLOW', '20')),
+    'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', '30')),
+    'RECYCLE': int(os.getenv('DB_POOL_RECYCLE', '1800'))
+}
+
+# Réplicas de lectura (src.replicas): la SQL de solo lectura del chatbot va a
+# la réplica sana menos cargada; la escritura y el catálogo, a la primaria
+REPLICA_CONFIG = {
+    # URLs de SQLAlchemy separadas por comas (vacío = todo a la primaria)
+    'URLS': [u.strip() for u in os.getenv('DB_REPLICA_URLS', '').split(',') if u.strip()],
+    'POOL_SIZE': int(os.getenv('DB_REPLICA_POOL_SIZE', '0')) or POOL_CONFIG['SIZE'],
+    'MAX_OVERFLOW': int(os.getenv('DB_REPLICA_MAX_OVERFLOW', str(POOL_CONFIG['MAX_OVERFLOW']))),
+    # Retraso de replicación máximo admitido (s); más, y la réplica no recibe consultas
+    'MAX_LAG_SECONDS': float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', '10')),
+    # Cada cuánto se comprueban conexión y retraso de cada réplica (s)
+    'HEALTH_INTERVAL': float(os.getenv('DB_REPLICA_HEALTH_INTERVAL', '5')),
+    # Sin réplicas sanas, leer de la primaria (si no, la consulta falla)
+    'PRIMARY_FALLBACK': os.getenv('DB_REPLICA_PRIMARY_FALLBACK', 'True').lower() == 'true'
+}
+
+# Caché de consultas (pregunta -> SQL y SQL -> resultados)
+CACHE_CONFIG = {
+    'ENABLED': os.getenv('CACHE_ENABLED', 'True').lower() == 'true',
+    'SQL_MAXSIZE': int(os.getenv('CACHE_SQL_MAXSIZE', '512')),
+    'RESULT_MAXSIZE': int(os.getenv('CACHE_RESULT_MAXSIZE', '256')),
+    'RESULT_TTL': float(os.getenv('CACHE_RESULT_TTL', '300')),
+    'SIMILARITY_THRESHOLD': float(os.getenv('CACHE_SIMILARITY_THRESHOLD', '0.92')),
+    'SCHEMA_CHECK_INTERVAL': float(os.getenv('CACHE_SCHEMA_CHECK_INTERVAL', '300')),
+    # Dónde viven las entradas: 'local' (cada proceso la suya), 'shm' (memoria
+    # compartida entre los workers de la máquina) o 'redis'
+    'BACKEND': os.getenv('CACHE_BACKEND', 'local').lower(),
+    # Fichero de la caché 'shm' (vacío = directorio privado en /dev/shm) o URL de Redis
+    'LOCATION': os.getenv('CACHE_LOCATION', '') or None
+}
+
+# Instantánea del esquema en disco (arranque rápido y compartida entre workers)
+SCHEMA_CONFIG = {
+    'SNAPSHOT_ENABLED': os.getenv('SCHEMA_SNAPSHOT_ENABLED', 'True').lower() == 'true',
+    'SNAPSHOT_DIR': Path(os.getenv('SCHEMA_SNAPSHOT_DIR', Path(__file__).parent.parent / '.cache')),
+    # Instantáneas de otras URIs que se conservan: máximo de ficheros y días
+    'SNAPSHOT_MAX_FILES': int(os.getenv('SCHEMA_SNAPSHOT_MAX_FILES', '16')),
+    'SNAPSHOT_MAX_AGE': float(os.getenv('SCHEMA_SNAPSHOT_MAX_AGE_DAYS', '7')) * 86400,
+    # Recorte del esquema por pregunta cuando no cabe en el presupuesto
+    'PRUNING_ENABLED': os.getenv('SCHEMA_PRUNING_ENABLED', 'True').lower() == 'true',
+    'PROMPT_TOKEN_BUDGET': int(os.getenv('SCHEMA_PROMPT_TOKEN_BUDGET', '2000'))
+}
+
+# Resultados: tope de filas por respuesta (con paginación) y filas por lote
+# al leer con cursor de servidor
+RESULT_CONFIG = {
+    'MAX_ROWS': int(os.getenv('RESULT_MAX_ROWS', '1000')),
+    'FETCH_BATCH': int(os.getenv('RESULT_FETCH_BATCH', '200')),
+    # Resultados por columnas (ColumnarResult) en lugar de un dict por fila
+    'COLUMNAR': os.getenv('RESULT_COLUMNAR', 'True').lower() == 'true'
+}
+
+# Exportación de resultados completos (CSV, NDJSON, Parquet)
+EXPORT_CONFIG = {
+    'BATCH_SIZE': int(os.getenv('EXPORT_BATCH_SIZE', '10000')),
+    'CHUNK_SIZE': int(os.getenv('EXPORT_CHUNK_SIZE', '65536')),
+    # Bloques de COPY en espera de ser enviados al cliente
+    'QUEUE_CHUNKS': int(os.getenv('EXPORT_QUEUE_CHUNKS', '16')),
+    # statement_timeout de las exportaciones en ms (0 = sin límite)
+    'STATEMENT_TIMEOUT_MS': int(os.getenv('EXPORT_STATEMENT_TIMEOUT_MS', '0'))
+}
+
+# Comprobaciones previas a la ejecución de la SQL generada (QueryGuard)
+GUARD_CONFIG = {
+    'ENABLED': os.getenv('GUARD_ENABLED', 'True').lower() == 'true',
+    # Coste total estimado por EXPLAIN por encima del cual se rechaza la consulta
+    'MAX_COST': float(os.getenv('GUARD_MAX_COST', '1000000')),
+    # Filas estimadas por encima de las cuales se añade LIMIT (o se rechaza)
+    'MAX_ESTIMATED_ROWS': int(os.getenv('GUARD_MAX_ESTIMATED_ROWS', '100000')),
+    # 'limit' reescribe la consulta con LIMIT AUTO_LIMIT; 'reject' la rechaza
+    'ROWS_ACTION': os.getenv('GUARD_ROWS_ACTION', 'limit').lower(),
+    'AUTO_LIMIT': int(os.getenv('GUARD_AUTO_LIMIT', '10000')),
+    # statement_timeout de cada sentencia en ms (PostgreSQL; 0 = sin límite)
+    'STATEMENT_TIMEOUT_MS': int(os.getenv('GUARD_STATEMENT_TIMEOUT_MS', '15000'))
+}
+
 # Configuración de Groq
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 MODEL_NAME = os.getenv('MODEL_NAME')
 
+# Generación de SQL: 'agent' (agente con herramientas) o 'direct' (una sola
+# llamada al LLM, con el agente como respaldo)
+GENERATION_MODE = os.getenv('GENERATION_MODE', 'agent')
+
+# Traza del agente en stdout (verbose de LangChain); las trazas estructuradas
+# van por src.tracing
+AGENT_VERBOSE = os.getenv('AGENT_VERBOSE', 'False').lower() == 'true'
+
+# Trazas por petición y métricas de Prometheus (src.tracing)
+TRACING_CONFIG = {
+    'ENABLED': os.getenv('TRACING_ENABLED', 'True').lower() == 'true',
+    # Trazas en JSON compatible con OpenTelemetry (OTLP/JSON), una por línea
+    'OTEL_LOG': os.getenv('TRACING_OTEL_LOG', 'False').lower() == 'true',
+    # Fichero de las trazas JSON; vacío = logger 'chatbot.otel'
+    'OTEL_LOG_FILE': os.getenv('TRACING_OTEL_LOG_FILE', ''),
+    # Peticiones más lentas que esto (s) se resumen en el log por etapa
+    'SLOW_SECONDS': float(os.getenv('TRACING_SLOW_SECONDS', '5')),
+    'SERVICE_NAME': os.getenv('TRACING_SERVICE_NAME', 'sql-chatbot')
+}
+
+# Límite de llamadas al LLM según la cuota de Groq (peticiones y tokens por
+# minuto; 0 tokens = sin límite de tokens)
+RATE_LIMIT_CONFIG = {
+    'ENABLED': os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true',
+    'REQUESTS_PER_MINUTE': float(os.getenv('RATE_LIMIT_REQUESTS_PER_MINUTE', '30')),
+    'TOKENS_PER_MINUTE': float(os.getenv('RATE_LIMIT_TOKENS_PER_MINUTE', '0')),
+    # Peticiones que pueden salir de golpe (0 = las de un minuto)
+    'BURST': float(os.getenv('RATE_LIMIT_BURST', '0'))
+}
+
+# Cliente del LLM (src.resilience): pool HTTP persistente, reintentos con
+# jitter, peticiones duplicadas (hedging) y modelo de respaldo
+LLM_CONFIG = {
+    'TIMEOUT': float(os.getenv('LLM_TIMEOUT', '60')),
+    'MAX_CONNECTIONS': int(os.getenv('LLM_MAX_CONNECTIONS', '32')),
+    'MAX_KEEPALIVE': int(os.getenv('LLM_MAX_KEEPALIVE', '16')),
+    'KEEPALIVE_EXPIRY': float(os.getenv('LLM_KEEPALIVE_EXPIRY', '60')),
+    'MAX_RETRIES': int(os.getenv('LLM_MAX_RETRIES', '3')),
+    'BACKOFF_BASE': float(os.getenv('LLM_BACKOFF_BASE', '0.5')),
+    'BACKOFF_MAX': float(os.getenv('LLM_BACKOFF_MAX', '8')),
+    # Copia de la petición si tarda más que el percentil indicado de las
+    # últimas latencias (con al menos HEDGE_MIN_SAMPLES medidas)
+    'HEDGE_ENABLED': os.getenv('LLM_HEDGE_ENABLED', 'True').lower() == 'true',
+    'HEDGE_PERCENTILE': float(os.getenv('LLM_HEDGE_PERCENTILE', '95')),
+    'HEDGE_MIN_DELAY': float(os.getenv('LLM_HEDGE_MIN_DELAY', '1')),
+    'HEDGE_MIN_SAMPLES': int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20')),
+    # Modelo más pequeño o rápido si el principal sigue fallando ('' = ninguno)
+    'FALLBACK_MODEL': os.getenv('LLM_FALLBACK_MODEL', ''),
+    # URL base de la API compatible con Groq ('' = la oficial); útil para
+    # pruebas con un servidor local (benchmarks/fake_llm.py)
+    'API_BASE': os.getenv('LLM_API_BASE', '') or None
+}
+
+# Lotes de preguntas (ChatbotSQL.process_batch y /api/batch)
+BATCH_CONFIG = {
+    'MAX_QUESTIONS': int(os.getenv('BATCH_MAX_QUESTIONS', '500')),
+    # Preguntas generándose a la vez (llamadas al LLM en paralelo)
+    'CONCURRENCY': int(os.getenv('BATCH_CONCURRENCY', '16')),
+    # Consultas SQL distintas ejecutándose a la vez
+    'DB_CONCURRENCY': int(os.getenv('BATCH_DB_CONCURRENCY', '4'))
+}
+
+# Plantillas de respuesta aprendidas del historial de SQL generada
+# (src.answer_templates): las preguntas con la forma de una plantilla
+# frecuente se resuelven sin LLM y su resultado se materializa en memoria
+# hasta que cambian las tablas de origen
+TEMPLATE_CONFIG = {
+    'ENABLED': os.getenv('TEMPLATES_ENABLED', 'True').lower() == 'true',
+    # Veces que debe verse una forma de pregunta/SQL para usarla
+    'MIN_OCCURRENCES': int(os.getenv('TEMPLATES_MIN_OCCURRENCES', '3')),
+    'MAX_TEMPLATES': int(os.getenv('TEMPLATES_MAX_TEMPLATES', '200')),
+    'MAX_MATERIALIZED': int(os.getenv('TEMPLATES_MAX_MATERIALIZED', '256')),
+    # Segundos entre comprobaciones de la marca de agua de cada tabla
+    'WATERMARK_INTERVAL': float(os.getenv('TEMPLATES_WATERMARK_INTERVAL', '5')),
+    # Guardar las plantillas aprendidas junto a la instantánea del esquema
+    'PERSIST': os.getenv('TEMPLATES_PERSIST', 'True').lower() == 'true'
+}
+
+# Registro de la SQL ejecutada (workload) y asesor de índices (src.index_advisor)
+INDEX_ADVISOR_CONFIG = {
+    # Grabar el workload es opcional: el fichero contiene la SQL y sus parámetros
+    'RECORD': os.getenv('INDEX_ADVISOR_RECORD', 'False').lower() == 'true',
+    # Fichero JSONL del workload (vacío = workload.jsonl junto a la instantánea del esquema)
+    'WORKLOAD_FILE': Path(os.getenv('INDEX_ADVISOR_WORKLOAD_FILE', '')
+                          or SCHEMA_CONFIG['SNAPSHOT_DIR'] / 'workload.jsonl'),
+    # Tamaño a partir del cual el fichero pasa a .1 (0 = sin rotación)
+    'MAX_BYTES': int(os.getenv('INDEX_ADVISOR_MAX_BYTES', str(50 * 1024 * 1024))),
+    # Consultas distintas que se miden (las de más tiempo acumulado)
+    'SAMPLE_SIZE': int(os.getenv('INDEX_ADVISOR_SAMPLE_SIZE', '50')),
+    'MAX_INDEXES': int(os.getenv('INDEX_ADVISOR_MAX_INDEXES', '5')),
+    # Reducción mínima del coste del workload (fracción) para recomendar un índice
+    'MIN_IMPROVEMENT': float(os.getenv('INDEX_ADVISOR_MIN_IMPROVEMENT', '0.1')),
+    # 'hypopg' (índices hipotéticos), 'trial' (crea cada índice, mide y lo
+    # borra) o 'auto' (hypopg si está instalado; trial fuera de PostgreSQL)
+    'STRATEGY': os.getenv('INDEX_ADVISOR_STRATEGY', 'auto').lower(),
+    # Ejecuciones por medición fuera de PostgreSQL (se toma la más rápida)
+    'REPEAT': int(os.getenv('INDEX_ADVISOR_REPEAT', '3'))
+}
+
+# Invalidación de cachés por eventos con LISTEN/NOTIFY (src.invalidation,
+# solo PostgreSQL): triggers por sentencia en las tablas y event trigger de DDL
+INVALIDATION_CONFIG = {
+    'ENABLED': os.getenv('INVALIDATION_ENABLED', 'False').lower() == 'true',
+    'CHANNEL': os.getenv('INVALIDATION_CHANNEL', 'chatbot_invalidation'),
+    # Crear (o actualizar) los triggers al arrancar; si no, los instala un
+    # administrador con python -m src.invalidation --install
+    'INSTALL': os.getenv('INVALIDATION_INSTALL', 'True').lower() == 'true',
+    # Tablas vigiladas separadas por comas (vacío = todas las del esquema)
+    'TABLES': [t.strip() for t in os.getenv('INVALIDATION_TABLES', '').split(',') if t.strip()],
+    # Event trigger de DDL para refrescar el esquema (requiere superusuario)
+    'DDL': os.getenv('INVALIDATION_DDL', 'True').lower() == 'true',
+    # Espera entre reintentos si se pierde la conexión de escucha (s)
+    'RECONNECT_SECONDS': float(os.getenv('INVALIDATION_RECONNECT_SECONDS', '5'))
+}
+
+# Contexto de negocio recuperado de la documentación (src.doc_retrieval)
+DOCS_CONFIG = {
+    'ENABLED': os.getenv('DOCS_ENABLED', 'True').lower() == 'true',
+    'DIR': Path(os.getenv('DOCS_DIR', '') or Path(__file__).parent.parent / 'documentacion'),
+    # Índice precalculado (vacío = doc_index junto a la instantánea del esquema)
+    'INDEX_DIR': Path(os.getenv('DOCS_INDEX_DIR', '') or SCHEMA_CONFIG['SNAPSHOT_DIR'] / 'doc_index'),
+    # Construir el índice al arrancar si falta o si han cambiado los documentos
+    'AUTO_BUILD': os.getenv('DOCS_AUTO_BUILD', 'True').lower() == 'true',
+    'TOP_K': int(os.getenv('DOCS_TOP_K', '2')),
+    # Puntuación mínima (0-1) de un fragmento para entrar en el prompt
+    'MIN_SCORE': float(os.getenv('DOCS_MIN_SCORE', '0.2')),
+    'TOKEN_BUDGET': int(os.getenv('DOCS_TOKEN_BUDGET', '300')),
+    # Troceado: palabras por fragmento y solape entre fragmentos consecutivos
+    'CHUNK_WORDS': int(os.getenv('DOCS_CHUNK_WORDS', '120')),
+    'CHUNK_OVERLAP': int(os.getenv('DOCS_CHUNK_OVERLAP', '30')),
+    # Dimensiones de los vectores (hashing de términos y n-gramas)
+    'DIMENSIONS': int(os.getenv('DOCS_DIMENSIONS', '512'))
+}
+
+# Conversaciones por sesión (src.conversation): historial compacto en el
+# prompt y preguntas de seguimiento resueltas sobre el resultado anterior
+CONVERSATION_CONFIG = {
+    'ENABLED': os.getenv('CONVERSATION_ENABLED', 'True').lower() == 'true',
+    # Sesiones en memoria (las menos recientes se descartan) y caducidad (s)
+    'MAX_SESSIONS': int(os.getenv('CONVERSATION_MAX_SESSIONS', '1000')),
+    'SESSION_TTL': float(os.getenv('CONVERSATION_SESSION_TTL', '1800')),
+    'MAX_TURNS': int(os.getenv('CONVERSATION_MAX_TURNS', '10')),
+    'HISTORY_TOKEN_BUDGET': int(os.getenv('CONVERSATION_HISTORY_TOKEN_BUDGET', '300')),
+    # Seguimientos (filtrar, ordenar, limitar, agregar) sin LLM ni base de datos
+    'LOCAL_FOLLOW_UPS': os.getenv('CONVERSATION_LOCAL_FOLLOW_UPS', 'True').lower() == 'true',
+    # Filas del último resultado que se guardan por sesión y en total
+    'MAX_RESULT_ROWS': int(os.getenv('CONVERSATION_MAX_RESULT_ROWS', '5000')),
+    'MAX_TOTAL_ROWS': int(os.getenv('CONVERSATION_MAX_TOTAL_ROWS', '200000'))
+}
+
 # Configuración de la aplicación
 APP_CONFIG = {
     'TEMPLATES_DIR': Path(__file__).parent.parent / 'templates',
@@ -26,13 +259,48 @@ APP_CONFIG = {
     'DEBUG': os.getenv('DEBUG', 'False').lower() == 'true'
 }
 
+# Servidor de producción (gunicorn.conf.py): workers uvicorn bajo gunicorn,
+# con la aplicación cargada una sola vez antes del fork (PRELOAD)
+SERVER_CONFIG = {
+    'HOST': os.getenv('SERVER_HOST', '0.0.0.0'),
+    'PORT': int(os.getenv('SERVER_PORT', '8000')),
+    'WORKERS': int(os.getenv('SERVER_WORKERS', '0')) or os.cpu_count() or 1,
+    'WORKER_CLASS': os.getenv('SERVER_WORKER_CLASS', 'uvicorn.workers.UvicornWorker'),
+    'TIMEOUT': int(os.getenv('SERVER_TIMEOUT', '120')),
+    'PRELOAD': os.getenv('SERVER_PRELOAD', 'True').lower() == 'true'
+}
+
+# Configuración del pool de ejecución de consultas
+EXECUTOR_CONFIG = {
+    'MODE': os.getenv('EXECUTOR_MODE', 'thread'),  # thread | process | async
+    'WORKERS': int(os.getenv('EXECUTOR_WORKERS', '4')),
+    'MAX_QUEUE': int(os.getenv('EXECUTOR_MAX_QUEUE', '16')),
+    'REQUEST_TIMEOUT': float(os.getenv('EXECUTOR_REQUEST_TIMEOUT', '30'))
+}
+
 # Validar configuración
 if not GROQ_API_KEY:
     raise ValueError("GROQ_API_KEY no está configurada en las variables de entorno")
 
 def get_db_uri():
     """Genera la URI de conexión para SQLAlchemy"""
+    # DATABASE_URL permite apuntar a otra base (p. ej. SQLite en benchmarks)
+    if os.getenv('DATABASE_URL'):
+        return os.getenv('DATABASE_URL')
     return (
         f"postgresql+psycopg2://{DB_CONFIG['user']}:{DB_CONFIG['password']}"
         f"@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
-    )
\ No newline at end of file
+    )
+
+# Drivers asíncronos equivalentes a los síncronos de get_db_uri()
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite'
+}
+
+def get_async_db_uri(uri: str = None):
+    """Genera la URI de conexión para el motor asíncrono de SQLAlchemy (de la primaria o de 'uri')"""
+    uri = uri or get_db_uri()
+    scheme, rest = uri.split('://', 1)
+    backend = scheme.split('+', 1)[0]
+    return f"{ASYNC_DRIVERS.get(backend, scheme)}://{rest}"
@@ -0,0 +1,774 @@
+"""
+Conversaciones por sesión y preguntas de seguimiento resueltas en local
+
+Cada sesión (cookie de la API o session_id) guarda sus últimas preguntas
+con la SQL que las respondió y el último resultado completo. Con ello:
+  - el prompt recibe un historial compacto ({history}) dentro de un
+    presupuesto de tokens: la SQL solo de los turnos más recientes y, de
+    los anteriores, la pregunta
+  - los seguimientos que solo filtran, ordenan, limitan o agregan el
+    resultado anterior ("y solo los completados", "ordénalos por fecha",
+    "¿cuántos son?") se ejecutan en SQLite en memoria sobre ese resultado,
+    sin LLM ni PostgreSQL
+
+FollowUpPlanner solo acepta una pregunta si entiende todas sus palabras;
+ante cualquier duda devuelve None y la pregunta va al LLM con el historial.
+La memoria está acotada: sesiones con LRU y caducidad, y un máximo de filas
+guardadas por sesión y en total (se sueltan primero los resultados de las
+sesiones menos recientes).
+
+Con la invalidación por eventos (src.invalidation) se sueltan los
+resultados guardados que leen tablas escritas, y el seguimiento siguiente
+vuelve a la base de datos. Las sesiones viven en la memoria de cada
+proceso: con varios workers (gunicorn) una conversación solo continúa si
+sus peticiones llegan al mismo worker; en otro empieza de cero.
+"""
+from collections import OrderedDict, deque
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from src.cache import sql_tables
+from src.config import CONVERSATION_CONFIG
+from src.langchain_setup import estimate_tokens
+from src.results import ColumnarResult, row_values
+from src.sql_validator import is_read_only, strip_sql
+from src.tracing import tracer
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+tracer.metrics.describe("chatbot_follow_ups_total", "counter",
+                        "Preguntas de seguimiento por forma de resolverlas (local o llm)")
+
+# Distintos valores como máximo para tratar una columna de texto como categórica
+_MAX_VALUES = 100
+
+_ARTICLES = {"el", "la", "los", "las", "lo", "un", "una", "unos", "unas"}
+_NEGATIONS = {"excepto", "menos", "salvo", "sin", "no", "quitando", "excluyendo", "exceptuando"}
+_CONNECTORS = {"y", "e", "o", "u", "ni", ","}
+# Palabras que no cambian el significado de un seguimiento
+_FILLER = _ARTICLES | _CONNECTORS | {
+    "solo", "solamente", "unicamente", "de", "del", "que", "con", "en", "a", "al", "son", "es", "hay",
+    "cual", "cuales", "muestra", "muestrame", "muestralos", "muestralas", "dame", "damelos", "ensename",
+    "ensenamelos", "ahora", "tambien", "pero", "ver", "me", "quiero", "mostrar", "lista", "listalos",
+    "filtra", "filtralos", "filtralas", "deja", "dejame", "quedate", "quedame", "ellos", "ellas",
+    "esos", "esas", "estos", "estas", "aquellos", "aquellas", "ese", "esa", "este", "esta",
+    "resultado", "resultados", "fila", "filas", "registro", "registros", "anterior", "anteriores",
+    "todos", "todas", "total", "favor", "por", "si", "tengo", "tiene", "tienen", "hubo", "estan", "esta",
+    "cuantos", "cuantas"
+}
+# Señales de que la pregunta se refiere al resultado anterior
+_ANAPHORA = {"esos", "esas", "estos", "estas", "ellos", "ellas", "aquellos", "aquellas", "anterior",
+             "anteriores", "solo", "solamente", "unicamente"}
+_PROJECTION_CUES = {"solo", "solamente", "unicamente", "muestra", "muestrame", "dame", "ensename", "quiero"}
+_NUMBER_WORDS = {"uno": 1, "un": 1, "una": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6,
+                 "siete": 7, "ocho": 8, "nueve": 9, "diez": 10, "veinte": 20, "cincuenta": 50, "cien": 100}
+_AGGREGATES = {"suma": "SUM", "sumar": "SUM", "total": "SUM", "media": "AVG", "medio": "AVG",
+               "promedio": "AVG", "maximo": "MAX", "minimo": "MIN"}
+_AGGREGATE_ALIAS = {"SUM": "suma", "AVG": "media", "MAX": "maximo", "MIN": "minimo"}
+# (frase, dirección) para ORDER BY
+_DIRECTIONS = [
+    (("de", "mayor", "a", "menor"), "DESC"), (("de", "menor", "a", "mayor"), "ASC"),
+    (("de", "mas", "reciente", "a", "mas", "antiguo"), "DESC"),
+    (("de", "mas", "antiguo", "a", "mas", "reciente"), "ASC"),
+    (("de", "mas", "caro", "a", "mas", "barato"), "DESC"), (("de", "mas", "barato", "a", "mas", "caro"), "ASC"),
+    (("mas", "reciente", "primero"), "DESC"), (("mas", "antiguo", "primero"), "ASC"),
+    (("descendente",), "DESC"), (("descendentemente",), "DESC"), (("desc",), "DESC"),
+    (("ascendente",), "ASC"), (("ascendentemente",), "ASC"), (("asc",), "ASC")
+]
+# (frase, operador) delante de un número
+_COMPARISONS = [
+    (("al", "menos"), ">="), (("como", "minimo"), ">="), (("como", "mucho"), "<="), (("como", "maximo"), "<="),
+    (("mayor", "o", "igual", "a"), ">="), (("menor", "o", "igual", "a"), "<="),
+    (("mayor", "de"), ">"), (("mayor", "que"), ">"), (("mayor", "a"), ">"), (("mas", "de"), ">"),
+    (("mas", "que"), ">"), (("superior", "a"), ">"), (("por", "encima", "de"), ">"),
+    (("menor", "de"), "<"), (("menor", "que"), "<"), (("menor", "a"), "<"), (("menos", "de"), "<"),
+    (("menos", "que"), "<"), (("inferior", "a"), "<"), (("por", "debajo", "de"), "<"),
+    (("igual", "a"), "="), (("de",), "=")
+]
+
+
+def _fold(text: str) -> str:
+    """Minúsculas y sin tildes"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def _stem(word: str) -> str:
+    """Forma común de singular/plural y masculino/femenino: completados -> completad"""
+    if len(word) > 4 and word.endswith("es") and word[-3] in "dlnrjz":
+        word = word[:-2]
+    elif len(word) > 3 and word.endswith("s"):
+        word = word[:-1]
+    if len(word) > 3 and word[-1] in "ao":
+        word = word[:-1]
+    return word
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"\d+(?:[.,]\d+)?|[a-z0-9_]+", _fold(text))
+
+
+def _number(token: str) -> Optional[float]:
+    if token in _NUMBER_WORDS:
+        return _NUMBER_WORDS[token]
+    if re.fullmatch(r"\d+(?:[.,]\d+)?", token):
+        value = float(token.replace(",", "."))
+        return int(value) if value.is_integer() else value
+    return None
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value: Any) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _sqlite_value(value: Any) -> Any:
+    """Valor que SQLite compara igual que PostgreSQL (Decimal como REAL, fechas ISO)"""
+    if value is None or isinstance(value, (int, float, str)):
+        return int(value) if isinstance(value, bool) else value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat(" ")
+    if isinstance(value, (date, dt_time)):
+        return value.isoformat()
+    return str(value)
+
+
+class LocalQuery:
+    """
+    Operaciones de un seguimiento sobre el resultado anterior
+
+    Se traduce a SQL sobre la tabla 'resultado': en SQLite es el resultado
+    cargado en memoria y en PostgreSQL la SQL anterior como subconsulta, de
+    modo que la SQL equivalente de la respuesta puede ejecutarse tal cual.
+    """
+
+    def __init__(self):
+        self.where: List[str] = []
+        self.columns: List[str] = []        # proyección; vacía = todas
+        self.group_by: List[str] = []
+        self.aggregates: List[Tuple[str, Optional[str], str]] = []  # (función, columna, alias)
+        self.order_by: List[Tuple[str, str]] = []
+        self.limit: Optional[int] = None
+
+    def __bool__(self) -> bool:
+        return bool(self.where or self.columns or self.aggregates or self.order_by or self.limit is not None)
+
+    @property
+    def referenced(self) -> List[str]:
+        """Columnas del resultado que necesita la consulta"""
+        names = [column for column, _ in self.order_by] + self.group_by
+        names += [column for _, column, _ in self.aggregates if column]
+        names += [name for condition in self.where for name in re.findall(r'"((?:[^"]|"")+)"', condition)]
+        return list(dict.fromkeys(name.replace('""', '"') for name in names))
+
+    def output_columns(self, columns: Sequence[str]) -> List[str]:
+        if self.aggregates:
+            return self.group_by + [alias for _, _, alias in self.aggregates]
+        return self.columns or list(columns)
+
+    def _select(self) -> str:
+        if self.aggregates:
+            items = [_quote(column) for column in self.group_by]
+            items += [f"{func}({_quote(column) if column else '*'}) AS {_quote(alias)}"
+                      for func, column, alias in self.aggregates]
+            return ", ".join(items)
+        return ", ".join(_quote(column) for column in self.columns) or "*"
+
+    def _where(self) -> str:
+        return " WHERE " + " AND ".join(self.where) if self.where else ""
+
+    def _order(self) -> List[Tuple[str, str]]:
+        """Orden pedido; con agregados, por las columnas de agrupación"""
+        return self.order_by or [(column, "ASC") for column in self.group_by]
+
+    @staticmethod
+    def _order_sql(order_by: List[Tuple[str, str]]) -> str:
+        if not order_by:
+            return ""
+        # Los NULL donde los deja PostgreSQL (SQLite los pone al principio)
+        return " ORDER BY " + ", ".join(
+            f"{_quote(column)} {direction} NULLS {'LAST' if direction == 'ASC' else 'FIRST'}"
+            for column, direction in order_by)
+
+    def _limit_sql(self) -> str:
+        return f" LIMIT {self.limit}" if self.limit is not None else ""
+
+    def to_sql(self, previous_sql: str) -> str:
+        """SQL equivalente en PostgreSQL sobre la consulta anterior"""
+        source = strip_sql(previous_sql)
+        group = " GROUP BY " + ", ".join(_quote(column) for column in self.group_by) if self.group_by else ""
+        return (f"SELECT {self._select()} FROM ({source}) AS resultado"
+                f"{self._where()}{group}{self._order_sql(self._order())}{self._limit_sql()}")
+
+    def run(self, result: ColumnarResult) -> ColumnarResult:
+        """
+        Ejecuta la consulta en SQLite en memoria
+
+        SQLite elige y ordena las filas; los valores se toman del resultado
+        original, así que conservan sus tipos (Decimal, fechas). Los
+        agregados se calculan en Python sobre esos valores.
+        """
+        referenced = self.referenced
+        conn = sqlite3.connect(":memory:")
+        try:
+            conn.execute("CREATE TABLE resultado (" + ", ".join(["_fila INTEGER", *map(_quote, referenced)]) + ")")
+            arrays = [[_sqlite_value(value) for value in result.column(column)] for column in referenced]
+            conn.executemany(f"INSERT INTO resultado VALUES ({', '.join('?' * (len(referenced) + 1))})",
+                             zip(range(len(result)), *arrays))
+            # _fila desempata: a igualdad se respeta el orden del resultado anterior
+            order = self._order_sql([*self._order(), ("_fila", "ASC")])
+            limit = "" if self.aggregates else self._limit_sql()
+            indexes = [row[0] for row in conn.execute(f"SELECT _fila FROM resultado{self._where()}{order}{limit}")]
+        finally:
+            conn.close()
+        if not self.aggregates:
+            columns = self.output_columns(result.columns)
+            return ColumnarResult(columns, [[result.column(column)[i] for i in indexes] for column in columns])
+        return self._aggregate(result, indexes)
+
+    def _aggregate(self, result: ColumnarResult, indexes: List[int]) -> ColumnarResult:
+        """Grupos en el orden de las filas elegidas y sus agregados"""
+        keys = [result.column(column) for column in self.group_by]
+        groups: Dict[Tuple[Any, ...], List[int]] = {}
+        for i in indexes:
+            groups.setdefault(tuple(array[i] for array in keys), []).append(i)
+        if not self.group_by and not groups:
+            groups[()] = []
+        rows = [key + tuple(self._apply(func, result.column(column) if column else None, members)
+                            for func, column, _ in self.aggregates)
+                for key, members in groups.items()]
+        output = ColumnarResult(self.output_columns(result.columns))
+        output.extend(rows[:self.limit] if self.limit is not None else rows)
+        return output
+
+    @staticmethod
+    def _apply(func: str, values: Optional[List[Any]], members: List[int]) -> Any:
+        if values is None:
+            return len(members)
+        present = [values[i] for i in members if values[i] is not None]
+        if func == "COUNT":
+            return len(present)
+        if not present:
+            return None
+        if func == "SUM":
+            return sum(present)
+        if func == "AVG":
+            return sum(present) / len(present)
+        return max(present) if func == "MAX" else min(present)
+
+
+class FollowUpPlanner:
+    """
+    Reconoce seguimientos que solo operan sobre el resultado anterior
+
+    Filtros por valores de columnas de texto (singular/plural, negación y
+    listas: "excepto los cancelados y los pendientes"), comparaciones
+    numéricas ("con precio mayor de 20", "al menos 3"), orden ("ordénalos
+    por fecha de mayor a menor"), límites ("los 5 primeros"), agregados
+    ("¿cuántos son?", "la suma de total por estado") y proyección ("solo el
+    nombre y el precio").
+
+    Se crea uno por pregunta: guarda el estado del análisis (palabras ya
+    explicadas por alguna operación).
+
+    Args:
+        question: Pregunta de seguimiento
+        result: Último resultado completo de la sesión
+        tables: Tablas de la SQL anterior ("pedidos" no es una palabra nueva)
+    """
+
+    def __init__(self, question: str, result: ColumnarResult, tables: Iterable[str] = ()):
+        self.tokens = _tokens(question)
+        self.stems = [_stem(token) for token in self.tokens]
+        self.used = [False] * len(self.tokens)
+        self.result = result
+        self.table_words = {_stem(word) for table in tables for word in _fold(table).split("_") if word}
+        self.kinds = self._column_kinds(result)
+        self.phrases = self._column_phrases(result.columns)
+
+    def plan(self) -> Optional[LocalQuery]:
+        """LocalQuery para la pregunta, o None si no es (seguro) un seguimiento"""
+        if not self.tokens or not len(self.result):
+            return None
+        query = LocalQuery()
+        try:
+            self._order_by(query)
+            self._limit(query)
+            self._comparisons(query)
+            self._aggregates(query)
+            self._values(query)
+            self._projection(query)
+        except _NotFollowUp:
+            return None
+        if not query:
+            return None
+        mentions_table = False
+        for token, stem, used in zip(self.tokens, self.stems, self.used):
+            if used or token in _FILLER:
+                continue
+            if stem in self.table_words:
+                mentions_table = True
+                continue
+            return None
+        # "pedidos completados" puede ser una pregunta nueva sobre toda la tabla
+        first = self.tokens[0]
+        if mentions_table and not (set(self.tokens) & _ANAPHORA or first in ("y", "e")
+                                   or re.search(r"(los|las)$", first)):
+            return None
+        return query
+
+    # Columnas
+
+    def _column_kinds(self, result: ColumnarResult) -> Dict[str, str]:
+        kinds = {}
+        for column, array in zip(result.columns, result.arrays):
+            present = [value for value in array if value is not None]
+            if present and all(isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+                               for value in present):
+                kinds[column] = "number"
+            elif present and all(isinstance(value, str) for value in present):
+                kinds[column] = "text"
+            else:
+                kinds[column] = "other"
+        return kinds
+
+    def _column_phrases(self, columns: Sequence[str]) -> List[Tuple[Tuple[str, ...], str]]:
+        """(palabras, columna): el nombre completo y cada parte que solo tiene una columna"""
+        phrases = [(tuple(_stem(part) for part in _fold(column).split("_") if part), column) for column in columns]
+        parts: Dict[str, List[str]] = {}
+        for words, column in phrases:
+            for word in words:
+                parts.setdefault(word, []).append(column)
+        # "pedido" nombra la tabla, no la columna pedido_id
+        phrases += [((word,), owners[0]) for word, owners in parts.items()
+                    if len(owners) == 1 and word != "id" and word not in self.table_words
+                    and (word,) not in {words for words, _ in phrases}]
+        return sorted(phrases, key=lambda phrase: -len(phrase[0]))
+
+    def _column_at(self, i: int) -> Optional[Tuple[str, int]]:
+        """Columna nombrada a partir del token i (saltando artículos): (columna, fin)"""
+        while i < len(self.tokens) and self.tokens[i] in _ARTICLES:
+            i += 1
+        for words, column in self.phrases:
+            end = i + len(words)
+            if self._matches(words, i):
+                return column, end
+        return None
+
+    def _matches(self, stems: Sequence[str], i: int) -> bool:
+        """Las raíces 'stems' aparecen a partir del token i sin usar"""
+        end = i + len(stems)
+        return end <= len(self.tokens) and not any(self.used[i:end]) and tuple(self.stems[i:end]) == tuple(stems)
+
+    def _find(self, phrase: Sequence[str]) -> int:
+        stems = [_stem(word) for word in phrase]
+        return next((i for i in range(len(self.tokens)) if self._matches(stems, i)), -1)
+
+    def _use(self, start: int, end: int) -> None:
+        for i in range(start, end):
+            self.used[i] = True
+
+    # Operaciones
+
+    def _order_by(self, query: LocalQuery) -> None:
+        for i, token in enumerate(self.tokens):
+            if not token.startswith("orden"):
+                continue
+            by = next((j for j in range(i + 1, min(i + 4, len(self.tokens))) if self.tokens[j] == "por"), None)
+            found = self._column_at(by + 1) if by is not None else None
+            if found is None:
+                raise _NotFollowUp()
+            column, end = found
+            self._use(i, end)
+            direction = "ASC"
+            for phrase, value in _DIRECTIONS:
+                start = self._find(phrase)
+                if start >= 0:
+                    direction = value
+                    self._use(start, start + len(phrase))
+                    break
+            query.order_by.append((column, direction))
+            return
+
+    def _limit(self, query: LocalQuery) -> None:
+        for i, token in enumerate(self.tokens):
+            if self.used[i] or not (re.fullmatch(r"primer[oa]s?", token) or token == "top"):
+                continue
+            before = _number(self.tokens[i - 1]) if i and not self.used[i - 1] else None
+            after = _number(self.tokens[i + 1]) if i + 1 < len(self.tokens) and not self.used[i + 1] else None
+            if after is not None and token != "primero":
+                query.limit, span = after, (i, i + 2)
+            elif before is not None and self.tokens[i - 1] not in ("un", "una"):
+                query.limit, span = before, (i - 1, i + 1)
+            elif token in ("primero", "primera"):
+                query.limit, span = 1, (i, i + 1)
+            else:
+                raise _NotFollowUp()
+            if not isinstance(query.limit, int) or query.limit <= 0:
+                raise _NotFollowUp()
+            self._use(*span)
+            return
+
+    def _comparisons(self, query: LocalQuery) -> None:
+        i = 0
+        while i < len(self.tokens):
+            if self.used[i]:
+                i += 1
+                continue
+            if self.tokens[i] == "entre":
+                low = _number(self.tokens[i + 1]) if i + 1 < len(self.tokens) else None
+                high = _number(self.tokens[i + 3]) if i + 3 < len(self.tokens) else None
+                if low is None or high is None or self.tokens[i + 2] != "y":
+                    raise _NotFollowUp()
+                column = self._compared_column(i, i + 4)
+                query.where.append(f"{_quote(column)} BETWEEN {_literal(low)} AND {_literal(high)}")
+                self._use(i, i + 4)
+                i += 4
+                continue
+            for phrase, operator in _COMPARISONS:
+                end = i + len(phrase)
+                if end < len(self.tokens) and not self.used[end] and self._matches([_stem(w) for w in phrase], i):
+                    value = _number(self.tokens[end])
+                    # "de" solo compara si va entre una columna numérica y un número
+                    if value is None or (phrase == ("de",) and self._column_before(i) is None):
+                        continue
+                    column = self._compared_column(i, end + 1)
+                    query.where.append(f"{_quote(column)} {operator} {_literal(value)}")
+                    self._use(i, end + 1)
+                    i = end
+                    break
+            i += 1
+
+    def _column_before(self, i: int) -> Optional[Tuple[str, int]]:
+        """Columna numérica que termina justo antes del token i: (columna, inicio)"""
+        for start in range(max(0, i - 3), i):
+            found = self._column_at(start)
+            if found is not None and found[1] == i and self.kinds.get(found[0]) == "number":
+                return found[0], start
+        return None
+
+    def _compared_column(self, i: int, end: int) -> str:
+        """Columna de una comparación: la nombrada delante o detrás, o la única numérica"""
+        before = self._column_before(i)
+        if before is not None:
+            self._use(before[1], i)
+            return before[0]
+        found = self._column_at(end)
+        if found is not None and self.kinds.get(found[0]) == "number":
+            self._use(end, found[1])
+            return found[0]
+        # Sin columna nombrada: la única numérica que no es un identificador
+        numeric = [column for column, kind in self.kinds.items()
+                   if kind == "number" and not re.search(r"(^|_)id$", column.lower())]
+        if len(numeric) != 1:
+            raise _NotFollowUp()
+        return numeric[0]
+
+    def _aggregates(self, query: LocalQuery) -> None:
+        for i, token in enumerate(self.tokens):
+            if self.used[i]:
+                continue
+            if re.fullmatch(r"cuant[oa]s", token) or tuple(self.tokens[i:i + 2]) == ("numero", "de"):
+                query.aggregates.append(("COUNT", None, "total"))
+                self._use(i, i + (1 if token.startswith("cuant") else 2))
+            elif token in _AGGREGATES:
+                # "suma de total", "precio medio", "el máximo del precio"
+                j = i + 1
+                while j < len(self.tokens) and self.tokens[j] in ("de", "del"):
+                    j += 1
+                found = self._column_at(j)
+                if found is not None:
+                    column, end = found
+                    start = i
+                else:
+                    before = self._column_before(i)
+                    if before is None:
+                        continue
+                    (column, start), end = before, i + 1
+                func = _AGGREGATES[token]
+                if func in ("SUM", "AVG") and self.kinds.get(column) != "number":
+                    raise _NotFollowUp()
+                query.aggregates.append((func, column, f"{_AGGREGATE_ALIAS[func]}_{column}"))
+                self._use(start, end)
+        if not query.aggregates:
+            # "por estado" sin agregado no es una operación sobre el resultado
+            if any(token == "por" and not self.used[i] and self._column_at(i + 1)
+                   for i, token in enumerate(self.tokens)):
+                raise _NotFollowUp()
+            return
+        for i, token in enumerate(self.tokens):
+            if token != "por" or self.used[i]:
+                continue
+            j = i + 1 + (self.tokens[i + 1:i + 2] == ["cada"])
+            found = self._column_at(j)
+            if found is None:
+                continue
+            query.group_by.append(found[0])
+            self._use(i, found[1])
+        if query.limit is not None and not query.group_by:
+            raise _NotFollowUp()
+        if query.order_by and any(column not in query.group_by for column, _ in query.order_by):
+            raise _NotFollowUp()
+
+    def _values(self, query: LocalQuery) -> None:
+        """Filtros por valores de las columnas categóricas"""
+        phrases = []
+        for column, kind in self.kinds.items():
+            if kind != "text":
+                continue
+            distinct = set(self.result.column(column))
+            distinct.discard(None)
+            if len(distinct) > _MAX_VALUES:
+                continue
+            for value in distinct:
+                words = tuple(_stem(token) for token in _tokens(value))
+                if words:
+                    phrases.append((words, column, value))
+        phrases.sort(key=lambda phrase: -len(phrase[0]))
+        stems = self.stems
+        # columna -> {negado: [valores]}
+        filters: Dict[str, Dict[bool, List[str]]] = {}
+        matches = []
+        for words, column, value in phrases:
+            for i in range(len(stems) - len(words) + 1):
+                if tuple(stems[i:i + len(words)]) == words and not any(self.used[i:i + len(words)]):
+                    matches.append((i, i + len(words), column, value))
+                    self._use(i, i + len(words))
+        previous = None
+        for start, end, column, value in sorted(matches):
+            j = start - 1
+            while j >= 0 and self.tokens[j] in _ARTICLES and not self.used[j]:
+                j -= 1
+            negated = j >= 0 and self.tokens[j] in _NEGATIONS and not self.used[j]
+            if negated:
+                self._use(j, start)
+            elif previous is not None and all(self.tokens[k] in _ARTICLES | _CONNECTORS
+                                              for k in range(previous[0], start)):
+                # "excepto los cancelados y los pendientes"
+                negated = previous[1]
+                self._use(previous[0], start)
+            filters.setdefault(column, {}).setdefault(negated, []).append(value)
+            previous = (end, negated)
+        for column, by_sign in filters.items():
+            for negated, values in by_sign.items():
+                values = sorted(set(values))
+                if len(values) == 1:
+                    query.where.append(f"{_quote(column)} {'<>' if negated else '='} {_literal(values[0])}")
+                else:
+                    query.where.append(f"{_quote(column)} {'NOT IN' if negated else 'IN'} "
+                                       f"({', '.join(_literal(value) for value in values)})")
+            # "con estado completado": la columna filtrada ya está explicada
+            for i in range(len(self.tokens)):
+                found = self._column_at(i)
+                if found is not None and found[0] == column:
+                    self._use(i, found[1])
+
+    def _projection(self, query: LocalQuery) -> None:
+        """'solo el nombre y el precio': columnas nombradas que no usa otra operación"""
+        named = []
+        i = 0
+        while i < len(self.tokens):
+            found = self._column_at(i) if not self.used[i] else None
+            if found is None:
+                i += 1
+                continue
+            named.append(found[0])
+            self._use(i, found[1])
+            i = found[1]
+        if not named:
+            return
+        if query.aggregates or not set(self.tokens) & _PROJECTION_CUES:
+            raise _NotFollowUp()
+        query.columns = list(dict.fromkeys(named))
+
+
+class _NotFollowUp(Exception):
+    """La pregunta no es un seguimiento que pueda resolverse en local"""
+
+
+class Conversation:
+    """Turnos recientes de una sesión y su último resultado completo"""
+
+    def __init__(self, max_turns: int):
+        # (pregunta, SQL, columnas, filas)
+        self.turns: deque = deque(maxlen=max_turns)
+        self.sql: Optional[str] = None
+        self.result: Optional[ColumnarResult] = None
+        self.touched = time.monotonic()
+
+    @property
+    def rows(self) -> int:
+        return len(self.result) if self.result is not None else 0
+
+    @property
+    def last_question(self) -> str:
+        return self.turns[-1][0] if self.turns else ""
+
+    def history(self, token_budget: int) -> str:
+        """
+        Historial para el prompt dentro de 'token_budget' tokens
+
+        Del turno más reciente hacia atrás: con su SQL mientras quepa y,
+        de los anteriores, solo la pregunta.
+        """
+        if not self.turns or token_budget <= 0:
+            return ""
+        header = "Conversación anterior (la pregunta puede referirse a ella):"
+        used = estimate_tokens(header)
+        lines: List[str] = []
+        with_sql = True
+        for question, sql, _, rows in reversed(self.turns):
+            line = f"- {question}"
+            if with_sql and sql:
+                detailed = f"{line}\n  SQL: {sql}" + (f" (filas: {rows})" if rows is not None else "")
+                if used + estimate_tokens(detailed) <= token_budget:
+                    line = detailed
+                else:
+                    with_sql = False
+            cost = estimate_tokens(line)
+            if used + cost > token_budget:
+                break
+            lines.append(line)
+            used += cost
+        if not lines:
+            return ""
+        return "\n".join([header, *reversed(lines)])
+
+
+class ConversationStore:
+    """
+    Sesiones en memoria con LRU, caducidad y un máximo de filas guardadas
+
+    Las sesiones son de este proceso: no se comparten entre workers.
+
+    Args:
+        config: CONVERSATION_CONFIG por defecto
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = {**CONVERSATION_CONFIG, **(config or {})}
+        self._sessions: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+        self.local = 0
+        self.evicted = 0
+
+    def get(self, session_id: str) -> Conversation:
+        """Conversación de la sesión (nueva si no existe o ha caducado)"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            conversation = self._sessions.get(session_id)
+            if conversation is None:
+                conversation = self._sessions[session_id] = Conversation(self.config['MAX_TURNS'])
+                while len(self._sessions) > self.config['MAX_SESSIONS']:
+                    _, dropped = self._sessions.popitem(last=False)
+                    self._rows -= dropped.rows
+                    self.evicted += 1
+            else:
+                self._sessions.move_to_end(session_id)
+            conversation.touched = now
+            return conversation
+
+    def _expire(self, now: float) -> None:
+        while self._sessions:
+            session_id, conversation = next(iter(self._sessions.items()))
+            if now - conversation.touched <= self.config['SESSION_TTL']:
+                return
+            del self._sessions[session_id]
+            self._rows -= conversation.rows
+
+    def record(self, conversation: Conversation, question: str, sql: Optional[str],
+               columns: Optional[List[str]], data: Any, complete: bool) -> None:
+        """
+        Añade un turno; el resultado de una lectura se guarda solo si está
+        completo (sin página siguiente) y cabe en MAX_RESULT_ROWS
+        """
+        rows = len(data) if data is not None and complete else None
+        result = None
+        if rows is not None and sql and columns and is_read_only(sql) and rows <= self.config['MAX_RESULT_ROWS']:
+            result = data if isinstance(data, ColumnarResult) else \
+                ColumnarResult.from_rows(columns, row_values(columns, data))
+        with self._lock:
+            conversation.turns.append((question, sql, columns, rows))
+            self._rows -= conversation.rows
+            conversation.sql, conversation.result = (sql, result) if result is not None else (None, None)
+            self._rows += conversation.rows
+            # Se sueltan los resultados de las sesiones menos recientes
+            for other in self._sessions.values():
+                if self._rows <= self.config['MAX_TOTAL_ROWS']:
+                    break
+                if other.result is not None:
+                    self._rows -= other.rows
+                    other.sql, other.result = None, None
+
+    def invalidate_tables(self, tables: Optional[Iterable[str]]) -> int:
+        """
+        Suelta los resultados guardados que leen alguna de las tablas
+
+        Args:
+            tables: Tablas escritas; None para soltar todos los resultados
+
+        Returns:
+            Número de resultados soltados
+        """
+        tables = None if tables is None else {table.lower() for table in tables}
+        dropped = 0
+        with self._lock:
+            for conversation in self._sessions.values():
+                if conversation.result is None:
+                    continue
+                if tables is None or sql_tables(conversation.sql) & tables:
+                    self._rows -= conversation.rows
+                    conversation.sql, conversation.result = None, None
+                    dropped += 1
+        return dropped
+
+    def follow_up(self, conversation: Conversation, question: str) -> Optional[Tuple[str, ColumnarResult]]:
+        """
+        Respuesta local a un seguimiento sobre el último resultado
+
+        Returns:
+            (SQL equivalente, resultado) o None si hay que preguntar al LLM
+        """
+        if not self.config['LOCAL_FOLLOW_UPS']:
+            return None
+        with self._lock:
+            sql, result = conversation.sql, conversation.result
+        if result is None:
+            return None
+        query = FollowUpPlanner(question, result, sql_tables(sql)).plan()
+        if query is None:
+            tracer.metrics.inc("chatbot_follow_ups_total", source="llm")
+            return None
+        with tracer.span("follow_up", rows=len(result)):
+            output = query.run(result)
+        with self._lock:
+            self.local += 1
+        tracer.metrics.inc("chatbot_follow_ups_total", source="local")
+        return query.to_sql(sql), output
+
+    def after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "stored_rows": self._rows,
+                "local_follow_ups": self.local,
+                "evicted_sessions": self.evicted
+            }
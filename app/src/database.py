@@ -1,100 +1,622 @@
-from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.inspection import inspect
-from src.models import engine
-from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from langchain_community.utilities.sql_database import SQLDatabase
+from src.guard import QueryGuard, GuardedSQLDatabase
+from src.index_advisor import get_workload_recorder, SKIP_OPTION
+from src.invalidation import ChangeListener, install_triggers, supports_notify
+from src.models import engine, read_only, SessionLocal, get_async_engine, peek_async_engine, dispose_async_engine, reset_engines_after_fork
+from src.pool import get_pool_metrics
+from src.replicas import ReplicaRouter, DatabaseTarget
+from src.schema import SchemaSnapshotStore, introspect_schema, catalog_fingerprint
+from src.pagination import paginate_sql, LIMIT_PARAM, OFFSET_PARAM
+from src.sql_validator import is_read_only
+from src.results import ColumnarResult, ResultPage
+from src.tracing import tracer, truncate
+from src.config import SCHEMA_CONFIG, RESULT_CONFIG, GUARD_CONFIG, INVALIDATION_CONFIG, REPLICA_CONFIG, get_db_uri
+from typing import List, Dict, Any, Callable, Iterable, Optional, Set, Tuple, Iterator
+from contextlib import contextmanager, nullcontext
+import threading
 import logging
+import json
+import time
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
 class DatabaseManager:
     def __init__(self):
-        self.Session = sessionmaker(bind=engine)
-        self.session = None
+        self.Session = SessionLocal
+        self._sql_database = None
+        self._schema = None
+        self._schema_fingerprint = None
+        self._schema_lock = threading.RLock()
+        self._snapshots = None
+        if SCHEMA_CONFIG['SNAPSHOT_ENABLED']:
+            self._snapshots = SchemaSnapshotStore(SCHEMA_CONFIG['SNAPSHOT_DIR'], get_db_uri(),
+                                                  SCHEMA_CONFIG['SNAPSHOT_MAX_FILES'],
+                                                  SCHEMA_CONFIG['SNAPSHOT_MAX_AGE'])
+        self._connected = False
+        # Comprobaciones previas a la ejecución (validación, EXPLAIN, LIMIT)
+        self.guard = QueryGuard(self) if GUARD_CONFIG['ENABLED'] else None
+        # Lecturas a réplicas (src.replicas); sin réplicas todo va a la primaria
+        self.router: Optional[ReplicaRouter] = None
+        if REPLICA_CONFIG['URLS']:
+            self.router = ReplicaRouter(engine, REPLICA_CONFIG['URLS'])
+            self.router.start()
+        # Registro de la SQL ejecutada para el asesor de índices (src.index_advisor)
+        self.workload = get_workload_recorder()
+        if self.workload is not None:
+            self.workload.attach(engine)
+            for replica in (self.router.replicas if self.router is not None else []):
+                self.workload.attach(replica.engine)
+        # Escucha de cambios por LISTEN/NOTIFY (watch_changes)
+        self.change_listener: Optional[ChangeListener] = None
+        self.watches_ddl = False
+        self._watched_tables: Set[str] = set()
         
     def connect(self) -> bool:
-        """Establece conexión con la base de datos"""
+        """Comprueba que el pool compartido puede abrir conexiones"""
+        if self._connected:
+            return True
         try:
-            if not self.session:
-                self.session = self.Session()
-                logger.info("Conexión a PostgreSQL establecida")
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            self._connected = True
+            logger.info("Conexión a PostgreSQL establecida")
             return True
         except SQLAlchemyError as e:
             logger.error(f"Error al conectar a PostgreSQL: {e}")
             return False
+
+    @contextmanager
+    def session_scope(self) -> Iterator[Session]:
+        """
+        Abre una sesión propia para una petición y la cierra al terminar
+
+        La conexión vuelve al pool compartido al salir del bloque, con
+        commit si todo fue bien o rollback si hubo una excepción.
+        """
+        session = self.Session()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get_sql_database(self) -> SQLDatabase:
+        """
+        SQLDatabase de LangChain construido sobre el mismo motor (sin pool propio)
+
+        Las consultas del agente pasan por el mismo QueryGuard que las demás.
+        """
+        if self._sql_database is None:
+            # Reflexión perezosa: cada tabla se refleja solo cuando el agente la usa
+            self._sql_database = GuardedSQLDatabase(engine, guard=self.guard, router=self.router,
+                                                    lazy_table_reflection=True)
+        return self._sql_database
+
+    def supports_explain(self) -> bool:
+        """EXPLAIN (FORMAT JSON) con costes estimados solo existe en PostgreSQL"""
+        return engine.dialect.name == "postgresql"
+
+    def explain(self, query: str, params: Optional[Dict] = None) -> Optional[Dict[str, float]]:
+        """
+        Coste y filas estimados por el planificador (sin ejecutar la consulta)
+
+        Returns:
+            Dict con 'cost' (Total Cost) y 'rows' (Plan Rows), o None si el
+            motor no ofrece estimaciones
+
+        Raises:
+            SQLAlchemyError: si la consulta no es válida para el servidor
+        """
+        if not self.supports_explain():
+            return None
+        with tracer.span("sql.explain"), engine.connect() as conn:
+            plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), params or {}).scalar()
+        return _plan_estimate(plan)
+
+    async def aexplain(self, query: str, params: Optional[Dict] = None) -> Optional[Dict[str, float]]:
+        """Versión asíncrona de explain"""
+        if not self.supports_explain():
+            return None
+        with tracer.span("sql.explain"):
+            async with get_async_engine().connect() as conn:
+                result = await conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), params or {})
+                plan = result.scalar()
+        return _plan_estimate(plan)
     
-    def execute_query(self, query: str, params: Optional[Dict] = None) -> Optional[Tuple[List[str], List[Dict]]]:
+    def execute_query(self, query: str, params: Optional[Dict] = None, columnar: bool = False,
+                      statement_timeout: Optional[int] = None) -> Optional[Tuple[List[str], List[Dict]]]:
         """
         Ejecuta una consulta SQL directa
+
+        Las lecturas van a una réplica si las hay (src.replicas) y se
+        repiten en la primaria si la réplica no está disponible. Con el
+        guard activo, o si la consulta es de lectura, se ejecuta en una
+        transacción READ ONLY.
         
         Args:
             query: Consulta SQL a ejecutar
             params: Parámetros para la consulta
+            columnar: Devolver un ColumnarResult (una lista por columna) en
+                lugar de un dict por fila
+            statement_timeout: ms (0 = sin límite) que sustituyen al
+                statement_timeout de la conexión solo para esta consulta
             
         Returns:
             Tuple con (columnas, resultados) o None si hay error
         """
-        if not self.connect():
+        with tracer.span("sql", query=truncate(query)) as span:
+            target = None
+            try:
+                target = self._read_target(query)
+                if target is not None:
+                    with target.track(span), read_only(target.engine).connect() as conn:
+                        if statement_timeout is not None:
+                            self._set_statement_timeout(conn.exec_driver_sql, statement_timeout)
+                        return self._collect(conn.execute(text(query), params or {}), columnar, span)
+            except SQLAlchemyError as e:
+                if target is None or not self.router.failover(target, e):
+                    logger.error(f"Error al ejecutar consulta: {e}")
+                    span.set(error=truncate(e))
+                    return None, None
+            try:
+                if self._read_only(query):
+                    with self._track(None, span), read_only(engine).connect() as conn:
+                        if statement_timeout is not None:
+                            self._set_statement_timeout(conn.exec_driver_sql, statement_timeout)
+                        return self._collect(conn.execute(text(query), params or {}), columnar, span)
+                with self._track(None, span), self.session_scope() as session:
+                    if statement_timeout is not None:
+                        self._set_statement_timeout(lambda sql: session.execute(text(sql)), statement_timeout)
+                    result = session.execute(text(query), params or {})
+                    if result.returns_rows:
+                        return self._collect(result, columnar, span)
+                    return None, None
+            except SQLAlchemyError as e:
+                logger.error(f"Error al ejecutar consulta: {e}")
+                span.set(error=truncate(e))
+                return None, None
+    
+    def _read_only(self, query: str) -> bool:
+        """Ejecutar en transacción READ ONLY: todo lo que pasa por el guard y las lecturas"""
+        return self.guard is not None or is_read_only(query)
+
+    def _read_target(self, query: str) -> Optional[DatabaseTarget]:
+        """
+        Réplica que debe ejecutar la consulta, o None para la primaria
+
+        Raises:
+            NoReplicaAvailable: lectura sin réplicas sanas ni PRIMARY_FALLBACK
+        """
+        if self.router is None:
             return None
-            
+        target = self.router.route(query)
+        return None if target is self.router.primary else target
+
+    def _track(self, target: Optional[DatabaseTarget], span: Any = None) -> Any:
+        """Cuenta la consulta en la réplica o en la primaria (sin réplicas no se mide)"""
+        if target is not None:
+            return target.track(span)
+        return self.router.primary.track(span) if self.router is not None else nullcontext()
+
+    def _collect(self, result: Any, columnar: bool, span: Any = None) -> Tuple[List[str], Any]:
+        """Lee todas las filas de un resultado como dicts o por columnas"""
+        columns = list(result.keys())
+        if columnar:
+            rows = ColumnarResult.from_batches(columns, result.partitions(RESULT_CONFIG['FETCH_BATCH']))
+        else:
+            rows = [dict(zip(columns, row)) for row in result.fetchall()]
+        _count_rows(span, len(rows))
+        return columns, rows
+
+    def fetch_page(self, query: str, params: Optional[Dict] = None, offset: int = 0,
+                   limit: Optional[int] = None, columnar: bool = False,
+                   statement_timeout: Optional[int] = None) -> Tuple[Optional[List[str]], Optional[ResultPage]]:
+        """
+        Ejecuta una consulta de lectura devolviendo como mucho 'limit' filas
+
+        Pide al servidor limit + 1 filas a partir de 'offset' para saber si
+        hay más sin leer el resultado completo.
+
+        Returns:
+            Tuple con (columnas, ResultPage) o (None, None) si hay error; con
+            columnar=True la página es un ColumnarResult
+        """
+        limit = limit or RESULT_CONFIG['MAX_ROWS']
+        columns, rows = self.execute_query(paginate_sql(query), self._page_params(params, offset, limit), columnar,
+                                           statement_timeout)
+        return columns, self._to_page(rows, offset, limit)
+
+    async def afetch_page(self, query: str, params: Optional[Dict] = None, offset: int = 0,
+                          limit: Optional[int] = None, columnar: bool = False,
+                          statement_timeout: Optional[int] = None) -> Tuple[Optional[List[str]], Optional[ResultPage]]:
+        """Versión asíncrona de fetch_page"""
+        limit = limit or RESULT_CONFIG['MAX_ROWS']
+        columns, rows = await self.aexecute_query(paginate_sql(query), self._page_params(params, offset, limit), columnar,
+                                                  statement_timeout)
+        return columns, self._to_page(rows, offset, limit)
+
+    def _page_params(self, params: Optional[Dict], offset: int, limit: int) -> Dict[str, Any]:
+        return {**(params or {}), LIMIT_PARAM: limit + 1, OFFSET_PARAM: offset}
+
+    def _to_page(self, rows: Any, offset: int, limit: int) -> Any:
+        if rows is None:
+            return None
+        next_offset = offset + limit if len(rows) > limit else None
+        if isinstance(rows, ColumnarResult):
+            page = rows[:limit] if next_offset is not None else rows
+            page.offset, page.next_offset = offset, next_offset
+            return page
+        return ResultPage(rows[:limit], offset=offset, next_offset=next_offset)
+
+    @contextmanager
+    def stream_query(self, query: str, params: Optional[Dict] = None,
+                     batch_size: Optional[int] = None,
+                     statement_timeout: Optional[int] = None) -> Iterator[Tuple[List[str], Iterator[List[Tuple]]]]:
+        """
+        Lee una consulta con cursor de servidor, por lotes
+
+        Las filas no se cargan todas en memoria: el driver trae 'batch_size'
+        filas cada vez (stream_results/yield_per). La conexión se devuelve al
+        pool al salir del bloque, aunque no se haya leído todo.
+        statement_timeout (ms, 0 = sin límite) sustituye al de la conexión
+        solo para esta consulta.
+
+        Yields:
+            Tuple con (columnas, iterador de lotes de filas). Cada fila es una
+            tupla en el orden de las columnas.
+        """
+        batch_size = batch_size or RESULT_CONFIG['FETCH_BATCH']
+        # Span manual: el bloque del llamador puede ser un generador que se
+        # reanuda en otros hilos (streaming, exportación)
+        span = tracer.start_span("sql.stream", query=truncate(query))
+        rows = 0
+
+        def batches(result: Any) -> Iterator[List[Tuple]]:
+            nonlocal rows
+            for batch in result.partitions(batch_size):
+                rows += len(batch)
+                yield list(batch)
+
+        error = None
+        try:
+            # Sin repetición en la primaria: el llamador puede haber leído ya filas
+            target = self._read_target(query)
+            with self._track(target, span), read_only(target.engine if target is not None else engine).connect() as conn:
+                if statement_timeout is not None:
+                    self._set_statement_timeout(conn.exec_driver_sql, statement_timeout)
+                result = conn.execution_options(stream_results=True, yield_per=batch_size) \
+                    .execute(text(query), params or {})
+                try:
+                    yield list(result.keys()), batches(result)
+                finally:
+                    result.close()
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _count_rows(span, rows)
+            span.finish(error)
+
+    def supports_copy(self) -> bool:
+        """COPY ... TO STDOUT solo está disponible con PostgreSQL y psycopg2"""
+        return engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+
+    def _set_statement_timeout(self, execute: Any, timeout_ms: int) -> None:
+        """SET LOCAL statement_timeout: vale hasta el final de la transacción en curso"""
+        if engine.dialect.name == "postgresql":
+            execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
+    async def _aset_statement_timeout(self, conn: Any, timeout_ms: Optional[int]) -> None:
+        """Versión asíncrona de _set_statement_timeout sobre una AsyncConnection"""
+        if timeout_ms is not None and conn.dialect.name == "postgresql":
+            await conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
+    def copy_to(self, query: str, sink: Any, options: str = "FORMAT csv, HEADER",
+                statement_timeout: Optional[int] = None) -> None:
+        """
+        Vuelca el resultado de una consulta con COPY (consulta) TO STDOUT
+
+        El servidor genera el fichero y psycopg2 lo escribe en 'sink' (un
+        objeto con write()) a medida que llega, sin pasar por filas Python.
+        """
+        with tracer.span("sql.copy", query=truncate(query)) as span:
+            target = self._read_target(query)
+            with self._track(target, span):
+                self._copy(target.engine if target is not None else engine, query, sink, options, statement_timeout)
+
+    def _copy(self, db_engine: Any, query: str, sink: Any, options: str, statement_timeout: Optional[int]) -> None:
+        conn = db_engine.raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                # Conexión cruda: sin las opciones de read_only()
+                cursor.execute("SET TRANSACTION READ ONLY")
+                if statement_timeout is not None:
+                    self._set_statement_timeout(cursor.execute, statement_timeout)
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH ({options})", sink)
+            conn.rollback()
+        finally:
+            conn.close()
+
+    async def aexecute_query(self, query: str, params: Optional[Dict] = None, columnar: bool = False,
+                             statement_timeout: Optional[int] = None) -> Optional[Tuple[List[str], List[Dict]]]:
+        """
+        Versión asíncrona de execute_query sobre el motor asyncpg
+
+        Cada llamada toma su propia conexión del pool asíncrono, por lo que
+        pueden convivir muchas consultas en curso en el mismo event loop.
+        Las lecturas van a una réplica igual que en execute_query, y
+        statement_timeout se aplica igual.
+        """
+        with tracer.span("sql", query=truncate(query)) as span:
+            target = None
+            try:
+                target = self._read_target(query)
+                if target is not None:
+                    replica_engine = read_only(self._attached(target.async_engine()))
+                    with target.track(span):
+                        async with replica_engine.connect() as conn:
+                            await self._aset_statement_timeout(conn, statement_timeout)
+                            return self._collect(await conn.execute(text(query), params or {}), columnar, span)
+            except SQLAlchemyError as e:
+                if target is None or not self.router.failover(target, e):
+                    logger.error(f"Error al ejecutar consulta asíncrona: {e}")
+                    span.set(error=truncate(e))
+                    return None, None
+            async_engine = self._attached(get_async_engine())
+            if self._read_only(query):
+                async_engine = read_only(async_engine)
+            try:
+                with self._track(None, span):
+                    async with async_engine.connect() as conn:
+                        await self._aset_statement_timeout(conn, statement_timeout)
+                        result = await conn.execute(text(query), params or {})
+                        if result.returns_rows:
+                            return self._collect(result, columnar, span)
+                        await conn.commit()
+                        return None, None
+            except SQLAlchemyError as e:
+                logger.error(f"Error al ejecutar consulta asíncrona: {e}")
+                span.set(error=truncate(e))
+                return None, None
+
+    def _attached(self, async_engine: Any) -> Any:
+        """Graba también la SQL del motor asíncrono para el asesor de índices"""
+        if self.workload is not None:
+            self.workload.attach(async_engine.sync_engine)
+        return async_engine
+
+    def get_database_schema(self, refresh: bool = False) -> Dict[str, Any]:
+        """
+        Obtiene el esquema completo de la base de datos
+
+        El resultado se memoriza. Si existe una instantánea en disco se usa
+        de inmediato y su vigencia se comprueba en segundo plano; con
+        refresh=True se compara la huella del catálogo en el momento y solo
+        se vuelve a introspeccionar si ha cambiado.
+        """
+        if self._schema is not None and not refresh:
+            return self._schema
+
+        with self._schema_lock:
+            if self._schema is not None and not refresh:
+                return self._schema
+
+            if not refresh and self._snapshots is not None:
+                snapshot = self._snapshots.load()
+                if snapshot is not None:
+                    self._schema = snapshot["schema"]
+                    self._schema_fingerprint = snapshot["fingerprint"]
+                    threading.Thread(
+                        target=self._refresh_schema_in_background,
+                        name="schema-refresh",
+                        daemon=True
+                    ).start()
+                    return self._schema
+
+            if not self.connect():
+                return self._schema or {}
+            return self._refresh_schema()
+
+    def _refresh_schema(self) -> Dict[str, Any]:
+        """Compara la huella del catálogo y reintrospecciona solo si ha cambiado"""
         try:
-            result = self.session.execute(query, params or {})
-            if result.returns_rows:
-                columns = list(result.keys())
-                rows = [dict(zip(columns, row)) for row in result.fetchall()]
-                return columns, rows
-            self.session.commit()
-            return None, None
+            fingerprint = catalog_fingerprint(engine)
+            if fingerprint is None or fingerprint != self._schema_fingerprint or self._schema is None:
+                start = time.perf_counter()
+                schema = introspect_schema(engine)
+                logger.info(
+                    f"Esquema introspeccionado: {len(schema)} tablas "
+                    f"en {time.perf_counter() - start:.2f}s"
+                )
+                self._schema, self._schema_fingerprint = schema, fingerprint
+                if self._snapshots is not None:
+                    self._snapshots.save(fingerprint, schema)
         except SQLAlchemyError as e:
-            logger.error(f"Error al ejecutar consulta: {e}")
-            self.session.rollback()
-            return None, None
-    
-    def get_database_schema(self) -> Dict[str, Any]:
-        """Obtiene el esquema completo de la base de datos"""
-        if not self.connect():
+            logger.error(f"Error al obtener el esquema: {e}")
+            return self._schema or {}
+        return self._schema
+
+    def _refresh_schema_in_background(self) -> None:
+        """Verifica que la instantánea cargada de disco sigue vigente"""
+        with self._schema_lock:
+            previous = self._schema_fingerprint
+            self._refresh_schema()
+            if self._schema_fingerprint != previous:
+                logger.info("La instantánea de esquema estaba desactualizada y se ha regenerado")
+
+    def table_watermarks(self, tables: List[str]) -> Dict[str, str]:
+        """
+        Marca de agua de cada tabla: cambia cuando se escriben filas en ella
+
+        En PostgreSQL son los contadores de pg_stat_user_tables (filas
+        insertadas, actualizadas y borradas; sin leer la tabla, con unos
+        segundos de retraso). En otros motores, COUNT(*) y el mayor rowid o
+        el número de filas: no detectan las actualizaciones en el sitio.
+
+        Raises:
+            SQLAlchemyError: si la consulta falla
+        """
+        if not tables:
             return {}
-            
-        inspector = inspect(engine)
-        schema = {}
-        
-        for table_name in inspector.get_table_names():
-            # Obtener columnas
-            columns = []
-            for column in inspector.get_columns(table_name):
-                col_info = {
-                    'name': column['name'],
-                    'type': str(column['type']),
-                    'nullable': column['nullable'],
-                    'primary_key': column.get('primary_key', False)
-                }
-                columns.append(col_info)
-            
-            # Obtener relaciones
-            foreign_keys = []
-            for fk in inspector.get_foreign_keys(table_name):
-                fk_info = {
-                    'constrained_columns': fk['constrained_columns'],
-                    'referred_table': fk['referred_table']
-                }
-                foreign_keys.append(fk_info)
-            
-            schema[table_name] = {
-                'columns': columns,
-                'foreign_keys': foreign_keys
+        with tracer.span("sql.watermark", tables=len(tables)), engine.connect() as conn:
+            conn = conn.execution_options(**{SKIP_OPTION: False})
+            if engine.dialect.name == "postgresql":
+                rows = conn.execute(text(
+                    "SELECT relname, n_tup_ins || ':' || n_tup_upd || ':' || n_tup_del "
+                    "FROM pg_stat_user_tables "
+                    "WHERE schemaname = current_schema() AND relname = ANY(:tables)"
+                ), {"tables": list(tables)}).all()
+                return {name: value for name, value in rows}
+            rowid = "MAX(rowid)" if engine.dialect.name == "sqlite" else "0"
+            preparer = engine.dialect.identifier_preparer
+            return {
+                table: ":".join(str(value) for value in conn.execute(text(
+                    f"SELECT COUNT(*), {rowid} FROM {preparer.quote(table)}")).one())
+                for table in tables
             }
-        
-        return schema
-    
+
+    def watch_changes(self, on_change: Callable[[Optional[Set[str]], bool], None]) -> bool:
+        """
+        Instala los triggers de notificación y empieza a escuchar cambios
+
+        Ver src.invalidation. Las tablas son INVALIDATION_TABLES o todas las
+        del esquema; on_change se llama desde el hilo de escucha.
+
+        Returns:
+            False si el motor no admite LISTEN/NOTIFY o no se pudieron crear
+            los triggers
+        """
+        if not supports_notify(engine):
+            logger.info(f"Invalidación por eventos no disponible en {engine.dialect.name}: se usan los TTL")
+            return False
+        channel = INVALIDATION_CONFIG['CHANNEL']
+        tables = INVALIDATION_CONFIG['TABLES'] or list(self.get_database_schema())
+        try:
+            if INVALIDATION_CONFIG['INSTALL']:
+                installed = install_triggers(engine, tables, channel, ddl=INVALIDATION_CONFIG['DDL'])
+                self.watches_ddl = installed["ddl"]
+            else:
+                # Instalados por un administrador: basta con saber si hay event trigger
+                with engine.connect() as conn:
+                    self.watches_ddl = conn.execute(
+                        text("SELECT COUNT(*) FROM pg_event_trigger WHERE evtname = :name AND evtenabled <> 'D'"),
+                        {"name": f"{channel}_ddl"}
+                    ).scalar() > 0
+        except SQLAlchemyError as e:
+            logger.error(f"No se pudieron instalar los triggers de invalidación: {e}")
+            return False
+        self._watched_tables = set(tables)
+        if self.router is not None:
+            # Antes que la caché: lo que se lea tras la invalidación no sale de una réplica atrasada
+            on_change = self._pin_written_tables(on_change)
+        self.change_listener = ChangeListener(engine, channel, on_change,
+                                              reconnect_seconds=INVALIDATION_CONFIG['RECONNECT_SECONDS'])
+        self.change_listener.start()
+        return True
+
+    def _pin_written_tables(self, on_change: Callable[[Optional[Set[str]], bool], None]) -> Callable:
+        def notify(tables: Optional[Set[str]], ddl: bool) -> None:
+            if tables:
+                self.router.tables_changed(tables)
+            on_change(tables, ddl)
+        return notify
+
+    def watch_tables(self, tables: Iterable[str]) -> None:
+        """Añade el trigger de notificación a las tablas nuevas (p. ej. tras un CREATE TABLE)"""
+        if self.change_listener is None or INVALIDATION_CONFIG['TABLES'] or not INVALIDATION_CONFIG['INSTALL']:
+            return
+        new_tables = set(tables) - self._watched_tables
+        if not new_tables:
+            return
+        try:
+            install_triggers(engine, new_tables, INVALIDATION_CONFIG['CHANNEL'], ddl=False)
+            self._watched_tables |= new_tables
+        except SQLAlchemyError as e:
+            logger.error(f"No se pudo instalar el trigger de invalidación en {sorted(new_tables)}: {e}")
+
+    def invalidation_metrics(self) -> Optional[Dict[str, Any]]:
+        """Notificaciones de cambios recibidas y retraso hasta la invalidación"""
+        if self.change_listener is None:
+            return None
+        return {**self.change_listener.stats(), "tables": len(self._watched_tables), "ddl": self.watches_ddl}
+
+    def guard_metrics(self) -> Optional[Dict[str, Any]]:
+        """Consultas comprobadas, rechazadas y limitadas por QueryGuard"""
+        return self.guard.stats() if self.guard is not None else None
+
+    def workload_metrics(self) -> Optional[Dict[str, Any]]:
+        """Consultas grabadas para el asesor de índices"""
+        return self.workload.stats() if self.workload is not None else None
+
+    def replica_metrics(self) -> Optional[Dict[str, Any]]:
+        """Estado, retraso, carga y latencia de la primaria y de cada réplica"""
+        return self.router.stats() if self.router is not None else None
+
+    def pool_metrics(self) -> Dict[str, Any]:
+        """Métricas de los pools de conexiones (síncrono y, si existe, asíncrono)"""
+        metrics = {"sync": get_pool_metrics(engine.pool)}
+        async_engine = peek_async_engine()
+        if async_engine is not None:
+            metrics["async"] = get_pool_metrics(async_engine.sync_engine.pool)
+        return metrics
+
     def close(self) -> None:
-        """Cierra la conexión a la base de datos"""
-        if self.session:
-            try:
-                self.session.close()
-                logger.info("Conexión a PostgreSQL cerrada")
-            except SQLAlchemyError as e:
-                logger.error(f"Error al cerrar sesión: {e}")
-            finally:
-                self.session = None
\ No newline at end of file
+        """Cierra las conexiones del pool compartido"""
+        if self.change_listener is not None:
+            self.change_listener.stop()
+        if self.router is not None:
+            self.router.close()
+        try:
+            engine.dispose()
+            self._connected = False
+            logger.info("Conexión a PostgreSQL cerrada")
+        except SQLAlchemyError as e:
+            logger.error(f"Error al cerrar el pool de conexiones: {e}")
+
+    def after_fork(self) -> None:
+        """
+        Prepara el gestor en un worker creado con fork() (preload de gunicorn)
+
+        El esquema ya cargado se conserva; las conexiones y los locks
+        heredados del padre se sustituyen por otros propios del worker.
+        """
+        reset_engines_after_fork()
+        self._schema_lock = threading.RLock()
+        if self.workload is not None:
+            self.workload.after_fork()
+        if self.change_listener is not None:
+            self.change_listener.after_fork()
+        if self.router is not None:
+            self.router.after_fork()
+
+    async def aclose(self) -> None:
+        """Cierra el pool síncrono y libera el asíncrono"""
+        self.close()
+        try:
+            await dispose_async_engine()
+            if self.router is not None:
+                await self.router.aclose()
+        except SQLAlchemyError as e:
+            logger.error(f"Error al liberar el pool asíncrono: {e}")
+
+def _count_rows(span: Any, rows: int) -> None:
+    tracer.metrics.inc("chatbot_sql_rows_total", rows)
+    if span is not None:
+        span.set(rows=rows)
+
+
+def _plan_estimate(plan: Any) -> Dict[str, float]:
+    """Extrae coste y filas del nodo raíz de EXPLAIN (FORMAT JSON)"""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+    return {"cost": float(root["Total Cost"]), "rows": float(root["Plan Rows"])}
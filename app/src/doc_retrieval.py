@@ -0,0 +1,428 @@
+"""
+Contexto de negocio recuperado de la documentación (app/documentacion)
+
+El esquema no explica términos como "pedido en proceso" o "ticket medio";
+los documentos de app/documentacion sí. Este módulo los trocea y construye
+un índice local, sin red ni modelos externos:
+  - índice invertido BM25 (términos de tokenize_terms, como SchemaIndex)
+  - matriz de vectores float32 (hashing de términos y n-gramas de
+    caracteres, para variantes como "facturado"/"facturación") que se abre
+    con np.memmap: los workers comparten las páginas del fichero
+
+El índice se construye una vez (al arrancar si falta o han cambiado los
+documentos, o a mano) y en cada pregunta se añaden al prompt los k
+fragmentos más relevantes que superan MIN_SCORE y caben en TOKEN_BUDGET.
+Los términos que ya son nombres de tablas o columnas no cuentan: para
+eso está el esquema.
+
+Uso (desde app/):
+    python -m src.doc_retrieval --build             # (re)construye el índice
+    python -m src.doc_retrieval "ticket medio por cliente"
+"""
+from src.config import DOCS_CONFIG
+from src.langchain_setup import estimate_tokens
+from src.schema_retrieval import tokenize_terms
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # numpy es opcional: sin él solo se usa BM25
+    np = None
+
+try:
+    import pypdf
+except ImportError:  # pypdf es opcional: sin él no se indexan los PDF
+    pypdf = None
+
+INDEX_FILE = "index.json"
+MATRIX_FILE = "embeddings.f32"
+# Cambia si cambia el formato del índice o la forma de calcular los vectores
+INDEX_VERSION = 1
+DOC_EXTENSIONS = (".md", ".txt", ".pdf")
+# Peso de BM25 frente a la similitud coseno en la puntuación combinada
+BM25_WEIGHT = 0.6
+NGRAM_SIZE = 4
+# Peso conjunto de los n-gramas de un término respecto al término completo
+NGRAM_WEIGHT = 0.5
+
+# Títulos: "## Ticket medio" (markdown) o "2. Descripción de los archivos" (PDF)
+_MD_HEADING = re.compile(r"^#{1,6}\s+(.+?)\s*#*$")
+_NUMBERED_HEADING = re.compile(r"^\d+(?:\.\d+)*\.?\s+[A-ZÁÉÍÓÚÑ].{0,70}$")
+_SPACES = re.compile(r"\s+")
+# Palabras de la pregunta que no identifican ningún concepto de negocio
+_QUERY_STOPWORDS = {
+    "mas", "menos", "cada", "total", "mayor", "menor", "alguna", "alguno", "vez",
+    "ningun", "ninguna", "hecho", "han", "ha", "tiene", "tienen", "como", "cuando"
+}
+
+
+def read_document(path: Path) -> str:
+    """Texto de un documento (.md, .txt o .pdf); cadena vacía si no se puede leer"""
+    if path.suffix.lower() != ".pdf":
+        return path.read_text(encoding="utf-8", errors="replace")
+    if pypdf is None:
+        logger.warning(f"pypdf no está instalado: se omite {path.name}")
+        return ""
+    try:
+        return "\n".join(page.extract_text() or "" for page in pypdf.PdfReader(str(path)).pages)
+    except Exception as e:
+        logger.warning(f"No se pudo leer {path.name}: {e}")
+        return ""
+
+
+def split_sections(text: str) -> List[Tuple[str, str]]:
+    """Divide un texto en (título, cuerpo) por sus encabezados"""
+    sections, heading, lines = [], "", []
+    for line in text.splitlines():
+        line = line.strip()
+        match = _MD_HEADING.match(line)
+        if match or _NUMBERED_HEADING.match(line):
+            if lines:
+                sections.append((heading, " ".join(lines)))
+            heading, lines = (match.group(1) if match else line), []
+        elif line:
+            lines.append(line)
+    if lines:
+        sections.append((heading, " ".join(lines)))
+    return [(heading, _SPACES.sub(" ", body).strip()) for heading, body in sections]
+
+
+def chunk_document(text: str, source: str, chunk_words: int, overlap: int) -> List[Dict[str, str]]:
+    """
+    Fragmentos de como mucho chunk_words palabras, sin cruzar secciones
+
+    Las secciones largas se cortan en ventanas que se solapan en overlap
+    palabras; cada fragmento lleva el título de su sección.
+    """
+    step = max(1, chunk_words - overlap)
+    chunks = []
+    for heading, body in split_sections(text):
+        words = body.split()
+        start = 0
+        while words:
+            chunks.append({"source": source, "heading": heading,
+                           "text": " ".join(words[start:start + chunk_words])})
+            if start + chunk_words >= len(words):
+                break
+            start += step
+    return chunks
+
+
+def index_terms(text: str) -> List[str]:
+    """Términos de tokenize_terms más los pares consecutivos ("pedido_pendient")"""
+    terms = tokenize_terms(text)
+    return terms + [f"{a}_{b}" for a, b in zip(terms, terms[1:])]
+
+
+def _ngrams(term: str) -> List[str]:
+    padded = f"_{term}_"
+    if len(padded) <= NGRAM_SIZE:
+        return [padded]
+    return [padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)]
+
+
+def _hashed_features(terms: Iterable[str], idf: Dict[str, float], default_idf: float) -> Dict[int, float]:
+    """Rasgos con signo (hashing trick) de términos y n-gramas, ponderados por IDF"""
+    features: Dict[int, float] = defaultdict(float)
+    for term, tf in Counter(terms).items():
+        weight = (1 + math.log(tf)) * idf.get(term, default_idf)
+        # Los pares de términos solo cuentan enteros
+        grams = _ngrams(term) if "_" not in term else []
+        for feature, value in [(f"w:{term}", weight)] + [(f"g:{g}", weight * NGRAM_WEIGHT / len(grams))
+                                                          for g in grams]:
+            h = zlib.crc32(feature.encode("utf-8"))
+            features[h] += value if h & 0x80000000 else -value
+    return features
+
+
+def embed(terms: Iterable[str], idf: Dict[str, float], default_idf: float, dimensions: int):
+    """Vector float32 normalizado (L2) de una lista de términos"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for h, value in _hashed_features(terms, idf, default_idf).items():
+        vector[h % dimensions] += value
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+def _bm25_idf(n: int, df: int) -> float:
+    return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+
+def sources_fingerprint(doc_dir: Path, chunk_words: int, overlap: int, dimensions: int) -> str:
+    """Huella de los documentos (nombre, tamaño, fecha) y de los parámetros del índice"""
+    parts = [f"v{INDEX_VERSION}:{chunk_words}:{overlap}:{dimensions}:{np is not None}:{pypdf is not None}"]
+    for path in sorted(doc_dir.glob("*")) if doc_dir.is_dir() else []:
+        if path.suffix.lower() in DOC_EXTENSIONS:
+            stat = path.stat()
+            parts.append(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def build_index(doc_dir: Path, index_dir: Path, chunk_words: int = 120,
+                overlap: int = 30, dimensions: int = 512) -> Dict[str, Any]:
+    """
+    Trocea los documentos y escribe el índice en index_dir
+
+    La matriz se escribe antes que index.json y los dos con os.replace: un
+    index.json presente siempre corresponde a una matriz completa.
+
+    Returns:
+        Resumen: documentos, fragmentos, términos y segundos
+    """
+    start = time.perf_counter()
+    fingerprint = sources_fingerprint(doc_dir, chunk_words, overlap, dimensions)
+    chunks, documents = [], []
+    for path in sorted(doc_dir.glob("*")) if doc_dir.is_dir() else []:
+        if path.suffix.lower() in DOC_EXTENSIONS:
+            found = chunk_document(read_document(path), path.name, chunk_words, overlap)
+            if found:
+                documents.append(path.name)
+                chunks.extend(found)
+
+    # BM25: cada fragmento cuenta también con las palabras de su título
+    postings: Dict[str, List[List[int]]] = defaultdict(list)
+    lengths, chunk_terms = [], []
+    for i, chunk in enumerate(chunks):
+        terms = index_terms(f"{chunk['heading']} {chunk['text']}")
+        chunk_terms.append(terms)
+        lengths.append(len(terms))
+        for term, tf in Counter(terms).items():
+            postings[term].append([i, tf])
+
+    index_dir.mkdir(parents=True, exist_ok=True)
+    if np is not None and chunks:
+        idf = {term: _bm25_idf(len(chunks), len(p)) for term, p in postings.items()}
+        matrix = np.stack([embed(terms, idf, 0.0, dimensions) for terms in chunk_terms])
+        fd, tmp_path = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(matrix.astype(np.float32).tobytes())
+        os.replace(tmp_path, index_dir / MATRIX_FILE)
+
+    index = {
+        "version": INDEX_VERSION, "fingerprint": fingerprint, "created_at": time.time(),
+        "dimensions": dimensions if np is not None else 0,
+        "documents": documents, "chunks": chunks, "lengths": lengths, "postings": postings
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, index_dir / INDEX_FILE)
+
+    summary = {"documents": len(documents), "chunks": len(chunks), "terms": len(postings),
+               "seconds": round(time.perf_counter() - start, 3)}
+    logger.info(f"Índice de documentación construido en {index_dir}: {summary}")
+    return summary
+
+
+class DocumentIndex:
+    """
+    Índice de fragmentos cargado desde disco (solo lectura)
+
+    index.json (fragmentos y BM25) se carga en memoria; la matriz de
+    vectores se abre con np.memmap, sin copiarla.
+    """
+
+    def __init__(self, index_dir: Path, k1: float = 1.2, b: float = 0.75):
+        with open(index_dir / INDEX_FILE, encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != INDEX_VERSION:
+            raise ValueError(f"versión de índice {index.get('version')} no soportada")
+        self.k1 = k1
+        self.b = b
+        self.fingerprint = index["fingerprint"]
+        self.documents = index["documents"]
+        self.chunks = index["chunks"]
+        self.dimensions = index["dimensions"]
+        self._lengths = index["lengths"]
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        self._postings = index["postings"]
+        n = len(self.chunks)
+        self._idf = {term: _bm25_idf(n, len(p)) for term, p in self._postings.items()}
+        # Términos desconocidos: como los más raros del índice
+        self._default_idf = _bm25_idf(n, 0) if n else 0.0
+        self._matrix = None
+        if np is not None and self.dimensions and n:
+            self._matrix = np.memmap(index_dir / MATRIX_FILE, dtype=np.float32, mode="r",
+                                     shape=(n, self.dimensions))
+
+    @classmethod
+    def open(cls, index_dir: Path) -> Optional["DocumentIndex"]:
+        """Carga el índice; None si no existe o no se puede leer"""
+        try:
+            return cls(index_dir)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Índice de documentación ilegible ({index_dir}): {e}")
+            return None
+
+    def search(self, question: str, top_k: int, min_score: float = 0.0,
+               ignore: Optional[Set[str]] = None) -> List[Tuple[float, Dict[str, str]]]:
+        """
+        Fragmentos más relevantes para la pregunta, de más a menos
+
+        La puntuación (0-1) combina BM25, normalizado por la suma de los IDF
+        de los términos de la pregunta, con la similitud coseno de los
+        vectores. Los términos de ignore no cuentan por sí solos, pero sí
+        dentro de un par ("pedido_pendient").
+        """
+        ignore = (ignore or set()) | _QUERY_STOPWORDS
+        words = [t for t in tokenize_terms(question) if t not in _QUERY_STOPWORDS]
+        terms = [t for t in words if len(t) > 2 and t not in ignore]
+        terms += [f"{a}_{b}" for a, b in zip(words, words[1:]) if a not in ignore or b not in ignore]
+        if not terms or not self.chunks:
+            return []
+        unique = set(terms)
+
+        bm25: Dict[int, float] = defaultdict(float)
+        for term in unique:
+            for chunk_id, tf in self._postings.get(term, ()):
+                norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / (self._avg_length or 1))
+                bm25[chunk_id] += self._idf[term] * tf * (self.k1 + 1) / norm
+        bound = sum(self._idf.get(term, self._default_idf) for term in unique) or 1.0
+
+        if self._matrix is None:
+            scores = {i: min(1.0, s / bound) for i, s in bm25.items()}
+        else:
+            query = embed(terms, self._idf, self._default_idf, self.dimensions)
+            combined = np.maximum(self._matrix @ query, 0) * (1 - BM25_WEIGHT)
+            for i, s in bm25.items():
+                combined[i] += BM25_WEIGHT * min(1.0, s / bound)
+            k = min(top_k, len(combined))
+            best = np.argpartition(-combined, k - 1)[:k]
+            scores = {int(i): float(combined[i]) for i in best}
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(score, self.chunks[i]) for i, score in ranked if score >= min_score and score > 0]
+
+
+class DocsContextBuilder:
+    """
+    Contexto de documentación por pregunta para el prompt
+
+    Abre el índice una vez (construyéndolo si falta o está desactualizado y
+    AUTO_BUILD lo permite) y, en cada pregunta, devuelve los fragmentos
+    relevantes o una cadena vacía. Los nombres de tablas y columnas del
+    esquema se ignoran al buscar.
+    """
+
+    def __init__(self, db_manager, config: Optional[Dict[str, Any]] = None):
+        self.db_manager = db_manager
+        self.config = {**DOCS_CONFIG, **(config or {})}
+        self.index = self._open_index()
+        self._schema: Optional[Dict[str, Any]] = None
+        self._schema_terms: Set[str] = set()
+        self._lock = threading.Lock()
+        self._searches = 0
+        self._with_context = 0
+        self._search_seconds = 0.0
+
+    def _open_index(self) -> Optional[DocumentIndex]:
+        config = self.config
+        index_dir = Path(config['INDEX_DIR'])
+        fingerprint = sources_fingerprint(Path(config['DIR']), config['CHUNK_WORDS'],
+                                          config['CHUNK_OVERLAP'], config['DIMENSIONS'])
+        index = DocumentIndex.open(index_dir)
+        if index is not None and index.fingerprint == fingerprint:
+            return index
+        if not config['AUTO_BUILD']:
+            if index is not None:
+                logger.warning("El índice de documentación no corresponde a los documentos actuales "
+                               "(python -m src.doc_retrieval --build)")
+            return index
+        try:
+            build_index(Path(config['DIR']), index_dir, config['CHUNK_WORDS'],
+                        config['CHUNK_OVERLAP'], config['DIMENSIONS'])
+        except OSError as e:
+            logger.warning(f"No se pudo construir el índice de documentación: {e}")
+            return index
+        return DocumentIndex.open(index_dir)
+
+    def _sync_schema(self) -> Set[str]:
+        schema = self.db_manager.get_database_schema()
+        if schema is not self._schema:
+            terms = set()
+            for table_name, table_info in (schema or {}).items():
+                terms.update(tokenize_terms(table_name))
+                for column in table_info['columns']:
+                    terms.update(tokenize_terms(column['name']))
+            self._schema, self._schema_terms = schema, terms
+        return self._schema_terms
+
+    def search(self, question: str) -> List[Tuple[float, Dict[str, str]]]:
+        if self.index is None:
+            return []
+        start = time.perf_counter()
+        hits = self.index.search(question, self.config['TOP_K'], self.config['MIN_SCORE'],
+                                 ignore=self._sync_schema())
+        with self._lock:
+            self._searches += 1
+            self._with_context += bool(hits)
+            self._search_seconds += time.perf_counter() - start
+        return hits
+
+    def for_question(self, question: str) -> str:
+        """Texto para la variable {docs} del prompt (vacío si no hay nada relevante)"""
+        lines, used = [], 0
+        for _, chunk in self.search(question):
+            heading = f", {chunk['heading']}" if chunk['heading'] else ""
+            line = f"- ({chunk['source']}{heading}) {chunk['text']}"
+            cost = estimate_tokens(line)
+            if used + cost > self.config['TOKEN_BUDGET']:
+                continue
+            lines.append(line)
+            used += cost
+        if not lines:
+            return ""
+        return "Definiciones del negocio (extractos de la documentación):\n" + "\n".join(lines)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            searches = self._searches
+            return {
+                "documents": len(self.index.documents) if self.index else 0,
+                "chunks": len(self.index.chunks) if self.index else 0,
+                "searches": searches,
+                "with_context": self._with_context,
+                "avg_search_ms": round(self._search_seconds / searches * 1000, 3) if searches else 0.0
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("question", nargs="?", help="Pregunta de prueba: muestra los fragmentos encontrados")
+    parser.add_argument("--build", action="store_true", help="Reconstruir el índice")
+    parser.add_argument("--top-k", type=int, default=DOCS_CONFIG['TOP_K'])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    index_dir = Path(DOCS_CONFIG['INDEX_DIR'])
+    if args.build:
+        summary = build_index(Path(DOCS_CONFIG['DIR']), index_dir, DOCS_CONFIG['CHUNK_WORDS'],
+                              DOCS_CONFIG['CHUNK_OVERLAP'], DOCS_CONFIG['DIMENSIONS'])
+        print(json.dumps(summary, ensure_ascii=False))
+    if args.question:
+        index = DocumentIndex.open(index_dir)
+        if index is None:
+            parser.error(f"No hay índice en {index_dir} (use --build)")
+        for score, chunk in index.search(args.question, args.top_k):
+            print(f"{score:.3f}  {chunk['source']} · {chunk['heading']}\n       {chunk['text'][:200]}")
+
+
+if __name__ == "__main__":
+    main()
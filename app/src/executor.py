@@ -0,0 +1,331 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor
+from src.config import EXECUTOR_CONFIG
+from typing import Optional, Dict, Any, Callable, Iterator, List
+import asyncio
+import threading
+import logging
+import time
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Chatbot propio de cada proceso worker (solo en modo 'process')
+_worker_chatbot = None
+
+
+class QueueFullError(Exception):
+    """La cola de consultas está llena y la petición se rechaza"""
+
+
+class QueryTimeoutError(Exception):
+    """La consulta superó el plazo máximo permitido"""
+
+
+def _init_process_worker():
+    """Inicializa un ChatbotSQL independiente en cada proceso del pool"""
+    global _worker_chatbot
+    from src.chatbot import ChatbotSQL
+    _worker_chatbot = ChatbotSQL()
+
+
+def _run_in_process(user_input: str, deadline: float, render: bool = True,
+                    page_token: Optional[str] = None, session_id: Optional[str] = None) -> Dict[str, Any]:
+    """Ejecuta la consulta en el chatbot del proceso worker"""
+    return _run_with_deadline(_worker_chatbot, user_input, deadline, render, page_token, session_id)
+
+
+def _run_with_deadline(chatbot, user_input: str, deadline: float, render: bool = True,
+                       page_token: Optional[str] = None, session_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Descarta las peticiones que caducaron mientras esperaban en la cola y
+    pasa el plazo a process_query, que deja de trabajar cuando vence
+    """
+    if time.time() > deadline:
+        return {
+            "success": False,
+            "response": "La consulta expiró antes de poder procesarse.",
+            "query": None,
+            "columns": None,
+            "results": None,
+            "next_page": None
+        }
+    return chatbot.process_query(user_input, render=render, page_token=page_token, session_id=session_id,
+                                 deadline=deadline)
+
+
+class _SlotIterator:
+    """
+    Iterador que ocupa una plaza del pool hasta agotarse, cerrarse o ser recolectado
+
+    El finally de un generador que nunca llega a iterarse no se ejecuta: si
+    el cliente se desconecta antes del primer evento la plaza se perdería.
+    La plaza se libera una sola vez, sea cual sea el camino.
+    """
+
+    def __init__(self, items: Iterator[Any], release: Callable[[], None]):
+        self._items = items
+        self._release = release
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self) -> "_SlotIterator":
+        return self
+
+    def __next__(self) -> Any:
+        try:
+            return next(self._items)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        try:
+            close = getattr(self._items, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._release()
+
+    def __del__(self) -> None:
+        self.close()
+
+
+class QueryExecutor:
+    """
+    Ejecuta ChatbotSQL.process_query fuera del event loop.
+
+    Usa un pool de hilos (o de procesos) de tamaño fijo con una cola acotada:
+    cuando hay más peticiones en curso que workers + MAX_QUEUE se rechazan
+    de inmediato con QueueFullError, y cada petición tiene un plazo máximo.
+
+    En modo 'async' no hay pool: las consultas se atienden con
+    ChatbotSQL.aprocess_query en el propio event loop, con el mismo límite
+    de admisión (workers + MAX_QUEUE consultas en curso).
+    """
+
+    def __init__(self, chatbot=None, mode: Optional[str] = None,
+                 workers: Optional[int] = None, max_queue: Optional[int] = None,
+                 timeout: Optional[float] = None):
+        self.mode = mode or EXECUTOR_CONFIG['MODE']
+        self.workers = workers or EXECUTOR_CONFIG['WORKERS']
+        self.max_queue = EXECUTOR_CONFIG['MAX_QUEUE'] if max_queue is None else max_queue
+        self.timeout = timeout or EXECUTOR_CONFIG['REQUEST_TIMEOUT']
+        self.chatbot = chatbot
+        self._pending = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._lock = threading.Lock()
+
+        if self.mode in ("thread", "async") and chatbot is None:
+            raise ValueError(f"El modo '{self.mode}' necesita una instancia de ChatbotSQL")
+        if self.mode not in ("thread", "process", "async"):
+            raise ValueError(f"Modo de ejecución no soportado: {self.mode}")
+        self._pool: Optional[Executor] = self._create_pool()
+
+        logger.info(
+            f"Pool de consultas '{self.mode}' con {self.workers} workers "
+            f"y cola de {self.max_queue}"
+        )
+
+    def _create_pool(self) -> Optional[Executor]:
+        if self.mode == "process":
+            return ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_process_worker
+            )
+        if self.mode == "thread":
+            return ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="chatbot-worker"
+            )
+        return None
+
+    def after_fork(self) -> None:
+        """
+        Rehace el pool en un worker creado con fork() (preload de gunicorn)
+
+        Los hilos y procesos del pool del padre no existen en el hijo: se
+        descarta sin cerrarlo y se parte de contadores vacíos.
+        """
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._pool = self._create_pool()
+
+    @property
+    def capacity(self) -> int:
+        """Número máximo de peticiones admitidas a la vez (en curso + en cola)"""
+        return self.workers + self.max_queue
+
+    def _acquire_slot(self) -> None:
+        with self._lock:
+            if self._pending >= self.capacity:
+                self._rejected += 1
+                raise QueueFullError("Demasiadas consultas en curso, inténtalo más tarde")
+            self._pending += 1
+
+    def _release_slot(self, _future=None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def submit(self, user_input: str, render: bool = True,
+                     page_token: Optional[str] = None, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Encola una consulta y espera su resultado sin bloquear el event loop
+
+        Args:
+            user_input: Consulta del usuario
+            render: Incluir la tabla HTML en la respuesta (ver ChatbotSQL.process_query)
+            page_token: Token de la página siguiente de una respuesta anterior
+            session_id: Sesión de la conversación (en modo 'process' cada
+                proceso del pool guarda sus propias sesiones)
+
+        Raises:
+            QueueFullError: si la cola está llena
+            QueryTimeoutError: si la consulta no termina dentro del plazo
+        """
+        if self.mode == "async":
+            return await self._submit_async(user_input, render, page_token, session_id)
+
+        self._acquire_slot()
+        deadline = time.time() + self.timeout
+        try:
+            if self.mode == "process":
+                future = self._pool.submit(_run_in_process, user_input, deadline, render, page_token, session_id)
+            else:
+                future = self._pool.submit(_run_with_deadline, self.chatbot, user_input, deadline,
+                                           render, page_token, session_id)
+        except Exception:
+            self._release_slot()
+            raise
+        future.add_done_callback(self._release_slot)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError as e:
+            with self._lock:
+                self._timeouts += 1
+            # Si aún estaba en cola no llegará a ejecutarse
+            future.cancel()
+            raise QueryTimeoutError(
+                f"La consulta superó el límite de {self.timeout:.0f} segundos"
+            ) from e
+
+    async def _submit_async(self, user_input: str, render: bool = True,
+                            page_token: Optional[str] = None, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Atiende la consulta en el event loop con la misma admisión y plazo"""
+        self._acquire_slot()
+        deadline = time.time() + self.timeout
+        try:
+            return await asyncio.wait_for(self.chatbot.aprocess_query(user_input, render=render, page_token=page_token,
+                                                                  session_id=session_id, deadline=deadline),
+                                          self.timeout)
+        except asyncio.TimeoutError as e:
+            with self._lock:
+                self._timeouts += 1
+            raise QueryTimeoutError(
+                f"La consulta superó el límite de {self.timeout:.0f} segundos"
+            ) from e
+        finally:
+            self._release_slot()
+
+    def stream(self, user_input: str, page_token: Optional[str] = None,
+               session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Admite una consulta en streaming y devuelve sus eventos (ChatbotSQL.stream_query)
+
+        La admisión se decide al llamar (QueueFullError de inmediato); el
+        iterador se consume fuera del event loop y libera su plaza al
+        terminar, al cerrarse o al recolectarse aunque no llegue a leerse.
+        El plazo se comprueba entre eventos y, en la base de datos, como
+        statement_timeout de las consultas de la respuesta; al superarlo se
+        corta el stream con un evento 'error'.
+
+        Raises:
+            QueueFullError: si la cola está llena
+        """
+        if self.chatbot is None:
+            raise ValueError("El streaming necesita una instancia de ChatbotSQL en este proceso")
+        self._acquire_slot()
+        return _SlotIterator(self._stream_events(user_input, page_token, time.time() + self.timeout, session_id),
+                             self._release_slot)
+
+    def _stream_events(self, user_input: str, page_token: Optional[str],
+                       deadline: float, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        events = self.chatbot.stream_query(user_input, page_token, deadline=deadline, session_id=session_id)
+        try:
+            for event in events:
+                yield event
+                if time.time() > deadline:
+                    with self._lock:
+                        self._timeouts += 1
+                    yield {"event": "error", "data": {
+                        "message": f"La consulta superó el límite de {self.timeout:.0f} segundos"
+                    }}
+                    return
+        finally:
+            events.close()
+
+    async def batch(self, questions: List[str], render: bool = False) -> List[Dict[str, Any]]:
+        """
+        Admite un lote de preguntas (ChatbotSQL.process_batch) y espera sus respuestas
+
+        El lote ocupa una sola plaza y no usa los workers del pool: reparte
+        su trabajo en hilos propios (BATCH_CONCURRENCY). No tiene plazo
+        máximo, como las exportaciones.
+
+        Raises:
+            QueueFullError: si la cola está llena
+        """
+        if self.chatbot is None:
+            raise ValueError("Los lotes necesitan una instancia de ChatbotSQL en este proceso")
+        self._acquire_slot()
+        try:
+            return await asyncio.to_thread(self.chatbot.process_batch, questions, render)
+        finally:
+            self._release_slot()
+
+    def export(self, user_input: str, fmt: str) -> Iterator[bytes]:
+        """
+        Admite una exportación (ChatbotSQL.export_query) y devuelve sus fragmentos
+
+        Ocupa una plaza como cualquier consulta hasta que termina o el
+        cliente se desconecta, pero sin plazo máximo: una exportación grande
+        dura lo que tarde en enviarse.
+
+        Raises:
+            QueueFullError: si la cola está llena
+        """
+        if self.chatbot is None:
+            raise ValueError("La exportación necesita una instancia de ChatbotSQL en este proceso")
+        self._acquire_slot()
+        try:
+            chunks = self.chatbot.export_query(user_input, fmt)
+        except BaseException:
+            self._release_slot()
+            raise
+        return _SlotIterator(chunks, self._release_slot)
+
+    def stats(self) -> Dict[str, Any]:
+        """Estado actual del pool para monitorización"""
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "pending": self._pending,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts
+            }
+
+    def shutdown(self) -> None:
+        """Detiene el pool cancelando las consultas que no han empezado"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        logger.info("Pool de consultas detenido")
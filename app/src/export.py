@@ -0,0 +1,245 @@
+from src.serialization import dumps
+from src.config import EXPORT_CONFIG
+from src.sql_validator import strip_sql
+from typing import Any, Iterator, List, Optional, Sequence
+import csv
+import io
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional: sin él no hay exportación a Parquet
+    pa = pq = None
+
+# Formato -> (tipo MIME, extensión)
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+_DONE = object()
+
+
+class ExportCancelled(Exception):
+    """El cliente dejó de leer la exportación"""
+
+
+class _QueueSink:
+    """
+    Fichero de solo escritura que pasa los datos de COPY a una cola acotada
+
+    Agrupa las escrituras (COPY escribe fila a fila) en bloques de
+    chunk_size bytes. Si la cola está llena, COPY espera a que el cliente
+    consuma: la memoria usada no pasa de EXPORT_QUEUE_CHUNKS bloques.
+    """
+
+    def __init__(self, chunks: "queue.Queue", cancelled: threading.Event, chunk_size: int):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.chunk_size = chunk_size
+        self._buffer = bytearray()
+
+    def write(self, data: Any) -> int:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def put(self, item: Any) -> None:
+        while True:
+            if self.cancelled.is_set():
+                raise ExportCancelled()
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+class _ParquetSink(io.RawIOBase):
+    """Destino de ParquetWriter que acumula los bytes escritos hasta drain()"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ResultExporter:
+    """
+    Exporta el resultado completo de una consulta a CSV, NDJSON o Parquet
+
+    Lee del cursor de servidor en lotes de EXPORT_BATCH_SIZE filas y emite
+    cada lote ya codificado, de modo que la memoria no depende del tamaño
+    del resultado. En PostgreSQL (psycopg2) el CSV lo genera el propio
+    servidor con COPY ... TO STDOUT. Las exportaciones usan su propio
+    statement_timeout (EXPORT_STATEMENT_TIMEOUT_MS), no el de las consultas
+    interactivas.
+    """
+
+    def __init__(self, db_manager, batch_size: Optional[int] = None,
+                 chunk_size: Optional[int] = None):
+        self.db_manager = db_manager
+        self.batch_size = batch_size or EXPORT_CONFIG['BATCH_SIZE']
+        self.chunk_size = chunk_size or EXPORT_CONFIG['CHUNK_SIZE']
+        self.statement_timeout = EXPORT_CONFIG['STATEMENT_TIMEOUT_MS']
+
+    def export(self, query: str, fmt: str) -> Iterator[bytes]:
+        """
+        Genera el fichero por fragmentos
+
+        Raises:
+            ValueError: si el formato no está soportado o falta pyarrow
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Formato de exportación no soportado: {fmt}")
+        # Sin comentarios: la consulta va dentro de COPY (...)
+        query = strip_sql(query)
+        if fmt == "csv":
+            if self.db_manager.supports_copy():
+                return self._copy_csv(query)
+            return self._csv(query)
+        if fmt == "ndjson":
+            return self._ndjson(query)
+        if pa is None:
+            raise ValueError("La exportación a Parquet necesita el paquete pyarrow")
+        return self._parquet(query)
+
+    def _stream(self, query: str):
+        return self.db_manager.stream_query(query, batch_size=self.batch_size,
+                                            statement_timeout=self.statement_timeout)
+
+    def _csv(self, query: str) -> Iterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        with self._stream(query) as (columns, batches):
+            writer.writerow(columns)
+            for batch in batches:
+                writer.writerows(batch)
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue().encode("utf-8")
+
+    def _copy_csv(self, query: str) -> Iterator[bytes]:
+        """CSV generado por el servidor con COPY, leído desde un hilo con cola acotada"""
+        chunks: "queue.Queue" = queue.Queue(maxsize=EXPORT_CONFIG['QUEUE_CHUNKS'])
+        cancelled = threading.Event()
+        sink = _QueueSink(chunks, cancelled, self.chunk_size)
+
+        def run_copy():
+            try:
+                self.db_manager.copy_to(query, sink, "FORMAT csv, HEADER",
+                                        statement_timeout=self.statement_timeout)
+                sink.flush()
+                sink.put(_DONE)
+            except ExportCancelled:
+                logger.info("Exportación COPY cancelada por el cliente")
+            except Exception as e:
+                try:
+                    sink.put(e)
+                except ExportCancelled:
+                    pass
+
+        thread = threading.Thread(target=run_copy, name="export-copy", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = chunks.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancelled.set()
+
+    def _ndjson(self, query: str) -> Iterator[bytes]:
+        with self._stream(query) as (columns, batches):
+            for batch in batches:
+                yield b"".join(dumps(dict(zip(columns, row))) + b"\n" for row in batch)
+
+    def _parquet(self, query: str) -> Iterator[bytes]:
+        """Un row group por lote; el esquema se toma del primer lote"""
+        sink = _ParquetSink()
+        writer = None
+        schema = None
+        with self._stream(query) as (columns, batches):
+            for batch in batches:
+                arrays = _columns_of(columns, batch)
+                if writer is None:
+                    schema = _infer_schema(columns, arrays)
+                    writer = pq.ParquetWriter(sink, schema)
+                record_batch = pa.RecordBatch.from_arrays(
+                    [_to_arrow(values, field.type) for values, field in zip(arrays, schema)],
+                    schema=schema
+                )
+                writer.write_batch(record_batch)
+                yield sink.drain()
+            if writer is None:
+                # Resultado vacío: fichero válido con columnas de texto
+                schema = pa.schema([(name, pa.string()) for name in columns])
+                writer = pq.ParquetWriter(sink, schema)
+        writer.close()
+        yield sink.drain()
+
+
+def _columns_of(columns: Sequence[str], batch: Sequence[Sequence[Any]]) -> List[List[Any]]:
+    if not batch:
+        return [[] for _ in columns]
+    return [list(values) for values in zip(*batch)]
+
+
+def _infer_schema(columns: Sequence[str], arrays: List[List[Any]]) -> "pa.Schema":
+    """Tipos de Arrow del primer lote; las columnas todo NULL se guardan como texto"""
+    fields = []
+    for name, values in zip(columns, arrays):
+        arrow_type = pa.array(values).type
+        if pa.types.is_null(arrow_type):
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def _to_arrow(values: List[Any], arrow_type: "pa.DataType") -> "pa.Array":
+    if pa.types.is_string(arrow_type):
+        values = [None if value is None else str(value) for value in values]
+    return pa.array(values, type=arrow_type)
+
+
+def export_filename(fmt: str, name: str = "export") -> str:
+    return f"{name}.{EXPORT_FORMATS[fmt][1]}"
+
+
+def export_media_type(fmt: str) -> str:
+    return EXPORT_FORMATS[fmt][0]
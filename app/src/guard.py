@@ -0,0 +1,189 @@
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy.exc import SQLAlchemyError
+from src.sql_validator import clean_sql, validate_sql, has_limit, strip_sql
+from src.models import read_only
+from src.config import GUARD_CONFIG
+from typing import Any, Dict, Iterator, Optional
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import copy
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Plazo (time.time()) de la petición en curso; lo fija ChatbotSQL.process_query
+_deadline: ContextVar[Optional[float]] = ContextVar("chatbot_request_deadline", default=None)
+
+
+@contextmanager
+def request_deadline(deadline: Optional[float]) -> Iterator[None]:
+    """Las consultas del agente (GuardedSQLDatabase) en este contexto no se lanzan pasado 'deadline'"""
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class QueryRejected(ValueError):
+    """La consulta no supera las comprobaciones previas a la ejecución"""
+
+
+class QueryGuard:
+    """
+    Comprobaciones de una consulta antes de enviarla a la base de datos
+
+    1. Validación local (validate_sql): una sola sentencia de lectura, sin
+       escritura ni DDL, con tablas y columnas del esquema cacheado.
+    2. EXPLAIN (solo PostgreSQL): coste y filas estimados por el planificador.
+       Por encima de MAX_COST la consulta se rechaza; por encima de
+       MAX_ESTIMATED_ROWS se reescribe con LIMIT AUTO_LIMIT (o se rechaza
+       con ROWS_ACTION='reject') si no tiene ya un LIMIT.
+
+    El statement_timeout de cada sentencia lo fija la conexión (ver
+    src.models), así que también cubre a las consultas que pasan el guard.
+    Con el guard activo las consultas se ejecutan además en transacciones
+    READ ONLY (src.models.read_only): si una escritura escapa a la
+    validación local, la rechaza PostgreSQL.
+    """
+
+    def __init__(self, db_manager, config: Optional[Dict[str, Any]] = None):
+        self.db_manager = db_manager
+        self.config = {**GUARD_CONFIG, **(config or {})}
+        self._lock = threading.Lock()
+        self._stats = {"checked": 0, "rejected": 0, "limited": 0, "explain_seconds": 0.0}
+
+    def check(self, query: str, limit_rows: bool = True) -> str:
+        """
+        Valida la consulta y devuelve la SQL que debe ejecutarse
+
+        Args:
+            query: SQL a comprobar
+            limit_rows: Aplicar el umbral de filas estimadas. Las
+                exportaciones lo desactivan: piden el resultado completo
+
+        Raises:
+            QueryRejected: si la consulta no es válida o es demasiado costosa
+        """
+        query = self._validate(query)
+        start = time.perf_counter()
+        try:
+            plan = self.db_manager.explain(query)
+        except SQLAlchemyError as e:
+            self._count("rejected")
+            raise QueryRejected(f"SQL no válida: {getattr(e, 'orig', e)}") from e
+        finally:
+            self._count("explain_seconds", time.perf_counter() - start)
+        return self._apply_plan(query, plan, limit_rows)
+
+    async def acheck(self, query: str, limit_rows: bool = True) -> str:
+        """Versión asíncrona de check (EXPLAIN con el motor asyncpg)"""
+        query = self._validate(query)
+        start = time.perf_counter()
+        try:
+            plan = await self.db_manager.aexplain(query)
+        except SQLAlchemyError as e:
+            self._count("rejected")
+            raise QueryRejected(f"SQL no válida: {getattr(e, 'orig', e)}") from e
+        finally:
+            self._count("explain_seconds", time.perf_counter() - start)
+        return self._apply_plan(query, plan, limit_rows)
+
+    def _validate(self, query: str) -> str:
+        self._count("checked")
+        query = clean_sql(query)
+        valid, error = validate_sql(query, self.db_manager.get_database_schema())
+        if not valid:
+            self._count("rejected")
+            raise QueryRejected(error)
+        return query
+
+    def _apply_plan(self, query: str, plan: Optional[Dict[str, float]], limit_rows: bool) -> str:
+        """Decide a partir del plan estimado (None si el motor no tiene EXPLAIN con costes)"""
+        if plan is None:
+            return query
+        if plan["cost"] > self.config['MAX_COST']:
+            self._count("rejected")
+            raise QueryRejected(
+                f"Consulta demasiado costosa (coste estimado {plan['cost']:.0f}, "
+                f"máximo {self.config['MAX_COST']:.0f})"
+            )
+        if not limit_rows or plan["rows"] <= self.config['MAX_ESTIMATED_ROWS'] or has_limit(query):
+            return query
+        if self.config['ROWS_ACTION'] == 'reject':
+            self._count("rejected")
+            raise QueryRejected(
+                f"La consulta devolvería demasiadas filas ({plan['rows']:.0f} estimadas, "
+                f"máximo {self.config['MAX_ESTIMATED_ROWS']})"
+            )
+        self._count("limited")
+        logger.warning(
+            f"Consulta con {plan['rows']:.0f} filas estimadas: se añade LIMIT {self.config['AUTO_LIMIT']}"
+        )
+        # Sin comentarios: un '-- comentario' final anularía el LIMIT
+        return f"{strip_sql(query)} LIMIT {int(self.config['AUTO_LIMIT'])}"
+
+    def _count(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+
+class GuardedSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase de LangChain que pasa las consultas del agente por QueryGuard
+
+    La herramienta sql_db_query llama a run_no_throw: una consulta
+    rechazada vuelve al agente como texto 'Error: ...' para que la corrija,
+    igual que un error de la base de datos. Con réplicas (src.replicas) las
+    lecturas del agente se ejecutan en la que elige el router. Con guard,
+    en transacciones READ ONLY. Pasado el plazo de la petición
+    (request_deadline) no se lanzan más consultas: el TimeoutError corta
+    la ejecución del agente.
+    """
+
+    def __init__(self, *args: Any, guard: Optional[QueryGuard] = None, router: Any = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.guard = guard
+        self.router = router
+
+    def run(self, command: Any, *args: Any, **kwargs: Any) -> Any:
+        if self.guard is not None and isinstance(command, str):
+            command = self.guard.check(command)
+        return super().run(command, *args, **kwargs)
+
+    def _execute(self, command: Any, *args: Any, **kwargs: Any) -> Any:
+        deadline = _deadline.get()
+        if deadline is not None and time.time() > deadline:
+            raise TimeoutError("La consulta superó su plazo y se abandona")
+        if not isinstance(command, str) or (self.router is None and self.guard is None):
+            return super()._execute(command, *args, **kwargs)
+        if self.router is not None:
+            target = self.router.route(command)
+            if target is not self.router.primary:
+                try:
+                    with target.track():
+                        return self._execute_on(target.engine, command, *args, **kwargs)
+                except SQLAlchemyError as e:
+                    if not self.router.failover(target, e):
+                        raise
+        with self.router.primary.track() if self.router is not None else nullcontext():
+            return self._execute_on(self._engine, command, *args, **kwargs)
+
+    def _execute_on(self, db_engine: Any, command: str, *args: Any, **kwargs: Any) -> Any:
+        """_execute con otro motor (réplica o READ ONLY)"""
+        # Copia superficial: varios hilos comparten self
+        database = copy.copy(self)
+        database._engine = read_only(db_engine) if self.guard is not None else db_engine
+        return SQLDatabase._execute(database, command, *args, **kwargs)
+
+    def run_no_throw(self, command: str, *args: Any, **kwargs: Any) -> Any:
+        try:
+            return super().run_no_throw(command, *args, **kwargs)
+        except QueryRejected as e:
+            return f"Error: {e}"
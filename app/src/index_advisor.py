@@ -0,0 +1,807 @@
+"""
+Asesor de índices a partir de la SQL que ejecuta el chatbot
+
+1. WorkloadRecorder (opcional, INDEX_ADVISOR_RECORD) graba en un fichero
+   JSONL cada consulta de lectura que pasa por el motor de SQLAlchemy
+   (agente, modo directo, paginación, exportaciones), con sus parámetros y
+   su duración. Las consultas internas (catálogo, EXPLAIN, marcas de agua)
+   no se graban.
+2. IndexAdvisor agrupa el workload por forma de consulta (mismos tokens,
+   distintos literales), toma las que más tiempo acumulan y las mide
+   (EXPLAIN (ANALYZE, BUFFERS) en PostgreSQL; ejecución cronometrada en
+   otros motores) si pasan validate_sql, en transacciones de solo lectura.
+   Propone índices sobre las columnas de WHERE, JOIN ... ON, GROUP BY y
+   ORDER BY que no cubre ya ningún índice, evalúa cada uno:
+     - 'hypopg': índice hipotético y coste estimado por el planificador,
+       sin crear nada (requiere la extensión hypopg)
+     - 'trial': crea el índice, vuelve a medir y lo borra
+   y recomienda los que más reducen el coste total del workload.
+3. Con --apply los crea (CREATE INDEX CONCURRENTLY en PostgreSQL) y el
+   informe compara antes y después con mediciones reales.
+
+Uso (desde app/):
+    python -m src.index_advisor                    # informe
+    python -m src.index_advisor --apply            # crea los recomendados
+    python -m src.index_advisor --json --output informe.json
+"""
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.elements import TextClause
+from src.cache import normalize_sql
+from src.config import INDEX_ADVISOR_CONFIG
+from src.pagination import unwrap_page
+from src.sql_validator import extract_tables, table_aliases, tokenize, validate_sql, _is_identifier, _unquote
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from contextlib import contextmanager
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Consultas al catálogo o a las estadísticas del motor: no son del workload
+_CATALOG = re.compile(
+    r"\b(pg_catalog|information_schema|pg_stat\w*|pg_class|pg_namespace|pg_extension|"
+    r"sqlite_master|sqlite_schema)\b", re.IGNORECASE)
+
+# Solo se graban las consultas de lectura
+_READ_QUERY = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+# Opción de ejecución para que una consulta no se grabe (conn.execution_options(workload=False))
+SKIP_OPTION = "workload"
+
+# Escrituras entre comprobaciones del tamaño del fichero
+_ROTATE_CHECK_EVERY = 256
+
+# Palabras que abren cada parte de la consulta (para saber dónde aparece una columna)
+_FILTER_KEYWORDS = {"where", "on", "having"}
+_RESET_KEYWORDS = {"select", "from", "join", "limit", "offset", "union", "intersect", "except",
+                   "returning", "window", "values"}
+
+
+def is_workload_sql(sql: str) -> bool:
+    """True si la consulta es de lectura, lee alguna tabla y no toca el catálogo"""
+    if not _READ_QUERY.match(sql) or _CATALOG.search(sql):
+        return False
+    tables, ctes = extract_tables(sql)
+    return bool(tables - ctes)
+
+
+def query_fingerprint(sql: str) -> str:
+    """Huella de la forma de una consulta: ignora literales, mayúsculas, espacios y paginación"""
+    shape = []
+    for token in tokenize(unwrap_page(sql)):
+        if token.startswith("'") or token[0].isdigit():
+            shape.append("?")
+        else:
+            shape.append(token.lower())
+    return hashlib.sha1(" ".join(shape).encode("utf-8")).hexdigest()[:12]
+
+
+class WorkloadRecorder:
+    """
+    Graba en JSONL las consultas que ejecutan los motores vigilados
+
+    Una línea por sentencia: {"ts", "sql", "params", "ms"}. 'ms' es el
+    tiempo hasta que el servidor responde, sin leer las filas. Varios
+    procesos (workers de gunicorn, modo 'process') pueden escribir en el
+    mismo fichero: cada línea va en una sola escritura con O_APPEND. Al
+    superar max_bytes el fichero pasa a '<fichero>.1' (se conserva uno).
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 0):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._fd: Optional[int] = None
+        self._lock = threading.Lock()
+        self._engines = weakref.WeakSet()
+        self._writes = 0
+        self._stats = {"recorded": 0, "skipped": 0, "errors": 0}
+
+    def attach(self, engine: Engine) -> None:
+        """Empieza a grabar las consultas de 'engine' (una sola vez por motor)"""
+        with self._lock:
+            if engine in self._engines:
+                return
+            self._engines.add(engine)
+        event.listen(engine, "before_execute", self._before_execute)
+        event.listen(engine, "after_execute", self._after_execute)
+
+    def _before_execute(self, conn, clauseelement, multiparams, params, execution_options) -> None:
+        conn.info["workload_start"] = time.perf_counter()
+
+    def _after_execute(self, conn, clauseelement, multiparams, params, execution_options, result) -> None:
+        start = conn.info.pop("workload_start", None)
+        if start is None or not isinstance(clauseelement, TextClause):
+            return
+        if execution_options.get(SKIP_OPTION) is False:
+            return
+        params = params or (multiparams[0] if multiparams and isinstance(multiparams[0], dict) else {})
+        self.record(clauseelement.text, params, time.perf_counter() - start)
+
+    def record(self, sql: str, params: Optional[Dict[str, Any]], seconds: float) -> None:
+        """Añade una consulta al fichero si es del workload"""
+        if not is_workload_sql(sql):
+            self._count("skipped")
+            return
+        entry = {"ts": round(time.time(), 3), "sql": normalize_sql(sql), "params": params or {},
+                 "ms": round(seconds * 1000, 3)}
+        line = (json.dumps(entry, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        try:
+            with self._lock:
+                if self._fd is None:
+                    self._open()
+                os.write(self._fd, line)
+                self._writes += 1
+                if self.max_bytes and self._writes % _ROTATE_CHECK_EVERY == 0:
+                    self._rotate()
+                self._stats["recorded"] += 1
+        except OSError as e:
+            self._count("errors")
+            logger.warning(f"No se pudo grabar la consulta en {self.path}: {e}")
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _rotate(self) -> None:
+        """Pasa el fichero a .1 si es demasiado grande (o reabre si otro proceso ya lo rotó)"""
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            current = None
+        own = os.fstat(self._fd)
+        if current is not None and current.st_ino == own.st_ino and own.st_size >= self.max_bytes:
+            os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+            current = None
+        if current is None or current.st_ino != own.st_ino:
+            os.close(self._fd)
+            self._open()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def after_fork(self) -> None:
+        """En un worker creado con fork(): lock y descriptor propios"""
+        self._lock = threading.Lock()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "file": str(self.path)}
+
+
+_recorder: Optional[WorkloadRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def get_workload_recorder() -> Optional[WorkloadRecorder]:
+    """Grabador compartido por el proceso (None si INDEX_ADVISOR_RECORD=False)"""
+    global _recorder
+    if not INDEX_ADVISOR_CONFIG['RECORD']:
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = WorkloadRecorder(INDEX_ADVISOR_CONFIG['WORKLOAD_FILE'], INDEX_ADVISOR_CONFIG['MAX_BYTES'])
+        return _recorder
+
+
+class WorkloadQuery:
+    """Forma de consulta del workload: un ejemplo con sus parámetros y cuánto se ha ejecutado"""
+
+    def __init__(self, fingerprint: str, sql: str, params: Dict[str, Any]):
+        self.fingerprint = fingerprint
+        self.sql = sql
+        self.params = params
+        self.count = 0
+        self.total_ms = 0.0
+
+
+def load_workload(path: Path) -> List[WorkloadQuery]:
+    """
+    Lee el workload grabado (el fichero rotado .1 y el actual)
+
+    Returns:
+        Formas de consulta, de más a menos tiempo acumulado; el ejemplo de
+        cada una es su ejecución más reciente
+    """
+    path = Path(path)
+    queries: Dict[str, WorkloadQuery] = {}
+    for file in (path.with_name(path.name + ".1"), path):
+        if not file.exists():
+            continue
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    sql = entry["sql"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+                fingerprint = query_fingerprint(sql)
+                query = queries.get(fingerprint)
+                if query is None:
+                    query = queries[fingerprint] = WorkloadQuery(fingerprint, sql, {})
+                query.sql, query.params = sql, entry.get("params") or {}
+                query.count += 1
+                query.total_ms += float(entry.get("ms") or 0)
+    return sorted(queries.values(), key=lambda q: q.total_ms, reverse=True)
+
+
+class IndexCandidate:
+    """Índice B-tree propuesto sobre una tabla y las consultas que podría acelerar"""
+
+    def __init__(self, table: str, columns: Tuple[str, ...]):
+        self.table = table
+        self.columns = columns
+        self.queries: Set[str] = set()
+        self.benefit = 0.0
+        self.improvement = 0.0
+
+    @property
+    def key(self) -> Tuple[str, Tuple[str, ...]]:
+        return self.table, self.columns
+
+    @property
+    def name(self) -> str:
+        # Los identificadores de PostgreSQL tienen como mucho 63 caracteres
+        name = "ix_" + "_".join((self.table,) + self.columns)
+        if len(name) > 63:
+            name = name[:54] + "_" + hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+        return name
+
+    def ddl(self, preparer: Any, concurrently: bool = False, named: bool = True) -> str:
+        columns = ", ".join(preparer.quote(c) for c in self.columns)
+        name = f"IF NOT EXISTS {preparer.quote(self.name)} " if named else ""
+        return (f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}{name}"
+                f"ON {preparer.quote(self.table)} ({columns})")
+
+
+def predicate_columns(sql: str, schema: Dict[str, Any]) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Columnas de cada tabla que usa una consulta, por tipo de uso
+
+    Returns:
+        tabla -> {'eq': [...], 'range': [...], 'order': [...]}: igualdades
+        e IN (también las de JOIN ... ON), rangos y BETWEEN, y columnas de
+        GROUP BY / ORDER BY, en orden de aparición. Las columnas dentro de
+        funciones o expresiones no cuentan: un índice simple no las cubre.
+    """
+    sql = unwrap_page(sql)
+    tokens = tokenize(sql)
+    lowered = [t.lower() for t in tokens]
+    aliases = table_aliases(sql)
+    columns = {
+        name: {column['name'].lower() for column in info.get('columns', [])}
+        for name, info in schema.items()
+    }
+    used = {t for targets in aliases.values() for t in targets if t in columns}
+    usage: Dict[str, Dict[str, List[str]]] = {}
+
+    def add(table: str, column: str, kind: str) -> None:
+        kinds = usage.setdefault(table, {"eq": [], "range": [], "order": []})
+        if column not in kinds[kind]:
+            kinds[kind].append(column)
+
+    clause: Optional[str] = None
+    stack: List[Optional[str]] = []
+    i = 0
+    while i < len(tokens):
+        token = lowered[i]
+        if token == "(":
+            stack.append(clause)
+        elif token == ")":
+            clause = stack.pop() if stack else None
+        elif token in _FILTER_KEYWORDS:
+            clause = "filter"
+        elif token in ("group", "order") and i + 1 < len(tokens) and lowered[i + 1] == "by":
+            clause = "order"
+            i += 1
+        elif token in _RESET_KEYWORDS:
+            clause = None
+        elif clause is not None and _is_identifier(tokens[i]) and (i == 0 or tokens[i - 1] not in (".", ":")):
+            # Columna calificada (alias.columna) o sin calificar
+            if i + 2 < len(tokens) and tokens[i + 1] == "." and _is_identifier(tokens[i + 2]):
+                targets = [t for t in aliases.get(_unquote(tokens[i]), ()) if t in columns]
+                column, end = _unquote(tokens[i + 2]).lower(), i + 2
+            else:
+                targets = [t for t in used if token in columns[t]]
+                column, end = _unquote(tokens[i]).lower(), i
+            if len(targets) == 1 and column in columns[targets[0]] \
+                    and (end + 1 >= len(tokens) or tokens[end + 1] != "("):
+                kind = _usage_kind(lowered, i, end, clause)
+                if kind is not None:
+                    add(targets[0], column, kind)
+            i = end
+        i += 1
+    return usage
+
+
+def _usage_kind(lowered: List[str], start: int, end: int, clause: str) -> Optional[str]:
+    """Tipo de uso de la columna tokens[start:end + 1] según los operadores que la rodean"""
+    after = lowered[end + 1:end + 3]
+    before = lowered[max(0, start - 2):start]
+    if clause == "order":
+        # Solo columnas sueltas: 'ORDER BY a, b DESC', no expresiones
+        previous = before[-1] if before else ""
+        following = after[0] if after else ""
+        if previous in ("by", ",") and following in ("", ",", "asc", "desc", "limit", "offset", ")", "nulls",
+                                                        "having", "order"):
+            return "order"
+        return None
+    if after and (after[0] == "in" or after[:2] == ["is", "null"]):
+        return "eq"
+    if after and after[0] == "=" and not (before and before[-1] in ("<", ">", "!")):
+        return "eq"
+    if after and (after[0] in ("<", ">", "between")) and after[:2] != ["<", ">"]:
+        return "range"
+    if before and before[-1] == "=" and not (len(before) > 1 and before[-2] in ("<", ">", "!")):
+        return "eq"
+    if before and (before[-1] in ("<", ">") or before[-2:] in (["<", "="], [">", "="])):
+        return "range"
+    return None
+
+
+class IndexAdvisor:
+    """
+    Recomienda índices para un workload grabado
+
+    Args:
+        engine: motor de SQLAlchemy de la base a analizar
+        schema: esquema con el formato de get_database_schema() (por
+            defecto se introspecciona)
+        config: valores que sustituyen a INDEX_ADVISOR_CONFIG
+    """
+
+    def __init__(self, engine: Engine, schema: Optional[Dict[str, Any]] = None,
+                 config: Optional[Dict[str, Any]] = None):
+        self.engine = engine
+        self.config = {**INDEX_ADVISOR_CONFIG, **(config or {})}
+        if schema is None:
+            from src.schema import introspect_schema
+            schema = introspect_schema(engine)
+        self.schema = {name.lower(): info for name, info in schema.items()}
+        self.postgres = engine.dialect.name == "postgresql"
+        self.preparer = engine.dialect.identifier_preparer
+
+    def existing_indexes(self) -> Dict[str, List[Tuple[Tuple[str, ...], bool]]]:
+        """Tabla -> [(columnas, único)] de la clave primaria y los índices existentes"""
+        inspector = inspect(self.engine)
+        indexes: Dict[str, List[Tuple[Tuple[str, ...], bool]]] = {}
+        for table in self.schema:
+            found = []
+            primary = inspector.get_pk_constraint(table).get("constrained_columns") or []
+            if primary:
+                found.append((tuple(c.lower() for c in primary), True))
+            for index in inspector.get_indexes(table):
+                columns = [c for c in index.get("column_names") or [] if c]
+                if columns:
+                    found.append((tuple(c.lower() for c in columns), bool(index.get("unique"))))
+            for constraint in inspector.get_unique_constraints(table):
+                found.append((tuple(c.lower() for c in constraint["column_names"]), True))
+            indexes[table] = found
+        return indexes
+
+    def candidates(self, queries: Iterable[WorkloadQuery],
+                   existing: Optional[Dict[str, List[Tuple[Tuple[str, ...], bool]]]] = None) -> List[IndexCandidate]:
+        """
+        Índices que podrían acelerar cada consulta y no cubre ya otro índice
+
+        Por tabla: una columna para cada igualdad o rango; las dos primeras
+        igualdades juntas; y las igualdades seguidas del primer rango (o de
+        la primera columna de ORDER BY), como mucho tres columnas.
+        """
+        existing = existing if existing is not None else self.existing_indexes()
+        found: Dict[Tuple[str, Tuple[str, ...]], IndexCandidate] = {}
+        for query in queries:
+            for table, kinds in predicate_columns(query.sql, self.schema).items():
+                eq, ranges, order = kinds["eq"], [c for c in kinds["range"] if c not in kinds["eq"]], kinds["order"]
+                options = [(c,) for c in eq + ranges]
+                if len(eq) >= 2:
+                    options.append(tuple(eq[:2]))
+                tail = (ranges or [c for c in order if c not in eq])[:1]
+                if eq and tail:
+                    options.append(tuple(eq[:2] + tail))
+                for columns in options:
+                    if _covered(columns, existing.get(table, [])):
+                        continue
+                    candidate = found.setdefault((table, columns), IndexCandidate(table, columns))
+                    candidate.queries.add(query.fingerprint)
+        return list(found.values())
+
+    def analyze(self, queries: List[WorkloadQuery], apply: bool = False,
+                strategy: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Mide una muestra del workload, evalúa los candidatos y (con apply)
+        crea los índices recomendados
+
+        Returns:
+            Informe: estrategia, recomendaciones con su DDL y su mejora, y
+            totales y detalle por consulta antes y después
+        """
+        sample = sorted(queries, key=lambda q: q.total_ms, reverse=True)[:self.config['SAMPLE_SIZE']]
+        with self._connect() as conn:
+            strategy = self._strategy(conn, strategy or self.config['STRATEGY'])
+            metric = "cost" if strategy == "hypopg" else "ms"
+            before = {}
+            for query in sample:
+                measured = self._measure(conn, query, analyze=True)
+                if measured is not None:
+                    before[query.fingerprint] = measured
+            sample = [q for q in sample if q.fingerprint in before]
+            candidates = self.candidates(sample)
+            selected, simulated = [], {}
+            if strategy is not None:
+                selected, simulated = self._select(conn, candidates, sample, before, strategy, metric)
+            after = simulated if selected else {}
+            if selected and apply:
+                for candidate in selected:
+                    self._create(conn, candidate)
+                after = {q.fingerprint: self._measure(conn, q, analyze=True) for q in sample}
+        return self._report(queries, sample, candidates, selected, before, after, strategy, metric,
+                            apply and bool(selected))
+
+    def _connect(self):
+        # Conexión propia en autocommit: CREATE INDEX CONCURRENTLY no admite
+        # transacciones y los índices hipotéticos de hypopg son de la sesión
+        return self.engine.connect().execution_options(isolation_level="AUTOCOMMIT", **{SKIP_OPTION: False})
+
+    def _strategy(self, conn: Any, requested: str) -> Optional[str]:
+        """Estrategia de evaluación disponible ('hypopg', 'trial' o None)"""
+        hypopg = self.postgres and conn.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = 'hypopg'")).first() is not None
+        if requested == "hypopg" and not hypopg:
+            logger.warning("La extensión hypopg no está instalada: los candidatos no se evalúan")
+            return None
+        if requested == "auto":
+            if hypopg:
+                return "hypopg"
+            if self.postgres:
+                # Crear índices de prueba bloquea las escrituras en la tabla
+                logger.warning("Sin hypopg los candidatos no se evalúan (use --strategy trial para "
+                               "crearlos de prueba)")
+                return None
+            return "trial"
+        return requested
+
+    def _measure(self, conn: Any, query: WorkloadQuery, analyze: bool) -> Optional[Dict[str, Any]]:
+        """
+        Coste de una consulta: en PostgreSQL el plan (ms reales con
+        analyze, coste estimado y bloques leídos); en otros motores, el
+        mejor de REPEAT tiempos de ejecución y las tablas recorridas enteras
+
+        El workload es un fichero: cada entrada pasa por validate_sql y se
+        ejecuta en solo lectura (_read_only) antes de medirla.
+        """
+        valid, error = validate_sql(query.sql, self.schema)
+        if not valid:
+            logger.warning(f"Consulta {query.fingerprint} del workload descartada: {error}")
+            return None
+        try:
+            with self._read_only(conn):
+                return self._run_measure(conn, query, analyze)
+        except SQLAlchemyError as e:
+            logger.warning(f"No se pudo medir la consulta {query.fingerprint}: {getattr(e, 'orig', e)}")
+            return None
+
+    def _run_measure(self, conn: Any, query: WorkloadQuery, analyze: bool) -> Dict[str, Any]:
+        if self.postgres:
+            options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+            plan = conn.execute(text(f"EXPLAIN ({options}) {query.sql}"), query.params).scalar()
+            return _plan_summary(plan)
+        best = None
+        for _ in range(max(1, self.config['REPEAT'])):
+            start = time.perf_counter()
+            conn.execute(text(query.sql), query.params).fetchall()
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        scans: Set[str] = set()
+        if self.engine.dialect.name == "sqlite":
+            # 'SCAN <alias>' sin índice; los alias se traducen a tablas del esquema
+            aliases = table_aliases(unwrap_page(query.sql))
+            for row in conn.execute(text(f"EXPLAIN QUERY PLAN {query.sql}"), query.params):
+                detail = row[-1].split()
+                if len(detail) == 2 and detail[0] == "SCAN":
+                    scans.update(t for t in aliases.get(detail[1].lower(), ()) if t in self.schema)
+        return {"ms": round(best, 3), "cost": None, "buffers": None, "seq_scans": sorted(set(scans))}
+
+    @contextmanager
+    def _read_only(self, conn: Any) -> Iterator[None]:
+        """
+        La conexión está en autocommit (ver _connect): la medición va en su
+        propia transacción READ ONLY que se deshace al terminar (EXPLAIN
+        ANALYZE ejecuta la consulta). En SQLite, PRAGMA query_only.
+        """
+        if self.postgres:
+            conn.execute(text("BEGIN"))
+            try:
+                conn.execute(text("SET TRANSACTION READ ONLY"))
+                yield
+            finally:
+                conn.execute(text("ROLLBACK"))
+        elif self.engine.dialect.name == "sqlite":
+            conn.execute(text("PRAGMA query_only = ON"))
+            try:
+                yield
+            finally:
+                conn.execute(text("PRAGMA query_only = OFF"))
+        else:
+            yield
+
+    def _select(self, conn: Any, candidates: List[IndexCandidate], sample: List[WorkloadQuery],
+                before: Dict[str, Dict[str, Any]], strategy: str,
+                metric: str) -> Tuple[List[IndexCandidate], Dict[str, Dict[str, Any]]]:
+        """
+        Elección voraz: en cada ronda, el candidato que más reduce el coste
+        ponderado de las consultas de su tabla con los ya elegidos presentes
+
+        Tras elegir uno se vuelven a medir las consultas de su tabla y se
+        reevalúan los demás candidatos de esa tabla, para que dos índices
+        que sirven a la misma consulta no sumen dos veces la mejora. Se para
+        en MAX_INDEXES o cuando ninguno mejora al menos MIN_IMPROVEMENT; no
+        se eligen dos índices con la misma primera columna.
+
+        Returns:
+            Tuple con (elegidos, mediciones con todos los elegidos)
+        """
+        tables = {q.fingerprint: extract_tables(unwrap_page(q.sql))[0] for q in sample}
+        current = dict(before)
+        for candidate in candidates:
+            self._evaluate(conn, candidate, sample, tables, current, strategy, metric)
+        logger.info(f"{len(candidates)} candidatos evaluados con '{strategy}'")
+
+        selected: List[IndexCandidate] = []
+        handles = []
+        try:
+            while len(selected) < self.config['MAX_INDEXES']:
+                eligible = [
+                    c for c in candidates
+                    if c not in selected and c.benefit > 0 and c.improvement >= self.config['MIN_IMPROVEMENT']
+                    and not any(s.table == c.table and s.columns[0] == c.columns[0] for s in selected)
+                ]
+                if not eligible:
+                    break
+                best = max(eligible, key=lambda c: c.benefit)
+                handles.append(self._add_index(conn, best, strategy))
+                selected.append(best)
+                for query in sample:
+                    if best.table in tables[query.fingerprint]:
+                        current[query.fingerprint] = self._measure(conn, query, analyze=strategy != "hypopg") \
+                            or current[query.fingerprint]
+                for candidate in candidates:
+                    if candidate not in selected and candidate.table == best.table:
+                        self._evaluate(conn, candidate, sample, tables, current, strategy, metric)
+        finally:
+            for handle in reversed(handles):
+                self._drop_index(conn, handle, strategy)
+        return selected, current
+
+    def _evaluate(self, conn: Any, candidate: IndexCandidate, sample: List[WorkloadQuery],
+                  tables: Dict[str, Set[str]], current: Dict[str, Dict[str, Any]],
+                  strategy: str, metric: str) -> None:
+        """
+        Beneficio del candidato frente a las mediciones actuales, y su
+        mejora como fracción del coste de toda la muestra
+
+        Se miden todas las consultas que leen su tabla, no solo las que lo
+        motivaron: un índice nuevo también puede cambiar (y empeorar) otros
+        planes.
+        """
+        affected = [q for q in sample if candidate.table in tables[q.fingerprint]]
+        try:
+            handle = self._add_index(conn, candidate, strategy)
+        except SQLAlchemyError as e:
+            logger.warning(f"No se pudo evaluar {candidate.name}: {getattr(e, 'orig', e)}")
+            candidate.benefit = candidate.improvement = 0.0
+            return
+        try:
+            measured = {q.fingerprint: self._measure(conn, q, analyze=strategy != "hypopg") for q in affected}
+        finally:
+            self._drop_index(conn, handle, strategy)
+        base = sum(q.count * current[q.fingerprint][metric] for q in affected)
+        new = sum(q.count * (measured[q.fingerprint] or current[q.fingerprint])[metric] for q in affected)
+        workload = sum(q.count * current[q.fingerprint][metric] for q in sample)
+        candidate.benefit = base - new
+        candidate.improvement = candidate.benefit / workload if workload else 0.0
+
+    def _add_index(self, conn: Any, candidate: IndexCandidate, strategy: str) -> Any:
+        """Crea un candidato para medir: hipotético (devuelve su oid) o real (devuelve su nombre)"""
+        if strategy == "hypopg":
+            return conn.execute(text("SELECT indexrelid FROM hypopg_create_index(:ddl)"),
+                                {"ddl": candidate.ddl(self.preparer, named=False)}).scalar()
+        with self._no_statement_timeout(conn):
+            conn.execute(text(candidate.ddl(self.preparer)))
+        return candidate.name
+
+    def _drop_index(self, conn: Any, handle: Any, strategy: str) -> None:
+        if strategy == "hypopg":
+            conn.execute(text("SELECT hypopg_drop_index(:oid)"), {"oid": handle})
+        else:
+            conn.execute(text(f"DROP INDEX IF EXISTS {self.preparer.quote(handle)}"))
+
+    def _create(self, conn: Any, candidate: IndexCandidate) -> None:
+        ddl = candidate.ddl(self.preparer, concurrently=self.postgres)
+        logger.info(f"Creando índice: {ddl}")
+        start = time.perf_counter()
+        with self._no_statement_timeout(conn):
+            conn.execute(text(ddl))
+        logger.info(f"Índice {candidate.name} creado en {time.perf_counter() - start:.2f}s")
+
+    @contextmanager
+    def _no_statement_timeout(self, conn: Any) -> Iterator[None]:
+        """Construir un índice puede tardar más que el statement_timeout de la aplicación"""
+        if not self.postgres:
+            yield
+            return
+        conn.execute(text("SET statement_timeout = 0"))
+        try:
+            yield
+        finally:
+            conn.execute(text("RESET statement_timeout"))
+
+    def _report(self, queries: List[WorkloadQuery], sample: List[WorkloadQuery],
+                candidates: List[IndexCandidate], selected: List[IndexCandidate],
+                before: Dict[str, Dict[str, Any]], after: Dict[str, Dict[str, Any]],
+                strategy: Optional[str], metric: str, applied: bool) -> Dict[str, Any]:
+        def total(measurements: Dict[str, Optional[Dict[str, Any]]], name: str) -> Optional[float]:
+            values = [(q.count, (measurements.get(q.fingerprint) or {}).get(name)) for q in sample]
+            if not values or any(v is None for _, v in values):
+                return None
+            return round(sum(count * value for count, value in values), 3)
+
+        return {
+            "strategy": strategy,
+            "metric": metric,
+            "applied": applied,
+            "statements": sum(q.count for q in queries),
+            "queries": len(queries),
+            "sampled": len(sample),
+            "recommendations": [{
+                "table": c.table, "columns": list(c.columns), "name": c.name,
+                "ddl": c.ddl(self.preparer, concurrently=self.postgres),
+                "benefit": round(c.benefit, 3), "improvement": round(c.improvement, 4),
+                "queries": len(c.queries)
+            } for c in selected],
+            "candidates": [{
+                "table": c.table, "columns": list(c.columns),
+                "benefit": round(c.benefit, 3), "improvement": round(c.improvement, 4)
+            } for c in sorted(candidates, key=lambda c: c.benefit, reverse=True)],
+            "before": {name: total(before, name) for name in ("ms", "cost")},
+            "after": {name: total(after, name) for name in ("ms", "cost")} if after else None,
+            "detail": [{
+                "fingerprint": q.fingerprint, "sql": q.sql, "count": q.count,
+                "before": before.get(q.fingerprint), "after": after.get(q.fingerprint) if after else None
+            } for q in sample]
+        }
+
+
+def _covered(columns: Tuple[str, ...], existing: List[Tuple[Tuple[str, ...], bool]]) -> bool:
+    """True si un índice existente empieza por esas columnas o la primera ya es única"""
+    for index, unique in existing:
+        if index[:len(columns)] == columns or (unique and index == columns[:len(index)]):
+            return True
+    return False
+
+
+def _plan_summary(plan: Any) -> Dict[str, Any]:
+    """Tiempo, coste, bloques y tablas recorridas enteras de EXPLAIN (FORMAT JSON)"""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]
+    node = root["Plan"]
+    scans: Set[str] = set()
+    pending = [node]
+    while pending:
+        current = pending.pop()
+        if current.get("Node Type") == "Seq Scan" and current.get("Relation Name"):
+            scans.add(current["Relation Name"])
+        pending.extend(current.get("Plans", []))
+    blocks = node.get("Shared Hit Blocks")
+    if blocks is not None:
+        blocks += node.get("Shared Read Blocks", 0)
+    elapsed = root.get("Execution Time")
+    return {
+        "ms": round(elapsed + root.get("Planning Time", 0), 3) if elapsed is not None else None,
+        "cost": float(node["Total Cost"]),
+        "buffers": blocks,
+        "seq_scans": sorted(scans)
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Informe en texto de IndexAdvisor.analyze"""
+    unit = "coste estimado" if report["metric"] == "cost" else "ms"
+    lines = [
+        f"Workload: {report['statements']} sentencias, {report['queries']} consultas distintas, "
+        f"{report['sampled']} medidas",
+        f"Evaluación: {report['strategy'] or 'sin evaluar (instale hypopg o use --strategy trial)'}",
+        ""
+    ]
+    if report["recommendations"]:
+        lines.append("Índices recomendados" + (" (creados)" if report["applied"] else "") + ":")
+        for r in report["recommendations"]:
+            lines.append(f"  {r['ddl']}")
+            lines.append(f"      -{r['improvement']:.0%} del workload; motivado por "
+                         f"{r['queries']} consulta{'s' if r['queries'] != 1 else ''} "
+                         f"({r['benefit']:.1f} {unit} ponderados)")
+    else:
+        lines.append("Ningún índice supera la mejora mínima")
+    if report["strategy"] is None and report["candidates"]:
+        lines.append("")
+        lines.append("Candidatos:")
+        lines.extend(f"  {c['table']} ({', '.join(c['columns'])})" for c in report["candidates"])
+
+    lines.append("")
+    before, after = report["before"], report["after"] or {}
+
+    def value(totals: Dict[str, Any], name: str) -> str:
+        return "-" if totals.get(name) is None else f"{totals[name]:.1f}"
+
+    lines.append(f"{'':<10} {'ms':>12} {'coste':>14}   (ponderado por ejecuciones)")
+    lines.append(f"{'antes':<10} {value(before, 'ms'):>12} {value(before, 'cost'):>14}")
+    if report["after"]:
+        label = "después" if report["applied"] else "simulado"
+        lines.append(f"{label:<10} {value(after, 'ms'):>12} {value(after, 'cost'):>14}")
+
+    lines.append("")
+    lines.append(f"{'consulta':<14} {'veces':>6} {'antes':>10} {'después':>10}  tablas recorridas enteras")
+    for item in report["detail"]:
+        old, new = item["before"] or {}, item["after"] or {}
+        metric = report["metric"]
+        scans = ", ".join(old.get("seq_scans") or []) or "-"
+        if new:
+            scans += f" -> {', '.join(new.get('seq_scans') or []) or '-'}"
+        new_value = "-" if new.get(metric) is None else f"{new[metric]:.1f}"
+        lines.append(f"{item['fingerprint']:<14} {item['count']:>6} {old.get(metric, 0):>10.1f} "
+                     f"{new_value:>10}  {scans}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workload", default=str(INDEX_ADVISOR_CONFIG['WORKLOAD_FILE']),
+                        help="Fichero JSONL grabado por WorkloadRecorder")
+    parser.add_argument("--sample", type=int, default=INDEX_ADVISOR_CONFIG['SAMPLE_SIZE'],
+                        help="Consultas distintas que se miden (las de más tiempo acumulado)")
+    parser.add_argument("--max-indexes", type=int, default=INDEX_ADVISOR_CONFIG['MAX_INDEXES'])
+    parser.add_argument("--min-improvement", type=float, default=INDEX_ADVISOR_CONFIG['MIN_IMPROVEMENT'])
+    parser.add_argument("--strategy", choices=["auto", "hypopg", "trial"], default=INDEX_ADVISOR_CONFIG['STRATEGY'])
+    parser.add_argument("--apply", action="store_true", help="Crear los índices recomendados")
+    parser.add_argument("--json", action="store_true", help="Informe en JSON")
+    parser.add_argument("--output", help="Fichero del informe (por defecto, la salida estándar)")
+    args = parser.parse_args()
+
+    queries = load_workload(Path(args.workload))
+    if not queries:
+        parser.error(f"No hay consultas grabadas en {args.workload}")
+
+    from src.models import engine
+    advisor = IndexAdvisor(engine, config={"SAMPLE_SIZE": args.sample, "MAX_INDEXES": args.max_indexes,
+                                           "MIN_IMPROVEMENT": args.min_improvement})
+    report = advisor.analyze(queries, apply=args.apply, strategy=args.strategy)
+    body = json.dumps(report, ensure_ascii=False, indent=2, default=str) if args.json else format_report(report)
+    if args.output:
+        Path(args.output).write_text(body + "\n", encoding="utf-8")
+    else:
+        print(body)
+
+
+if __name__ == "__main__":
+    main()
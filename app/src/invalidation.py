@@ -0,0 +1,359 @@
+"""
+Invalidación de cachés por eventos con LISTEN/NOTIFY de PostgreSQL
+
+install_triggers() crea, de forma idempotente:
+  - en cada tabla vigilada, un trigger AFTER INSERT/UPDATE/DELETE/TRUNCATE
+    FOR EACH STATEMENT que hace pg_notify(canal, {"table", "op", "ts"}):
+    una notificación por sentencia (no por fila) que PostgreSQL entrega al
+    confirmar la transacción y descarta si se deshace
+  - un event trigger ddl_command_end (CREATE/ALTER/DROP de tablas y vistas)
+    que notifica {"ddl": etiqueta}. Requiere superusuario: si no se puede
+    crear se avisa y el esquema se sigue revisando cada
+    CACHE_SCHEMA_CHECK_INTERVAL segundos
+
+ChangeListener escucha el canal desde una conexión propia, fuera del pool,
+en un hilo en segundo plano. Agrupa las notificaciones que llegan juntas y
+llama a on_change(tablas, ddl). Si pierde la conexión se reconecta y llama
+a on_change(None, True): durante el corte pudieron perderse escrituras y
+cambios de esquema.
+
+Uso (desde app/, con la base de datos de DB_* o DATABASE_URL):
+    python -m src.invalidation --install       # triggers y event trigger
+    python -m src.invalidation --listen        # muestra las notificaciones
+    python -m src.invalidation --uninstall
+"""
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from src.config import INVALIDATION_CONFIG
+from src.tracing import tracer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+import argparse
+import json
+import logging
+import re
+import select
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+tracer.metrics.describe("chatbot_invalidation_notifications_total", "counter",
+                        "Notificaciones de cambios recibidas por tabla (o DDL)")
+tracer.metrics.describe("chatbot_invalidation_lag_seconds", "histogram",
+                        "Tiempo desde la sentencia que cambia una tabla hasta que se invalida la caché")
+
+TRIGGER_NAME = "chatbot_notify_change"
+# Segundos máximos de espera en select(): cada cuánto se comprueba stop()
+POLL_SECONDS = 1.0
+# DDL que puede cambiar lo que devuelve get_database_schema()
+DDL_TAGS = (
+    "CREATE TABLE", "CREATE TABLE AS", "SELECT INTO", "ALTER TABLE", "DROP TABLE",
+    "CREATE VIEW", "ALTER VIEW", "DROP VIEW", "CREATE MATERIALIZED VIEW",
+    "ALTER MATERIALIZED VIEW", "DROP MATERIALIZED VIEW", "CREATE FOREIGN TABLE",
+    "ALTER FOREIGN TABLE", "DROP FOREIGN TABLE", "COMMENT"
+)
+_CHANNEL = re.compile(r"^[a-z_][a-z0-9_]{0,50}$")
+
+# El canal llega como argumento del trigger: una sola función para todos
+_NOTIFY_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION {TRIGGER_NAME}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify(TG_ARGV[0], json_build_object(
+        'table', TG_TABLE_NAME, 'op', TG_OP,
+        'ts', extract(epoch FROM clock_timestamp()))::text);
+    RETURN NULL;
+END
+$$
+"""
+
+
+def _check_channel(channel: str) -> str:
+    # El canal se escribe dentro de la SQL de los triggers
+    if not _CHANNEL.match(channel):
+        raise ValueError(f"Canal de invalidación no válido: {channel!r} (minúsculas, dígitos y _)")
+    return channel
+
+
+def supports_notify(engine: Engine) -> bool:
+    """LISTEN/NOTIFY solo existe en PostgreSQL (y la escucha usa psycopg2)"""
+    return engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+
+
+def install_triggers(engine: Engine, tables: Iterable[str], channel: str, ddl: bool = True) -> Dict[str, Any]:
+    """
+    Crea o actualiza los triggers de notificación
+
+    Los triggers de tabla se crean en una transacción con un bloqueo
+    consultivo (varios workers pueden arrancar a la vez); el event trigger,
+    en otra, para que la falta de permisos no deshaga los primeros.
+
+    Returns:
+        {'tables': [tablas con trigger], 'ddl': True si hay event trigger}
+    """
+    _check_channel(channel)
+    preparer = engine.dialect.identifier_preparer
+    tables = sorted(set(tables))
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock(hashtext('{channel}'))")
+        conn.exec_driver_sql(_NOTIFY_FUNCTION)
+        for table in tables:
+            quoted = preparer.quote(table)
+            conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON {quoted}")
+            conn.exec_driver_sql(
+                f"CREATE TRIGGER {TRIGGER_NAME} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE "
+                f"ON {quoted} FOR EACH STATEMENT EXECUTE FUNCTION {TRIGGER_NAME}('{channel}')"
+            )
+
+    installed_ddl = False
+    if ddl:
+        tags = ", ".join(f"'{tag}'" for tag in DDL_TAGS)
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock(hashtext('{channel}'))")
+                # Las funciones de event trigger no admiten argumentos: una por canal
+                conn.exec_driver_sql(f"""
+CREATE OR REPLACE FUNCTION {channel}_ddl() RETURNS event_trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', json_build_object(
+        'ddl', TG_TAG, 'ts', extract(epoch FROM clock_timestamp()))::text);
+END
+$$
+""")
+                conn.exec_driver_sql(f"DROP EVENT TRIGGER IF EXISTS {channel}_ddl")
+                conn.exec_driver_sql(
+                    f"CREATE EVENT TRIGGER {channel}_ddl ON ddl_command_end "
+                    f"WHEN TAG IN ({tags}) EXECUTE FUNCTION {channel}_ddl()"
+                )
+            installed_ddl = True
+        except SQLAlchemyError as e:
+            logger.warning(
+                "No se pudo crear el event trigger de DDL (requiere superusuario): "
+                f"el esquema se revisará periódicamente. {getattr(e, 'orig', e)}"
+            )
+    logger.info(f"Triggers de invalidación en {len(tables)} tablas (canal '{channel}', DDL: {installed_ddl})")
+    return {"tables": tables, "ddl": installed_ddl}
+
+
+def uninstall_triggers(engine: Engine, tables: Iterable[str], channel: str) -> None:
+    """Borra los triggers, el event trigger y sus funciones"""
+    _check_channel(channel)
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        for table in sorted(set(tables)):
+            conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON {preparer.quote(table)}")
+    try:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"DROP EVENT TRIGGER IF EXISTS {channel}_ddl")
+            conn.exec_driver_sql(f"DROP FUNCTION IF EXISTS {channel}_ddl()")
+    except SQLAlchemyError as e:
+        logger.warning(f"No se pudo borrar el event trigger de DDL: {getattr(e, 'orig', e)}")
+    with engine.begin() as conn:
+        # Otros canales pueden seguir usando la función común
+        remaining = conn.exec_driver_sql(
+            f"SELECT COUNT(*) FROM pg_trigger WHERE tgname = '{TRIGGER_NAME}'").scalar()
+        if not remaining:
+            conn.exec_driver_sql(f"DROP FUNCTION IF EXISTS {TRIGGER_NAME}()")
+
+
+class ChangeListener:
+    """
+    Escucha las notificaciones de cambios en un hilo en segundo plano
+
+    on_change(tablas, ddl) recibe el conjunto de tablas escritas desde la
+    llamada anterior (None si pudieron perderse notificaciones) y si hubo
+    (o pudo haber) DDL. Se ejecuta en el hilo de escucha: debe ser rápida.
+    """
+
+    def __init__(self, engine: Engine, channel: str,
+                 on_change: Callable[[Optional[Set[str]], bool], None],
+                 reconnect_seconds: float = 5.0):
+        self.engine = engine
+        self.channel = _check_channel(channel)
+        self.on_change = on_change
+        self.reconnect_seconds = reconnect_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._conn = None
+        # Conexiones heredadas de fork(): no deben cerrarse desde el hijo
+        self._inherited: List[Any] = []
+        self._lock = threading.Lock()
+        self.connected = False
+        self.notifications = 0
+        self.batches = 0
+        self.ddl_events = 0
+        self.reconnects = 0
+        self.errors = 0
+        self._lag_total = 0.0
+        self._lag_count = 0
+        self._last_lag = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="invalidation-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = POLL_SECONDS * 2) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def after_fork(self) -> None:
+        """
+        En un worker creado con fork(): el hilo de escucha no existe en el
+        hijo y la conexión heredada es del padre (se suelta sin cerrarla)
+        """
+        if self._conn is not None:
+            self._inherited.append(self._conn)
+            self._conn = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.connected = False
+        self.start()
+
+    def _connect(self):
+        cargs, cparams = self.engine.dialect.create_connect_args(self.engine.url)
+        conn = self.engine.dialect.loaded_dbapi.connect(*cargs, **cparams)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        return conn
+
+    def _run(self) -> None:
+        first = True
+        while not self._stop.is_set():
+            try:
+                self._conn = self._connect()
+            except Exception as e:
+                self._failed("conexión", e)
+                self._stop.wait(self.reconnect_seconds)
+                continue
+            self.connected = True
+            if not first:
+                # Lo escrito mientras no se escuchaba no se notificará
+                with self._lock:
+                    self.reconnects += 1
+                logger.info("Escucha de invalidación reconectada: se descartan los resultados en caché")
+                self._dispatch(None, True)
+            first = False
+            try:
+                self._listen(self._conn)
+            except Exception as e:
+                self._failed("escucha", e)
+            finally:
+                self.connected = False
+                conn, self._conn = self._conn, None
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stop.wait(self.reconnect_seconds)
+
+    def _listen(self, conn: Any) -> None:
+        while not self._stop.is_set():
+            if not select.select([conn], [], [], POLL_SECONDS)[0]:
+                continue
+            conn.poll()
+            if not conn.notifies:
+                continue
+            tables: Set[str] = set()
+            ddl = False
+            now = time.time()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    payload = json.loads(notify.payload)
+                except ValueError:
+                    payload = {}
+                if "ddl" in payload:
+                    ddl = True
+                    tracer.metrics.inc("chatbot_invalidation_notifications_total", table="ddl")
+                elif payload.get("table"):
+                    tables.add(payload["table"])
+                    tracer.metrics.inc("chatbot_invalidation_notifications_total", table=payload["table"])
+                if "ts" in payload:
+                    self._observe_lag(now - float(payload["ts"]))
+                with self._lock:
+                    self.notifications += 1
+                    self.ddl_events += "ddl" in payload
+            self._dispatch(tables, ddl)
+
+    def _dispatch(self, tables: Optional[Set[str]], ddl: bool) -> None:
+        try:
+            self.on_change(tables, ddl)
+        except Exception as e:
+            self._failed("invalidación", e)
+        with self._lock:
+            self.batches += 1
+
+    def _observe_lag(self, lag: float) -> None:
+        lag = max(0.0, lag)
+        tracer.metrics.observe("chatbot_invalidation_lag_seconds", lag)
+        with self._lock:
+            self._lag_total += lag
+            self._lag_count += 1
+            self._last_lag = lag
+
+    def _failed(self, stage: str, error: Exception) -> None:
+        with self._lock:
+            self.errors += 1
+        logger.warning(f"Escucha de invalidación ({stage}): {error}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "channel": self.channel,
+                "connected": self.connected,
+                "notifications": self.notifications,
+                "batches": self.batches,
+                "ddl_events": self.ddl_events,
+                "reconnects": self.reconnects,
+                "errors": self.errors,
+                "avg_lag_ms": round(self._lag_total / self._lag_count * 1000, 3) if self._lag_count else 0.0,
+                "last_lag_ms": round(self._last_lag * 1000, 3) if self._last_lag is not None else None
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--install", action="store_true", help="Crear o actualizar los triggers")
+    action.add_argument("--uninstall", action="store_true", help="Borrar los triggers")
+    action.add_argument("--listen", action="store_true", help="Mostrar las notificaciones recibidas")
+    parser.add_argument("--channel", default=INVALIDATION_CONFIG['CHANNEL'])
+    parser.add_argument("--tables", help="Tablas separadas por comas (por defecto INVALIDATION_TABLES o todas)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from sqlalchemy import inspect
+    from src.models import engine
+    if not supports_notify(engine):
+        parser.error(f"LISTEN/NOTIFY requiere PostgreSQL con psycopg2 (motor: {engine.dialect.name})")
+    tables = ([t.strip() for t in args.tables.split(",") if t.strip()] if args.tables
+              else INVALIDATION_CONFIG['TABLES'] or inspect(engine).get_table_names())
+
+    if args.install:
+        print(json.dumps(install_triggers(engine, tables, args.channel, ddl=INVALIDATION_CONFIG['DDL']),
+                         ensure_ascii=False))
+    elif args.uninstall:
+        uninstall_triggers(engine, tables, args.channel)
+    else:
+        def show(changed: Optional[Set[str]], ddl: bool) -> None:
+            print(f"{time.strftime('%H:%M:%S')} tablas={sorted(changed) if changed is not None else 'todas'} ddl={ddl}",
+                  flush=True)
+
+        listener = ChangeListener(engine, args.channel, show, INVALIDATION_CONFIG['RECONNECT_SECONDS'])
+        listener.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            listener.stop()
+
+
+if __name__ == "__main__":
+    main()
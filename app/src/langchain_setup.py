@@ -1,32 +1,70 @@
 from langchain_community.agent_toolkits import create_sql_agent
 from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_community.utilities.sql_database import SQLDatabase
-from src.config import GROQ_API_KEY, MODEL_NAME, get_db_uri
+from src.config import GROQ_API_KEY, MODEL_NAME, AGENT_VERBOSE, LLM_CONFIG
+from src.resilience import ResilientChatModel
+from src.tracing import TracingCallbackHandler
+import httpx
 import logging
-from typing import Optional, Any
+from typing import Optional, Any, Dict, List
 
 logger = logging.getLogger(__name__)
 
-def setup_sql_agent(db_manager) -> Optional[Any]:
-    """Configura el agente SQL con LangChain"""
+def create_groq_model(model_name: str, http_client: Optional[httpx.Client] = None,
+                      http_async_client: Optional[httpx.AsyncClient] = None) -> ChatGroq:
+    """ChatGroq sin reintentos propios: los hace ResilientChatModel"""
+    return ChatGroq(
+        temperature=0,
+        model_name=model_name,
+        groq_api_key=GROQ_API_KEY,
+        max_tokens=1024,
+        max_retries=0,
+        request_timeout=LLM_CONFIG['TIMEOUT'],
+        base_url=LLM_CONFIG['API_BASE'],
+        http_client=http_client,
+        http_async_client=http_async_client
+    )
+
+def create_llm() -> ResilientChatModel:
+    """
+    Crea el modelo de lenguaje de Groq con la configuración del proyecto
+
+    Modelo principal y de respaldo comparten un pool HTTP persistente
+    (conexiones keep-alive) y van envueltos en ResilientChatModel.
+    """
     if not GROQ_API_KEY:
         raise ValueError("GROQ_API_KEY no está configurada")
+    limits = httpx.Limits(
+        max_connections=LLM_CONFIG['MAX_CONNECTIONS'],
+        max_keepalive_connections=LLM_CONFIG['MAX_KEEPALIVE'],
+        keepalive_expiry=LLM_CONFIG['KEEPALIVE_EXPIRY']
+    )
+    timeout = httpx.Timeout(LLM_CONFIG['TIMEOUT'])
+    http_client = httpx.Client(limits=limits, timeout=timeout)
+    http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
 
-    # Crear instancia de SQLDatabase para LangChain
-    try:
-        db = SQLDatabase.from_uri(get_db_uri())
-    except Exception as e:
-        logger.error(f"Error al crear SQLDatabase: {e}")
-        return None
+    primary = create_groq_model(MODEL_NAME, http_client, http_async_client)
+    fallback = None
+    if LLM_CONFIG['FALLBACK_MODEL'] and LLM_CONFIG['FALLBACK_MODEL'] != MODEL_NAME:
+        fallback = create_groq_model(LLM_CONFIG['FALLBACK_MODEL'], http_client, http_async_client)
+    return ResilientChatModel(
+        primary=primary,
+        fallback=fallback,
+        max_retries=LLM_CONFIG['MAX_RETRIES'],
+        backoff_base=LLM_CONFIG['BACKOFF_BASE'],
+        backoff_max=LLM_CONFIG['BACKOFF_MAX'],
+        hedge=LLM_CONFIG['HEDGE_ENABLED'],
+        hedge_percentile=LLM_CONFIG['HEDGE_PERCENTILE'],
+        hedge_min_delay=LLM_CONFIG['HEDGE_MIN_DELAY'],
+        hedge_min_samples=LLM_CONFIG['HEDGE_MIN_SAMPLES']
+    )
 
-    # Obtener esquema de la base de datos
-    schema = db_manager.get_database_schema()
-    if not schema:
-        logger.error("No se pudo obtener el esquema de la base de datos")
-        return None
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida de tokens (~4 caracteres por token)"""
+    return max(1, len(text) // 4) if text else 0
 
-    # Construir descripción del esquema
+def build_schema_text(schema: Dict[str, Any]) -> str:
+    """Construye la descripción textual del esquema para el prompt"""
     schema_lines = ["Esquema de la base de datos:"]
     for table_name, table_info in schema.items():
         schema_lines.append(f"\nTabla: {table_name}\nColumnas:")
@@ -37,28 +75,37 @@ def setup_sql_agent(db_manager) -> Optional[Any]:
             if not column['nullable']:
                 desc += " (NOT NULL)"
             schema_lines.append(desc)
-        
+
         if table_info['foreign_keys']:
             schema_lines.append("Relaciones:")
             for fk in table_info['foreign_keys']:
                 schema_lines.append(f"- {fk['constrained_columns']} → {fk['referred_table']}")
 
-    schema_text = "\n".join(schema_lines)
+    return "\n".join(schema_lines)
 
-    # Configurar el modelo de lenguaje
-    llm = ChatGroq(
-        temperature=0,
-        model_name=MODEL_NAME,
-        groq_api_key=GROQ_API_KEY,
-        max_tokens=1024
-    )
+def build_sql_prompt(with_scratchpad: bool = True) -> ChatPromptTemplate:
+    """
+    Prompt de traducción de lenguaje natural a SQL
+
+    El esquema no va fijo en el prompt: se pasa en cada llamada en la
+    variable {schema} (ver SchemaContextBuilder), junto con {input},
+    {docs}, las definiciones de negocio de la documentación relevantes para
+    la pregunta (ver DocsContextBuilder; vacía si no hay ninguna), e
+    {history}, los turnos anteriores de la conversación (ver
+    src.conversation; vacío fuera de una sesión).
 
-    # Prompt ya interpolado con schema_text
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", f"""
+    Args:
+        with_scratchpad: Incluir el hueco para los pasos intermedios del agente
+    """
+    messages = [
+        ("system", """
     Eres un experto en bases de datos PostgreSQL. Tu tarea es traducir preguntas en lenguaje natural a consultas SQL válidas, precisas y eficientes, basadas exclusivamente en el siguiente esquema de base de datos:
 
-    {schema_text}
+    {schema}
+
+    {docs}
+
+    {history}
 
     Instrucciones estrictas:
     1. Siempre responde en español, sin importar el idioma de entrada del usuario.
@@ -74,9 +121,44 @@ def setup_sql_agent(db_manager) -> Optional[Any]:
 
     Tu respuesta debe ser solo una línea limpia de SQL correctamente formada. No incluyas explicaciones, contexto, comentarios ni nada adicional.
     """),
-        ("human", "{input}"),
-        ("placeholder", "{agent_scratchpad}")
-    ])
+        ("human", "{input}")
+    ]
+    if with_scratchpad:
+        messages.append(("placeholder", "{agent_scratchpad}"))
+    return ChatPromptTemplate.from_messages(messages)
+
+def setup_sql_agent(db_manager, llm: Optional[Any] = None,
+                    callbacks: Optional[List[Any]] = None) -> Optional[Any]:
+    """
+    Configura el agente SQL con LangChain
+
+    Args:
+        db_manager: DatabaseManager con la conexión activa
+        llm: Modelo de chat a utilizar (por defecto create_llm())
+        callbacks: Callbacks adicionales a los de trazas (p. ej. el límite de tokens)
+    """
+    if llm is None and not GROQ_API_KEY:
+        raise ValueError("GROQ_API_KEY no está configurada")
+
+    # SQLDatabase de LangChain sobre el pool compartido de DatabaseManager
+    try:
+        db = db_manager.get_sql_database()
+    except Exception as e:
+        logger.error(f"Error al crear SQLDatabase: {e}")
+        return None
+
+    # Obtener esquema de la base de datos
+    schema = db_manager.get_database_schema()
+    if not schema:
+        logger.error("No se pudo obtener el esquema de la base de datos")
+        return None
+
+    # Configurar el modelo de lenguaje
+    if llm is None:
+        llm = create_llm()
+
+    # El esquema, la documentación y el historial se inyectan por pregunta
+    prompt = build_sql_prompt()
 
     # Crear agente
     try:
@@ -85,12 +167,36 @@ def setup_sql_agent(db_manager) -> Optional[Any]:
             db=db,
             prompt=prompt,
             agent_type="tool-calling",
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             handle_parsing_errors=True,
-            max_iterations=5               # suficiente para Thought→Action→Obs→Done            
-            
+            max_iterations=5               # suficiente para Thought→Action→Obs→Done
+
         )
-        return agent
+        # Spans de LLM y herramientas; en la config para que los hereden las subllamadas
+        return agent.with_config({"callbacks": [TracingCallbackHandler(), *(callbacks or [])]})
     except Exception as e:
         logger.error(f"Error al crear el agente SQL: {e}")
         return None
+
+def setup_sql_generator(db_manager, llm: Optional[Any] = None,
+                        callbacks: Optional[List[Any]] = None) -> Optional[Any]:
+    """
+    Configura la generación directa de SQL: una sola llamada al LLM
+
+    A diferencia del agente, no usa herramientas (no vuelve a listar tablas
+    ni a consultar el esquema): el esquema relevante ya va en el prompt.
+
+    Returns:
+        Runnable que recibe {"input": pregunta, "schema": texto, "docs": texto, "history": texto} y devuelve
+        un mensaje con la SQL
+    """
+    schema = db_manager.get_database_schema()
+    if not schema:
+        logger.error("No se pudo obtener el esquema de la base de datos")
+        return None
+
+    if llm is None:
+        llm = create_llm()
+
+    generator = build_sql_prompt(with_scratchpad=False) | llm
+    return generator.with_config({"callbacks": [TracingCallbackHandler(), *(callbacks or [])]})
@@ -1,19 +1,102 @@
 from sqlalchemy import Column, Integer, String, Date, Numeric, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, sessionmaker
 from sqlalchemy import create_engine
-from src.config import get_db_uri
+from src.config import get_db_uri, get_async_db_uri, POOL_CONFIG, GUARD_CONFIG
+from src.pool import InstrumentedQueuePool, InstrumentedAsyncQueuePool
 
 # Crear la base para los modelos
 Base = declarative_base()
 
-# Configurar el motor de la base de datos
-engine = create_engine(
-    get_db_uri(),
-    pool_size=10,
-    max_overflow=20,
-    pool_pre_ping=True
-)
+# Parámetros comunes a los pools síncrono y asíncrono
+POOL_OPTIONS = {
+    'pool_size': POOL_CONFIG['SIZE'],
+    'max_overflow': POOL_CONFIG['MAX_OVERFLOW'],
+    'pool_timeout': POOL_CONFIG['TIMEOUT'],
+    'pool_recycle': POOL_CONFIG['RECYCLE'],
+    'pool_pre_ping': True
+}
+
+def _timeout_connect_args(uri: str, asyncpg: bool = False) -> dict:
+    """statement_timeout de sesión para cada conexión nueva de PostgreSQL"""
+    timeout = GUARD_CONFIG['STATEMENT_TIMEOUT_MS']
+    if timeout <= 0 or not uri.startswith('postgresql'):
+        return {}
+    if asyncpg:
+        return {'server_settings': {'statement_timeout': str(timeout)}}
+    return {'options': f'-c statement_timeout={timeout}'}
+
+def create_pooled_engine(uri: str, **pool_options):
+    """Motor síncrono con pool instrumentado (la primaria o una réplica)"""
+    return create_engine(
+        uri,
+        poolclass=InstrumentedQueuePool,
+        connect_args=_timeout_connect_args(uri),
+        **{**POOL_OPTIONS, **pool_options}
+    )
+
+def create_pooled_async_engine(uri: str, **pool_options):
+    """Motor asíncrono (asyncpg/aiosqlite) con pool instrumentado para 'uri'"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+    async_uri = get_async_db_uri(uri)
+    return create_async_engine(
+        async_uri,
+        poolclass=InstrumentedAsyncQueuePool,
+        connect_args=_timeout_connect_args(async_uri, asyncpg=True),
+        **{**POOL_OPTIONS, **pool_options}
+    )
+
+def read_only(db_engine):
+    """
+    El mismo motor (y pool) con transacciones READ ONLY en PostgreSQL
+
+    El servidor rechaza cualquier escritura aunque haya pasado la
+    validación local; la opción se deshace al devolver la conexión al
+    pool. Vale para motores síncronos y asíncronos.
+    """
+    if db_engine.dialect.name != 'postgresql':
+        return db_engine
+    return db_engine.execution_options(postgresql_readonly=True)
+
+# Motor único del proceso: lo comparten el ORM, DatabaseManager y LangChain
+engine = create_pooled_engine(get_db_uri())
+
+# Fábrica de sesiones cortas (una por petición)
+SessionLocal = sessionmaker(bind=engine)
+
+# Motor asíncrono (asyncpg); se crea bajo demanda para no exigir el driver
+# a quien solo usa la API síncrona
+_async_engine = None
+
+def get_async_engine():
+    """Devuelve el motor asíncrono, creándolo en el primer uso"""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_pooled_async_engine(get_db_uri())
+    return _async_engine
+
+def peek_async_engine():
+    """Devuelve el motor asíncrono solo si ya fue creado (o None)"""
+    return _async_engine
+
+def reset_engines_after_fork():
+    """
+    Descarta en un proceso hijo de fork() las conexiones heredadas del padre
+
+    Se sueltan sin cerrarlas (close=False): los sockets siguen siendo del
+    padre y cerrarlos desde el hijo rompería sus sesiones. El worker abre
+    conexiones propias en el primer uso.
+    """
+    engine.dispose(close=False)
+    if _async_engine is not None:
+        _async_engine.sync_engine.dispose(close=False)
+
+async def dispose_async_engine():
+    """Cierra las conexiones del motor asíncrono si llegó a crearse"""
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
 
 class Cliente(Base):
     """Modelo para la tabla de clientes"""
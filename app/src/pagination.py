@@ -0,0 +1,62 @@
+from src.cache import normalize_sql
+from src.sql_validator import strip_sql
+import base64
+import re
+import hashlib
+import json
+
+# Parámetros que añade paginate_sql a la consulta
+LIMIT_PARAM = "_pagina_limite"
+OFFSET_PARAM = "_pagina_desde"
+
+
+def _query_key(query: str) -> str:
+    return hashlib.sha256(normalize_sql(query).encode("utf-8")).hexdigest()[:16]
+
+
+def paginate_sql(query: str) -> str:
+    """
+    Envuelve una consulta de lectura para leer una sola página
+
+    El servidor aplica LIMIT/OFFSET sobre la consulta original, así que
+    solo viajan las filas de la página. Sin ORDER BY en la consulta el
+    orden entre páginas no está garantizado. Los comentarios se quitan: un
+    '-- comentario' final dejaría sin cerrar el paréntesis.
+    """
+    inner = strip_sql(query)
+    return f"SELECT * FROM ({inner}) AS _pagina LIMIT :{LIMIT_PARAM} OFFSET :{OFFSET_PARAM}"
+
+
+_PAGE_WRAPPER = re.compile(
+    rf"^SELECT \* FROM \((?P<inner>.*)\) AS _pagina LIMIT :{LIMIT_PARAM} OFFSET :{OFFSET_PARAM}$", re.DOTALL)
+
+
+def unwrap_page(query: str) -> str:
+    """Consulta original de una SQL generada por paginate_sql (o la misma SQL si no lo es)"""
+    match = _PAGE_WRAPPER.match(query.strip())
+    return match.group("inner") if match else query
+
+
+def encode_page_token(query: str, offset: int) -> str:
+    """Token opaco para pedir la página que empieza en 'offset' de esta consulta"""
+    payload = json.dumps({"q": _query_key(query), "o": offset}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_page_token(token: str, query: str) -> int:
+    """
+    Devuelve el desplazamiento guardado en el token
+
+    Raises:
+        ValueError: si el token no es válido o corresponde a otra consulta
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        offset = int(payload["o"])
+        key = payload["q"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Token de página no válido") from e
+    if key != _query_key(query) or offset < 0:
+        raise ValueError("El token de página no corresponde a esta consulta")
+    return offset
@@ -0,0 +1,90 @@
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from typing import Dict, Any
+import threading
+import time
+
+
+class PoolStats:
+    """Contadores de uso de un pool de conexiones"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_total_seconds": round(self.wait_total, 6),
+                "wait_max_seconds": round(self.wait_max, 6),
+                "wait_avg_seconds": round(self.wait_total / self.checkouts, 6) if self.checkouts else 0.0
+            }
+
+
+class _InstrumentedPoolMixin:
+    """Mide cuánto espera cada petición hasta obtener una conexión del pool"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self):
+        # dispose()/recreate() crean un pool nuevo: conservamos los contadores
+        new_pool = super().recreate()
+        new_pool.stats = self.stats
+        return new_pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    """QueuePool con métricas de espera para el motor síncrono"""
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool con métricas de espera para el motor asyncpg"""
+
+
+def get_pool_metrics(pool) -> Dict[str, Any]:
+    """
+    Devuelve el estado de un pool de conexiones
+
+    Returns:
+        Dict con tamaño configurado, conexiones prestadas y libres,
+        desbordamiento actual y los contadores de espera
+    """
+    metrics = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        metrics.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow
+        })
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        metrics.update(stats.as_dict())
+    return metrics
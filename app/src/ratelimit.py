@@ -0,0 +1,147 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.rate_limiters import BaseRateLimiter
+from src.config import RATE_LIMIT_CONFIG
+from src.tracing import _token_usage
+from typing import Any, Dict, Optional
+import asyncio
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Cubo de fichas: se rellena a `rate` fichas por segundo hasta `capacity`
+
+    consume() puede dejar el saldo en negativo (p. ej. al descontar los
+    tokens reales de una respuesta); las siguientes peticiones esperan
+    hasta que vuelva a haber saldo.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._level = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, amount: float = 1, require: Optional[float] = None) -> float:
+        """
+        Intenta retirar `amount` fichas si hay al menos `require` (por defecto `amount`)
+
+        Returns:
+            0 si se han retirado, o los segundos que faltan para que haya saldo
+        """
+        require = amount if require is None else require
+        with self._lock:
+            self._refill()
+            if self._level >= require:
+                self._level -= amount
+                return 0.0
+            return (require - self._level) / self.rate
+
+    def consume(self, amount: float) -> None:
+        with self._lock:
+            self._refill()
+            self._level -= amount
+
+
+class GroqRateLimiter(BaseRateLimiter):
+    """
+    Límite de peticiones y tokens por minuto para las llamadas al LLM
+
+    Se asigna como rate_limiter del modelo de chat: LangChain llama a
+    acquire() (o aacquire()) antes de cada petición a Groq, también las
+    del agente. Los tokens no se conocen hasta la respuesta, así que una
+    petición solo espera a que el saldo de tokens no sea negativo y
+    RateLimitCallbackHandler descuenta después los tokens reales.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float = 0,
+                 burst: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute / 60.0, burst or requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute > 0 else None
+        self._lock = threading.Lock()
+        self._stats = {"acquired": 0, "throttled": 0, "wait_seconds": 0.0, "tokens": 0}
+
+    def _try(self) -> float:
+        """0 si la petición puede salir ya, o los segundos que hay que esperar"""
+        if self.tokens is not None:
+            wait = self.tokens.take(0, require=0)
+            if wait:
+                return wait
+        return self.requests.take()
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        start = time.monotonic()
+        while True:
+            wait = self._try()
+            if not wait:
+                return self._acquired(start)
+            if not blocking:
+                return False
+            time.sleep(min(wait, 1.0))
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        start = time.monotonic()
+        while True:
+            wait = self._try()
+            if not wait:
+                return self._acquired(start)
+            if not blocking:
+                return False
+            await asyncio.sleep(min(wait, 1.0))
+
+    def _acquired(self, start: float) -> bool:
+        waited = time.monotonic() - start
+        with self._lock:
+            self._stats["acquired"] += 1
+            if waited > 0.001:
+                self._stats["throttled"] += 1
+                self._stats["wait_seconds"] += waited
+        return True
+
+    def record_tokens(self, tokens: int) -> None:
+        """Descuenta los tokens consumidos por una respuesta"""
+        if self.tokens is not None and tokens > 0:
+            self.tokens.consume(tokens)
+        with self._lock:
+            self._stats["tokens"] += tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+        return stats
+
+
+class RateLimitCallbackHandler(BaseCallbackHandler):
+    """Descuenta del límite de tokens por minuto el uso real de cada respuesta del LLM"""
+
+    run_inline = True
+
+    def __init__(self, limiter: GroqRateLimiter):
+        self.limiter = limiter
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        prompt_tokens, completion_tokens = _token_usage(response)
+        self.limiter.record_tokens(prompt_tokens + completion_tokens)
+
+
+def create_rate_limiter(config: Optional[Dict[str, Any]] = None) -> Optional[GroqRateLimiter]:
+    """Limitador con la configuración del proyecto, o None si está desactivado"""
+    config = {**RATE_LIMIT_CONFIG, **(config or {})}
+    if not config['ENABLED'] or config['REQUESTS_PER_MINUTE'] <= 0:
+        return None
+    return GroqRateLimiter(
+        requests_per_minute=config['REQUESTS_PER_MINUTE'],
+        tokens_per_minute=config['TOKENS_PER_MINUTE'],
+        burst=config['BURST'] or None
+    )
@@ -0,0 +1,315 @@
+"""
+Réplicas de lectura: a qué base va cada consulta del chatbot
+
+La primaria (src.models.engine) recibe la escritura, el catálogo y todo lo
+que no es una única sentencia SELECT/WITH; las lecturas van a la réplica
+sana menos cargada: consultas en curso respecto a su pool y, a igualdad,
+la de menor latencia reciente. Cada réplica tiene su propio pool.
+
+Un hilo comprueba cada HEALTH_INTERVAL que cada réplica responde y su
+retraso de replicación:
+  - caída (no conecta): no recibe consultas hasta que vuelva a responder
+  - retrasada (más de MAX_LAG_SECONDS): tampoco, hasta ponerse al día
+Si una lectura falla en una réplica por la conexión (que se marca caída) o
+por un conflicto con la recuperación, se repite en la primaria. Una
+sentencia que escribe (25006, read_only_sql_transaction) no se repite:
+vuelve al llamador como error.
+
+Las tablas recién escritas (avisos de src.invalidation) se leen de la
+primaria durante el retraso observado, para no volver a guardar en caché
+filas que la réplica todavía no tiene.
+"""
+from contextlib import contextmanager
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError, OperationalError, SQLAlchemyError, TimeoutError as PoolTimeoutError
+from src.cache import sql_tables
+from src.config import REPLICA_CONFIG
+from src.models import create_pooled_engine, create_pooled_async_engine
+from src.pool import get_pool_metrics
+from src.sql_validator import is_read_only
+from src.tracing import tracer
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+tracer.metrics.describe("chatbot_db_target_seconds", "histogram",
+                        "Duración de las consultas por destino (primaria o réplica)")
+tracer.metrics.describe("chatbot_db_failovers_total", "counter",
+                        "Lecturas repetidas en la primaria tras fallar en una réplica")
+
+# Retraso de una réplica en PostgreSQL: 0 si ya ha aplicado todo lo recibido
+# (pg_last_xact_replay_timestamp no avanza mientras la primaria no escribe)
+_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+# SQLSTATE que se reintentan en la primaria sin marcar la réplica como caída
+_RETRY_ON_PRIMARY = {
+    "40001"   # serialization_failure: conflicto con la recuperación (hot standby)
+}
+# Peso de la última muestra en la latencia media móvil
+_LATENCY_ALPHA = 0.2
+
+
+class NoReplicaAvailable(SQLAlchemyError):
+    """No hay réplicas sanas y PRIMARY_FALLBACK está desactivado"""
+
+
+class DatabaseTarget:
+    """Destino de las consultas (primaria o réplica) con su pool y sus métricas"""
+
+    def __init__(self, name: str, engine: Engine, replica: bool = True, capacity: Optional[int] = None):
+        self.name = name
+        self.engine = engine
+        self.replica = replica
+        self.capacity = capacity or engine.pool.size() + max(engine.pool._max_overflow, 0)
+        self._async_engine = None
+        self._lock = threading.Lock()
+        self.state = "ok"  # ok | down | lagging
+        self.lag: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.inflight = 0
+        self.queries = 0
+        self.errors = 0
+        self._latency = 0.0
+        self._latency_total = 0.0
+
+    @property
+    def load(self) -> float:
+        """Consultas en curso respecto al tamaño del pool"""
+        return self.inflight / self.capacity
+
+    def async_engine(self):
+        """Motor asíncrono del mismo destino, creado en el primer uso"""
+        if self._async_engine is None:
+            with self._lock:
+                if self._async_engine is None:
+                    self._async_engine = create_pooled_async_engine(
+                        self.engine.url.render_as_string(hide_password=False),
+                        pool_size=self.engine.pool.size(), max_overflow=self.engine.pool._max_overflow)
+        return self._async_engine
+
+    @contextmanager
+    def track(self, span: Any = None) -> Iterator[None]:
+        """Cuenta la consulta en curso y mide su duración"""
+        if span is not None:
+            span.set(target=self.name)
+        with self._lock:
+            self.inflight += 1
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            tracer.metrics.observe("chatbot_db_target_seconds", elapsed, target=self.name)
+            with self._lock:
+                self.inflight -= 1
+                self.queries += 1
+                self.errors += failed
+                self._latency_total += elapsed
+                self._latency = elapsed if self.queries == 1 else \
+                    self._latency + _LATENCY_ALPHA * (elapsed - self._latency)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "url": self.engine.url.render_as_string(hide_password=True),
+                "state": self.state,
+                "healthy": self.state == "ok",
+                "inflight": self.inflight,
+                "load": round(self.load, 4),
+                "queries": self.queries,
+                "errors": self.errors,
+                "latency_ms": round(self._latency * 1000, 3),
+                "avg_latency_ms": round(self._latency_total / self.queries * 1000, 3) if self.queries else 0.0
+            }
+            if self.replica:
+                stats.update(lag_seconds=self.lag, last_error=self.last_error)
+        stats["pool"] = get_pool_metrics(self.engine.pool)
+        return stats
+
+
+class ReplicaRouter:
+    """
+    Elige el destino de cada consulta y vigila la salud de las réplicas
+
+    Args:
+        primary: Motor de la primaria (src.models.engine)
+        urls: URLs de SQLAlchemy de las réplicas
+        config: REPLICA_CONFIG por defecto
+    """
+
+    def __init__(self, primary: Engine, urls: Iterable[str], config: Optional[Dict[str, Any]] = None):
+        self.config = {**REPLICA_CONFIG, **(config or {})}
+        self.primary = DatabaseTarget("primary", primary, replica=False)
+        self.replicas: List[DatabaseTarget] = [
+            DatabaseTarget(f"replica{i}", create_pooled_engine(
+                url, pool_size=self.config['POOL_SIZE'], max_overflow=self.config['MAX_OVERFLOW']))
+            for i, url in enumerate(urls, 1)
+        ]
+        self._lock = threading.Lock()
+        # Tabla -> instante (monotonic) hasta el que se lee de la primaria
+        self._recent: Dict[str, float] = {}
+        self.primary_reads = 0
+        self.failovers = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # Enrutado
+
+    def route(self, sql: str) -> DatabaseTarget:
+        """
+        Destino de una consulta: réplica para las lecturas, primaria para el resto
+
+        Raises:
+            NoReplicaAvailable: lectura sin réplicas sanas y sin PRIMARY_FALLBACK
+        """
+        if not is_read_only(sql):
+            return self.primary
+        if self._recent and self._recently_written(sql):
+            return self._primary_read()
+        candidates = [target for target in self.replicas if target.state == "ok"]
+        if not candidates:
+            if not self.config['PRIMARY_FALLBACK']:
+                raise NoReplicaAvailable("No hay réplicas de lectura disponibles")
+            return self._primary_read()
+        return min(candidates, key=lambda target: (target.load, target._latency))
+
+    def _primary_read(self) -> DatabaseTarget:
+        with self._lock:
+            self.primary_reads += 1
+        return self.primary
+
+    def _recently_written(self, sql: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            for table, until in list(self._recent.items()):
+                if until <= now:
+                    del self._recent[table]
+            return bool(self._recent.keys() & sql_tables(sql))
+
+    def failover(self, target: DatabaseTarget, error: Exception) -> bool:
+        """
+        Decide si una lectura que ha fallado en 'target' se repite en la primaria
+
+        Los errores de conexión marcan la réplica como caída hasta la
+        siguiente comprobación; los de la propia consulta (sintaxis,
+        statement_timeout, escritura en solo lectura...) no se repiten.
+        """
+        if target is self.primary or not self.config['PRIMARY_FALLBACK']:
+            return False
+        code = getattr(getattr(error, "orig", None), "pgcode", None)
+        # psycopg2 da SQLSTATE a todo error del servidor: sin él, no hubo conexión
+        connection_lost = isinstance(error, PoolTimeoutError) or (
+            isinstance(error, DBAPIError) and error.connection_invalidated) or (
+            isinstance(error, OperationalError) and code is None
+            and target.engine.dialect.name == "postgresql")
+        if not connection_lost and code not in _RETRY_ON_PRIMARY:
+            return False
+        if connection_lost:
+            self._set_state(target, "down", error=str(getattr(error, "orig", error)).strip())
+        with self._lock:
+            self.failovers += 1
+        tracer.metrics.inc("chatbot_db_failovers_total", target=target.name)
+        logger.warning(f"Lectura repetida en la primaria tras fallar en {target.name}: {error}")
+        return True
+
+    def tables_changed(self, tables: Iterable[str]) -> None:
+        """Lee 'tables' de la primaria mientras las réplicas puedan no tener el cambio"""
+        lags = [target.lag or 0.0 for target in self.replicas if target.state == "ok"]
+        # Margen de una comprobación: el retraso medido puede haber crecido
+        until = time.monotonic() + min(max(lags, default=0.0) + self.config['HEALTH_INTERVAL'],
+                                       self.config['MAX_LAG_SECONDS'])
+        with self._lock:
+            for table in tables:
+                self._recent[table.lower()] = until
+
+    # Salud
+
+    def start(self) -> None:
+        if not self.replicas or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.check_health()
+            self._stop.wait(self.config['HEALTH_INTERVAL'])
+
+    def check_health(self) -> None:
+        """Comprueba conexión y retraso de cada réplica (también a demanda)"""
+        for target in self.replicas:
+            try:
+                with target.engine.connect() as conn:
+                    lag = float(conn.execute(text(_LAG_SQL if target.engine.dialect.name == "postgresql"
+                                                  else "SELECT 0")).scalar() or 0.0)
+            except SQLAlchemyError as e:
+                self._set_state(target, "down", error=str(getattr(e, "orig", e)).strip())
+                continue
+            target.lag = round(lag, 3)
+            self._set_state(target, "lagging" if lag > self.config['MAX_LAG_SECONDS'] else "ok")
+
+    def _set_state(self, target: DatabaseTarget, state: str, error: Optional[str] = None) -> None:
+        with target._lock:
+            previous, target.state = target.state, state
+            target.checked_at = time.time()
+            if error is not None:
+                target.last_error = error
+        if state != previous:
+            detail = f": {error}" if error else f" (retraso {target.lag}s)" if target.lag is not None else ""
+            log = logger.info if state == "ok" else logger.warning
+            log(f"Réplica {target.name}: {previous} -> {state}{detail}")
+
+    # Ciclo de vida
+
+    def after_fork(self) -> None:
+        """Suelta las conexiones heredadas sin cerrarlas y rearranca la comprobación"""
+        for target in self.replicas:
+            target.engine.dispose(close=False)
+            if target._async_engine is not None:
+                target._async_engine.sync_engine.dispose(close=False)
+            target._lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.start()
+
+    def close(self) -> None:
+        self.stop()
+        for target in self.replicas:
+            target.engine.dispose()
+
+    async def aclose(self) -> None:
+        for target in self.replicas:
+            if target._async_engine is not None:
+                await target._async_engine.dispose()
+                target._async_engine = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pinned = sum(1 for until in self._recent.values() if until > time.monotonic())
+            counters = {"primary_reads": self.primary_reads, "failovers": self.failovers, "pinned_tables": pinned}
+        return {
+            **counters,
+            "targets": {target.name: target.stats() for target in [self.primary, *self.replicas]}
+        }
@@ -0,0 +1,404 @@
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables.config import var_child_runnable_config
+from pydantic import PrivateAttr
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from collections import deque
+from src.tracing import tracer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import contextvars
+import asyncio
+import threading
+import logging
+import random
+import math
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Códigos HTTP que merece la pena reintentar: límite de peticiones,
+# tiempo agotado, conflicto y errores del servidor
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _isolated() -> contextvars.Context:
+    """
+    Contexto sin la configuración de LangChain de la llamada en curso
+
+    Los modelos envueltos heredarían de ella los callbacks (trazas, tokens,
+    límite), que ya se registran una vez en ResilientChatModel.
+    """
+    context = contextvars.copy_context()
+    context.run(var_child_runnable_config.set, None)
+    return context
+
+
+tracer.metrics.describe("chatbot_llm_attempts_total", "counter", "Peticiones al LLM por modelo y resultado")
+tracer.metrics.describe("chatbot_llm_retries_total", "counter", "Reintentos de llamadas al LLM por motivo")
+tracer.metrics.describe("chatbot_llm_hedges_total", "counter", "Peticiones duplicadas al LLM (lanzadas y ganadas)")
+tracer.metrics.describe("chatbot_llm_fallbacks_total", "counter", "Llamadas resueltas con el modelo de respaldo")
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Errores transitorios: de conexión, tiempo agotado, 429 y 5xx"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # groq.APIConnectionError / APITimeoutError y los de httpx no traen código
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & {"APIConnectionError", "APITimeoutError", "TimeoutException",
+                         "NetworkError", "RemoteProtocolError", "TimeoutError", "ConnectionError"})
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Segundos indicados por la cabecera Retry-After de la respuesta, si la hay"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return max(0.0, float(headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Espera exponencial con jitter completo: aleatoria en [0, min(cap, base * 2^intento)]"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class LatencyTracker:
+    """Últimas latencias correctas del modelo principal, para calcular el retraso del hedge"""
+
+    def __init__(self, window: int = 200):
+        self._values: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._values.append(seconds)
+
+    def percentile(self, pct: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self._values) < max(1, min_samples):
+                return None
+            ordered = sorted(self._values)
+        index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+
+class ResilientChatModel(BaseChatModel):
+    """
+    Modelo de chat que envuelve al de Groq con reintentos, hedging y respaldo
+
+    - Reintentos: los errores transitorios (ver is_retryable) se reintentan
+      hasta max_retries veces con espera exponencial y jitter, respetando
+      Retry-After.
+    - Hedging: si una petición tarda más que el percentil hedge_percentile
+      de las latencias recientes (y al menos hedge_min_delay), se lanza una
+      copia y se usa la primera respuesta. El hilo perdedor termina por su
+      cuenta; en asyncio se cancela.
+    - Respaldo: agotados los reintentos, la llamada se repite con el modelo
+      `fallback` (más pequeño o rápido), con sus propios reintentos.
+
+    Cada intento extra (reintento, hedge o respaldo) pasa por rate_limiter;
+    el primero ya lo controla BaseChatModel. Los contadores se publican en
+    /metrics y stats().
+    """
+
+    primary: Any
+    fallback: Any = None
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    hedge: bool = True
+    hedge_percentile: float = 95.0
+    hedge_min_delay: float = 1.0
+    hedge_min_samples: int = 20
+    hedge_workers: int = 16
+    _latencies: LatencyTracker = PrivateAttr(default_factory=LatencyTracker)
+    _stats: Dict[str, int] = PrivateAttr(default_factory=lambda: {
+        "calls": 0, "retries": 0, "hedges": 0, "hedges_won": 0, "fallbacks": 0, "failures": 0})
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _pool: Any = PrivateAttr(default=None)
+
+    @property
+    def _llm_type(self) -> str:
+        return "resilient-chat"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "ResilientChatModel":
+        bound = self.model_copy(update={
+            "primary": self.primary.bind_tools(tools, **kwargs),
+            "fallback": self.fallback.bind_tools(tools, **kwargs) if self.fallback is not None else None
+        })
+        # Latencias, contadores y pool de hedging comunes a todas las copias
+        bound._latencies = self._latencies
+        bound._stats = self._stats
+        bound._lock = self._lock
+        bound._pool = self._pool
+        return bound
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        p95 = self._latencies.percentile(self.hedge_percentile, self.hedge_min_samples)
+        stats["hedge_delay_seconds"] = round(max(p95, self.hedge_min_delay), 3) if p95 is not None else None
+        return stats
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        p95 = self._latencies.percentile(self.hedge_percentile, self.hedge_min_samples)
+        return None if p95 is None else max(p95, self.hedge_min_delay)
+
+    def _extra_attempt(self, blocking: bool = True) -> bool:
+        """Pide cupo al limitador para un intento que no es el primero"""
+        return self.rate_limiter is None or self.rate_limiter.acquire(blocking=blocking)
+
+    async def _aextra_attempt(self) -> None:
+        if self.rate_limiter is not None:
+            await self.rate_limiter.aacquire()
+
+    def _invoke(self, model: Any, messages: List[Any], stop: Optional[List[str]], kwargs: Dict[str, Any],
+                role: str) -> Any:
+        start = time.perf_counter()
+        try:
+            message = _isolated().run(model.invoke, messages, stop=stop, **kwargs)
+        except Exception as e:
+            tracer.metrics.inc("chatbot_llm_attempts_total", model=role, result=type(e).__name__)
+            raise
+        tracer.metrics.inc("chatbot_llm_attempts_total", model=role, result="ok")
+        if role == "primary":
+            self._latencies.add(time.perf_counter() - start)
+        return message
+
+    async def _ainvoke(self, model: Any, messages: List[Any], stop: Optional[List[str]], kwargs: Dict[str, Any],
+                       role: str) -> Any:
+        start = time.perf_counter()
+        try:
+            token = var_child_runnable_config.set(None)
+            try:
+                message = await model.ainvoke(messages, stop=stop, **kwargs)
+            finally:
+                var_child_runnable_config.reset(token)
+        except Exception as e:
+            tracer.metrics.inc("chatbot_llm_attempts_total", model=role, result=type(e).__name__)
+            raise
+        tracer.metrics.inc("chatbot_llm_attempts_total", model=role, result="ok")
+        if role == "primary":
+            self._latencies.add(time.perf_counter() - start)
+        return message
+
+    # Llamadas síncronas
+
+    def _generate(self, messages: List[Any], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        self._count("calls")
+        try:
+            message = self._with_retries(self.primary, messages, stop, kwargs, "primary")
+        except Exception as e:
+            if self.fallback is None or not is_retryable(e):
+                self._count("failures")
+                raise
+            logger.warning(f"LLM principal no disponible ({type(e).__name__}); se usa el modelo de respaldo")
+            self._count("fallbacks")
+            tracer.metrics.inc("chatbot_llm_fallbacks_total")
+            self._extra_attempt()
+            try:
+                message = self._with_retries(self.fallback, messages, stop, kwargs, "fallback")
+            except Exception:
+                self._count("failures")
+                raise
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _with_retries(self, model: Any, messages: List[Any], stop: Optional[List[str]],
+                      kwargs: Dict[str, Any], role: str) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                if role == "primary":
+                    return self._hedged(model, messages, stop, kwargs)
+                return self._invoke(model, messages, stop, kwargs, role)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = retry_after(e)
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max) if delay is None else delay
+                self._retried(e, role, attempt, delay)
+                time.sleep(delay)
+                self._extra_attempt()
+
+    def _retried(self, error: BaseException, role: str, attempt: int, delay: float) -> None:
+        self._count("retries")
+        reason = str(getattr(error, "status_code", None) or type(error).__name__)
+        tracer.metrics.inc("chatbot_llm_retries_total", model=role, reason=reason)
+        logger.info(f"LLM {role}: {reason}; reintento {attempt + 1}/{self.max_retries} en {delay:.2f}s")
+
+    def _hedge_pool(self) -> ThreadPoolExecutor:
+        # Perezoso y por proceso: tras un fork() los hilos del padre no existen
+        pool = self._pool
+        if pool is None or pool[0] != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pool[0] != os.getpid():
+                    self._pool = (os.getpid(), ThreadPoolExecutor(
+                        max_workers=self.hedge_workers, thread_name_prefix="llm-hedge"))
+                pool = self._pool
+        return pool[1]
+
+    def _hedged(self, model: Any, messages: List[Any], stop: Optional[List[str]],
+                kwargs: Dict[str, Any]) -> Any:
+        """Petición al modelo principal con una copia si tarda más de lo normal"""
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._invoke(model, messages, stop, kwargs, "primary")
+
+        pool = self._hedge_pool()
+        first = pool.submit(contextvars.copy_context().run, self._invoke, model, messages, stop, kwargs, "primary")
+        done, _ = wait([first], timeout=delay)
+        # Sin cupo en el limitador no se duplica la petición
+        if done or not self._extra_attempt(blocking=False):
+            return first.result()
+
+        self._count("hedges")
+        tracer.metrics.inc("chatbot_llm_hedges_total", outcome="launched")
+        second = pool.submit(contextvars.copy_context().run, self._invoke, model, messages, stop, kwargs, "primary")
+        return self._first_success([first, second], second)
+
+    def _first_success(self, futures: List[Future], hedge: Future) -> Any:
+        """Resultado de la primera petición correcta; si fallan las dos, el error de la última"""
+        pending = set(futures)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count("hedges_won")
+                        tracer.metrics.inc("chatbot_llm_hedges_total", outcome="won")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    # Llamadas asíncronas
+
+    async def _agenerate(self, messages: List[Any], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        self._count("calls")
+        try:
+            message = await self._awith_retries(self.primary, messages, stop, kwargs, "primary")
+        except Exception as e:
+            if self.fallback is None or not is_retryable(e):
+                self._count("failures")
+                raise
+            logger.warning(f"LLM principal no disponible ({type(e).__name__}); se usa el modelo de respaldo")
+            self._count("fallbacks")
+            tracer.metrics.inc("chatbot_llm_fallbacks_total")
+            await self._aextra_attempt()
+            try:
+                message = await self._awith_retries(self.fallback, messages, stop, kwargs, "fallback")
+            except Exception:
+                self._count("failures")
+                raise
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _awith_retries(self, model: Any, messages: List[Any], stop: Optional[List[str]],
+                             kwargs: Dict[str, Any], role: str) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                if role == "primary":
+                    return await self._ahedged(model, messages, stop, kwargs)
+                return await self._ainvoke(model, messages, stop, kwargs, role)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = retry_after(e)
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max) if delay is None else delay
+                self._retried(e, role, attempt, delay)
+                await asyncio.sleep(delay)
+                await self._aextra_attempt()
+
+    async def _ahedged(self, model: Any, messages: List[Any], stop: Optional[List[str]],
+                       kwargs: Dict[str, Any]) -> Any:
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._ainvoke(model, messages, stop, kwargs, "primary")
+
+        first = asyncio.ensure_future(self._ainvoke(model, messages, stop, kwargs, "primary"))
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done or not self._extra_attempt(blocking=False):
+            return await first
+
+        self._count("hedges")
+        tracer.metrics.inc("chatbot_llm_hedges_total", outcome="launched")
+        second = asyncio.ensure_future(self._ainvoke(model, messages, stop, kwargs, "primary"))
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedges_won")
+                            tracer.metrics.inc("chatbot_llm_hedges_total", outcome="won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # Streaming (generación directa de SQL)
+
+    def _stream(self, messages: List[Any], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        """
+        Reenvía el stream del modelo principal
+
+        Solo se reintenta (o se pasa al respaldo) si el error llega antes del
+        primer fragmento: después ya se han emitido tokens al cliente.
+        """
+        self._count("calls")
+        candidates: List[Tuple[Any, str]] = [(self.primary, "primary")]
+        if self.fallback is not None:
+            candidates.append((self.fallback, "fallback"))
+        for model, role in candidates:
+            for attempt in range(self.max_retries + 1):
+                started = False
+                context = _isolated()
+                try:
+                    chunks = context.run(model.stream, messages, stop=stop, **kwargs)
+                    while (chunk := context.run(next, chunks, None)) is not None:
+                        started = True
+                        if not isinstance(chunk, AIMessageChunk):
+                            chunk = AIMessageChunk(content=getattr(chunk, "content", str(chunk)))
+                        generation = ChatGenerationChunk(message=chunk)
+                        if run_manager is not None and chunk.content:
+                            run_manager.on_llm_new_token(chunk.content, chunk=generation)
+                        yield generation
+                    tracer.metrics.inc("chatbot_llm_attempts_total", model=role, result="ok")
+                    return
+                except Exception as e:
+                    tracer.metrics.inc("chatbot_llm_attempts_total", model=role, result=type(e).__name__)
+                    if started or not is_retryable(e):
+                        self._count("failures")
+                        raise
+                    last_attempt = attempt >= self.max_retries
+                    if last_attempt and (role == "fallback" or self.fallback is None):
+                        self._count("failures")
+                        raise
+                    if last_attempt:
+                        break
+                    delay = retry_after(e)
+                    delay = backoff_delay(attempt, self.backoff_base, self.backoff_max) if delay is None else delay
+                    self._retried(e, role, attempt, delay)
+                    time.sleep(delay)
+                    self._extra_attempt()
+            logger.warning("LLM principal no disponible; se usa el modelo de respaldo")
+            self._count("fallbacks")
+            tracer.metrics.inc("chatbot_llm_fallbacks_total")
+            self._extra_attempt()
@@ -0,0 +1,192 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple, Union
+import csv
+
+
+class ResultPage(list):
+    """
+    Filas (dicts) de una página de resultados
+
+    next_offset es el desplazamiento de la página siguiente, o None si no
+    quedan más filas.
+    """
+    __slots__ = ("offset", "next_offset")
+
+    def __init__(self, rows=(), offset: int = 0, next_offset: Optional[int] = None):
+        super().__init__(rows)
+        self.offset = offset
+        self.next_offset = next_offset
+
+
+class RowView:
+    """
+    Vista de una fila de ColumnarResult
+
+    No copia los valores: lee de las columnas del resultado. Admite el
+    acceso de un dict (row['col'], row.get('col'), keys/items) para que el
+    código que trataba las filas como dicts siga funcionando.
+    """
+    __slots__ = ("_result", "_index")
+
+    def __init__(self, result: "ColumnarResult", index: int):
+        self._result = result
+        self._index = index
+
+    def __getitem__(self, key: Union[str, int]) -> Any:
+        if isinstance(key, int):
+            return self._result.arrays[key][self._index]
+        return self._result.arrays[self._result.index_of(key)][self._index]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        position = self._result.position.get(key)
+        if position is None:
+            return default
+        return self._result.arrays[position][self._index]
+
+    def keys(self) -> List[str]:
+        return list(self._result.columns)
+
+    def values(self) -> List[Any]:
+        return [array[self._index] for array in self._result.arrays]
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return list(zip(self._result.columns, self.values()))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._result.columns)
+
+    def __len__(self) -> int:
+        return len(self._result.columns)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._result.position
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (RowView, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"RowView({dict(self.items())!r})"
+
+
+class ColumnarResult:
+    """
+    Resultado de una consulta guardado por columnas
+
+    Una lista de valores por columna en lugar de un dict por fila: las
+    claves no se repiten en cada fila y recorrer una columna (sumas,
+    conteos) no crea objetos intermedios. Iterar devuelve RowView, así que
+    se puede usar donde antes había una lista de dicts.
+
+    offset/next_offset tienen el mismo sentido que en ResultPage cuando el
+    resultado es una página de una consulta más grande.
+    """
+    __slots__ = ("columns", "arrays", "position", "offset", "next_offset")
+
+    def __init__(self, columns: Sequence[str], arrays: Optional[List[List[Any]]] = None,
+                 offset: int = 0, next_offset: Optional[int] = None):
+        self.columns = list(columns)
+        self.arrays = arrays if arrays is not None else [[] for _ in self.columns]
+        self.position = {name: i for i, name in enumerate(self.columns)}
+        self.offset = offset
+        self.next_offset = next_offset
+
+    @classmethod
+    def from_batches(cls, columns: Sequence[str], batches: Iterable[Sequence[Sequence[Any]]]) -> "ColumnarResult":
+        """Construye el resultado a partir de lotes de filas (tuplas) sin guardar las filas"""
+        result = cls(columns)
+        for batch in batches:
+            result.extend(batch)
+        return result
+
+    @classmethod
+    def from_rows(cls, columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> "ColumnarResult":
+        return cls.from_batches(columns, [rows])
+
+    def extend(self, rows: Sequence[Sequence[Any]]) -> None:
+        """Añade filas (tuplas en el orden de las columnas)"""
+        if not rows:
+            return
+        for array, values in zip(self.arrays, zip(*rows)):
+            array.extend(values)
+
+    def index_of(self, column: str) -> int:
+        try:
+            return self.position[column]
+        except KeyError:
+            raise KeyError(column) from None
+
+    def column(self, name: str) -> List[Any]:
+        """Valores de una columna (la lista interna, sin copiar)"""
+        return self.arrays[self.index_of(name)]
+
+    def __len__(self) -> int:
+        return len(self.arrays[0]) if self.arrays else 0
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self) -> Iterator[RowView]:
+        return (RowView(self, i) for i in range(len(self)))
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[RowView, "ColumnarResult"]:
+        if isinstance(index, slice):
+            return ColumnarResult(self.columns, [array[index] for array in self.arrays])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("índice de fila fuera de rango")
+        return RowView(self, index)
+
+    def iter_tuples(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Tuple[Any, ...]]:
+        """Filas como tuplas en el orden de las columnas"""
+        if start or stop is not None:
+            return zip(*(array[start:stop] for array in self.arrays))
+        return zip(*self.arrays)
+
+    def to_rows(self, start: int = 0, stop: Optional[int] = None) -> List[Tuple[Any, ...]]:
+        """
+        Filas como tuplas (formato 'results' de la API JSON)
+
+        Las tuplas se serializan como arrays JSON igual que las listas, sin
+        copiar cada fila a una lista.
+        """
+        return list(self.iter_tuples(start, stop))
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [dict(zip(self.columns, row)) for row in self.iter_tuples()]
+
+    def to_payload(self) -> Dict[str, Any]:
+        """Representación JSON por columnas: {"columns": [...], "data": {columna: valores}}"""
+        return {"columns": self.columns, "data": dict(zip(self.columns, self.arrays))}
+
+    def to_csv(self, file: TextIO, header: bool = True) -> int:
+        """
+        Escribe el resultado en formato CSV
+
+        Returns:
+            Número de filas escritas
+        """
+        writer = csv.writer(file)
+        if header:
+            writer.writerow(self.columns)
+        writer.writerows(self.iter_tuples())
+        return len(self)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"columns": self.columns, "arrays": self.arrays,
+                "offset": self.offset, "next_offset": self.next_offset}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)
+
+    def __repr__(self) -> str:
+        return f"ColumnarResult(columns={self.columns!r}, rows={len(self)})"
+
+
+def row_values(columns: List[str], data: Any, start: int = 0,
+               stop: Optional[int] = None) -> List[Sequence[Any]]:
+    """Filas [start:stop] como secuencias de valores, de ColumnarResult o de una lista de dicts"""
+    if isinstance(data, ColumnarResult):
+        return data.to_rows(start, stop)
+    return [[row.get(col) for col in columns] for row in data[start:stop]]
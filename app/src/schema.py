@@ -0,0 +1,241 @@
+from sqlalchemy import text
+from sqlalchemy.inspection import inspect
+from sqlalchemy.engine import Engine
+from typing import Any, Dict, Optional
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# Una sola consulta al catálogo de PostgreSQL con columnas, PK y FK de
+# todas las tablas del esquema actual
+PG_SCHEMA_QUERY = """
+SELECT c.relname AS table_name,
+       (SELECT json_agg(json_build_object(
+                   'name', a.attname,
+                   'type', format_type(a.atttypid, a.atttypmod),
+                   'nullable', NOT a.attnotnull,
+                   'primary_key', EXISTS (
+                       SELECT 1 FROM pg_constraint p
+                       WHERE p.conrelid = c.oid AND p.contype = 'p'
+                         AND a.attnum = ANY (p.conkey))
+               ) ORDER BY a.attnum)
+          FROM pg_attribute a
+         WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped) AS columns,
+       (SELECT COALESCE(json_agg(json_build_object(
+                   'constrained_columns', (
+                       SELECT json_agg(att.attname ORDER BY k.ord)
+                         FROM unnest(f.conkey) WITH ORDINALITY AS k(attnum, ord)
+                         JOIN pg_attribute att
+                           ON att.attrelid = f.conrelid AND att.attnum = k.attnum),
+                   'referred_table', r.relname,
+                   'referred_columns', (
+                       SELECT json_agg(att.attname ORDER BY k.ord)
+                         FROM unnest(f.confkey) WITH ORDINALITY AS k(attnum, ord)
+                         JOIN pg_attribute att
+                           ON att.attrelid = f.confrelid AND att.attnum = k.attnum)
+               )), '[]'::json)
+          FROM pg_constraint f
+          JOIN pg_class r ON r.oid = f.confrelid
+         WHERE f.conrelid = c.oid AND f.contype = 'f') AS foreign_keys
+  FROM pg_class c
+  JOIN pg_namespace n ON n.oid = c.relnamespace
+ WHERE c.relkind IN ('r', 'p') AND n.nspname = current_schema()
+ ORDER BY c.relname
+"""
+
+# Huella barata del catálogo: el servidor solo devuelve un md5
+PG_FINGERPRINT_QUERY = """
+SELECT md5(
+    COALESCE((SELECT string_agg(c.relname || '.' || a.attname || ':' || a.atttypid || ':'
+                                || a.atttypmod || ':' || a.attnotnull, ','
+                                ORDER BY c.relname, a.attnum)
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+               WHERE c.relkind IN ('r', 'p') AND n.nspname = current_schema()), '')
+    || '|' ||
+    COALESCE((SELECT string_agg(c.relname || ':' || k.contype || ':' || pg_get_constraintdef(k.oid), ','
+                                ORDER BY c.relname, k.conname)
+                FROM pg_constraint k
+                JOIN pg_class c ON c.oid = k.conrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+               WHERE k.contype IN ('p', 'f') AND n.nspname = current_schema()), '')
+)
+"""
+
+SQLITE_FINGERPRINT_QUERY = "SELECT group_concat(name || ':' || sql, ';') FROM sqlite_master WHERE type = 'table'"
+
+
+def introspect_schema(engine: Engine) -> Dict[str, Any]:
+    """
+    Obtiene el esquema con el mismo formato que DatabaseManager.get_database_schema()
+
+    En PostgreSQL usa una única consulta al catálogo; en otros motores
+    recurre al inspector de SQLAlchemy (una consulta por tabla).
+    """
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            rows = conn.execute(text(PG_SCHEMA_QUERY)).fetchall()
+        return {
+            row.table_name: {
+                'columns': row.columns or [],
+                'foreign_keys': row.foreign_keys or []
+            }
+            for row in rows
+        }
+    return _introspect_with_inspector(engine)
+
+
+def _introspect_with_inspector(engine: Engine) -> Dict[str, Any]:
+    inspector = inspect(engine)
+    schema = {}
+    for table_name in inspector.get_table_names():
+        primary_keys = set(inspector.get_pk_constraint(table_name).get('constrained_columns') or [])
+        columns = [
+            {
+                'name': column['name'],
+                'type': str(column['type']),
+                'nullable': column['nullable'],
+                'primary_key': column['name'] in primary_keys
+            }
+            for column in inspector.get_columns(table_name)
+        ]
+        foreign_keys = [
+            {
+                'constrained_columns': fk['constrained_columns'],
+                'referred_table': fk['referred_table'],
+                'referred_columns': fk['referred_columns']
+            }
+            for fk in inspector.get_foreign_keys(table_name)
+        ]
+        schema[table_name] = {'columns': columns, 'foreign_keys': foreign_keys}
+    return schema
+
+
+def catalog_fingerprint(engine: Engine) -> Optional[str]:
+    """
+    Huella del catálogo calculada en el servidor (una sola consulta)
+
+    Returns:
+        La huella, o None si el motor no permite calcularla de forma barata
+    """
+    queries = {
+        "postgresql": PG_FINGERPRINT_QUERY,
+        "sqlite": SQLITE_FINGERPRINT_QUERY
+    }
+    query = queries.get(engine.dialect.name)
+    if query is None:
+        return None
+    with engine.connect() as conn:
+        value = conn.execute(text(query)).scalar() or ""
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+class SchemaSnapshotStore:
+    """
+    Instantánea del esquema en disco, compartida entre reinicios y workers
+
+    El fichero se identifica por la URI de la base de datos y guarda la
+    huella del catálogo con la que se generó; solo se reutiliza mientras
+    esa huella coincida.
+
+    Cada URI deja su propio fichero en el directorio: al guardar se borran
+    los de otras URIs que superan 'max_age' segundos y, de los que quedan,
+    los menos recientes por encima de 'max_files' (el actual no se borra).
+
+    Args:
+        directory: Directorio de las instantáneas
+        db_uri: URI de la base de datos
+        max_files: Máximo de instantáneas en el directorio
+        max_age: Antigüedad máxima (s) de las instantáneas de otras URIs;
+            None para no caducarlas
+    """
+
+    # Temporales huérfanos (un proceso que murió a mitad de save) que se borran
+    TMP_MAX_AGE = 3600
+
+    def __init__(self, directory: Path, db_uri: str, max_files: int = 16,
+                 max_age: Optional[float] = 7 * 86400):
+        db_key = hashlib.sha256(db_uri.encode("utf-8")).hexdigest()[:16]
+        self.path = Path(directory) / f"schema_{db_key}.json"
+        self.max_files = max_files
+        self.max_age = max_age
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Devuelve {'fingerprint', 'schema', 'created_at'} o None"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if "fingerprint" in snapshot and "schema" in snapshot:
+                return snapshot
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Instantánea de esquema ilegible ({self.path}): {e}")
+        return None
+
+    def save(self, fingerprint: Optional[str], schema: Dict[str, Any]) -> None:
+        """Escribe la instantánea de forma atómica (varios workers pueden escribir)"""
+        if fingerprint is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix="schema_", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"fingerprint": fingerprint, "created_at": time.time(), "schema": schema}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar la instantánea de esquema: {e}")
+            return
+        self.prune()
+
+    def prune(self) -> int:
+        """
+        Borra las instantáneas de otras URIs caducadas o que sobran y los
+        temporales huérfanos
+
+        Returns:
+            Número de ficheros borrados
+        """
+        now = time.time()
+        snapshots = []
+        removed = 0
+        for path in self.path.parent.glob("schema_*"):
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:
+                continue
+            if path.suffix == ".tmp":
+                expired = now - mtime > self.TMP_MAX_AGE
+            elif path.suffix == ".json" and path != self.path:
+                expired = self.max_age is not None and now - mtime > self.max_age
+                if not expired:
+                    snapshots.append((mtime, path))
+            else:
+                continue
+            if expired:
+                removed += self._remove(path)
+        # El actual cuenta dentro del máximo
+        snapshots.sort(reverse=True)
+        for _, path in snapshots[max(self.max_files - 1, 0):]:
+            removed += self._remove(path)
+        if removed:
+            logger.info(f"Instantáneas de esquema borradas: {removed}")
+        return removed
+
+    @staticmethod
+    def _remove(path: Path) -> int:
+        try:
+            path.unlink()
+            return 1
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            logger.warning(f"No se pudo borrar {path}: {e}")
+            return 0
@@ -0,0 +1,217 @@
+from src.cache import normalize_question
+from src.langchain_setup import build_schema_text, estimate_tokens
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional, Set
+import logging
+import math
+import re
+
+logger = logging.getLogger(__name__)
+
+# Peso extra de los términos que aparecen en el nombre de la tabla
+TABLE_NAME_BOOST = 3
+# Fracción de la puntuación que hereda una tabla vecina por clave foránea
+FK_NEIGHBOR_DECAY = 0.5
+# Tablas encontradas que se expanden por el grafo de claves foráneas
+MAX_EXPANDED_TABLES = 5
+
+# Términos de negocio que no aparecen en los nombres de tablas/columnas
+# (prefijo del término -> término del esquema)
+_SYNONYMS = {
+    "compr": "pedido",
+    "vend": "pedido",
+    "vent": "pedido",
+    "gast": "pedido",
+    "factur": "pedido",
+    "comprador": "client",
+    "usuario": "client",
+    "articulo": "producto",
+}
+
+_SPLIT = re.compile(r"[^a-z0-9]+")
+_STOPWORDS = {
+    "el", "la", "los", "las", "un", "una", "unos", "unas", "de", "del", "al",
+    "a", "en", "y", "o", "que", "por", "para", "con", "sin", "cual", "cuales",
+    "cuanto", "cuantos", "cuanta", "cuantas", "hay", "es", "son", "me", "mi",
+    "muestrame", "dame", "lista", "listar", "todos", "todas", "su", "sus", "se", "id"
+}
+
+
+def _stem(token: str) -> str:
+    """Lematización mínima para español: quita plurales y la -e final (cliente/clientes)"""
+    if len(token) > 4 and token.endswith("es"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s"):
+        return token[:-1]
+    if len(token) > 4 and token.endswith("e"):
+        return token[:-1]
+    return token
+
+
+def tokenize_terms(text: str) -> List[str]:
+    """Términos normalizados de una pregunta o de un identificador SQL"""
+    normalized = normalize_question(text.replace("_", " "))
+    return [_stem(t) for t in _SPLIT.split(normalized) if t and t not in _STOPWORDS]
+
+
+class SchemaIndex:
+    """
+    Índice léxico (BM25) sobre tablas y columnas del esquema
+
+    Cada tabla es un documento formado por su nombre (con más peso), sus
+    columnas y las tablas a las que referencia. Las claves foráneas forman
+    un grafo que se usa para añadir las tablas necesarias para los JOIN.
+    """
+
+    def __init__(self, schema: Dict[str, Any], k1: float = 1.2, b: float = 0.75):
+        self.schema = schema
+        self.k1 = k1
+        self.b = b
+        self._docs: Dict[str, Counter] = {}
+        self._neighbors: Dict[str, Set[str]] = {name: set() for name in schema}
+        self._table_tokens: Dict[str, int] = {}
+
+        for table_name, table_info in schema.items():
+            terms = tokenize_terms(table_name) * TABLE_NAME_BOOST
+            for column in table_info['columns']:
+                terms.extend(tokenize_terms(column['name']))
+            for fk in table_info['foreign_keys']:
+                referred = fk['referred_table']
+                terms.extend(tokenize_terms(referred))
+                if referred in self._neighbors:
+                    self._neighbors[table_name].add(referred)
+                    self._neighbors[referred].add(table_name)
+            self._docs[table_name] = Counter(terms)
+            self._table_tokens[table_name] = estimate_tokens(build_schema_text({table_name: table_info}))
+
+        self._lengths = {name: sum(doc.values()) for name, doc in self._docs.items()}
+        self._avg_length = sum(self._lengths.values()) / len(self._lengths) if self._lengths else 0.0
+        document_frequency = Counter(term for doc in self._docs.values() for term in doc)
+        n = len(self._docs)
+        self._idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def score(self, question: str) -> Dict[str, float]:
+        """Puntuación BM25 de cada tabla para la pregunta (solo las > 0)"""
+        terms = set(tokenize_terms(question))
+        terms.update(synonym for term in list(terms)
+                     for prefix, synonym in _SYNONYMS.items() if term.startswith(prefix))
+        scores = {}
+        for table_name, doc in self._docs.items():
+            length = self._lengths[table_name]
+            total = 0.0
+            for term in terms:
+                tf = doc.get(term, 0)
+                if not tf:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * length / (self._avg_length or 1))
+                total += self._idf[term] * tf * (self.k1 + 1) / norm
+            if total > 0:
+                scores[table_name] = total
+        return scores
+
+    def select_tables(self, question: str, token_budget: int) -> List[str]:
+        """
+        Tablas relevantes para la pregunta que caben en el presupuesto de tokens
+
+        Parte de las tablas con coincidencias léxicas, añade las tablas que
+        las conectan en el grafo de claves foráneas (para poder hacer JOIN) y
+        sus vecinas directas con menor peso, y recorta por puntuación.
+        """
+        scores = self.score(question)
+        if not scores:
+            # Sin pistas léxicas: las tablas más conectadas
+            ranked = sorted(self._docs, key=lambda t: len(self._neighbors[t]), reverse=True)
+            return self._fit_budget(ranked, token_budget)
+
+        candidates = dict(scores)
+        matched = sorted(scores, key=scores.get, reverse=True)[:MAX_EXPANDED_TABLES]
+        # Tablas puente entre pares de tablas encontradas
+        for i, source in enumerate(matched):
+            for target in matched[i + 1:]:
+                for table in self._path(source, target)[1:-1]:
+                    candidates[table] = max(candidates.get(table, 0.0),
+                                            min(scores[source], scores[target]) * FK_NEIGHBOR_DECAY)
+        # Vecinas directas de las tablas encontradas
+        for table in matched:
+            for neighbor in self._neighbors[table]:
+                if neighbor not in candidates:
+                    candidates[neighbor] = scores[table] * FK_NEIGHBOR_DECAY ** 2
+
+        ranked = sorted(candidates, key=candidates.get, reverse=True)
+        return self._fit_budget(ranked, token_budget)
+
+    def _path(self, source: str, target: str, max_depth: int = 3) -> List[str]:
+        """Camino más corto por claves foráneas entre dos tablas (BFS acotado)"""
+        previous = {source: None}
+        queue = deque([(source, 0)])
+        while queue:
+            table, depth = queue.popleft()
+            if table == target:
+                path = []
+                while table is not None:
+                    path.append(table)
+                    table = previous[table]
+                return path[::-1]
+            if depth >= max_depth:
+                continue
+            for neighbor in self._neighbors[table]:
+                if neighbor not in previous:
+                    previous[neighbor] = table
+                    queue.append((neighbor, depth + 1))
+        return []
+
+    def _fit_budget(self, ranked: List[str], token_budget: int) -> List[str]:
+        selected, used = [], estimate_tokens("Esquema de la base de datos:")
+        for table in ranked:
+            cost = self._table_tokens[table]
+            if selected and used + cost > token_budget:
+                continue
+            selected.append(table)
+            used += cost
+        return selected
+
+    def build_context(self, question: str, token_budget: int) -> str:
+        """Texto de esquema para el prompt de esta pregunta"""
+        tables = self.select_tables(question, token_budget)
+        return build_schema_text({name: self.schema[name] for name in tables})
+
+
+class SchemaContextBuilder:
+    """
+    Construye el contexto de esquema por pregunta para el prompt
+
+    Si el esquema completo cabe en el presupuesto se usa entero; si no, se
+    recorta con SchemaIndex. El índice se reconstruye cuando cambia el
+    esquema devuelto por DatabaseManager.
+    """
+
+    def __init__(self, db_manager, token_budget: int, enabled: bool = True):
+        self.db_manager = db_manager
+        self.token_budget = token_budget
+        self.enabled = enabled
+        self._schema: Optional[Dict[str, Any]] = None
+        self._full_text = ""
+        self._index: Optional[SchemaIndex] = None
+
+    def _sync(self) -> None:
+        schema = self.db_manager.get_database_schema()
+        if schema is self._schema:
+            return
+        self._schema = schema
+        self._full_text = build_schema_text(schema)
+        self._index = None
+        if self.enabled and estimate_tokens(self._full_text) > self.token_budget:
+            self._index = SchemaIndex(schema)
+            logger.info(
+                f"Esquema de {len(schema)} tablas (~{estimate_tokens(self._full_text)} tokens): "
+                f"se recortará por pregunta a {self.token_budget} tokens"
+            )
+
+    def for_question(self, question: str) -> str:
+        self._sync()
+        if self._index is None:
+            return self._full_text
+        return self._index.build_context(question, self.token_budget)
@@ -0,0 +1,61 @@
+from fastapi.responses import JSONResponse
+from src.results import row_values
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+import datetime
+import json
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: se usa json de la librería estándar
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    """Tipos de PostgreSQL que no son JSON nativo"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    raise TypeError(f"Tipo no serializable a JSON: {type(value).__name__}")
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Serializa a JSON (UTF-8)
+
+    Con orjson las fechas, UUID y dataclasses se codifican en C y solo los
+    Decimal (NUMERIC) pasan por _default; sin orjson se usa json.dumps.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def rows_as_lists(columns: Optional[List[str]], data: Optional[List[Dict]]) -> Optional[List[List[Any]]]:
+    """Filas como arrays JSON en el orden de 'columns' (sin repetir las claves en cada fila)"""
+    if columns is None or data is None:
+        return None
+    return row_values(columns, data)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse que serializa con dumps()
+
+    Evita jsonable_encoder de FastAPI, que recorre y copia cada fila antes
+    de serializarla.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
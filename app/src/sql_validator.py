@@ -0,0 +1,331 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+import re
+
+# Tokens SQL: literales, identificadores (con o sin comillas), números y símbolos
+_TOKEN = re.compile(r"'(?:[^']|'')*'|\"[^\"]+\"|[A-Za-z_][\w$]*|\d+(?:\.\d+)?|::|\S")
+# Comentarios; los literales y los identificadores entre comillas se
+# reconocen primero para no tomar un '--' dentro de ellos por un comentario
+_COMMENT = re.compile(r"('(?:[^']|'')*'|\"[^\"]*\")|--[^\n]*|/\*.*?\*/", re.DOTALL)
+_FENCE = re.compile(r"^```(?:sql)?\s*|\s*```$", re.IGNORECASE)
+
+# Palabras clave que indican escritura o DDL
+FORBIDDEN_KEYWORDS = {
+    "insert", "update", "delete", "merge", "upsert", "drop", "alter", "create",
+    "truncate", "grant", "revoke", "copy", "vacuum", "reindex", "cluster",
+    "comment", "call", "do", "lock", "refresh"
+}
+
+# Funciones con efectos secundarios: secuencias, sesiones de otros
+# backends, ficheros del servidor, objetos grandes, conexiones remotas...
+SIDE_EFFECT_FUNCTIONS = {
+    "setval", "nextval", "pg_terminate_backend", "pg_cancel_backend", "pg_reload_conf",
+    "pg_rotate_logfile", "pg_read_file", "pg_read_binary_file", "pg_ls_dir", "pg_stat_file",
+    "pg_sleep", "pg_sleep_for", "pg_sleep_until", "pg_notify", "set_config",
+    "pg_create_restore_point", "pg_switch_wal", "pg_promote", "pg_logical_emit_message",
+    "pg_backup_start", "pg_backup_stop", "pg_import_system_collations", "txid_current",
+    "query_to_xml", "query_to_xml_and_xmlschema", "cursor_to_xml"
+}
+SIDE_EFFECT_PREFIXES = ("lo_", "dblink", "pg_advisory", "pg_try_advisory", "pg_file_",
+                        "pg_replication_", "pg_create_", "pg_drop_")
+
+# Palabras que pueden aparecer tras FROM/JOIN sin ser una tabla
+_TABLE_PREFIXES = {"only", "lateral"}
+
+# Palabras que terminan la lista de tablas de un FROM
+_CLAUSE_KEYWORDS = {
+    "where", "group", "order", "having", "limit", "offset", "union", "intersect",
+    "except", "join", "inner", "left", "right", "full", "cross", "natural", "on",
+    "using", "window", "fetch", "for", "returning"
+}
+
+
+def clean_sql(text: str) -> str:
+    """Quita bloques markdown, espacios y el ';' final de la SQL devuelta por el LLM"""
+    sql = _FENCE.sub("", text.strip()).strip()
+    return sql.rstrip(";").strip()
+
+
+def strip_comments(sql: str) -> str:
+    """Quita los comentarios -- y /* */ (no los que están dentro de literales)"""
+    return _COMMENT.sub(lambda m: m.group(1) or " ", sql)
+
+
+def strip_sql(sql: str) -> str:
+    """
+    SQL sin comentarios, espacios ni ';' finales
+
+    Es la forma que se puede envolver en una subconsulta o ampliar con
+    LIMIT: un '-- comentario' final se tragaría lo que se añade detrás.
+    """
+    return strip_comments(sql).strip().rstrip(";").strip()
+
+
+def tokenize(sql: str) -> List[str]:
+    """Divide la SQL en tokens, ignorando los comentarios"""
+    return _TOKEN.findall(strip_comments(sql))
+
+
+def _is_identifier(token: str) -> bool:
+    return token[0].isalpha() or token[0] in "_\""
+
+
+def _unquote(identifier: str) -> str:
+    if identifier.startswith('"') and identifier.endswith('"'):
+        return identifier[1:-1]
+    return identifier.lower()
+
+
+def extract_tables(sql: str) -> Tuple[Set[str], Set[str]]:
+    """
+    Obtiene las tablas referenciadas en FROM/JOIN y los nombres de CTE
+
+    Los FROM dentro de llamadas a funciones (EXTRACT(YEAR FROM ...),
+    SUBSTRING(... FROM ...)) no se consideran tablas.
+
+    Returns:
+        Tuple con (tablas, nombres de CTE)
+    """
+    tables, ctes, _ = _scan_tables(tokenize(sql))
+    return tables, ctes
+
+
+def table_aliases(sql: str) -> Dict[str, Set[str]]:
+    """Alias (o nombre) -> tablas a las que se refiere, en minúsculas salvo comillas"""
+    _, ctes, aliases = _scan_tables(tokenize(sql))
+    return {alias: tables - ctes for alias, tables in aliases.items() if tables - ctes}
+
+
+def _scan_tables(tokens: List[str]) -> Tuple[Set[str], Set[str], Dict[str, Set[str]]]:
+    """Tablas, CTE y alias (alias o nombre -> tablas) de una lista de tokens"""
+    lowered = [t.lower() for t in tokens]
+    tables: Set[str] = set()
+    ctes: Set[str] = set()
+    aliases: Dict[str, Set[str]] = {}
+    # Pila de paréntesis: True si el paréntesis abre una subconsulta
+    stack: List[bool] = []
+
+    def in_query() -> bool:
+        return not stack or stack[-1]
+
+    i = 0
+    while i < len(tokens):
+        token = lowered[i]
+        if token == "(":
+            next_token = lowered[i + 1] if i + 1 < len(tokens) else ""
+            stack.append(next_token in ("select", "with"))
+        elif token == ")":
+            if stack:
+                stack.pop()
+        elif token == "as" and i > 0 and _opens_cte_body(lowered, i + 1):
+            # nombre AS (...) o nombre(columnas) AS [NOT MATERIALIZED] (...)
+            name = _cte_name(tokens, i - 1)
+            if name is not None:
+                ctes.add(_unquote(name))
+        elif token in ("from", "join") and in_query():
+            i = _read_table_list(tokens, lowered, i + 1, tables, allow_list=(token == "from"),
+                                 aliases=aliases)
+            continue
+        i += 1
+    return tables, ctes, aliases
+
+
+def _opens_cte_body(lowered: List[str], i: int) -> bool:
+    """True si en la posición i empieza '[NOT] [MATERIALIZED] (SELECT|WITH'"""
+    while i < len(lowered) and lowered[i] in ("not", "materialized"):
+        i += 1
+    return i + 1 < len(lowered) and lowered[i] == "(" and lowered[i + 1] in ("select", "with")
+
+
+def _cte_name(tokens: List[str], i: int) -> Optional[str]:
+    """Nombre de la CTE que acaba en la posición i, saltando su lista de columnas"""
+    if tokens[i] == ")":
+        depth = 0
+        while i >= 0:
+            if tokens[i] == ")":
+                depth += 1
+            elif tokens[i] == "(":
+                depth -= 1
+                if not depth:
+                    break
+            i -= 1
+        i -= 1
+    if i >= 0 and _is_identifier(tokens[i]):
+        return tokens[i]
+    return None
+
+
+def _read_table_list(tokens: List[str], lowered: List[str], i: int,
+                     tables: Set[str], allow_list: bool,
+                     aliases: Optional[Dict[str, Set[str]]] = None) -> int:
+    """Lee 'tabla [AS alias] [, tabla [AS alias]]...' a partir de la posición i"""
+    aliases = aliases if aliases is not None else {}
+    while i < len(tokens):
+        while i < len(tokens) and lowered[i] in _TABLE_PREFIXES:
+            i += 1
+        if i >= len(tokens) or not _is_identifier(tokens[i]):
+            return i
+        name = tokens[i]
+        i += 1
+        # Nombre calificado: esquema.tabla
+        while i + 1 < len(tokens) and tokens[i] == "." and _is_identifier(tokens[i + 1]):
+            name = tokens[i + 1]
+            i += 2
+        table = _unquote(name)
+        tables.add(table)
+        aliases.setdefault(table, set()).add(table)
+        # Alias opcional
+        if i < len(tokens) and lowered[i] == "as":
+            i += 1
+        if i < len(tokens) and _is_identifier(tokens[i]) and lowered[i] not in _CLAUSE_KEYWORDS:
+            aliases.setdefault(_unquote(tokens[i]), set()).add(table)
+            i += 1
+        if allow_list and i < len(tokens) and tokens[i] == ",":
+            i += 1
+            continue
+        return i
+    return i
+
+
+def unknown_columns(sql: str, schema: Dict[str, Any]) -> List[str]:
+    """
+    Columnas calificadas (alias.columna) que no existen en su tabla
+
+    Solo se comprueban las referencias cuyo calificador es una tabla del
+    esquema o su alias; las columnas sin calificar pueden ser alias del
+    SELECT o columnas de subconsultas y no se pueden resolver sin
+    analizar la consulta completa.
+    """
+    tokens = tokenize(sql)
+    _, ctes, aliases = _scan_tables(tokens)
+    columns = {
+        name.lower(): {column['name'].lower() for column in info.get('columns', [])}
+        for name, info in schema.items()
+    }
+    unknown = []
+    for i in range(1, len(tokens) - 1):
+        if tokens[i] != "." or not _is_identifier(tokens[i - 1]) or not _is_identifier(tokens[i + 1]):
+            continue
+        # Nombres de tres partes (esquema.tabla.columna) o esquema.tabla en FROM
+        if (i >= 2 and tokens[i - 2] == ".") or (i + 2 < len(tokens) and tokens[i + 2] in (".", "(")):
+            continue
+        qualifier = _unquote(tokens[i - 1])
+        targets = [t.lower() for t in aliases.get(qualifier, ()) if t not in ctes]
+        if not targets or any(t not in columns or not columns[t] for t in targets):
+            continue
+        column = _unquote(tokens[i + 1]).lower()
+        if not any(column in columns[t] for t in targets):
+            unknown.append(f"{tokens[i - 1]}.{tokens[i + 1]}")
+    return sorted(set(unknown))
+
+
+def has_limit(sql: str) -> bool:
+    """True si la consulta principal (fuera de paréntesis) tiene LIMIT o FETCH FIRST"""
+    depth = 0
+    for token in tokenize(sql):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0 and token.lower() in ("limit", "fetch"):
+            return True
+    return False
+
+
+def write_operations(sql: str) -> List[str]:
+    """
+    Sentencias de escritura, SELECT ... INTO, FOR UPDATE/SHARE y funciones
+    con efectos secundarios
+
+    Las palabras de FORBIDDEN_KEYWORDS solo cuentan al empezar una
+    sentencia: al principio, tras ';', al abrir el cuerpo de una CTE (CTE
+    que escriben) o tras él (WITH ... DELETE); como alias o nombre de
+    columna ("AS comment", "count(comment)") no son escrituras. INTO solo aparece
+    en una lectura como SELECT ... INTO tabla (crea la tabla); las
+    funciones se reconocen por ir seguidas de '('.
+    """
+    tokens = tokenize(sql)
+    lowered = [t.lower() for t in tokens]
+    found = set()
+    # Pila de paréntesis: True si abre el cuerpo de una CTE (AS [NOT] MATERIALIZED (...))
+    stack: List[bool] = []
+    statement_start = True
+    for i, token in enumerate(tokens):
+        name = lowered[i]
+        starts = statement_start
+        statement_start = False
+        if token == "(":
+            stack.append(i > 0 and lowered[i - 1] in ("as", "materialized"))
+            statement_start = stack[-1]
+        elif token == ")":
+            statement_start = stack.pop() if stack else False
+        elif token == ";":
+            statement_start = True
+        elif not _is_identifier(token) or token.startswith('"'):
+            continue
+        elif name in FORBIDDEN_KEYWORDS and starts:
+            found.add(name.upper())
+        elif name == "into":
+            found.add("INTO")
+        elif name == "for" and i + 1 < len(tokens) and lowered[i + 1] in ("update", "share", "no", "key"):
+            found.add("FOR SHARE" if "share" in lowered[i + 1:i + 3] else "FOR UPDATE")
+        elif i + 1 < len(tokens) and tokens[i + 1] == "(" and \
+                (name in SIDE_EFFECT_FUNCTIONS or name.startswith(SIDE_EFFECT_PREFIXES)):
+            found.add(f"{name}()")
+    return sorted(found)
+
+
+def is_read_only(sql: str) -> bool:
+    """
+    Una única sentencia SELECT/WITH sin escrituras
+
+    Es lo que puede ejecutarse en una réplica de lectura; SELECT ... FOR
+    UPDATE, SELECT ... INTO y las funciones de SIDE_EFFECT_FUNCTIONS
+    cuentan como escritura.
+    """
+    lowered = [t.lower() for t in tokenize(sql) if _is_identifier(t) or t == ";"]
+    if lowered and lowered[-1] == ";":
+        lowered.pop()
+    return (bool(lowered) and lowered[0] in ("select", "with") and ";" not in lowered
+            and not write_operations(sql))
+
+
+def validate_sql(sql: str, schema: Optional[Dict[str, Any]] = None) -> Tuple[bool, Optional[str]]:
+    """
+    Validación local (sin base de datos) de una consulta generada
+
+    Comprueba que sea una única sentencia de lectura (SELECT/WITH), que no
+    contenga palabras clave de escritura o DDL, SELECT ... INTO ni llamadas
+    a funciones con efectos secundarios (write_operations) y que las tablas y las
+    columnas calificadas existan en el esquema de get_database_schema().
+
+    Returns:
+        Tuple con (válida, mensaje de error o None)
+    """
+    if not sql or not sql.strip():
+        return False, "La consulta está vacía"
+
+    tokens = tokenize(sql)
+    lowered = [t.lower() for t in tokens if _is_identifier(t) or t == ";"]
+    if not lowered:
+        return False, "La consulta está vacía"
+
+    if ";" in lowered[:-1]:
+        return False, "Solo se permite una sentencia SQL"
+    if lowered[0] not in ("select", "with"):
+        return False, "Solo se permiten consultas de lectura (SELECT)"
+
+    forbidden = write_operations(sql)
+    if forbidden:
+        return False, f"Operación no permitida: {', '.join(forbidden)}"
+
+    if schema:
+        tables, ctes = extract_tables(sql)
+        known = {name.lower() for name in schema}
+        unknown = sorted(t for t in tables if t.lower() not in known and t not in ctes)
+        if unknown:
+            return False, f"Tablas desconocidas: {', '.join(unknown)}"
+        unknown = unknown_columns(sql, schema)
+        if unknown:
+            return False, f"Columnas desconocidas: {', '.join(unknown)}"
+
+    return True, None
@@ -0,0 +1,509 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from src.serialization import dumps
+from src.config import TRACING_CONFIG
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import logging
+import secrets
+import time
+import re
+
+logger = logging.getLogger(__name__)
+otel_logger = logging.getLogger("chatbot.otel")
+
+# Límites de los histogramas de duración (segundos)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Longitud máxima de los atributos de texto (SQL, entrada de herramientas)
+MAX_ATTRIBUTE_CHARS = 500
+
+# Caracteres no válidos en nombres de métricas de Prometheus
+_INVALID_NAME = re.compile(r"[^a-zA-Z0-9_:]")
+
+# Span activo en el contexto actual (hilo o tarea asyncio)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("chatbot_current_span", default=None)
+
+
+class Span:
+    """
+    Etapa cronometrada de una petición
+
+    Los atributos se añaden con set() y se exportan con la traza. Un span
+    sin traza (fuera de una petición) solo alimenta las métricas.
+    """
+    __slots__ = ("name", "trace", "span_id", "parent_id", "attributes",
+                 "start_ns", "end_ns", "_start", "duration", "error")
+
+    def __init__(self, name: str, trace: Optional["Trace"], parent_id: Optional[str],
+                 attributes: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        self.end_ns = self.start_ns + int(self.duration * 1e9)
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        tracer.record(self)
+
+
+class Trace:
+    """Spans de una petición (process_query, stream_query o export_query)"""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = secrets.token_hex(16)
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+        self.root = Span(name, self, None, attributes)
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def activate(self) -> Iterator[Span]:
+        """Hace del span raíz el span activo durante el bloque"""
+        token = _current_span.set(self.root)
+        try:
+            yield self.root
+        finally:
+            _current_span.reset(token)
+
+    def breakdown(self) -> Dict[str, Tuple[int, float]]:
+        """Número de spans y segundos totales por nombre (sin el raíz)"""
+        totals: Dict[str, Tuple[int, float]] = {}
+        with self._lock:
+            for span in self.spans:
+                if span is self.root:
+                    continue
+                count, seconds = totals.get(span.name, (0, 0.0))
+                totals[span.name] = (count + 1, seconds + span.duration)
+        return totals
+
+
+class MetricsRegistry:
+    """
+    Contadores e histogramas en memoria con salida en formato Prometheus
+
+    Sin dependencias: el endpoint /metrics devuelve render() como texto.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], List[float]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            # [cuenta por límite..., suma, cuenta total]
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [0] * len(DURATION_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        """Exposición en texto de Prometheus (versión 0.0.4)"""
+        lines: List[str] = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        described = set()
+
+        def header(name: str, default_kind: str) -> None:
+            if name in described:
+                return
+            described.add(name)
+            kind, help_text = self._meta.get(name, (default_kind, name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), state in histograms:
+            header(name, "histogram")
+            for bound, count in zip(DURATION_BUCKETS, state):
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {state[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(state[-2])}")
+            lines.append(f"{name}_count{_labels(labels)} {state[-1]}")
+        for name, value in sorted((gauges or {}).items()):
+            header(name, "gauge")
+            lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def flatten_gauges(prefix: str, stats: Any) -> Dict[str, float]:
+    """Convierte los dicts anidados de stats() en gauges 'prefijo_clave_subclave'"""
+    gauges: Dict[str, float] = {}
+    if isinstance(stats, dict):
+        for key, value in stats.items():
+            gauges.update(flatten_gauges(f"{prefix}_{_INVALID_NAME.sub('_', str(key))}", value))
+    elif isinstance(stats, bool):
+        gauges[prefix] = int(stats)
+    elif isinstance(stats, (int, float)):
+        gauges[prefix] = stats
+    return gauges
+
+
+metrics = MetricsRegistry()
+metrics.describe("chatbot_span_duration_seconds", "histogram", "Duración de cada etapa de una petición")
+metrics.describe("chatbot_requests_total", "counter", "Peticiones trazadas por punto de entrada y resultado")
+metrics.describe("chatbot_llm_tokens_total", "counter", "Tokens enviados y generados por el LLM")
+metrics.describe("chatbot_tool_calls_total", "counter", "Llamadas a herramientas del agente")
+metrics.describe("chatbot_sql_rows_total", "counter", "Filas leídas de la base de datos")
+
+
+class Tracer:
+    """
+    Crea trazas y spans y los vuelca en métricas y, opcionalmente, en JSON
+
+    El span activo se guarda en una ContextVar. Los generadores (streaming,
+    exportación) se ejecutan por partes y a veces en hilos distintos, así
+    que usan traced(), que reactiva la traza en cada next(), y spans
+    manuales (start_span/finish) en lugar del contextmanager span().
+    """
+
+    def __init__(self, registry: MetricsRegistry, config: Optional[Dict[str, Any]] = None):
+        self.metrics = registry
+        self.config = {**TRACING_CONFIG, **(config or {})}
+        self.enabled = self.config['ENABLED']
+        self._file_lock = threading.Lock()
+        self._listeners: List[Callable[[Trace], None]] = []
+
+    def subscribe(self, listener: Callable[[Trace], None]) -> None:
+        """Llama a 'listener' con cada traza terminada (p. ej. los benchmarks)"""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[Trace], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def current(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+        """Span manual: no pasa a ser el activo; hay que cerrarlo con finish()"""
+        parent = parent or _current_span.get()
+        trace = parent.trace if parent is not None else None
+        return Span(name, trace, parent.span_id if parent is not None else None, attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Span de un bloque síncrono o de una corrutina (sin yield dentro)"""
+        span = self.start_span(name, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.finish(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish()
+
+    @contextmanager
+    def trace(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """
+        Traza de una petición
+
+        Dentro de otra traza se comporta como span(); así las llamadas
+        anidadas (p. ej. process_query desde un lote) quedan en la misma.
+        """
+        if _current_span.get() is not None:
+            with self.span(name, **attributes) as span:
+                yield span
+            return
+        trace = Trace(name, attributes)
+        try:
+            with trace.activate() as root:
+                yield root
+        except BaseException as e:
+            trace.root.finish(e)
+            raise
+        finally:
+            trace.root.finish()
+
+    def traced(self, iterator: Iterator[Any], name: str, **attributes: Any) -> Iterator[Any]:
+        """Recorre un generador dentro de una traza que dura hasta agotarlo o cerrarlo"""
+        if _current_span.get() is not None:
+            root = self.start_span(name, **attributes)
+        else:
+            root = Trace(name, attributes).root
+        error = None
+        try:
+            while True:
+                token = _current_span.set(root)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    _current_span.reset(token)
+                yield item
+        except BaseException as e:
+            if not isinstance(e, GeneratorExit):
+                error = e
+            raise
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            root.finish(error)
+
+    def record(self, span: Span) -> None:
+        """Métricas del span cerrado y, si es el raíz, exportación de la traza"""
+        if not self.enabled:
+            return
+        self.metrics.observe("chatbot_span_duration_seconds", span.duration, span=span.name)
+        trace = span.trace
+        if trace is None:
+            return
+        trace.add(span)
+        if span is trace.root:
+            failed = span.error is not None or span.attributes.get("success") is False
+            self.metrics.inc("chatbot_requests_total", entry=span.name,
+                             status="error" if failed else "ok")
+            self._report(trace)
+            for listener in list(self._listeners):
+                try:
+                    listener(trace)
+                except Exception as e:
+                    logger.error(f"Error en un suscriptor de trazas: {e}")
+
+    def _report(self, trace: Trace) -> None:
+        root = trace.root
+        if root.duration >= self.config['SLOW_SECONDS']:
+            parts = ", ".join(
+                f"{name} {seconds:.2f}s ({count})"
+                for name, (count, seconds) in sorted(trace.breakdown().items(), key=lambda item: -item[1][1])
+            )
+            logger.warning(f"Petición lenta {root.name} {root.duration:.2f}s [{trace.trace_id}]: {parts}")
+        if self.config['OTEL_LOG']:
+            self._export_otel(trace)
+
+    def _export_otel(self, trace: Trace) -> None:
+        """Una línea JSON por traza con la estructura de OTLP/JSON (resourceSpans)"""
+        with trace._lock:
+            spans = [_otel_span(trace.trace_id, span) for span in trace.spans]
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": _otel_attributes({"service.name": self.config['SERVICE_NAME']})},
+                "scopeSpans": [{"scope": {"name": "src.tracing"}, "spans": spans}]
+            }]
+        }
+        line = dumps(payload).decode("utf-8")
+        path = self.config['OTEL_LOG_FILE']
+        if not path:
+            otel_logger.info(line)
+            return
+        try:
+            with self._file_lock, open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.error(f"No se pudo escribir la traza en {path}: {e}")
+
+
+def _otel_span(trace_id: str, span: Span) -> Dict[str, Any]:
+    data = {
+        "traceId": trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _otel_attributes(span.attributes),
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1}
+    }
+    if span.parent_id:
+        data["parentSpanId"] = span.parent_id
+    return data
+
+
+def _otel_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    result = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        result.append({"key": key, "value": typed})
+    return result
+
+
+def truncate(text: Any, limit: int = MAX_ATTRIBUTE_CHARS) -> str:
+    text = str(text)
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+tracer = Tracer(metrics)
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Convierte los callbacks de LangChain en spans
+
+    - chain: la ejecución de primer nivel (agente o generador directo)
+    - llm: cada llamada al modelo, con tokens de entrada y salida
+    - tool: cada herramienta del agente, con su entrada y el error si lo hay
+
+    Los spans se asocian por run_id, no por la ContextVar: así funcionan
+    también con agent.stream(), cuyos pasos se reanudan en otros hilos.
+    """
+    run_inline = True
+
+    def __init__(self, tracer: Tracer = tracer):
+        self.tracer = tracer
+        self._lock = threading.Lock()
+        self._spans: Dict[Any, Span] = {}
+        self._parents: Dict[Any, Any] = {}
+
+    def _parent_span(self, parent_run_id: Any) -> Optional[Span]:
+        """Span del antecesor trazado más cercano (las cadenas intermedias no tienen span)"""
+        with self._lock:
+            run_id = parent_run_id
+            while run_id is not None:
+                span = self._spans.get(run_id)
+                if span is not None:
+                    return span
+                run_id = self._parents.get(run_id)
+        return None
+
+    def _start(self, run_id: Any, parent_run_id: Any, name: str, **attributes: Any) -> None:
+        parent = self._parent_span(parent_run_id) or self.tracer.current()
+        span = self.tracer.start_span(name, parent, **attributes)
+        with self._lock:
+            self._spans[run_id] = span
+            if parent_run_id is not None:
+                self._parents[run_id] = parent_run_id
+
+    def _finish(self, run_id: Any, error: Optional[BaseException] = None, **attributes: Any) -> Optional[Span]:
+        with self._lock:
+            span = self._spans.pop(run_id, None)
+            self._parents.pop(run_id, None)
+        if span is not None:
+            span.set(**attributes)
+            span.finish(error)
+        return span
+
+    # Cadenas: solo la de primer nivel tiene span; el resto se recuerda
+    # para encontrar el span padre de los LLM y herramientas anidados
+    def on_chain_start(self, serialized: Optional[Dict[str, Any]], inputs: Any, *,
+                       run_id: Any, parent_run_id: Any = None, **kwargs: Any) -> None:
+        if parent_run_id is None:
+            name = kwargs.get("name") or (serialized or {}).get("name") or "chain"
+            self._start(run_id, None, "chain", chain=name)
+        else:
+            with self._lock:
+                self._parents[run_id] = parent_run_id
+
+    def on_chain_end(self, outputs: Any, *, run_id: Any, **kwargs: Any) -> None:
+        self._finish(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+        self._finish(run_id, error)
+
+    def on_chat_model_start(self, serialized: Optional[Dict[str, Any]], messages: Any, *,
+                            run_id: Any, parent_run_id: Any = None, **kwargs: Any) -> None:
+        self._start(run_id, parent_run_id, "llm", model=_model_name(serialized, kwargs))
+
+    def on_llm_start(self, serialized: Optional[Dict[str, Any]], prompts: Any, *,
+                     run_id: Any, parent_run_id: Any = None, **kwargs: Any) -> None:
+        self._start(run_id, parent_run_id, "llm", model=_model_name(serialized, kwargs))
+
+    def on_llm_end(self, response: Any, *, run_id: Any, **kwargs: Any) -> None:
+        prompt_tokens, completion_tokens = _token_usage(response)
+        self.tracer.metrics.inc("chatbot_llm_tokens_total", prompt_tokens, type="prompt")
+        self.tracer.metrics.inc("chatbot_llm_tokens_total", completion_tokens, type="completion")
+        self._finish(run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+        self._finish(run_id, error)
+
+    def on_tool_start(self, serialized: Optional[Dict[str, Any]], input_str: str, *,
+                      run_id: Any, parent_run_id: Any = None, **kwargs: Any) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("name") or "tool"
+        self.tracer.metrics.inc("chatbot_tool_calls_total", tool=name)
+        self._start(run_id, parent_run_id, "tool", tool=name, input=truncate(input_str))
+
+    def on_tool_end(self, output: Any, *, run_id: Any, **kwargs: Any) -> None:
+        text = getattr(output, "content", output)
+        attributes = {"output_chars": len(str(text))}
+        if isinstance(text, str) and text.startswith("Error:"):
+            attributes["tool_error"] = truncate(text)
+        self._finish(run_id, **attributes)
+
+    def on_tool_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+        self._finish(run_id, error)
+
+
+def _model_name(serialized: Optional[Dict[str, Any]], kwargs: Dict[str, Any]) -> str:
+    params = kwargs.get("invocation_params") or {}
+    return str(params.get("model_name") or params.get("model") or (serialized or {}).get("name") or "llm")
+
+
+def _token_usage(response: Any) -> Tuple[int, int]:
+    """Tokens de entrada y salida de un LLMResult (usage_metadata o llm_output)"""
+    prompt_tokens = completion_tokens = 0
+    for generations in getattr(response, "generations", []) or []:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+    if not prompt_tokens and not completion_tokens:
+        usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+    return prompt_tokens, completion_tokens
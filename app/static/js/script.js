@@ -13,66 +13,257 @@ document.addEventListener('DOMContentLoaded', function() {
     if (chatForm) {
         chatForm.addEventListener('submit', async function(e) {
             e.preventDefault();
-            
+
             const userInput = inputField.value.trim();
             if (!userInput) return;
 
             // Mostrar mensaje del usuario
             addMessage(userInput, 'user');
-            
-            // Mostrar indicador de carga
-            const loadingId = addMessage('Pensando...', 'bot', true);
-            
-            // Enviar consulta al servidor
-            try {
-                const response = await fetch('/query', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/x-www-form-urlencoded',
-                    },
-                    body: `user_input=${encodeURIComponent(userInput)}`
-                });
-                
-                if (!response.ok) throw new Error('Error en la respuesta');
-                
-                const html = await response.text();
-                const parser = new DOMParser();
-                const doc = parser.parseFromString(html, 'text/html');
-                const botResponse = doc.querySelector('.bot-message').innerHTML;
-                
-                // Actualizar mensaje de carga con respuesta
-                updateMessage(loadingId, botResponse);
-                
-            } catch (error) {
-                console.error('Error:', error);
-                updateMessage(loadingId, '<strong>Bot:</strong> Error al procesar tu solicitud');
-            } finally {
-                inputField.value = '';
-                inputField.focus();
-                scrollToBottom();
+
+            // Mensaje del bot que se irá completando con los eventos del servidor
+            const view = createStreamView(userInput);
+            inputField.value = '';
+
+            await runQuery(userInput, view);
+            inputField.focus();
+        });
+    }
+
+    // Envía la consulta (o una página siguiente): en streaming si el navegador
+    // lo permite, si no con la API JSON
+    async function runQuery(userInput, view, pageToken = null) {
+        try {
+            if (supportsStreaming) {
+                await streamQuery(userInput, view.handle, pageToken);
+            } else {
+                await jsonQuery(userInput, view.handle, pageToken);
             }
+        } catch (error) {
+            console.error('Error:', error);
+            view.handle('error', { message: error.message || 'Error al procesar tu solicitud' });
+        } finally {
+            scrollToBottom();
+        }
+    }
+
+    const supportsStreaming = typeof ReadableStream !== 'undefined'
+        && typeof TextDecoder !== 'undefined'
+        && 'body' in Response.prototype;
+
+    // Sesión de conversación de /api/query: la primera respuesta trae el
+    // session_id que genera el servidor (el streaming usa la cookie)
+    let sessionId = null;
+
+    function checkResponse(response) {
+        if (response.status === 503) throw new Error('El servidor está ocupado, inténtalo en unos segundos');
+        if (!response.ok) throw new Error('Error en la respuesta');
+    }
+
+    async function streamQuery(userInput, onEvent, pageToken) {
+        let body = `user_input=${encodeURIComponent(userInput)}`;
+        if (pageToken) body += `&page_token=${encodeURIComponent(pageToken)}`;
+
+        const response = await fetch('/query/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/x-www-form-urlencoded',
+            },
+            body: body
+        });
+        checkResponse(response);
+        await readEvents(response.body, onEvent);
+    }
+
+    // Consulta a /api/query; la respuesta se presenta con los mismos eventos del stream
+    async function jsonQuery(userInput, onEvent, pageToken) {
+        const response = await fetch('/api/query', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(sessionId
+                ? { user_input: userInput, page_token: pageToken, session_id: sessionId }
+                : { user_input: userInput, page_token: pageToken, new_session: true })
         });
+        checkResponse(response);
+
+        const result = await response.json();
+        if (result.session_id) sessionId = result.session_id;
+        if (result.query) onEvent('sql', { query: result.query });
+        if (result.response && result.response !== result.query) onEvent('answer', { text: result.response });
+        if (result.columns) {
+            onEvent('columns', { columns: result.columns });
+            onEvent('rows', { rows: result.results || [] });
+        }
+        onEvent('done', {
+            success: result.success,
+            query: result.query,
+            row_count: result.results ? result.results.length : 0,
+            next_page: result.next_page
+        });
+    }
+
+    // Lee un stream Server-Sent Events y llama a onEvent(nombre, datos) por evento
+    async function readEvents(body, onEvent) {
+        const reader = body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let name = 'message';
+                const data = [];
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('event:')) name = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+                }
+                if (data.length) onEvent(name, JSON.parse(data.join('\n')));
+            }
+        }
+    }
+
+    // Crea el mensaje del bot y devuelve el manejador que lo actualiza por evento
+    function createStreamView(userInput) {
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'message bot-message';
+        messageDiv.innerHTML = '<strong>Bot:</strong> ';
+
+        const status = document.createElement('span');
+        status.className = 'stream-status';
+        status.textContent = 'Pensando...';
+        messageDiv.appendChild(status);
+        chatHistory.appendChild(messageDiv);
+        scrollToBottom();
+
+        let sqlBlock = null;
+        let tbody = null;
+
+        function showSql(text, append) {
+            if (!sqlBlock) {
+                sqlBlock = document.createElement('pre');
+                sqlBlock.className = 'stream-sql';
+                messageDiv.appendChild(sqlBlock);
+            }
+            sqlBlock.textContent = append ? sqlBlock.textContent + text : text;
+        }
+
+        function handle(name, data) {
+            switch (name) {
+                case 'progress':
+                    status.textContent = data.message;
+                    break;
+                case 'token':
+                    showSql(data.text, true);
+                    break;
+                case 'sql':
+                    showSql(data.query, false);
+                    break;
+                case 'answer': {
+                    const answer = document.createElement('div');
+                    answer.textContent = data.text;
+                    messageDiv.insertBefore(answer, sqlBlock);
+                    break;
+                }
+                case 'columns': {
+                    // Las páginas siguientes se añaden a la misma tabla
+                    if (tbody) break;
+                    const wrapper = document.createElement('div');
+                    wrapper.className = 'table-responsive';
+                    const table = document.createElement('table');
+                    table.className = 'table table-striped';
+                    const headerRow = table.createTHead().insertRow();
+                    for (const column of data.columns) {
+                        const th = document.createElement('th');
+                        th.textContent = column;
+                        headerRow.appendChild(th);
+                    }
+                    tbody = table.createTBody();
+                    wrapper.appendChild(table);
+                    messageDiv.appendChild(wrapper);
+                    break;
+                }
+                case 'rows': {
+                    const fragment = document.createDocumentFragment();
+                    for (const row of data.rows) {
+                        const tr = document.createElement('tr');
+                        for (const value of row) {
+                            const td = document.createElement('td');
+                            td.textContent = value === null ? '' : value;
+                            tr.appendChild(td);
+                        }
+                        fragment.appendChild(tr);
+                    }
+                    tbody.appendChild(fragment);
+                    status.textContent = `${tbody.rows.length} filas...`;
+                    break;
+                }
+                case 'done':
+                    if (!data.success) status.textContent = 'Lo siento, no pude procesar tu consulta.';
+                    else if (tbody && tbody.rows.length) status.textContent = `${tbody.rows.length} filas`;
+                    else status.textContent = 'No se encontraron resultados.';
+                    if (data.next_page) addMoreButton(data.next_page);
+                    if (data.success && data.query) addExportLinks(data.query);
+                    break;
+                case 'error':
+                    status.textContent = data.message;
+                    break;
+            }
+            scrollToBottom();
+        }
+
+        function addMoreButton(pageToken) {
+            const button = document.createElement('button');
+            button.type = 'button';
+            button.className = 'stream-more';
+            button.textContent = 'Mostrar más filas';
+            button.addEventListener('click', function() {
+                button.remove();
+                runQuery(userInput, view, pageToken);
+            });
+            messageDiv.appendChild(button);
+        }
+
+        // Descarga del resultado completo (re-ejecuta la SQL mostrada)
+        function addExportLinks(query) {
+            if (messageDiv.querySelector('.stream-export')) return;
+            const links = document.createElement('div');
+            links.className = 'stream-export';
+            links.append('Exportar: ');
+            for (const format of ['csv', 'ndjson', 'parquet']) {
+                const link = document.createElement('a');
+                link.href = `/api/export?format=${format}&user_input=${encodeURIComponent('sql: ' + query)}`;
+                link.textContent = format.toUpperCase();
+                links.append(link, ' ');
+            }
+            messageDiv.appendChild(links);
+        }
+
+        const view = { handle };
+        return view;
     }
 
     function addMessage(content, type, isTemp = false) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${type}-message`;
-        messageDiv.innerHTML = type === 'user' 
+        messageDiv.innerHTML = type === 'user'
             ? `<strong>Tú:</strong> ${content}`
             : `<strong>Bot:</strong> ${content}`;
-        
+
         if (isTemp) messageDiv.id = 'temp-' + Date.now();
         chatHistory.appendChild(messageDiv);
         scrollToBottom();
         return messageDiv.id;
     }
 
-    function updateMessage(id, newContent) {
-        const message = document.getElementById(id);
-        if (message) message.innerHTML = newContent;
-    }
-
     function scrollToBottom() {
         chatHistory.scrollTop = chatHistory.scrollHeight;
     }
-});
\ No newline at end of file
+});